@@ -0,0 +1,169 @@
+'''This module houses the response types and row decoding of the read-only JSON API (/api/v1
+    routes in app.py) for a user's hikes, feeds and user search.
+    Rows are decoded straight into msgspec Structs (no dict per row) and encoded with msgspec.
+    Lists are paginated with the same (hike_date, id) keyset cursors as the HTML pages
+    (?after=<cursor>&limit=N), and ?fields=id,hike_date,... selects the columns queried and
+    returned: rows are decoded into a Struct type with only the selected fields, built once per
+    selection, so fields left out cost nothing and are omitted from the JSON.
+'''
+from functools import lru_cache
+import sqlite3
+from typing import List, Optional
+import msgspec
+from flask import current_app
+from connection_pool import scoped_connection
+from constants import FEED_MODE
+from utils import build_feed_page_query, build_hikes_page_query, clamp_page_size, encode_cursor
+
+encoder = msgspec.json.Encoder()
+
+
+# ==== RESPONSE TYPES ====
+# pylint: disable=too-few-public-methods
+
+class Hike(msgspec.Struct):
+    '''A hike, fields in hikes table column order.'''
+    id: int
+    hike_date: str
+    user_id: int
+    area_id: Optional[int]
+    area_name: str
+    trailhead: Optional[str]
+    trails_cs: Optional[str]
+    distance_km: Optional[float]
+    image_url: Optional[str]
+    image_alt: Optional[str]
+    map_link: Optional[str]
+    other_info: Optional[str]
+
+
+class FeedHike(Hike):
+    '''A hike in a feed, with its owner's username.'''
+    username: str
+
+
+class HikesPage(msgspec.Struct):
+    '''One page of hikes and the cursor for the next page (None on the last page).'''
+    hikes: List[Hike]
+    next_cursor: Optional[str] = None
+
+
+class UserCard(msgspec.Struct):
+    '''A user search result with the image of their most recent hike.'''
+    username: str
+    img_src: str
+    exact_match: bool
+
+
+class UsersPage(msgspec.Struct):
+    '''User search results.'''
+    users: List[UserCard]
+
+
+class ApiError(msgspec.Struct):
+    '''Error response body.'''
+    error: str
+
+
+# ==== ROW DECODING ====
+
+def get_columns(struct_type):
+    '''Takes hike struct type. Returns dict of field name: SQL column for each field.'''
+    return {field: 'users.username' if field == 'username' else f'hikes.{field}'
+        for field in struct_type.__struct_fields__}
+
+
+def select_fields(struct_type, fields_arg):
+    '''Takes hike struct type and ?fields= value (comma-separated names, or None for all).
+        Returns tuple of selected fields in struct order, or None if a field is unknown.
+    '''
+    if not fields_arg:
+        return struct_type.__struct_fields__
+    requested = set(fields_arg.split(','))
+    if not requested <= set(struct_type.__struct_fields__):
+        return None
+    return tuple(field for field in struct_type.__struct_fields__ if field in requested)
+
+
+@lru_cache(maxsize=128)
+def get_struct_type(struct_type, fields):
+    '''Takes hike struct type and selected fields.
+        Returns the struct type itself if every field is selected, otherwise a struct type with
+        only the selected fields (same name and field types), built once per selection.
+    '''
+    if fields == struct_type.__struct_fields__:
+        return struct_type
+    return msgspec.defstruct(struct_type.__name__, [(field.name, field.type)
+        for field in msgspec.structs.fields(struct_type) if field.name in fields])
+
+
+def get_select_list(struct_type, fields):
+    '''Takes hike struct type and selected fields.
+        Returns SQL column list: the selected columns, then hike_date and id for the cursor.
+    '''
+    columns = get_columns(struct_type)
+    return ', '.join([columns[field] for field in fields] + ['hikes.hike_date', 'hikes.id'])
+
+
+def fetch_hikes(db, page_query, struct_type, fields, limit):
+    '''Takes db file, (query, params) selecting get_select_list's columns, hike struct type,
+        selected fields and page size. Returns HikesPage, or None on a database error.
+    '''
+    with scoped_connection(db) as db_connection:
+        try:
+            rows = db_connection['cursor'].execute(*page_query).fetchall()
+        except sqlite3.Error as error:
+            print(error)
+            return None
+    # Columns are selected in field order, so structs are built positionally
+    page_type, count = get_struct_type(struct_type, fields), len(fields)
+    hikes = [page_type(*row[:count]) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit and hikes:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor({'hike_date': last[count], 'id': last[count + 1]})
+    return HikesPage(hikes=hikes, next_cursor=next_cursor)
+
+
+# ==== API DATA ====
+
+def get_hikes_page(db, user_id, after=None, limit=None, fields=Hike.__struct_fields__):
+    '''Takes db file, user id, optional page cursor, page size and selected fields.
+        Returns HikesPage of the user's hikes (newest first), or None on a database error.
+    '''
+    limit = clamp_page_size(limit)
+    page_query = build_hikes_page_query(user_id, after, limit, get_select_list(Hike, fields))
+    return fetch_hikes(db, page_query, Hike, fields, limit)
+
+
+# pylint: disable-next=too-many-arguments
+def get_feed_page(db, username, after=None, limit=None, fields=FeedHike.__struct_fields__, *,
+        feed_mode=FEED_MODE):
+    '''Takes db file, username, optional page cursor, page size, selected fields and feed mode.
+        Returns HikesPage of followees' hikes (newest first), or None on a database error.
+    '''
+    limit = clamp_page_size(limit)
+    page_query = build_feed_page_query(
+        username, after, limit, feed_mode, get_select_list(FeedHike, fields))
+    return fetch_hikes(db, page_query, FeedHike, fields, limit)
+
+
+def get_users_page(usernames, user_cards, exact_match):
+    '''Takes similar usernames, their user cards (from utils.get_user_cards) and exact match.
+        Returns UsersPage.
+    '''
+    return UsersPage(users=[UserCard(username=username,
+        img_src=user_cards.get(username, {}).get('img_src', ''),
+        exact_match=username == exact_match) for username in usernames])
+
+
+# ==== RESPONSES ====
+
+def respond(body, status=200):
+    '''Takes struct to encode and optional status code. Returns JSON response.'''
+    return current_app.response_class(encoder.encode(body), status, mimetype='application/json')
+
+
+def respond_error(message, status):
+    '''Takes error message and status code. Returns JSON error response.'''
+    return respond(ApiError(error=message), status)
@@ -0,0 +1,78 @@
+'''Unit tests for the JSON API (/api/v1) and its msgspec row decoding'''
+import msgspec
+import pytest
+from api import FeedHike, Hike, get_feed_page, get_hikes_page, select_fields
+from testing import HIKE
+from utils import add_hike, follow, rebuild_feed_items
+# pylint: disable=line-too-long
+
+
+@pytest.fixture(name='db')
+def fixture_db(db):
+    '''Returns db file where frank follows suze, who has three hikes (two on the same date).'''
+    follow(db, 'frank', 'suze', 'follow')
+    for hike_date in ['2025-01-01', '2025-01-02', '2025-01-02']:
+        add_hike(db, 1, 1, dict(HIKE, hike_date=hike_date, trails_cs='Rad Trail, Tubular Trail'))
+    return db
+
+
+@pytest.fixture(name='client')
+def fixture_client(app_module):
+    '''Returns test client of the app using the db fixture.'''
+    return app_module.app.test_client()
+
+
+class TestRowDecoding:
+    '''Tests building hike structs from query rows'''
+
+    def test_pages(self, db):
+        '''Pages follow (hike_date, id) cursors and hold every column, in struct order'''
+        first_page = get_hikes_page(db, 1, limit=2)
+        assert [hike.id for hike in first_page.hikes] == [3, 2]
+        assert first_page.hikes[0] == Hike(3, '2025-01-02', 1, 1, 'Neat Place', 'Start', 'Rad Trail, Tubular Trail', 3.3, '', None, None, '')
+        assert first_page.next_cursor == '2025-01-02_2'
+        second_page = get_hikes_page(db, 1, after=first_page.next_cursor, limit=2)
+        assert [hike.id for hike in second_page.hikes] == [1]
+        assert second_page.next_cursor is None
+        rebuild_feed_items(db)
+        for feed_mode in ['read', 'write']:
+            feed_page = get_feed_page(db, 'frank', limit=2, feed_mode=feed_mode)
+            assert [(hike.id, hike.username) for hike in feed_page.hikes] == [(3, 'suze'), (2, 'suze')]
+
+    def test_field_selection(self, db):
+        '''Unselected fields stay UNSET and are left out of the JSON'''
+        fields = select_fields(FeedHike, 'username,area_name')
+        assert fields == ('area_name', 'username')
+        assert select_fields(Hike, 'username') is None
+        page = get_feed_page(db, 'frank', limit=1, fields=fields)
+        assert msgspec.json.decode(msgspec.json.encode(page)) == {
+            'hikes': [{'area_name': 'Neat Place', 'username': 'suze'}], 'next_cursor': '2025-01-02_3'}
+
+
+class TestRoutes:
+    '''Tests the /api/v1 routes'''
+
+    def test_user_hikes(self, client):
+        '''A user's hikes are paginated and validated like the HTML page'''
+        response = client.get('/api/v1/users/suze/hikes?limit=2&fields=id')
+        assert response.mimetype == 'application/json'
+        assert response.json == {'hikes': [{'id': 3}, {'id': 2}], 'next_cursor': '2025-01-02_2'}
+        assert client.get('/api/v1/users/suze/hikes?after=2025-01-02_2&fields=id').json['hikes'] == [{'id': 1}]
+        etag = response.headers['ETag']
+        assert client.get('/api/v1/users/suze/hikes?limit=2&fields=id', headers={'If-None-Match': etag}).status_code == 304
+        assert client.get('/api/v1/users/nobody/hikes').status_code == 404
+        assert client.get('/api/v1/users/suze/hikes?fields=password_hash').status_code == 400
+
+    def test_feed(self, client):
+        '''The feed needs a logged in session'''
+        assert client.get('/api/v1/users/frank/feed').status_code == 401
+        with client.session_transaction() as session:
+            session['username'], session['user_id'] = 'frank', 2
+        response = client.get('/api/v1/users/frank/feed?fields=id,username')
+        assert response.json['hikes'][0] == {'id': 3, 'username': 'suze'}
+
+    def test_user_search(self, client):
+        '''Similar usernames are returned with an exact match flag'''
+        response = client.get('/api/v1/users?q=suze')
+        assert {'username': 'suze', 'img_src': '', 'exact_match': True} in response.json['users']
+        assert client.get('/api/v1/users?q=').status_code == 400
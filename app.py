@@ -1,25 +1,66 @@
 '''This module contains app and service configuration and all routes for the application'''
-from flask import Flask, redirect, render_template, request, session
-from werkzeug.security import generate_password_hash, check_password_hash
+import sqlite3
+from flask import Flask, Response, redirect, render_template, request, session
 import cloudinary
 import cloudinary.uploader
 import cloudinary.api
 from dotenv import load_dotenv
 from flask_session import Session
+import api
+import connection_pool
+import fragments
+import http_cache
+import leaderboards
+import metrics
+import search
+import sessions
+import uploads
 from content import hike_form_content, error_messages
-from constants import DB, CLOUDINARY_URL_100, CLOUDINARY_URL_900
-from utils import (add_area, add_hike, add_trail, add_user, delete_hike, format_hike_form_data,
-    follow, get_all_usernames, get_area_id, get_feed, get_followees, get_hikes, get_hike_img_src,
-    get_similar_usernames, get_context_string_from_referrer, get_user_by_username, handle_error,
-    login_required, process_img_upload, update_hike, validate_hike_form)
+from constants import (DB, CLOUDINARY_URL_100, CLOUDINARY_URL_900, SEARCH_MAX_LENGTH,
+    SEARCH_RESULTS_LIMIT, SESSION_BACKEND)
+from hashing import HashingBusy, hash_password, verify_password
+from http_cache import check_not_modified, make_etag
+from init_sql import migrate
+from user_stats import get_user_stats
+from utils import (add_user, delete_hike, format_hike_form_data, follow, get_area_name,
+    get_feed_activity, get_feed_page, get_followees, get_hikes, get_hikes_page, get_next_page_path,
+    get_similar_usernames, get_context_string_from_referrer, get_trail, get_trail_hikes_page,
+    get_trail_id, get_user_by_username, get_user_cards, get_user_activity, cache_stats,
+    handle_error, login_required, save_hike_changes, save_new_hike, sync_feed_mode,
+    validate_hike_form)
 
 
 # Configure app and instantiate Session
 app = Flask(__name__)
 app.config['TEMPLATES_AUTO_RELOAD'] = True
-app.config["SESSION_TYPE"] = "filesystem"
 app.config["SESSION_PERMANENT"] = False
-Session(app)
+if SESSION_BACKEND == 'filesystem':
+    app.config["SESSION_TYPE"] = "filesystem"
+    Session(app)
+else:
+    # Session data in a sqlite table (or in memory), see sessions.py
+    app.session_interface = sessions.get_session_interface(SESSION_BACKEND)
+    session_sweeper = sessions.SessionSweeper(app.session_interface.store).start()
+# Share one pooled sqlite connection per app context across all utils calls
+connection_pool.init_app(app)
+# Record SQL queries, time, rows and connections per request (see /metrics)
+metrics.init_app(app)
+# Cache-Control per route, versioned static assets and ETags (see http_cache.py)
+http_cache.init_app(app)
+# Rendered hike blocks are cached by hike id and version (see fragments.py)
+fragments.init_app(app)
+# Snippet highlighting for hike search results (see search.py)
+search.init_app(app)
+# How long ago a leaderboard was ranked (see leaderboards.py)
+leaderboards.init_app(app)
+# Bring the database schema up to date (creates missing tables, applies pending migrations)
+migrate(DB)
+# Rebuild follower timelines if FEED_MODE has just been switched to 'write'
+sync_feed_mode(DB)
+# Start background image upload workers (see uploads.py)
+upload_workers = uploads.UploadWorkers(DB, uploads.get_uploader()).start()
+# Rebuild the leaderboard snapshots every LEADERBOARD_REFRESH_SECONDS
+leaderboard_refresher = leaderboards.LeaderboardRefresher(DB).start()
 
 # -- cloudinary config -- for storing and serving image content
     # Source: https://cloudinary.com/documentation/python_quickstart
@@ -32,13 +73,12 @@ cloudinary.config(
 )
 
 
-@app.after_request
-def after_request(response):
-    '''Ensure responses aren't cached. Source: CS50'''
-    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-    response.headers['Expires'] = 0
-    response.headers['Pragma'] = 'no-cache'
-    return response
+@app.errorhandler(HashingBusy)
+def server_busy(_error):
+    '''Renders error template with a 503 status and Retry-After header when the password
+        hashing pool is full (ie. a burst of logins), rather than queueing without limit.
+    '''
+    return handle_error(request.url, error_messages['server_busy'], 503), 503, {'Retry-After': '1'}
 
 
 # == SPLASH PAGE ==
@@ -56,12 +96,21 @@ def index():
 @app.route('/users/<username>/feed')
 @login_required
 def feed(username):
-    '''Renders feed template'''
-    hikes_list = get_feed(DB, username)
+    '''Renders feed template, one page at a time (?after=<cursor>&limit=N)'''
+    # Answer 304 if neither the follows nor any followee's hikes changed since the last visit
+    activity = get_feed_activity(DB, username)
+    not_modified = check_not_modified(make_etag(
+        'feed', username, session.get('username'), request.full_path,
+        activity['follows_version'], activity['hikes_version']), activity['updated_at'])
+    if not_modified:
+        return not_modified
+    feed_page = get_feed_page(
+        DB, username, request.args.get('after'), request.args.get('limit', type=int))
     return render_template(
         'feed.html',
         username=username,
-        hikes_list=hikes_list,
+        hikes_list=feed_page['hikes'],
+        next_page=get_next_page_path(feed_page['next_cursor']),
         cloudinary_url=CLOUDINARY_URL_900,
         is_feed=True)
 
@@ -79,14 +128,27 @@ def user_route(username):
     is_authorized_to_edit = False
     follow_status = False
     context_string = ''
-    # Get hikes for given user
-    hikes_list = get_hikes(DB, user.get('id'))
     # Set follow_status if auth user is not same as current user page
     if not session.get('username') == username:
-        user_id = get_user_by_username(DB, username).get('id')
+        user_id = user.get('id')
         followees_list = get_followees(DB, session.get('username'))
         if user_id in followees_list:
             follow_status = True
+    elif request.method == 'GET':
+        # Check for context string (ie. after adding or editing a hike)
+        context_string = get_context_string_from_referrer(
+            request.referrer, request.query_string, session.get('username'))
+    # Answer 304 if the user's hikes are unchanged since the viewer last saw this page
+    activity = get_user_activity(DB, user.get('id'))
+    not_modified = check_not_modified(make_etag(
+        'user', username, session.get('username'), request.full_path, follow_status,
+        context_string, activity['hikes_version']), activity['updated_at'])
+    if not_modified:
+        return not_modified
+    # Get one page of hikes for given user (?after=<cursor>&limit=N for older hikes)
+    hikes_page = get_hikes_page(
+        DB, user.get('id'), request.args.get('after'), request.args.get('limit', type=int))
+    hikes_list = hikes_page['hikes']
     # Return no data template if user's hikes list is empty
     if not hikes_list:
         return render_template(
@@ -106,13 +168,61 @@ def user_route(username):
             # Otherwise it is an edit action
             path = '/edit-hike/' + hike_id
             return redirect(path)
-        # Otherwise check for context string
-        context_string = get_context_string_from_referrer(
-            request.referrer, request.query_string, session.get('username'))
     # Render user page with list of that user's hikes
     return render_template(
         'feed.html', username=username, hikes_list=hikes_list, auth=is_authorized_to_edit,
-        context_string=context_string, following=follow_status, cloudinary_url=CLOUDINARY_URL_900)
+        context_string=context_string, following=follow_status, cloudinary_url=CLOUDINARY_URL_900,
+        next_page=get_next_page_path(hikes_page['next_cursor']),
+        stats=get_user_stats(DB, user.get('id')))
+
+
+#  == TRAILS ==
+
+@app.route('/trails')
+def trail_lookup():
+    '''Redirects to the page of the ?name= trail in area ?area_id= (linked from hike blocks)'''
+    trail_id = get_trail_id(DB, request.args.get('area_id', type=int), request.args.get('name'))
+    if not trail_id:
+        return handle_error(request.host_url, error_messages['trail_not_found'], 404)
+    return redirect(f'/trails/{trail_id}')
+
+
+@app.route('/trails/<int:trail_id>')
+def trail_route(trail_id):
+    '''Renders every user's hikes on a trail, one page at a time (?after=<cursor>&limit=N)'''
+    trail = get_trail(DB, trail_id)
+    if not trail:
+        return handle_error(request.host_url, error_messages['trail_not_found'], 404)
+    trail_page = get_trail_hikes_page(
+        DB, trail_id, request.args.get('after'), request.args.get('limit', type=int))
+    return render_template(
+        'feed.html',
+        trail=trail,
+        hikes_list=trail_page['hikes'],
+        next_page=get_next_page_path(trail_page['next_cursor']),
+        cloudinary_url=CLOUDINARY_URL_900)
+
+
+#  == LEADERBOARDS ==
+
+@app.route('/leaderboards')
+@login_required
+def followee_leaderboard():
+    '''Renders this month's top hikers among the hikers the user follows'''
+    return render_template(
+        'leaderboard.html', heading='Hikers you follow',
+        board=leaderboards.get_leaderboard(DB, 'following', session.get('user_id')))
+
+
+@app.route('/leaderboards/areas/<int:area_id>')
+def area_leaderboard(area_id):
+    '''Renders this month's top hikers in an area'''
+    area_name = get_area_name(DB, area_id)
+    if not area_name:
+        return handle_error(request.host_url, error_messages['area_not_found'], 404)
+    return render_template(
+        'leaderboard.html', heading=area_name,
+        board=leaderboards.get_leaderboard(DB, 'area', area_id))
 
 
 #  == FOLLOW ==
@@ -155,22 +265,21 @@ def user_search():
         # Validate that input has valid query value.
         if not query_param or not len(query_param) <15:
             return handle_error(request.base_url, error_messages['user_query_invalid'], 403)
-        # Check for an exact username match.
-        exact_match = get_user_by_username(DB, query_param).get('username')
         # Get similar usernames.
-        similar_usernames = get_similar_usernames(DB, query_param)
+        similar_usernames = get_similar_usernames(DB, query_param, SEARCH_RESULTS_LIMIT)
+        # Fetch each result's most recent hike image (and check for an exact match) in one query.
+        user_cards = get_user_cards(DB, [query_param] + list(similar_usernames))
+        exact_match = query_param if query_param in user_cards else None
         if not similar_usernames and not exact_match:
             return render_template('user-search.html', query=query_param, user_list='no_match')
         user_list = []
         for user in similar_usernames:
-            is_exact_match = False
-            if user == exact_match:
-                is_exact_match = True
-            user_id = get_user_by_username(DB, user).get('id')
-            most_recent_hike_img = get_hike_img_src(DB, user_id)
+            most_recent_hike_img = user_cards.get(user, {}).get('img_src', '')
         # Then create a list of dictionaries:
-            user_list.append(
-                {'username': user, 'img_src': most_recent_hike_img, 'exact_match': is_exact_match})
+            user_list.append({
+                'username': user,
+                'img_src': most_recent_hike_img,
+                'exact_match': user == exact_match})
         return render_template(
             'user-search.html',
             query=query_param,
@@ -181,17 +290,41 @@ def user_search():
     return render_template('user-search.html')
 
 
+#  == HIKE SEARCH ==
+
+@app.route('/search')
+def hike_search():
+    '''Renders hike search form, or BM25 ranked results one page at a time if ?q= is present.
+        ?mode=following only searches hikes of the users the logged in user follows.
+    '''
+    query = request.args.get('q', '').strip()
+    following = request.args.get('mode') == 'following'
+    if following and not session.get('user_id'):
+        return redirect('/login')
+    if not query:
+        return render_template('hike-search.html', query='', following=following)
+    if len(query) > SEARCH_MAX_LENGTH:
+        return handle_error(request.base_url, error_messages['hike_query_invalid'], 403)
+    results = search.search_hikes(
+        DB, query, request.args.get('after'), request.args.get('limit', type=int),
+        session.get('user_id') if following else None)
+    return render_template(
+        'hike-search.html',
+        query=query,
+        following=following,
+        hikes_list=results['hikes'],
+        next_page=get_next_page_path(results['next_cursor'], keep=('q', 'mode', 'limit')),
+        cloudinary_url=CLOUDINARY_URL_900)
+
+
 # == SIGN UP ==
 
+# pylint: disable=too-many-return-statements
 @app.route('/signup', methods=['GET', 'POST'])
 def sign_up():
     '''Renders sign-up form template on GET, or submits new user to db on POST'''
     if request.method == 'POST':
         username = request.form.get('username').lower()
-        # Default method for generate_password_hash (scrypt) doesn't work on macOS,
-        # so switching to 'pbdkf2' for development
-        password_hash = generate_password_hash(request.form.get('password'), method='pbkdf2')
-        existing_usernames = get_all_usernames(DB)
         # Validate that username exists and is alphanumeric amd has correct length
         if not username.isalnum() or not len(username) >3 or not len(username) <15:
             return handle_error(
@@ -203,11 +336,18 @@ def sign_up():
         # Validate that password confirmation matches
         if not request.form.get('password') == request.form.get('confirmation'):
             return handle_error(request.url, error_messages['pw_confirm_match'], 403)
-        # Check if submitted username is already taken.
-        for existing_name in existing_usernames:
-            if username == existing_name[0]:
-                return handle_error(request.url, error_messages['username_taken'], 403)
-        add_user(DB, username, password_hash)
+        # Check if submitted username is already taken with an indexed lookup before paying
+        #   for a hash. The UNIQUE constraint (add_user error) catches one taken since then.
+        if get_user_by_username(DB, username):
+            return handle_error(request.url, error_messages['username_taken'], 409), 409
+        # Hash method is set by PASSWORD_HASH_METHOD (scrypt, werkzeug's default, doesn't work
+        #   on macOS, so it defaults to 'pbkdf2')
+        signup_error = add_user(DB, username, hash_password(request.form.get('password')))
+        if isinstance(signup_error, sqlite3.IntegrityError):
+            return handle_error(request.url, error_messages['username_taken'], 409), 409
+        if signup_error != 0:
+            # ie. database locked, the username may well be free
+            return handle_error(request.url, error_messages['signup_failed'], 500), 500
         return redirect('/login')
     # Render signup form
     return render_template('signup.html')
@@ -230,7 +370,7 @@ def log_in():
         if not bool(user):
             return handle_error(request.url, error_messages['user_not_found'], 403)
         # Validate password
-        if not check_password_hash(user.get('password_hash'), request.form.get('password')):
+        if not verify_password(user.get('password_hash'), request.form.get('password')):
             return handle_error(request.url, error_messages['incorrect_pw'], 403)
         # If values are valid, log in and redirect to home
         session['username'] = username
@@ -263,20 +403,19 @@ def new_hike():
             return handle_error(request.url, error_messages[form_error], 403)
         # Format form data
         hike_data = format_hike_form_data(form_data)
-        # Upload image file and set source as cloudinary public_id
-        image_id = process_img_upload(request.files.get('image_url'))
-
-        # Replace img url with cloudinary id
-        # hike_data['image_url'] = src_url
-        hike_data['image_url'] = image_id
-
-        # Insert to areas, trails, and hikes tables
-        area_name = hike_data.get('area_name')
-        trail_list = hike_data.get('trails_cs')
-        add_area(DB, area_name)
-        area_id = get_area_id(area_name, DB)
-        add_trail(DB, area_id, trail_list)
-        add_hike(DB, session.get('user_id'), area_id, hike_data)
+        # Spool image file for the upload workers, image_url is set once it is uploaded
+        pending_upload = uploads.spool_upload(
+            request.files.get('image_url'), session.get('username'))
+        hike_data['image_url'] = ''
+
+        # Insert to areas, trails, and hikes tables in one transaction
+        hike_id = save_new_hike(
+            DB, session.get('user_id'), hike_data, pending_upload=pending_upload)
+        if isinstance(hike_id, sqlite3.Error):
+            # Nothing was written, so no upload worker will ever pick up the spooled file
+            uploads.discard_upload(pending_upload)
+            return handle_error(request.url, error_messages['save_failed'], 500), 500
+        upload_workers.notify()
         return redirect('/')
     # Route to new hike form
     return render_template('hike-form.html', form_content=hike_form_content, selected_hike_data={})
@@ -301,13 +440,16 @@ def edit_hike(hike_id):
         if form_error:
             return handle_error(request.url, error_messages[form_error], 403)
         del updated_hike_data['action']
-        # Upload image file and set source as cloudinary public_id
-        image_id = process_img_upload(
-            request.files.get('image_url'), existing_hike_data.get('image_url'))
-        # Set image url with either existing or updated value
-        updated_hike_data['image_url'] = image_id
-        # Insert updated data into database
-        update_hike(DB, existing_hike_data, updated_hike_data)
+        # Spool new image file for the upload workers, existing image is kept until it's uploaded
+        pending_upload = uploads.spool_upload(request.files.get('image_url'), username)
+        updated_hike_data['image_url'] = existing_hike_data.get('image_url')
+        # Insert updated data (and the area and trails, if new) into database in one transaction
+        save_error = save_hike_changes(
+            DB, existing_hike_data.get('id'), updated_hike_data, pending_upload=pending_upload)
+        if isinstance(save_error, sqlite3.Error):
+            uploads.discard_upload(pending_upload)
+            return handle_error(request.url, error_messages['save_failed'], 500), 500
+        upload_workers.notify()
         # Redirect to user page
         path = '/users/' + username
         return redirect(path)
@@ -320,3 +462,80 @@ def edit_hike(hike_id):
         return handle_error(path, error_messages['unauthorized'], 401)
     return render_template(
         '/hike-form.html', form_content=hike_form_content, selected_hike_data=selected_hike_data)
+
+
+#  == JSON API ==
+# Read-only, paginated like the HTML pages (?after=<cursor>&limit=N), with ?fields=id,... to
+# select the hike fields returned (see api.py)
+
+@app.route('/api/v1/users/<username>/hikes')
+def api_user_hikes(username):
+    '''Returns one page of a user's hikes as JSON'''
+    user = get_user_by_username(DB, username)
+    if not bool(user):
+        return api.respond_error(error_messages['user_not_found'], 404)
+    fields = api.select_fields(api.Hike, request.args.get('fields'))
+    if fields is None:
+        return api.respond_error('Unknown field', 400)
+    activity = get_user_activity(DB, user.get('id'))
+    not_modified = check_not_modified(make_etag(
+        'api_user_hikes', username, request.full_path, activity['hikes_version']),
+        activity['updated_at'])
+    if not_modified:
+        return not_modified
+    hikes_page = api.get_hikes_page(
+        DB, user.get('id'), request.args.get('after'), request.args.get('limit', type=int), fields)
+    if hikes_page is None:
+        return api.respond_error('Database error', 500)
+    return api.respond(hikes_page)
+
+
+@app.route('/api/v1/users/<username>/feed')
+def api_feed(username):
+    '''Returns one page of a user's feed as JSON (logged in users only, like the feed page)'''
+    if not session.get('username'):
+        return api.respond_error('Login required', 401)
+    fields = api.select_fields(api.FeedHike, request.args.get('fields'))
+    if fields is None:
+        return api.respond_error('Unknown field', 400)
+    activity = get_feed_activity(DB, username)
+    not_modified = check_not_modified(make_etag(
+        'api_feed', username, session.get('username'), request.full_path,
+        activity['follows_version'], activity['hikes_version']), activity['updated_at'])
+    if not_modified:
+        return not_modified
+    feed_page = api.get_feed_page(
+        DB, username, request.args.get('after'), request.args.get('limit', type=int), fields)
+    if feed_page is None:
+        return api.respond_error('Database error', 500)
+    return api.respond(feed_page)
+
+
+@app.route('/api/v1/users')
+def api_user_search():
+    '''Returns users with usernames similar to ?q= as JSON, flagging an exact match'''
+    query_param = request.args.get('q', '').lower()
+    if not query_param or not len(query_param) < 15:
+        return api.respond_error(error_messages['user_query_invalid'], 400)
+    limit = request.args.get('limit', SEARCH_RESULTS_LIMIT, type=int)
+    limit = max(1, min(limit, SEARCH_RESULTS_LIMIT))
+    similar_usernames = get_similar_usernames(DB, query_param, limit)
+    user_cards = get_user_cards(DB, [query_param] + list(similar_usernames))
+    exact_match = query_param if query_param in user_cards else None
+    return api.respond(api.get_users_page(similar_usernames, user_cards, exact_match))
+
+
+#  == METRICS ==
+
+@app.route('/metrics')
+def metrics_route():
+    '''Returns per-endpoint request and SQL histograms, plus connection pool and cache stats,
+        in Prometheus text exposition format.
+    '''
+    gauges = metrics.render_gauges(
+        'connection_pool', 'Connection pool hits, misses and idle connections.',
+        connection_pool.pool.stats(), 'stat')
+    for name, stats in cache_stats().items():
+        gauges += metrics.render_gauges(
+            f'cache_{name}', f'Hits, misses and size of the {name} cache.', stats, 'stat')
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
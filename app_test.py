@@ -0,0 +1,47 @@
+'''Unit tests for the sign up route'''
+import sqlite3
+import pytest
+from hashing import hash_password
+from utils import get_user_by_username
+# pylint: disable=line-too-long
+
+FORM = {'password': 'pass', 'confirmation': 'pass'}
+
+
+@pytest.fixture(autouse=True)
+def fast_hash(app_module, monkeypatch):
+    '''Hashes passwords with one pbkdf2 iteration, sign up doesn't need to be slow here.'''
+    monkeypatch.setattr(app_module, 'hash_password', lambda password: hash_password(password, 'pbkdf2:sha256:1'))
+
+
+def sign_up(app_module, username):
+    '''Takes app module and username. Posts the sign up form for it. Returns response.'''
+    return app_module.app.test_client().post('/signup', data=dict(FORM, username=username))
+
+
+class TestSignUp:
+    '''Tests sign up answers username taken only when it is'''
+
+    def test_signed_up(self, app_module):
+        '''A free username is added, and the user is sent to log in'''
+        response = sign_up(app_module, 'bobby')
+        assert response.status_code == 302 and response.location == '/login'
+        assert get_user_by_username(app_module.DB, 'bobby')
+
+    def test_username_taken(self, app_module, monkeypatch):
+        '''A taken username is a conflict, whether the lookup or the UNIQUE constraint catches it'''
+        assert sign_up(app_module, 'suze').status_code == 409
+        # Taken between the lookup and the insert (ie. by another request)
+        monkeypatch.setattr(app_module, 'get_user_by_username', lambda *args: {})
+        response = sign_up(app_module, 'suze')
+        assert response.status_code == 409
+        assert b'Username is already taken' in response.data
+
+    def test_failed_write(self, app_module, monkeypatch):
+        '''Any other database error is a server error, not username taken'''
+        locked = sqlite3.OperationalError('database is locked')
+        monkeypatch.setattr(app_module, 'add_user', lambda *args: locked)
+        response = sign_up(app_module, 'bobby')
+        assert response.status_code == 500
+        assert b'Your account could not be created' in response.data
+        assert b'Username is already taken' not in response.data
@@ -0,0 +1,3 @@
+'''Benchmarks for the python server. Run each module from the project root, ie.
+    python -m benchmarks.bench_user_search
+'''
@@ -0,0 +1,100 @@
+'''Compares encoding a page of hikes as JSON with jsonify (rows -> hike records -> dicts ->
+    flask.jsonify) and with the API's msgspec path (rows -> Hike structs -> msgspec encoder),
+    with every field and with a few selected fields. Rows are fetched once, only building
+    and encoding the response body is timed.
+    Usage: python -m benchmarks.bench_api [rows per page] [pages encoded per case]
+'''
+import os
+import sys
+import tempfile
+import time
+from flask import Flask, jsonify
+import api
+from init_sql import migrate
+from records import decode_hikes
+from utils import add_user, create_connection, commit_close_conn
+from benchmarks.runner import summarize
+
+DEFAULT_ROWS = 100
+DEFAULT_PAGES = 2000
+SELECTED_FIELDS = ('id', 'hike_date', 'area_name', 'distance_km')
+
+
+def fetch_rows(db, rows):
+    '''Takes db file and number of rows. Adds that many hikes for one user.
+        Returns (cursor description, rows) of the user's hikes, as get_hikes_page would read them.
+    '''
+    add_user(db, 'hiker', 'x')
+    db_connection = create_connection(db)
+    db_connection['cursor'].executemany(
+        'INSERT INTO hikes (hike_date, user_id, area_id, area_name, trailhead, trails_cs, '
+        "distance_km, image_url, image_alt, map_link, other_info) VALUES (?, 1, 1, 'Neat Place', "
+        "'Rad Trailhead', 'Rad Trail, Tubular Trail', 4.9, 'image', 'Alt text', "
+        "'https://maps.google.com/map', 'Woah this trail is kewl!')",
+        [(f'2024-{index % 12 + 1:02d}-{index % 28 + 1:02d}',) for index in range(rows)])
+    db_connection['connection'].commit()
+    cursor = db_connection['cursor'].execute(
+        f'SELECT {api.get_select_list(api.Hike, api.Hike.__struct_fields__)} FROM hikes')
+    fetched = cursor.fetchall()
+    description = cursor.description
+    commit_close_conn(db_connection['connection'])
+    return description, fetched
+
+
+def encode_jsonify(description, rows):
+    '''Takes cursor description and rows. Returns JSON body built with hike dicts and jsonify.'''
+    hikes = [dict(hike) for hike in decode_hikes(description, rows)]
+    return jsonify({'hikes': hikes, 'next_cursor': None}).get_data()
+
+
+def encode_msgspec(fields):
+    '''Takes selected fields. Returns fn encoding rows as the API does.'''
+    page_type, count = api.get_struct_type(api.Hike, fields), len(fields)
+
+    def encode(_description, rows):
+        # The API selects only these columns, in field order, so rows would hold just these
+        hikes = [page_type(*row[:count]) for row in rows]
+        return api.encoder.encode(api.HikesPage(hikes=hikes, next_cursor=None))
+    return encode
+
+
+def time_encoder(encode, description, rows, pages):
+    '''Takes encode fn, cursor description, rows and pages to encode.
+        Returns (summary of ms per page, bytes per page).
+    '''
+    timings = []
+    for _ in range(pages):
+        start = time.perf_counter()
+        body = encode(description, rows)
+        timings.append((time.perf_counter() - start) * 1000)
+    return summarize(timings), len(body)
+
+
+def main(rows, pages):
+    '''Takes rows per page and pages per case. Prints encode time, pages/s and MB/s per case.'''
+    cases = {
+        'jsonify (dicts)': encode_jsonify,
+        'msgspec': encode_msgspec(api.Hike.__struct_fields__),
+        f'msgspec ({len(SELECTED_FIELDS)} fields)': encode_msgspec(SELECTED_FIELDS),
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        db = os.path.join(directory, 'bench.db')
+        migrate(db)
+        description, fetched = fetch_rows(db, rows)
+    columns = [column[0] for column in description]
+    selected_rows = [tuple(row[columns.index(field)] for field in SELECTED_FIELDS)
+        for row in fetched]
+    print(f'{rows} hikes per page, {pages} pages per case')
+    print(f'{"case":>24} {"p50 ms":>8} {"p95 ms":>8} {"pages/s":>9} {"MB/s":>7} {"bytes":>8}')
+    with Flask(__name__).app_context():
+        for name, encode in cases.items():
+            case_rows = selected_rows if name.endswith('fields)') else fetched
+            summary, size = time_encoder(encode, description, case_rows, pages)
+            pages_per_second = 1000 / summary['mean']
+            print(f'{name:>24} {summary["p50"]:>8.3f} {summary["p95"]:>8.3f} '
+                f'{pages_per_second:>9.0f} {pages_per_second * size / 1e6:>7.1f} {size:>8}')
+
+
+if __name__ == '__main__':
+    ARGS = [int(arg) for arg in sys.argv[1:]]
+    main(*(ARGS + [DEFAULT_ROWS, DEFAULT_PAGES][len(ARGS):]))
@@ -0,0 +1,83 @@
+'''Compares the two feed strategies (FEED_MODE): fan-out-on-read joins follows and hikes for
+    every feed page, fan-out-on-write reads a feed_items timeline kept current by add_hike.
+    Usage: python -m benchmarks.bench_feed [number of users] [follows per user]
+'''
+import os
+import random
+import sys
+import tempfile
+import time
+from init_sql import migrate
+from utils import (add_hike, create_connection, commit_close_conn, get_feed_page,
+    rebuild_feed_items)
+
+HIKES_PER_USER = 20
+SAMPLES = 200
+
+
+def populate(db, users, follows_per_user, seed=42):
+    '''Takes db file, number of users, follows per user and random seed.
+        Inserts users, follow edges (skewed towards popular hikers) and hikes in bulk.
+    '''
+    generator = random.Random(seed)
+    db_connection = create_connection(db)
+    db_connection['cursor'].executemany(
+        'INSERT INTO users (id, username, password_hash) VALUES (?, ?, ?)',
+        [(user_id, f'hiker{user_id}', 'x') for user_id in range(1, users + 1)])
+    # Low ids are popular: weight followees by 1 / id
+    weights = [1 / user_id for user_id in range(1, users + 1)]
+    follows = set()
+    for follower_id in range(1, users + 1):
+        for followee_id in generator.choices(range(1, users + 1), weights, k=follows_per_user):
+            if followee_id != follower_id:
+                follows.add((follower_id, followee_id))
+    db_connection['cursor'].executemany(
+        'INSERT INTO follows (follower_id, followee_id) VALUES (?, ?)', follows)
+    db_connection['cursor'].executemany(
+        'INSERT INTO hikes (hike_date, user_id, area_id, area_name, trails_cs, distance_km) '
+        "VALUES (?, ?, 1, 'Area', 'Trail', 5.0)",
+        [(f'2024-{generator.randint(1, 12):02d}-{generator.randint(1, 28):02d}', user_id)
+            for user_id in range(1, users + 1) for _ in range(HIKES_PER_USER)])
+    commit_close_conn(db_connection['connection'])
+
+
+def percentiles(timings):
+    '''Takes list of timings in ms. Returns (p50, p95) tuple.'''
+    timings = sorted(timings)
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.95)]
+
+
+def main(users, follows_per_user):
+    '''Takes number of users and follows per user. Prints feed read and hike write latency.'''
+    generator = random.Random(7)
+    with tempfile.TemporaryDirectory() as directory:
+        db = os.path.join(directory, 'bench.db')
+        migrate(db)
+        populate(db, users, follows_per_user)
+        rebuild_feed_items(db)
+        print(f'{users} users, ~{follows_per_user} follows each, {HIKES_PER_USER} hikes each')
+        print(f'{"mode":>6} {"feed p50 ms":>12} {"feed p95 ms":>12} {"add_hike p50 ms":>16}')
+        for feed_mode in ['read', 'write']:
+            reads = []
+            for _ in range(SAMPLES):
+                username = f'hiker{generator.randint(1, users)}'
+                start = time.perf_counter()
+                get_feed_page(db, username, feed_mode=feed_mode)
+                reads.append((time.perf_counter() - start) * 1000)
+            writes = []
+            for _ in range(SAMPLES // 4):
+                # Popular hikers post too, so fan-out cost is included
+                user_id = generator.randint(1, min(users, 50))
+                hike = {'hike_date': '2025-01-01', 'area_name': 'Area', 'trails_cs': 'Trail',
+                    'distance_km': '5.0'}
+                start = time.perf_counter()
+                add_hike(db, user_id, 1, hike, feed_mode=feed_mode)
+                writes.append((time.perf_counter() - start) * 1000)
+            read_p50, read_p95 = percentiles(reads)
+            write_p50 = percentiles(writes)[0]
+            print(f'{feed_mode:>6} {read_p50:>12.2f} {read_p95:>12.2f} {write_p50:>16.2f}')
+
+
+if __name__ == '__main__':
+    ARGS = [int(arg) for arg in sys.argv[1:]]
+    main(*(ARGS + [5000, 100][len(ARGS):]))
@@ -0,0 +1,73 @@
+'''Compares posting a new hike the way /new-hike used to (add_area, get_area_id, add_trail and
+    add_hike, each committing on its own) with save_new_hike (one transaction, one commit).
+    Each post runs in its own app context, like a request, so both share one pooled connection
+    per post, and commits are counted as the /metrics commits histogram counts them.
+    Usage: python -m benchmarks.bench_hike_writes [posts per case]
+'''
+import os
+import sys
+import tempfile
+import time
+from flask import Flask, g
+from connection_pool import pool, release_connections
+from init_sql import migrate
+from metrics import REQUEST_TOTALS
+from utils import add_area, add_hike, add_trail, add_user, get_area_id, save_new_hike
+from benchmarks.runner import BENCH_HIKE, summarize
+
+DEFAULT_POSTS = 500
+AREAS = 20
+
+
+def post_separately(db, hike_data):
+    '''Takes db file and hike data. Posts the hike with one commit per table.'''
+    add_area(db, hike_data['area_name'])
+    area_id = get_area_id(hike_data['area_name'], db)
+    add_trail(db, area_id, hike_data['trails_cs'])
+    add_hike(db, 1, area_id, hike_data)
+
+
+def post_in_one_transaction(db, hike_data):
+    '''Takes db file and hike data. Posts the hike with save_new_hike.'''
+    save_new_hike(db, 1, hike_data)
+
+
+def time_posts(post, db, posts):
+    '''Takes post fn, db file and number of posts.
+        Returns (summary of ms per post, commits per post, queries per post).
+    '''
+    app = Flask(__name__)
+    timings, commits, queries = [], 0, 0
+    for index in range(posts):
+        # Areas repeat, trails are new to every post
+        hike_data = dict(BENCH_HIKE, area_name=f'Area {index % AREAS}',
+            trails_cs=f'Trail {index}, Loop {index}')
+        with app.app_context():
+            g.sql_metrics = dict.fromkeys(REQUEST_TOTALS, 0)
+            start = time.perf_counter()
+            post(db, hike_data)
+            timings.append((time.perf_counter() - start) * 1000)
+            commits += g.sql_metrics['commits']
+            queries += g.sql_metrics['queries']
+            release_connections()
+    return summarize(timings), commits / posts, queries / posts
+
+
+def main(posts):
+    '''Takes posts per case. Prints latency, commits and statements per post for each case.'''
+    print(f'{posts} posts per case, p50/p95 ms per post')
+    print(f'{"case":>24} {"p50 ms":>8} {"p95 ms":>8} {"commits":>8} {"queries":>8}')
+    for name, post in [('one commit per table', post_separately),
+            ('save_new_hike', post_in_one_transaction)]:
+        with tempfile.TemporaryDirectory() as directory:
+            db = os.path.join(directory, 'bench.db')
+            migrate(db)
+            add_user(db, 'hiker', 'x')
+            summary, commits, queries = time_posts(post, db, posts)
+            pool.clear()
+        print(f'{name:>24} {summary["p50"]:>8.3f} {summary["p95"]:>8.3f} {commits:>8.1f} '
+            f'{queries:>8.1f}')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]] or [DEFAULT_POSTS])
@@ -0,0 +1,136 @@
+'''Times reading "top hikers this month" leaderboards three ways, for the users following the
+    most hikers and the busiest areas of a synthetic database (benchmarks.datagen): ranking the
+    month's hikes with an aggregate query on every view, loading the board's snapshot rows, and
+    reading the board kept in memory (leaderboards.get_leaderboard). Also times a snapshot
+    rebuild, and adding a hike with and without boards in memory to update.
+    Usage: python -m benchmarks.bench_leaderboards [users] [boards sampled]
+'''
+import os
+import sys
+import tempfile
+import time
+from flask import Flask
+import leaderboards
+from connection_pool import release_connections, scoped_connection
+from constants import LEADERBOARD_SIZE
+from utils import delete_hike, save_new_hike
+from benchmarks.datagen import generate
+from benchmarks.runner import BENCH_HIKE, summarize
+
+REPEATS = 20
+WRITES = 300
+MONTH = BENCH_HIKE['hike_date'][:7]
+# The same boards ranked from hikes, as a view would without the snapshots
+AGGREGATE_QUERIES = {
+    'following': 'SELECT hikes.user_id, total(hikes.distance_km) AS total_km, count(*) '
+        'FROM follows JOIN hikes ON hikes.user_id = follows.followee_id '
+        'WHERE follows.follower_id = ? AND hikes.hike_date >= ? AND hikes.hike_date < ? '
+        'GROUP BY hikes.user_id ORDER BY total_km DESC, hikes.user_id LIMIT ?',
+    'area': 'SELECT user_id, total(distance_km) AS total_km, count(*) FROM hikes '
+        'WHERE area_id = ? AND hike_date >= ? AND hike_date < ? '
+        'GROUP BY user_id ORDER BY total_km DESC, user_id LIMIT ?',
+}
+
+
+def aggregate_board(db, kind, board_id):
+    '''Takes db file, kind of board and board id. Ranks the board's hikers from hikes.'''
+    start, end = leaderboards.get_month_range(MONTH)
+    with scoped_connection(db) as db_connection:
+        db_connection['cursor'].execute(
+            AGGREGATE_QUERIES[kind], (board_id, start, end, LEADERBOARD_SIZE)).fetchall()
+
+
+def snapshot_board(db, kind, board_id):
+    '''Takes db file, kind of board and board id. Reads the board from its snapshot.'''
+    leaderboards.boards.pop(db, None)
+    leaderboards.get_leaderboard(db, kind, board_id)
+
+
+def memory_board(db, kind, board_id):
+    '''Takes db file, kind of board and board id. Reads the board held in memory.'''
+    leaderboards.get_leaderboard(db, kind, board_id)
+
+
+def time_reads(read, db, kind, board_ids):
+    '''Takes read fn, db file, kind of board and list of board ids. Returns summary of ms per
+        read. Reads share one pooled connection, as the queries of a request do.
+    '''
+    timings = []
+    with Flask(__name__).app_context():
+        for _ in range(REPEATS):
+            for board_id in board_ids:
+                start = time.perf_counter()
+                read(db, kind, board_id)
+                timings.append((time.perf_counter() - start) * 1000)
+        release_connections()
+    return summarize(timings)
+
+
+def print_reads(db, sampled):
+    '''Takes db file and number of boards sampled. Prints p50 and p95 per leaderboard read.'''
+    with scoped_connection(db) as db_connection:
+        followers = [row[0] for row in db_connection['cursor'].execute(
+            'SELECT follower_id FROM follows GROUP BY follower_id ORDER BY count(*) DESC LIMIT ?',
+            (sampled,))]
+        areas = [row[0] for row in db_connection['cursor'].execute(
+            'SELECT area_id FROM hikes GROUP BY area_id ORDER BY count(*) DESC LIMIT ?',
+            (sampled,))]
+    print(f'{REPEATS} reads of the {sampled} largest boards of each kind for {MONTH}, '
+        'ms per view')
+    print(f'{"leaderboard read":>28} {"p50":>8} {"p95":>8} {"max":>8}')
+    for kind, board_ids in [('following', followers), ('area', areas)]:
+        for read_name, read in [('aggregate', aggregate_board), ('snapshot', snapshot_board),
+                ('in memory', memory_board)]:
+            summary = time_reads(read, db, kind, board_ids)
+            print(f'{kind + ", " + read_name:>28} {summary["p50"]:>8.3f} '
+                f'{summary["p95"]:>8.3f} {summary["max"]:>8.3f}')
+    return followers, areas
+
+
+def print_writes(db, followers, areas):
+    '''Takes db file, and follower and area ids of the boards read.
+        Prints p50 and p95 per new hike, with and without those boards in memory. Writes share
+        one pooled connection, as in a request.
+    '''
+    with scoped_connection(db) as db_connection:
+        user_id = db_connection['cursor'].execute(
+            'SELECT followee_id FROM follows GROUP BY followee_id ORDER BY count(*) DESC LIMIT 1'
+        ).fetchone()[0]
+    print(f'{WRITES} hikes added by the most followed user, ms per write')
+    print(f'{"write":>28} {"p50":>8} {"p95":>8} {"max":>8}')
+    for boards_name in ['no boards', 'boards in memory']:
+        leaderboards.boards.pop(db, None)
+        if boards_name == 'boards in memory':
+            for kind, board_ids in [('following', followers), ('area', areas)]:
+                for board_id in board_ids:
+                    leaderboards.get_leaderboard(db, kind, board_id)
+        timings = []
+        with Flask(__name__).app_context():
+            for _ in range(WRITES):
+                start = time.perf_counter()
+                hike_id = save_new_hike(db, user_id, BENCH_HIKE)
+                timings.append((time.perf_counter() - start) * 1000)
+                delete_hike(db, hike_id, user_id)
+            release_connections()
+        summary = summarize(timings)
+        print(f'{"add, " + boards_name:>28} {summary["p50"]:>8.3f} '
+            f'{summary["p95"]:>8.3f} {summary["max"]:>8.3f}')
+
+
+def main(users, sampled):
+    '''Takes number of users and boards sampled. Prints p50 and p95 per read and write.'''
+    with tempfile.TemporaryDirectory() as directory:
+        db = os.path.join(directory, 'bench.db')
+        dataset = generate(db, users)
+        start = time.perf_counter()
+        leaderboards.rebuild_leaderboards(db, MONTH)
+        print(f'{dataset["hikes"]} hikes, snapshots rebuilt in '
+            f'{(time.perf_counter() - start) * 1000:.1f} ms')
+        followers, areas = print_reads(db, sampled)
+        print()
+        print_writes(db, followers, areas)
+
+
+if __name__ == '__main__':
+    ARGS = [int(arg) for arg in sys.argv[1:]]
+    main(*(ARGS + [10_000, 50][len(ARGS):]))
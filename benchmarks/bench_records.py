@@ -0,0 +1,117 @@
+'''Compares decoding a 1000-row feed into hike records (records.decode_hikes) with the dict per
+    row that format_hikes used to build. Times (CPU time per feed) decoding alone, decoding plus
+    the keys render_hike reads for a block in the fragment cache, and decoding plus every key a
+    block reads when it is rendered. Measures the memory held by the decoded feed with tracemalloc.
+    Usage: python -m benchmarks.bench_records [rows] [repeats]
+'''
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from init_sql import migrate
+from records import decode_hikes
+from utils import (add_user, build_feed_page_query, create_connection, commit_close_conn,
+    follow)
+from benchmarks.runner import summarize
+
+DEFAULT_ROWS = 1000
+DEFAULT_REPEATS = 200
+# Keys read by fragments.render_hike to find a cached block, and by templates/hike-block.html
+FRAGMENT_KEYS = ['id', 'username', 'version']
+BLOCK_KEYS = ['id', 'username', 'hike_date', 'area_name', 'trailhead', 'distance_km', 'image_url',
+    'image_alt', 'other_info', 'trails_list', 'map_link', 'version']
+
+
+def format_hikes(description, rows):
+    '''Takes cursor description and rows. Returns list of hike dicts, built the way
+        utils.format_hikes did before hike records replaced it.
+    '''
+    keys = []
+    for column in description:
+        keys.append(column[0])
+    hikes_list = []
+    for entry in rows:
+        this_entry = {}
+        for index, key in enumerate(keys):
+            if key == 'distance_km' and entry[index] is not None:
+                this_entry[key] = round(entry[index], 1)
+            else:
+                this_entry[key] = entry[index]
+        this_entry['trails_list'] = this_entry.get('trails_cs').split(', ')
+        hikes_list.append(this_entry)
+    return hikes_list
+
+
+def fetch_feed(db, rows):
+    '''Takes db file and number of rows. Adds a followed user with that many hikes.
+        Returns (cursor description, rows) of the follower's feed.
+    '''
+    add_user(db, 'follower', 'x')
+    add_user(db, 'hiker', 'x')
+    follow(db, 'follower', 'hiker', 'follow')
+    db_connection = create_connection(db)
+    db_connection['cursor'].executemany(
+        'INSERT INTO hikes (hike_date, user_id, area_id, area_name, trailhead, trails_cs, '
+        "distance_km, image_url, image_alt, map_link, other_info) VALUES (?, 2, 1, 'Neat Place', "
+        "'Rad Trailhead', 'Rad Trail, Tubular Trail', 4.94, 'image', 'Alt text', "
+        "'https://maps.google.com/map', 'Woah this trail is kewl!')",
+        [(f'2024-{index % 12 + 1:02d}-{index % 28 + 1:02d}',) for index in range(rows)])
+    db_connection['connection'].commit()
+    cursor = db_connection['cursor'].execute(*build_feed_page_query('follower', None, rows, 'read'))
+    fetched, description = cursor.fetchall()[:rows], cursor.description
+    commit_close_conn(db_connection['connection'])
+    return description, fetched
+
+
+def read_keys(hikes, keys):
+    '''Takes decoded hikes and keys. Reads those keys of every hike.'''
+    for hike in hikes:
+        for key in keys:
+            hike.get(key)
+
+
+def time_cpu(decode, description, rows, repeats, keys):
+    '''Takes decode fn, cursor description, rows, repeats and keys to read from each hike.
+        Returns summary of CPU ms per feed.
+    '''
+    timings = []
+    for _ in range(repeats):
+        start = time.process_time()
+        read_keys(decode(description, rows), keys)
+        timings.append((time.process_time() - start) * 1000)
+    return summarize(timings)
+
+
+def measure_memory(decode, description, rows):
+    '''Takes decode fn, cursor description and rows.
+        Returns bytes allocated by the decoded feed after every key was read once.
+    '''
+    tracemalloc.start()
+    hikes = decode(description, rows)
+    read_keys(hikes, BLOCK_KEYS)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size
+
+
+def main(rows, repeats):
+    '''Takes rows per feed and repeats. Prints CPU time and memory per decoder.'''
+    with tempfile.TemporaryDirectory() as directory:
+        db = os.path.join(directory, 'bench.db')
+        migrate(db)
+        description, fetched = fetch_feed(db, rows)
+    print(f'{len(fetched)} feed rows, {repeats} repeats, p50 CPU ms per feed')
+    print(f'{"decoder":>8} {"decode":>7} {"+ cached blocks":>16} {"+ rendered blocks":>18} '
+        f'{"KiB held":>9}')
+    for name, decode in [('dicts', format_hikes), ('records', decode_hikes)]:
+        timings = [time_cpu(decode, description, fetched, repeats, keys)['p50']
+            for keys in ([], FRAGMENT_KEYS, BLOCK_KEYS)]
+        size = measure_memory(decode, description, fetched)
+        print(f'{name:>8} {timings[0]:>7.3f} {timings[1]:>16.3f} {timings[2]:>18.3f} '
+            f'{size / 1024:>9.1f}')
+
+
+if __name__ == '__main__':
+    ARGS = [int(arg) for arg in sys.argv[1:]]
+    main(*(ARGS + [DEFAULT_ROWS, DEFAULT_REPEATS][len(ARGS):]))
@@ -0,0 +1,115 @@
+'''Times hike search (search.search_hikes, the first page of BM25 ranked results with snippets)
+    on a synthetic database of a million hikes, for common, rare, multi-term and prefix searches,
+    and in followees mode for a user following many hikers. Hikes are bulk inserted through the
+    hikes_fts triggers, as the app writes them. Notes are drawn from a skewed vocabulary, so a
+    few words are in most hikes and most words in very few.
+    Usage: python -m benchmarks.bench_search [hikes] [repeats]
+'''
+import os
+import random
+import sys
+import tempfile
+import time
+from init_sql import migrate
+from search import search_hikes
+from utils import create_connection, commit_close_conn
+from benchmarks.datagen import FIRST_WORDS, TRAIL_SUFFIXES, zipf_weights
+from benchmarks.runner import summarize
+
+DEFAULT_HIKES = 1_000_000
+DEFAULT_REPEATS = 20
+HIKES_PER_USER = 20
+AREAS = 5_000
+VOCABULARY = 20_000
+NOTE_WORDS = 12
+# Followees mode searches as user 1, who follows this many users
+FOLLOWEES = 500
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'ta', 'vo', 'shi', 'ber', 'dan', 'gor', 'wen']
+
+
+def make_vocabulary(generator, size):
+    '''Takes random generator and size. Returns list of unique made-up words, most common first.'''
+    words = dict.fromkeys(FIRST_WORDS)
+    while len(words) < size:
+        words[''.join(generator.choices(SYLLABLES, k=generator.randint(2, 4)))] = None
+    return list(words)
+
+
+def populate(db, hikes, seed=42):
+    '''Takes db file, number of hikes and random seed. Adds users, follows and hikes.
+        Returns dict of sample search terms by kind (common, rare).
+    '''
+    generator = random.Random(seed)
+    vocabulary = make_vocabulary(generator, VOCABULARY)
+    word_weights = zipf_weights(len(vocabulary))
+    area_weights = zipf_weights(AREAS)
+    areas = [f'{generator.choice(FIRST_WORDS).title()} '
+        f'{vocabulary[generator.randrange(500)].title()} Area {area}' for area in range(AREAS)]
+    users = max(FOLLOWEES + 1, hikes // HIKES_PER_USER)
+    db_connection = create_connection(db)
+    cursor = db_connection['cursor']
+    cursor.executemany('INSERT INTO users (id, username, password_hash) VALUES (?, ?, ?)',
+        [(user_id, f'hiker{user_id}', 'x') for user_id in range(1, users + 1)])
+    cursor.executemany('INSERT INTO follows (follower_id, followee_id) VALUES (1, ?)',
+        [(followee_id,) for followee_id in generator.sample(range(2, users + 1), FOLLOWEES)])
+
+    def make_hike(_index):
+        area = generator.choices(range(AREAS), cum_weights=area_weights)[0]
+        return (
+            f'{generator.randint(2015, 2025)}-{generator.randint(1, 12):02d}-'
+            f'{generator.randint(1, 28):02d}', generator.randint(1, users), area + 1, areas[area],
+            f'{vocabulary[area % 1000].title()} trailhead',
+            f'{vocabulary[area % 2000].title()} {TRAIL_SUFFIXES[area % len(TRAIL_SUFFIXES)]}',
+            ' '.join(generator.choices(vocabulary, cum_weights=word_weights, k=NOTE_WORDS)),
+            round(generator.uniform(1, 30), 1), '')
+    cursor.executemany(
+        'INSERT INTO hikes (hike_date, user_id, area_id, area_name, trailhead, trails_cs, '
+        'other_info, distance_km, image_url) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        map(make_hike, range(hikes)))
+    commit_close_conn(db_connection['connection'])
+    return {'common': vocabulary[:5], 'rare': vocabulary[-200:]}
+
+
+def time_search(db, queries, repeats, follower_id=None):
+    '''Takes db file, list of search texts, repeats and optional follower id.
+        Returns summary of ms per search, and mean hikes found per search.
+    '''
+    timings, found = [], 0
+    for _ in range(repeats):
+        for query in queries:
+            start = time.perf_counter()
+            found += len(search_hikes(db, query, follower_id=follower_id)['hikes'])
+            timings.append((time.perf_counter() - start) * 1000)
+    return summarize(timings), found / len(timings)
+
+
+def main(hikes, repeats):
+    '''Takes number of hikes and repeats. Prints p50 and p95 per kind of search.'''
+    with tempfile.TemporaryDirectory() as directory:
+        db = os.path.join(directory, 'bench.db')
+        migrate(db)
+        start = time.perf_counter()
+        terms = populate(db, hikes)
+        print(f'{hikes} hikes inserted and indexed in {time.perf_counter() - start:.0f} s, '
+            f'{repeats} repeats, ms per first page')
+        generator = random.Random(7)
+        cases = {
+            'common term': (terms['common'], None),
+            'rare term': (generator.sample(terms['rare'], 10), None),
+            'two terms': ([f'{common} {rare}' for common, rare
+                in zip(terms['common'], generator.sample(terms['rare'], 5))], None),
+            'prefix (3 chars)': ([rare[:3] for rare in generator.sample(terms['rare'], 10)], None),
+            'area name': (['glacier area', 'summit trailhead'], None),
+            'common, followees': (terms['common'], 1),
+            'rare, followees': (generator.sample(terms['rare'], 10), 1),
+        }
+        print(f'{"search":>18} {"p50":>8} {"p95":>8} {"max":>8} {"found":>6}')
+        for name, (queries, follower_id) in cases.items():
+            summary, found = time_search(db, queries, repeats, follower_id)
+            print(f'{name:>18} {summary["p50"]:>8.2f} {summary["p95"]:>8.2f} '
+                f'{summary["max"]:>8.2f} {found:>6.1f}')
+
+
+if __name__ == '__main__':
+    ARGS = [int(arg) for arg in sys.argv[1:]]
+    main(*(ARGS + [DEFAULT_HIKES, DEFAULT_REPEATS][len(ARGS):]))
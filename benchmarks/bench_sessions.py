@@ -0,0 +1,82 @@
+'''Compares the per-request overhead of the session backends: flask_session's filesystem
+    sessions, the sqlite backend (with and without the decoded session cache) and the in-memory
+    backend. Times opening and saving a logged in user's session, as Flask does around every
+    request, for requests that only read the session and requests that change it.
+    Usage: python -m benchmarks.bench_sessions [requests per case]
+'''
+import os
+import sys
+import tempfile
+import time
+from flask import Flask, request, session
+from flask_session import Session
+from cache import LRUCache
+from sessions import MemorySessionStore, SqliteSessionStore, StoreSessionInterface
+from benchmarks.runner import summarize
+
+BACKENDS = ['filesystem', 'sqlite', 'sqlite (no cache)', 'memory']
+DEFAULT_REQUESTS = 5000
+WARMUP = 50
+
+
+def make_app(backend, directory):
+    '''Takes backend name and temporary directory. Returns Flask app using that backend.'''
+    app = Flask(__name__)
+    app.config['SESSION_PERMANENT'] = False
+    if backend == 'filesystem':
+        app.config['SESSION_TYPE'] = 'filesystem'
+        app.config['SESSION_FILE_DIR'] = os.path.join(directory, 'flask_session')
+        Session(app)
+    elif backend == 'memory':
+        app.session_interface = StoreSessionInterface(MemorySessionStore())
+    else:
+        cache = LRUCache(1024, ttl=5) if backend == 'sqlite' else None
+        store = SqliteSessionStore(os.path.join(directory, f'{backend}.db'))
+        app.session_interface = StoreSessionInterface(store, cache)
+
+    @app.route('/login')
+    def login():
+        session['username'], session['user_id'] = 'suze', 1
+        return 'ok'
+
+    return app
+
+
+def time_session(app, cookie, write, requests):
+    '''Takes app, session cookie value, whether to change the session and number of requests.
+        Returns summary of timings (ms) to open and save the session.
+    '''
+    interface = app.session_interface
+    timings = []
+    for iteration in range(WARMUP + requests):
+        with app.test_request_context('/', headers={'Cookie': f'session={cookie}'}):
+            response = app.response_class()
+            start = time.perf_counter()
+            user_session = interface.open_session(app, request)
+            assert user_session['username'] == 'suze'
+            if write:
+                user_session['visits'] = iteration
+            interface.save_session(app, user_session, response)
+            if iteration >= WARMUP:
+                timings.append((time.perf_counter() - start) * 1000)
+    return summarize(timings)
+
+
+def main(requests):
+    '''Takes requests per case. Prints p50 and p95 session overhead per backend.'''
+    print(f'{requests} requests per case, session open + save in ms')
+    print(f'{"backend":>18} {"read p50":>9} {"read p95":>9} {"write p50":>10} {"write p95":>10}')
+    with tempfile.TemporaryDirectory() as directory:
+        for backend in BACKENDS:
+            app = make_app(backend, directory)
+            client = app.test_client()
+            client.get('/login')
+            cookie = client.get_cookie('session').value
+            read = time_session(app, cookie, False, requests)
+            write = time_session(app, cookie, True, requests)
+            print(f'{backend:>18} {read["p50"]:>9.4f} {read["p95"]:>9.4f} '
+                f'{write["p50"]:>10.4f} {write["p95"]:>10.4f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_REQUESTS)
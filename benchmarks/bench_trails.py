@@ -0,0 +1,58 @@
+'''Times finding who hiked a trail (the trail page's first page of hikes, newest first) with the
+    hike_trails join table, and with a LIKE match on hikes.trails_cs as before it existed.
+    Trails are sampled from a synthetic database (benchmarks.datagen), so a few popular areas'
+    trails have most of the hikes. Both queries run on one open connection.
+    Usage: python -m benchmarks.bench_trails [users] [trails sampled]
+'''
+import os
+import random
+import sys
+import tempfile
+import time
+from constants import FEED_PAGE_SIZE
+from utils import build_trail_page_query, create_connection, commit_close_conn
+from benchmarks.datagen import generate
+from benchmarks.runner import summarize
+
+REPEATS = 20
+# Hikes on the trail, matched by name within the hike's area
+LIKE_QUERY = ('SELECT hikes.*, users.username FROM hikes JOIN users ON users.id = hikes.user_id '
+    "WHERE hikes.area_id = ? AND ', ' || hikes.trails_cs || ', ' LIKE ? "
+    'ORDER BY hikes.hike_date DESC, hikes.id DESC LIMIT ?')
+
+
+def time_query(cursor, query, params):
+    '''Takes db cursor, query and params. Returns ms to run the query and fetch its rows.'''
+    start = time.perf_counter()
+    cursor.execute(query, params).fetchall()
+    return (time.perf_counter() - start) * 1000
+
+
+def main(users, sampled):
+    '''Takes number of users and trails sampled. Prints p50 and p95 per query.'''
+    with tempfile.TemporaryDirectory() as directory:
+        db = os.path.join(directory, 'bench.db')
+        dataset = generate(db, users)
+        db_connection = create_connection(db)
+        cursor = db_connection['cursor']
+        trails = random.Random(42).sample(
+            cursor.execute('SELECT id, area_id, trail_name FROM trails').fetchall(), sampled)
+        timings = {'hike_trails': [], 'LIKE': []}
+        for _ in range(REPEATS):
+            for trail_id, area_id, trail_name in trails:
+                timings['hike_trails'].append(time_query(
+                    cursor, *build_trail_page_query(trail_id, None, FEED_PAGE_SIZE)))
+                timings['LIKE'].append(time_query(
+                    cursor, LIKE_QUERY, (area_id, f'%, {trail_name}, %', FEED_PAGE_SIZE + 1)))
+        commit_close_conn(db_connection['connection'])
+    print(f'{dataset["hikes"]} hikes on {dataset["trails"]} trails, {sampled} trails sampled, '
+        f'{REPEATS} reads each, ms per page of {FEED_PAGE_SIZE}')
+    print(f'{"query":>12} {"p50":>8} {"p95":>8} {"max":>8}')
+    for name, query_timings in timings.items():
+        summary = summarize(query_timings)
+        print(f'{name:>12} {summary["p50"]:>8.3f} {summary["p95"]:>8.3f} {summary["max"]:>8.3f}')
+
+
+if __name__ == '__main__':
+    ARGS = [int(arg) for arg in sys.argv[1:]]
+    main(*(ARGS + [10_000, 50][len(ARGS):]))
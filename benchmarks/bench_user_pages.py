@@ -0,0 +1,91 @@
+'''Times paging through one user's hikes: get_hikes_page's query seeks past a (hike_date, id)
+    cursor in hikes_user_date_idx, so a deep page should cost the same as the first. The same
+    pages read with LIMIT/OFFSET are timed for comparison, since OFFSET steps over every
+    earlier row. Both queries run on one open connection, so only the query cost differs.
+    Usage: python -m benchmarks.bench_user_pages [number of hikes] [page size]
+'''
+import os
+import random
+import sys
+import tempfile
+import time
+from init_sql import migrate
+from utils import (add_user, create_connection, commit_close_conn, decode_cursor,
+    get_hikes_page)
+from benchmarks.runner import summarize
+
+PAGES = [1, 10, 100, 500]
+REPEATS = 50
+# get_hikes_page's query, and the same page read by skipping every earlier row
+KEYSET_QUERY = ('SELECT * FROM hikes WHERE user_id = ? AND (hike_date, id) < (?, ?) '
+    'ORDER BY hike_date DESC, id DESC LIMIT ?')
+OFFSET_QUERY = ('SELECT * FROM hikes WHERE user_id = ? '
+    'ORDER BY hike_date DESC, id DESC LIMIT ? OFFSET ?')
+
+
+def populate(db, hikes, seed=42):
+    '''Takes db file, number of hikes and random seed. Adds user 1 with that many hikes.'''
+    generator = random.Random(seed)
+    add_user(db, 'hiker', 'x')
+    db_connection = create_connection(db)
+    db_connection['cursor'].executemany(
+        'INSERT INTO hikes (hike_date, user_id, area_id, area_name, trails_cs, distance_km) '
+        "VALUES (?, 1, 1, 'Area', 'Trail', 5.0)",
+        [(f'{generator.randint(2000, 2024)}-{generator.randint(1, 12):02d}-'
+            f'{generator.randint(1, 28):02d}',) for _ in range(hikes)])
+    commit_close_conn(db_connection['connection'])
+
+
+def get_cursors(db, page_size):
+    '''Takes db file and page size. Returns dict of page number: cursor to fetch that page.'''
+    cursors, cursor = {1: None}, None
+    for page in range(2, max(PAGES) + 1):
+        cursor = get_hikes_page(db, 1, cursor, page_size)['next_cursor']
+        if cursor is None:
+            break
+        cursors[page] = cursor
+    return cursors
+
+
+def time_page(cursor, page, position, page_size):
+    '''Takes db cursor, page number, (hike_date, id) cursor position of the page and page size.
+        Returns (keyset, offset) ms to read the page with each query.
+    '''
+    timings = []
+    for query, params in [(KEYSET_QUERY, (1, *position, page_size)),
+            (OFFSET_QUERY, (1, page_size, (page - 1) * page_size))]:
+        start = time.perf_counter()
+        cursor.execute(query, params).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main(hikes, page_size):
+    '''Takes number of hikes and page size. Prints p50 and p95 per page, keyset vs OFFSET.'''
+    with tempfile.TemporaryDirectory() as directory:
+        db = os.path.join(directory, 'bench.db')
+        migrate(db)
+        populate(db, hikes)
+        cursors = get_cursors(db, page_size)
+        db_connection = create_connection(db)
+        print(f'{hikes} hikes, {page_size} per page, {REPEATS} reads per page, ms')
+        print(f'{"page":>6} {"keyset p50":>11} {"keyset p95":>11} '
+            f'{"offset p50":>11} {"offset p95":>11}')
+        for page in PAGES:
+            if page not in cursors:
+                print(f'{page:>6} (past the last page)')
+                continue
+            # The first page starts above every hike
+            position = decode_cursor(cursors[page]) or ['9999-12-31', 0]
+            timings = [time_page(db_connection['cursor'], page, position, page_size)
+                for _ in range(REPEATS)]
+            keyset = summarize([timing[0] for timing in timings])
+            offset = summarize([timing[1] for timing in timings])
+            print(f'{page:>6} {keyset["p50"]:>11.3f} {keyset["p95"]:>11.3f} '
+                f'{offset["p50"]:>11.3f} {offset["p95"]:>11.3f}')
+        commit_close_conn(db_connection['connection'])
+
+
+if __name__ == '__main__':
+    ARGS = [int(arg) for arg in sys.argv[1:]]
+    main(*(ARGS + [12000, 20][len(ARGS):]))
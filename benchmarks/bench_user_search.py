@@ -0,0 +1,85 @@
+'''Benchmarks get_similar_usernames (character bitmask index) against the previous full scan,
+    which loaded every username and scored it in python.
+    Usage: python -m benchmarks.bench_user_search [number of users ...]
+'''
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+from init_sql import migrate
+from utils import create_connection, commit_close_conn, get_similar_usernames
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+QUERIES = ['suze', 'frank', 'hiker', 'trail', 'zq', 'mountainman']
+REPEATS = 3
+
+
+def populate_users(db, count, seed=42):
+    '''Takes db file, number of users and random seed. Inserts users in bulk.'''
+    generator = random.Random(seed)
+    alphabet = string.ascii_lowercase + string.digits
+    usernames = set()
+    while len(usernames) < count:
+        usernames.add(''.join(generator.choices(alphabet, k=generator.randint(4, 14))))
+    db_connection = create_connection(db)
+    db_connection['cursor'].executemany(
+        'INSERT INTO users (id, username, password_hash) VALUES (?, ?, ?)',
+        [(user_id, username, 'x') for user_id, username in enumerate(usernames, start=1)])
+    commit_close_conn(db_connection['connection'])
+
+
+def full_scan_similar_usernames(db, query):
+    '''Previous implementation of get_similar_usernames, kept as the benchmark baseline.'''
+    db_connection = create_connection(db)
+    users_list = [row[0] for row in db_connection['cursor'].execute('SELECT username FROM users')]
+    db_connection['connection'].close()
+    similar_users = {}
+    for username in users_list:
+        frequency = 0
+        for char in query:
+            if char in username:
+                frequency +=1
+        accuracy = frequency / len(username)
+        if frequency > 2 or accuracy >= 0.5:
+            similar_users.update({username: frequency * accuracy})
+    return dict(sorted(similar_users.items(), key=lambda item: item[1], reverse=True))
+
+
+def time_queries(search, db, limit=None):
+    '''Takes search fn, db file and optional result limit. Returns median ms per query.'''
+    timings = []
+    for query in QUERIES:
+        for _ in range(REPEATS):
+            start = time.perf_counter()
+            if limit:
+                search(db, query, limit)
+            else:
+                search(db, query)
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def main(sizes):
+    '''Takes list of user counts. Prints median search latency for each implementation.'''
+    print(f'{"users":>10} {"full scan ms":>14} {"index build ms":>16} '
+          f'{"index ms":>10} {"index top 50 ms":>16}')
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            db = os.path.join(directory, 'bench.db')
+            migrate(db)
+            populate_users(db, size)
+            full_scan = time_queries(full_scan_similar_usernames, db)
+            # The first search builds the index, time that separately from the searches
+            start = time.perf_counter()
+            get_similar_usernames(db, QUERIES[0])
+            build = (time.perf_counter() - start) * 1000
+            indexed = time_queries(get_similar_usernames, db)
+            indexed_top = time_queries(get_similar_usernames, db, limit=50)
+        print(f'{size:>10} {full_scan:>14.1f} {build:>16.1f} {indexed:>10.1f} {indexed_top:>16.1f}')
+
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or DEFAULT_SIZES)
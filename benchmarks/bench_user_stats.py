@@ -0,0 +1,135 @@
+'''Times reading a user's profile stats from the rollup tables (user_stats.get_user_stats) and
+    computing them with aggregate queries over the user's hikes on every view, for the heaviest
+    users and a sample of all users of a synthetic database (benchmarks.datagen). Also times
+    adding, editing and deleting a hike with and without the rollup triggers, which is what the
+    rollups cost the write paths.
+    Usage: python -m benchmarks.bench_user_stats [users] [users sampled]
+'''
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from flask import Flask
+from connection_pool import release_connections, scoped_connection
+from constants import PROFILE_STATS_MONTHS
+from user_stats import check_user_stats, get_user_stats
+from utils import (create_connection, commit_close_conn, delete_hike, save_hike_changes,
+    save_new_hike)
+from benchmarks.datagen import generate
+from benchmarks.runner import BENCH_HIKE, summarize
+
+REPEATS = 20
+HEAVY_USERS = 10
+WRITES = 300
+# The same stats aggregated from hikes, as a profile view would without the rollups
+AGGREGATE_QUERIES = [
+    'SELECT count(*), total(distance_km), count(DISTINCT area_name), '
+    'coalesce(max(distance_km), 0) FROM hikes WHERE user_id = ?',
+    'SELECT substr(hike_date, 1, 7) AS month, count(*), total(distance_km) FROM hikes '
+    'WHERE user_id = ? GROUP BY month ORDER BY month DESC LIMIT ?',
+]
+
+
+def aggregate_stats(db, user_id):
+    '''Takes db file and user id. Runs the aggregate queries for the user's stats.'''
+    with scoped_connection(db) as db_connection:
+        db_connection['cursor'].execute(AGGREGATE_QUERIES[0], (user_id,)).fetchone()
+        db_connection['cursor'].execute(
+            AGGREGATE_QUERIES[1], (user_id, PROFILE_STATS_MONTHS)).fetchall()
+
+
+def rollup_stats(db, user_id):
+    '''Takes db file and user id. Reads the user's stats from the rollups.'''
+    get_user_stats(db, user_id)
+
+
+def time_reads(read, db, user_ids):
+    '''Takes read fn, db file and list of user ids. Returns summary of ms per read.
+        Reads share one pooled connection, as the queries of a request do.
+    '''
+    timings = []
+    with Flask(__name__).app_context():
+        for _ in range(REPEATS):
+            for user_id in user_ids:
+                start = time.perf_counter()
+                read(db, user_id)
+                timings.append((time.perf_counter() - start) * 1000)
+        release_connections()
+    return summarize(timings)
+
+
+def time_writes(db, user_id):
+    '''Takes db file and user id. Returns dict of summary of ms per add, edit and delete of one of
+        the user's hikes.
+    '''
+    timings = {'add': [], 'edit': [], 'delete': []}
+    for index in range(WRITES):
+        hike_data = dict(BENCH_HIKE, area_name=f'Area {index % 20}', distance_km=index % 30 + 1)
+        start = time.perf_counter()
+        hike_id = save_new_hike(db, user_id, hike_data)
+        timings['add'].append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        save_hike_changes(db, hike_id, dict(hike_data, hike_date='2024-06-01', distance_km=31))
+        timings['edit'].append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        delete_hike(db, hike_id, user_id)
+        timings['delete'].append((time.perf_counter() - start) * 1000)
+    return {name: summarize(write_timings) for name, write_timings in timings.items()}
+
+
+def print_reads(db, sampled):
+    '''Takes db file and number of users sampled. Prints p50 and p95 per stats read.
+        Returns id of the heaviest user.
+    '''
+    with scoped_connection(db) as db_connection:
+        hike_counts = db_connection['cursor'].execute(
+            'SELECT user_id, hike_count FROM user_stats ORDER BY hike_count DESC').fetchall()
+    heavy = [user_id for user_id, _ in hike_counts[:HEAVY_USERS]]
+    sample = random.Random(42).sample([user_id for user_id, _ in hike_counts], sampled)
+    print(f'{len(hike_counts)} users with hikes, heaviest has {hike_counts[0][1]}, '
+        f'{REPEATS} reads per user, ms per profile view')
+    print(f'{"stats read":>28} {"p50":>8} {"p95":>8} {"max":>8}')
+    for users_name, user_ids in [
+            (f'{HEAVY_USERS} heaviest', heavy), (f'{sampled} sampled', sample)]:
+        for read_name, read in [('aggregate', aggregate_stats), ('rollups', rollup_stats)]:
+            summary = time_reads(read, db, user_ids)
+            print(f'{users_name + ", " + read_name:>28} {summary["p50"]:>8.3f} '
+                f'{summary["p95"]:>8.3f} {summary["max"]:>8.3f}')
+    return heavy[0]
+
+
+def print_writes(db, user_id, directory):
+    '''Takes db file, user id and directory for copies of the db.
+        Prints p50 and p95 per write of the user's hikes, with and without the rollup triggers.
+    '''
+    print(f'{WRITES} hikes added, edited and deleted by the heaviest user, ms per write')
+    print(f'{"write":>28} {"p50":>8} {"p95":>8} {"max":>8}')
+    for triggers in ['with rollups', 'without rollups']:
+        copy = os.path.join(directory, f'{triggers}.db')
+        shutil.copy(db, copy)
+        if triggers == 'without rollups':
+            db_connection = create_connection(copy)
+            for trigger in ['user_stats_insert', 'user_stats_update', 'user_stats_delete']:
+                db_connection['cursor'].execute(f'DROP TRIGGER {trigger}')
+            commit_close_conn(db_connection['connection'])
+        for write_name, summary in time_writes(copy, user_id).items():
+            print(f'{write_name + ", " + triggers:>28} {summary["p50"]:>8.3f} '
+                f'{summary["p95"]:>8.3f} {summary["max"]:>8.3f}')
+
+
+def main(users, sampled):
+    '''Takes number of users and users sampled. Prints p50 and p95 per read and write.'''
+    with tempfile.TemporaryDirectory() as directory:
+        db = os.path.join(directory, 'bench.db')
+        dataset = generate(db, users)
+        print(f'{dataset["hikes"]} hikes')
+        heaviest = print_reads(db, sampled)
+        print(f'check_user_stats: {len(check_user_stats(db))} mismatched rows\n')
+        print_writes(db, heaviest, directory)
+
+
+if __name__ == '__main__':
+    ARGS = [int(arg) for arg in sys.argv[1:]]
+    main(*(ARGS + [10_000, 200][len(ARGS):]))
@@ -0,0 +1,141 @@
+'''Measures write throughput when several worker processes (as gunicorn runs the app) write to
+    one database at once. Each worker runs request threads that add hikes, follow users and add
+    users (save_new_hike, follow, add_user) as fast as they can, for 1, 4 and 16 workers, with:
+    the sqlite defaults the app used to run with (rollback journal, synchronous=FULL, 5 s busy
+    timeout, every thread committing its own writes), WAL mode with the connection pragmas in
+    DB_PRAGMAS, and WAL plus the writer thread group-committing each worker's writes (writer.py).
+    Prints writes per second, latency and writes that failed (ie. "database is locked").
+    Usage: python -m benchmarks.bench_write_contention [users] [seconds per run] [threads]
+'''
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from flask import Flask
+import connection_pool
+import writer
+from constants import DB_PRAGMAS
+from utils import add_user, follow, invalidate_caches, save_new_hike
+from benchmarks.datagen import generate
+from benchmarks.runner import BENCH_HIKE, summarize
+
+WORKERS = [1, 4, 16]
+# Name: (journal mode, connection pragmas, write queue)
+CONFIGS = {
+    'defaults': ('DELETE', {'busy_timeout': 5000, 'temp_store': 'MEMORY', 'cache_size': -8000},
+        False),
+    'wal': ('WAL', DB_PRAGMAS, False),
+    'wal + writer': ('WAL', DB_PRAGMAS, True),
+}
+# Share of each write (the rest add users)
+HIKE_SHARE = 0.6
+FOLLOW_SHARE = 0.3
+
+
+def write_once(db, generator, usernames, name):
+    '''Takes db file, random generator, list of usernames and unique name for a new user.
+        Makes one write, as a request would. Returns True if it was committed.
+    '''
+    choice = generator.random()
+    with Flask(__name__).app_context():
+        if choice < HIKE_SHARE:
+            result = save_new_hike(db, generator.randint(1, len(usernames)), BENCH_HIKE)
+        elif choice < HIKE_SHARE + FOLLOW_SHARE:
+            result = follow(db, generator.choice(usernames), generator.choice(usernames), 'follow')
+        else:
+            result = add_user(db, name, 'x')
+        connection_pool.release_connections()
+    return not isinstance(result, (sqlite3.Error, str))
+
+
+def run_thread(db, usernames, run_window, results):
+    '''Takes db file, list of usernames, (start, end) unix times and results list.
+        Writes from start to end, then appends (ms per committed write, failed writes).
+    '''
+    generator = random.Random(f'{os.getpid()}-{threading.get_ident()}')
+    timings, failed = [], 0
+    time.sleep(max(0, run_window[0] - time.time()))
+    while time.time() < run_window[1]:
+        name = f'w{os.getpid()}-{threading.get_ident()}-{len(timings) + failed}'
+        start = time.perf_counter()
+        if write_once(db, generator, usernames, name):
+            timings.append((time.perf_counter() - start) * 1000)
+        else:
+            failed += 1
+    results.append((timings, failed))
+
+
+def run_worker(case, results_queue):
+    '''Takes case dict (db file, config name, list of usernames, (start, end) unix times and
+        request threads) and results queue.
+        Worker process: writes from each thread, puts (ms per write, failed writes).
+    '''
+    _, pragmas, write_queue = CONFIGS[case['config']]
+    connection_pool.DB_PRAGMAS = pragmas
+    writer.DB_WRITE_QUEUE = write_queue
+    results = []
+    request_threads = [threading.Thread(target=run_thread,
+        args=(case['db'], case['usernames'], case['run_window'], results))
+        for _ in range(case['threads'])]
+    for request_thread in request_threads:
+        request_thread.start()
+    for request_thread in request_threads:
+        request_thread.join()
+    writer.stop_writers()
+    results_queue.put(([timing for timings, _ in results for timing in timings],
+        sum(failed for _, failed in results)))
+
+
+def run_case(db, config, workers, seconds, threads):
+    '''Takes db file (a fresh copy), config name, number of workers, seconds to run and threads
+        per worker. Returns (summary of ms per write, writes per second, failed writes).
+    '''
+    connection = sqlite3.connect(db)
+    connection.execute(f'PRAGMA journal_mode = {CONFIGS[config][0]}')
+    usernames = [row[0] for row in connection.execute('SELECT username FROM users ORDER BY id')]
+    connection.close()
+    context = multiprocessing.get_context('fork')
+    results_queue = context.Queue()
+    start = time.time() + 0.5
+    case = {'db': db, 'config': config, 'usernames': usernames,
+        'run_window': (start, start + seconds), 'threads': threads}
+    processes = [context.Process(target=run_worker, args=(case, results_queue))
+        for _ in range(workers)]
+    for process in processes:
+        process.start()
+    results = [results_queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+    timings = [timing for worker_timings, _ in results for timing in worker_timings]
+    return summarize(timings or [0]), len(timings) / seconds, sum(failed for _, failed in results)
+
+
+def main(users, seconds, threads):
+    '''Takes number of users, seconds per run and request threads per worker.
+        Prints writes per second, p50 and p95 ms per write and failed writes for each case.
+    '''
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'source.db')
+        dataset = generate(source, users)
+        invalidate_caches()
+        print(f'{dataset["hikes"]} hikes, {threads} request threads per worker, '
+            f'{seconds} s per run')
+        print(f'{"config":>14} {"workers":>8} {"writes/s":>10} {"p50 ms":>8} {"p95 ms":>8} '
+            f'{"max ms":>8} {"failed":>8}')
+        for config in CONFIGS:
+            for workers in WORKERS:
+                db = os.path.join(directory, f'{config}-{workers}.db'.replace(' ', ''))
+                shutil.copy(source, db)
+                summary, throughput, failed = run_case(db, config, workers, seconds, threads)
+                print(f'{config:>14} {workers:>8} {throughput:>10.0f} {summary["p50"]:>8.2f} '
+                    f'{summary["p95"]:>8.2f} {summary["max"]:>8.0f} {failed:>8}')
+
+
+if __name__ == '__main__':
+    ARGS = [int(arg) for arg in sys.argv[1:]]
+    main(*(ARGS + [1_000, 3, 4][len(ARGS):]))
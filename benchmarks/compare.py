@@ -0,0 +1,71 @@
+'''Compares two benchmarks.runner result files case by case.
+    Exits with status 1 if any case got slower than the threshold, so it can gate a CI job.
+    Usage: python -m benchmarks.compare <old.json> <new.json> [--metric p50] [--threshold 20]
+'''
+import argparse
+import json
+import sys
+
+
+def flatten(results, metric):
+    '''Takes runner results dict and metric name (ie. 'p95').
+        Returns dict of '<size> <group> <case>': metric value in ms.
+    '''
+    flat = {}
+    for size, result in results['sizes'].items():
+        for group in ['utils', 'routes']:
+            for name, summary in result.get(group, {}).items():
+                flat[f'{size} {group} {name}'] = summary[metric]
+    return flat
+
+
+def compare(old_results, new_results, metric='p50', threshold=20.0):
+    '''Takes old and new runner results dicts, metric name and regression threshold (percent).
+        Returns list of (case, old ms, new ms, percent change, regressed) tuples for the cases
+        in both results.
+    '''
+    old_flat, new_flat = flatten(old_results, metric), flatten(new_results, metric)
+    rows = []
+    for case, old_value in old_flat.items():
+        if case not in new_flat:
+            continue
+        new_value = new_flat[case]
+        change = (new_value - old_value) / old_value * 100 if old_value else 0.0
+        rows.append((case, old_value, new_value, change, change > threshold))
+    return rows
+
+
+def print_rows(rows):
+    '''Takes list of comparison rows. Prints them as a table.'''
+    print(f'{"case":<56} {"old ms":>9} {"new ms":>9} {"change":>8}')
+    for case, old_value, new_value, change, regressed in rows:
+        flag = '  REGRESSION' if regressed else ''
+        print(f'{case:<56} {old_value:>9.2f} {new_value:>9.2f} {change:>+7.1f}%{flag}')
+
+
+def main():
+    '''Parses command line args and prints the comparison. Exits 1 on regressions.'''
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--metric', default='p50', help='mean, max or p50/p90/p95/p99')
+    parser.add_argument('--threshold', type=float, default=20.0,
+        help='percent slowdown reported as a regression')
+    args = parser.parse_args()
+    results = []
+    for path in [args.old, args.new]:
+        with open(path, 'r', encoding='utf-8') as results_file:
+            results.append(json.load(results_file))
+    for label, result in zip(['old', 'new'], results):
+        meta = result['meta']
+        print(f'{label}: {meta.get("git_commit")} ({meta.get("created_at")}, '
+            f'FEED_MODE={meta.get("feed_mode")})')
+    rows = compare(results[0], results[1], args.metric, args.threshold)
+    print_rows(rows)
+    regressions = [row for row in rows if row[4]]
+    print(f'{len(regressions)} of {len(rows)} cases slower than {args.threshold}% ({args.metric})')
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+'''Seeded synthetic data generator for benchmarks. The same size and seed always produce the
+    same database, so two benchmark runs (ie. before and after a change) are comparable.
+    Data is skewed like real usage: a few users post most hikes and have most followers,
+    and a few areas get most of the hikes.
+    Usage: python -m benchmarks.datagen <db file> [number of users] [seed]
+'''
+import random
+import sys
+from init_sql import migrate
+from utils import create_connection, commit_close_conn, rebuild_feed_items
+
+FIRST_WORDS = ['trail', 'peak', 'river', 'alpine', 'cedar', 'granite', 'summit', 'canyon',
+    'forest', 'meadow', 'ridge', 'glacier', 'desert', 'valley', 'coastal', 'boulder']
+SECOND_WORDS = ['walker', 'runner', 'rambler', 'hiker', 'goat', 'fox', 'bear', 'hawk',
+    'wanderer', 'scout', 'nomad', 'seeker', 'climber', 'trekker', 'explorer', 'owl']
+TRAIL_SUFFIXES = ['Loop', 'Trail', 'Path', 'Ridge', 'Falls', 'Lookout', 'Creek', 'Pass']
+# Hikes per user and follows per user follow a pareto distribution (a long tail of heavy users)
+HIKES_PARETO_ALPHA = 1.2
+FOLLOWS_PARETO_ALPHA = 1.5
+MAX_HIKES_PER_USER = 500
+
+
+def zipf_weights(count, exponent=1.0):
+    '''Takes number of items and skew exponent. Returns cumulative weights for rank^-exponent.'''
+    cumulative, total = [], 0.0
+    for rank in range(1, count + 1):
+        total += rank ** -exponent
+        cumulative.append(total)
+    return cumulative
+
+
+def make_usernames(generator, count):
+    '''Takes random generator and count. Returns list of unique usernames (ie. cedarfox42).'''
+    # A dict keeps insertion order, so the result doesn't depend on string hashing
+    usernames = {}
+    while len(usernames) < count:
+        usernames[generator.choice(FIRST_WORDS) + generator.choice(SECOND_WORDS)
+            + str(generator.randint(1, count * 10))] = True
+    return list(usernames)
+
+
+def make_areas(generator, area_count):
+    '''Takes random generator and number of areas.
+        Returns (areas rows, trails rows, dict of area id: list of its trail names).
+    '''
+    areas_rows = [(area_id, f'{generator.choice(FIRST_WORDS).title()} Area {area_id}')
+        for area_id in range(1, area_count + 1)]
+    trails_rows = []
+    area_trails = {}
+    for area_id in range(1, area_count + 1):
+        for number in range(generator.randint(1, 8)):
+            name = (f'{generator.choice(FIRST_WORDS).title()} '
+                f'{generator.choice(TRAIL_SUFFIXES)} {area_id}-{number}')
+            trails_rows.append((len(trails_rows) + 1, area_id, name))
+            area_trails.setdefault(area_id, []).append(name)
+    return areas_rows, trails_rows, area_trails
+
+
+def make_hikes(generator, users, areas_rows, area_trails):
+    '''Takes random generator, number of users, areas rows and trails per area.
+        Returns hikes rows. Low user ids post the most, low area ids get the most hikes.
+    '''
+    area_weights = zipf_weights(len(areas_rows))
+    hike_counts = sorted((min(int(generator.paretovariate(HIKES_PARETO_ALPHA)) - 1,
+        MAX_HIKES_PER_USER) for _ in range(users)), reverse=True)
+    hikes_rows = []
+    for user_id, hike_count in enumerate(hike_counts, start=1):
+        for area_id in generator.choices(
+                range(1, len(areas_rows) + 1), cum_weights=area_weights, k=hike_count):
+            trails = area_trails[area_id]
+            hikes_rows.append((
+                f'{generator.randint(2022, 2025)}-{generator.randint(1, 12):02d}-'
+                f'{generator.randint(1, 28):02d}',
+                user_id, area_id, areas_rows[area_id - 1][1], f'{trails[0]} trailhead',
+                ', '.join(generator.sample(trails, generator.randint(1, min(3, len(trails))))),
+                round(generator.uniform(1, 30), 1),
+                generator.choice(['', f'hiker{user_id}photo']),
+            ))
+    return hikes_rows
+
+
+def make_hike_trails(trails_rows, hikes_rows):
+    '''Takes trails rows and hikes rows (hike ids are their positions, from 1).
+        Returns list of (trail id, hike date, hike id) for each trail of each hike.
+    '''
+    trail_ids = {(area_id, name): trail_id for trail_id, area_id, name in trails_rows}
+    return [(trail_ids[(hike[2], name)], hike[0], hike_id)
+        for hike_id, hike in enumerate(hikes_rows, start=1) for name in hike[5].split(', ')]
+
+
+def make_follows(generator, users):
+    '''Takes random generator and number of users.
+        Returns sorted list of (follower id, followee id). Low user ids get the most followers.
+    '''
+    user_weights = zipf_weights(users, 0.8)
+    follows = set()
+    for follower_id in range(1, users + 1):
+        follow_count = min(int(generator.paretovariate(FOLLOWS_PARETO_ALPHA) * 5), users - 1)
+        for followee_id in generator.choices(
+                range(1, users + 1), cum_weights=user_weights, k=follow_count):
+            if followee_id != follower_id:
+                follows.add((follower_id, followee_id))
+    return sorted(follows)
+
+
+def generate(db, users, seed=42):
+    '''Takes db file, number of users and random seed.
+        Creates schema and inserts users, areas, trails, hikes, hike trails and follows in bulk.
+        Returns dict of row counts per table.
+    '''
+    generator = random.Random(seed)
+    migrate(db)
+    users_rows = [(user_id, username, 'x') for user_id, username
+        in enumerate(make_usernames(generator, users), start=1)]
+    areas_rows, trails_rows, area_trails = make_areas(generator, max(10, users // 100))
+    hikes_rows = make_hikes(generator, users, areas_rows, area_trails)
+    hike_trails_rows = make_hike_trails(trails_rows, hikes_rows)
+    follows_rows = make_follows(generator, users)
+
+    db_connection = create_connection(db)
+    cursor = db_connection['cursor']
+    cursor.executemany('INSERT INTO users (id, username, password_hash) VALUES (?, ?, ?)',
+        users_rows)
+    cursor.executemany('INSERT INTO areas (id, area_name) VALUES (?, ?)', areas_rows)
+    cursor.executemany('INSERT INTO trails (id, area_id, trail_name) VALUES (?, ?, ?)',
+        trails_rows)
+    cursor.executemany(
+        'INSERT INTO hikes (hike_date, user_id, area_id, area_name, trailhead, trails_cs, '
+        'distance_km, image_url) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', hikes_rows)
+    cursor.executemany('INSERT INTO hike_trails (trail_id, hike_date, hike_id) VALUES (?, ?, ?)',
+        hike_trails_rows)
+    cursor.executemany('INSERT INTO follows (follower_id, followee_id) VALUES (?, ?)',
+        follows_rows)
+    commit_close_conn(db_connection['connection'])
+    # Keep fan-out-on-write timelines valid too, so either FEED_MODE can be benchmarked
+    rebuild_feed_items(db)
+    return {'users': len(users_rows), 'areas': len(areas_rows), 'trails': len(trails_rows),
+        'hikes': len(hikes_rows), 'follows': len(follows_rows)}
+
+
+if __name__ == '__main__':
+    ARGS = sys.argv[1:]
+    print(generate(ARGS[0], *([int(arg) for arg in ARGS[1:]] or [10_000])))
@@ -0,0 +1,383 @@
+'''Times the utils.py functions and every Flask route (through the test client) against
+    synthetic databases from benchmarks.datagen, at one or more data sizes.
+    Results (latency percentiles in ms per case) are written as JSON so two runs can be
+    diffed with benchmarks.compare.
+    Usage: python -m benchmarks.runner [--sizes 1000 10000] [--repeats 50] [--output file.json]
+'''
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+from constants import FEED_MODE, SEARCH_RESULTS_LIMIT
+from utils import (add_hike, delete_hike, follow, get_area_id, get_feed, get_feed_page,
+    get_followees, get_hikes, get_similar_usernames, get_trail_hikes_page, get_user_by_username,
+    get_user_cards, update_hike)
+from testing import load_app
+from writer import stop_writers
+from benchmarks.datagen import generate
+
+DEFAULT_SIZES = [1_000, 10_000]
+DEFAULT_REPEATS = 50
+WARMUP = 3
+PERCENTILES = [50, 90, 95, 99]
+BENCH_HIKE = {'hike_date': '2025-06-01', 'area_name': 'Benchmark Area', 'trailhead': 'Start',
+    'trails_cs': 'Benchmark Loop', 'distance_km': 5.0, 'image_url': ''}
+BENCH_PASSWORD = 'benchpass'
+
+
+# ==== STATS ====
+
+def summarize(timings):
+    '''Takes list of timings in ms. Returns dict of count, mean, max and percentiles.'''
+    timings = sorted(timings)
+    summary = {'count': len(timings), 'mean': sum(timings) / len(timings), 'max': timings[-1]}
+    for percentile in PERCENTILES:
+        index = min(len(timings) - 1, round(percentile / 100 * (len(timings) - 1)))
+        summary[f'p{percentile}'] = timings[index]
+    return summary
+
+
+def time_case(prepare, context, generator, repeats):
+    '''Takes case prepare fn, benchmark context, random generator and number of repeats.
+        prepare picks the arguments (untimed) and returns the zero-arg call to time.
+        Returns summary dict of timings, plus count of each status code for route responses.
+    '''
+    for _ in range(WARMUP):
+        prepare(context, generator)()
+    timings = []
+    statuses = {}
+    for _ in range(repeats):
+        timed_call = prepare(context, generator)
+        start = time.perf_counter()
+        result = timed_call()
+        timings.append((time.perf_counter() - start) * 1000)
+        if hasattr(result, 'status_code'):
+            statuses[str(result.status_code)] = statuses.get(str(result.status_code), 0) + 1
+    summary = summarize(timings)
+    if statuses:
+        summary['statuses'] = statuses
+    return summary
+
+
+# ==== CONTEXT ====
+
+def load_context(db, seed):
+    '''Takes db file and random seed.
+        Returns dict of db file and sampled ids/names the cases pick their arguments from.
+    '''
+    connection = sqlite3.connect(db)
+    context = {
+        'db': db,
+        'users': connection.execute('SELECT id, username FROM users ORDER BY id').fetchall(),
+        'areas': [row[0] for row in connection.execute('SELECT area_name FROM areas')],
+        'area_ids': [row[0] for row in connection.execute('SELECT id FROM areas')],
+        'trails': [row[0] for row in connection.execute('SELECT id FROM trails')],
+        'trail_names': connection.execute('SELECT area_id, trail_name FROM trails').fetchall(),
+        # Hikes of the most active user, for the edit page and update/delete cases
+        'heavy_user': connection.execute(
+            'SELECT users.id, username FROM users JOIN hikes ON hikes.user_id = users.id '
+            'GROUP BY users.id ORDER BY COUNT(*) DESC LIMIT 1').fetchone(),
+    }
+    context['heavy_hike_ids'] = [row[0] for row in connection.execute(
+        'SELECT id FROM hikes WHERE user_id = ? ORDER BY id', (context['heavy_user'][0],))]
+    connection.close()
+    random.Random(seed).shuffle(context['heavy_hike_ids'])
+    return context
+
+
+def random_user(context, generator):
+    '''Takes context and random generator. Returns (id, username) of a random user.'''
+    return generator.choice(context['users'])
+
+
+def search_query(context, generator):
+    '''Takes context and random generator. Returns 3 to 6 characters of a random username.'''
+    username = random_user(context, generator)[1]
+    start = generator.randint(0, max(0, len(username) - 6))
+    return username[start:start + generator.randint(3, 6)]
+
+
+def trail_lookup_query(context, generator):
+    '''Takes context and random generator. Returns query string of a random trail's area id
+        and name.
+    '''
+    return urlencode(dict(zip(('area_id', 'name'), generator.choice(context['trail_names']))))
+
+
+def hike_search_query(context, generator):
+    '''Takes context and random generator. Returns the first word of a random area name.'''
+    return generator.choice(context['areas']).split()[0]
+
+
+# ==== UTILS CASES ====
+# Each case takes the context and a random generator, picks its arguments,
+# and returns the zero-arg call to time.
+
+def call(function, *args, **kwargs):
+    '''Takes function and its args. Returns zero-arg call of function with those args.'''
+    return lambda: function(*args, **kwargs)
+
+
+def utils_cases():
+    '''Returns dict of case name: prepare fn for the utils.py functions.'''
+    def follow_unfollow(context, generator):
+        username, followee = random_user(context, generator)[1], random_user(context, generator)[1]
+        return lambda: (follow(context['db'], username, followee, 'follow'),
+            follow(context['db'], username, followee, 'unfollow'))
+
+    def delete(context, _generator):
+        # Once the user's hikes run out (ie. tiny datasets) the delete matches nothing
+        hike_id = context['heavy_hike_ids'].pop() if context['heavy_hike_ids'] else 0
+        return call(delete_hike, context['db'], hike_id, context['heavy_user'][0])
+
+    return {
+        'get_user_by_username': lambda context, generator: call(
+            get_user_by_username, context['db'], random_user(context, generator)[1]),
+        'get_hikes': lambda context, generator: call(
+            get_hikes, context['db'], random_user(context, generator)[0]),
+        'get_hikes (most active user)': lambda context, generator: call(
+            get_hikes, context['db'], context['heavy_user'][0]),
+        'get_feed': lambda context, generator: call(
+            get_feed, context['db'], random_user(context, generator)[1]),
+        'get_feed_page (limit 100)': lambda context, generator: call(
+            get_feed_page, context['db'], random_user(context, generator)[1], limit=100),
+        'get_followees': lambda context, generator: call(
+            get_followees, context['db'], random_user(context, generator)[1]),
+        'get_similar_usernames': lambda context, generator: call(
+            get_similar_usernames, context['db'], search_query(context, generator),
+            SEARCH_RESULTS_LIMIT),
+        'get_user_cards (20 users)': lambda context, generator: call(
+            get_user_cards, context['db'],
+            [random_user(context, generator)[1] for _ in range(20)]),
+        'get_trail_hikes_page': lambda context, generator: call(
+            get_trail_hikes_page, context['db'], generator.choice(context['trails'])),
+        'get_area_id': lambda context, generator: call(
+            get_area_id, generator.choice(context['areas']), context['db']),
+        'follow_unfollow': follow_unfollow,
+        'add_hike': lambda context, generator: call(
+            add_hike, context['db'], random_user(context, generator)[0], 1, dict(BENCH_HIKE)),
+        'update_hike': lambda context, generator: call(
+            update_hike, context['db'], {'id': generator.choice(context['heavy_hike_ids'])},
+            {'other_info': 'Updated'}),
+        # Deletes run last, they remove hikes the other cases read
+        'delete_hike': delete,
+    }
+
+
+# ==== ROUTE CASES ====
+
+def route_cases(client):
+    '''Takes Flask test client. Returns dict of case name: prepare fn for each route.
+        Requests are made as the most active user (logged in), unless noted.
+    '''
+    def log_in_as(user):
+        with client.session_transaction() as session:
+            session['username'], session['user_id'] = user[1], user[0]
+
+    def get(path_fn, random_viewer=False):
+        def prepare(context, generator):
+            user = random_user(context, generator) if random_viewer else context['heavy_user']
+            log_in_as(user)
+            path = path_fn(context, generator, user)
+            return lambda: client.get(path)
+        return prepare
+
+    def post(path_fn, form_fn):
+        def prepare(context, generator):
+            log_in_as(context['heavy_user'])
+            path, form = path_fn(context, generator), form_fn(context, generator)
+            return lambda: client.post(path, data=form)
+        return prepare
+
+    def hike_form(context, _generator):
+        return dict(BENCH_HIKE, image_alt='', map_link='', other_info='',
+            area_name=context['areas'][0])
+
+    # Users signed up by the POST /signup case, the only ones with a real password hash
+    signups = []
+
+    def post_signup(_context, _generator):
+        signups.append(f'bench{len(signups) + 1}')
+        form = {'username': signups[-1], 'password': BENCH_PASSWORD,
+            'confirmation': BENCH_PASSWORD}
+        return lambda: client.post('/signup', data=form)
+
+    def post_login(context, generator):
+        username = generator.choice(signups) if signups else context['heavy_user'][1]
+        form = {'username': username, 'password': BENCH_PASSWORD}
+        return lambda: client.post('/login', data=form)
+
+    return {
+        'GET /': get(lambda context, generator, user: '/'),
+        'GET /users/<username>': get(
+            lambda context, generator, user: f'/users/{random_user(context, generator)[1]}'),
+        'GET /users/<username> (most active)': get(
+            lambda context, generator, user: f'/users/{user[1]}'),
+        'POST /users/<username> (edit button)': post(
+            lambda context, generator: f'/users/{context["heavy_user"][1]}',
+            lambda context, generator: {'edit_hike': f'edit_{context["heavy_hike_ids"][0]}'}),
+        'GET /users/<username>/feed': get(
+            lambda context, generator, user: f'/users/{user[1]}/feed', random_viewer=True),
+        'GET /users?user_search=': get(lambda context, generator, user:
+            f'/users?user_search={search_query(context, generator)}'),
+        'POST /users': post(lambda context, generator: '/users', lambda context, generator: {}),
+        'GET /search?q=': get(lambda context, generator, user:
+            f'/search?q={hike_search_query(context, generator)}'),
+        'GET /search?q=&mode=following': get(lambda context, generator, user:
+            f'/search?q={hike_search_query(context, generator)}&mode=following',
+            random_viewer=True),
+        'GET /follow/<username>': get(
+            lambda context, generator, user: f'/follow/{random_user(context, generator)[1]}'),
+        'GET /unfollow/<username>': get(
+            lambda context, generator, user: f'/unfollow/{random_user(context, generator)[1]}'),
+        'GET /trails?area_id=&name=': get(lambda context, generator, user:
+            f'/trails?{trail_lookup_query(context, generator)}'),
+        'GET /trails/<trail_id>': get(
+            lambda context, generator, user: f'/trails/{generator.choice(context["trails"])}'),
+        'GET /leaderboards': get(lambda context, generator, user: '/leaderboards',
+            random_viewer=True),
+        'GET /leaderboards/areas/<area_id>': get(lambda context, generator, user:
+            f'/leaderboards/areas/{generator.choice(context["area_ids"])}'),
+        'GET /signup': get(lambda context, generator, user: '/signup'),
+        'POST /signup': post_signup,
+        'GET /login': get(lambda context, generator, user: '/login'),
+        'POST /login': post_login,
+        'GET /logout': get(lambda context, generator, user: '/logout'),
+        'GET /new-hike': get(lambda context, generator, user: '/new-hike'),
+        'POST /new-hike': post(lambda context, generator: '/new-hike', hike_form),
+        'GET /edit-hike/<hike_id>': get(
+            lambda context, generator, user: f'/edit-hike/{context["heavy_hike_ids"][0]}'),
+        'POST /edit-hike/<hike_id>': post(
+            lambda context, generator: f'/edit-hike/{context["heavy_hike_ids"][0]}',
+            lambda context, generator: dict(hike_form(context, generator), action='save')),
+        'GET /api/v1/users/<username>/hikes': get(lambda context, generator, user:
+            f'/api/v1/users/{random_user(context, generator)[1]}/hikes'),
+        'GET /api/v1/users/<username>/feed': get(
+            lambda context, generator, user: f'/api/v1/users/{user[1]}/feed', random_viewer=True),
+        'GET /api/v1/users?q=': get(lambda context, generator, user:
+            f'/api/v1/users?q={search_query(context, generator)}'),
+        'GET /metrics': get(lambda context, generator, user: '/metrics'),
+    }
+
+
+def get_routes(app):
+    '''Takes Flask app. Returns set of 'METHOD path' for every route and method it answers
+        (path variables without their converter, ie. GET /trails/<trail_id>), except static files.
+    '''
+    routes = set()
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint == 'static':
+            continue
+        path = re.sub(r'<(?:\w+:)?(\w+)>', r'<\1>', rule.rule)
+        routes.update(f'{method} {path}' for method in rule.methods - {'HEAD', 'OPTIONS'})
+    return routes
+
+
+def get_untimed_routes(app, cases):
+    '''Takes Flask app and dict of route cases. Case names start with the route they time
+        (ie. 'GET /users?user_search=' times GET /users).
+        Returns sorted list of the app's routes without a case.
+    '''
+    timed = {' '.join(re.split(r'[ ?]', name)[:2]) for name in cases}
+    return sorted(get_routes(app) - timed)
+
+
+# ==== RUNNER ====
+
+def run_size(size, seed, repeats, directory, app_module=None):
+    '''Takes number of users, random seed, repeats per case, temporary directory and
+        optional app module (route cases are skipped without it).
+        Returns dict of dataset row counts and per-case summaries.
+    '''
+    db = os.path.join(directory, f'bench_{size}.db')
+    dataset = generate(db, size, seed)
+    result = {'dataset': dataset, 'utils': {}, 'routes': {}}
+    generator = random.Random(seed)
+    context = load_context(db, seed)
+    for name, prepare in utils_cases().items():
+        result['utils'][name] = time_case(prepare, context, generator, repeats)
+    if app_module is not None:
+        app_module.DB = db
+        client = app_module.app.test_client()
+        context = load_context(db, seed)
+        cases = route_cases(client)
+        for route in get_untimed_routes(app_module.app, cases):
+            print(f'No benchmark case for {route}', file=sys.stderr)
+        for name, prepare in cases.items():
+            result['routes'][name] = time_case(prepare, context, generator, repeats)
+    return result
+
+
+def get_git_commit():
+    '''Returns current git commit hash, or None outside of a git checkout.'''
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+            check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, seed=42, repeats=DEFAULT_REPEATS, routes=True):
+    '''Takes list of user counts, random seed, repeats per case and whether to time routes.
+        Returns results dict (meta data and one entry per size).
+    '''
+    results = {
+        'meta': {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'git_commit': get_git_commit(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'feed_mode': FEED_MODE,
+            'seed': seed,
+            'repeats': repeats,
+        },
+        'sizes': {},
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        app_module = load_app(directory) if routes else None
+        for size in sizes:
+            print(f'Benchmarking {size} users...', file=sys.stderr)
+            results['sizes'][str(size)] = run_size(size, seed, repeats, directory, app_module)
+        # Writers keep their database open, stop them before the directory is removed
+        stop_writers()
+    return results
+
+
+def print_results(results):
+    '''Takes results dict. Prints p50 and p95 per case and size.'''
+    for size, result in results['sizes'].items():
+        print(f'{size} users: {result["dataset"]}')
+        for group in ['utils', 'routes']:
+            for name, summary in result[group].items():
+                statuses = ' '.join(f'{code}x{count}' for code, count
+                    in summary.get('statuses', {}).items())
+                print(f'  {name:<40} p50 {summary["p50"]:>9.2f} ms   '
+                    f'p95 {summary["p95"]:>9.2f} ms   {statuses}')
+
+
+def main():
+    '''Parses command line args, runs benchmarks, prints them and writes JSON results.'''
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-routes', action='store_true', help='only time utils functions')
+    parser.add_argument('--output', default='bench_results.json')
+    args = parser.parse_args()
+    results = run(args.sizes, args.seed, args.repeats, not args.no_routes)
+    print_results(results)
+    with open(args.output, 'w', encoding='utf-8') as output:
+        json.dump(results, output, indent=2)
+    print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+'''Unit tests for the benchmark data generator, runner stats and result comparison'''
+import sqlite3
+from hashing import hash_password
+from benchmarks.compare import compare
+from benchmarks.datagen import generate
+from benchmarks.runner import get_untimed_routes, route_cases, run, summarize
+# pylint: disable=line-too-long
+
+
+def test_generate_is_seeded(tmp_path):
+    '''The same size and seed produce the same data, with the most active users first'''
+    first, second = str(tmp_path / 'first.db'), str(tmp_path / 'second.db')
+    assert generate(first, 200, seed=1) == generate(second, 200, seed=1)
+    rows = []
+    for db in [first, second]:
+        connection = sqlite3.connect(db)
+        rows.append(connection.execute('SELECT * FROM hikes ORDER BY id').fetchall()
+            + connection.execute('SELECT * FROM users ORDER BY id').fetchall())
+        hike_counts = [row[0] for row in connection.execute('SELECT COUNT(*) FROM hikes GROUP BY user_id ORDER BY user_id')]
+        connection.close()
+    assert rows[0] == rows[1]
+    assert hike_counts[0] == max(hike_counts)
+
+
+def test_summarize():
+    '''Percentiles are picked from the sorted timings'''
+    summary = summarize([float(ms) for ms in range(100, 0, -1)])
+    assert (summary['count'], summary['max'], summary['mean']) == (100, 100.0, 50.5)
+    assert (summary['p50'], summary['p99']) == (51.0, 99.0)
+
+
+def test_run_and_compare():
+    '''A small run times every utils case, and comparing it with a slower copy flags regressions'''
+    results = run([50], seed=3, repeats=2, routes=False)
+    utils = results['sizes']['50']['utils']
+    assert utils['get_feed']['count'] == 2
+    assert results['sizes']['50']['routes'] == {}
+    slower = {'meta': {}, 'sizes': {'50': {'utils': {name: dict(summary, p50=summary['p50'] * 2) for name, summary in utils.items()}}}}
+    rows = compare(results, slower, 'p50', threshold=50)
+    assert len(rows) == len(utils)
+    assert all(regressed for _, _, _, _, regressed in rows)
+    assert not any(regressed for _, _, _, _, regressed in compare(results, results))
+
+
+def test_route_cases_cover_app(app_module):
+    '''Every route and method of the app has a benchmark case'''
+    cases = route_cases(app_module.app.test_client())
+    assert get_untimed_routes(app_module.app, cases) == []
+    del cases['POST /login'], cases['GET /trails?area_id=&name=']
+    assert get_untimed_routes(app_module.app, cases) == ['GET /trails', 'POST /login']
+
+
+def test_run_routes(app_module, monkeypatch):
+    '''A small run times every route case without a server error'''
+    # One pbkdf2 iteration, the signup and login cases don't need to be slow here
+    monkeypatch.setattr(app_module, 'hash_password', lambda password: hash_password(password, 'pbkdf2:sha256:1'))
+    routes = run([50], seed=3, repeats=1)['sizes']['50']['routes']
+    assert list(routes) == list(route_cases(app_module.app.test_client()))
+    assert all(int(status) < 500 for summary in routes.values() for status in summary['statuses'])
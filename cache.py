@@ -0,0 +1,93 @@
+'''This module houses a small in-process cache used by the utility functions.'''
+from collections import OrderedDict
+import sys
+import threading
+import time
+
+
+class LRUCache:  # pylint: disable=too-many-instance-attributes
+    '''Thread-safe least-recently-used cache with an optional time-to-live (seconds),
+        optional memory bound (max_bytes, as measured by weigh(value)) and hit/miss counters.
+    '''
+
+    def __init__(self, max_size, ttl=None, max_bytes=None, weigh=sys.getsizeof):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.weigh = weigh
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _pop(self, key):
+        '''Takes key. Removes its entry and its size from the byte count (caller holds the lock).'''
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def get(self, key):
+        '''Takes key. Returns cached value, or None if missing or expired.'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (entry[1] is not None and entry[1] < time.monotonic()):
+                self._pop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        '''Takes key, value and optional time-to-live overriding the cache's.
+            Stores value, evicting the least recently used entries if full.
+        '''
+        ttl = ttl if ttl is not None else self.ttl
+        expires = time.monotonic() + ttl if ttl else None
+        size = self.weigh(value) if self.max_bytes else 0
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (value, expires, size)
+            self.bytes += size
+            while self._entries and (len(self._entries) > self.max_size
+                    or (self.max_bytes and self.bytes > self.max_bytes)):
+                self._pop(next(iter(self._entries)))
+
+    def invalidate(self, key):
+        '''Takes key. Removes it from the cache if present.'''
+        with self._lock:
+            self._pop(key)
+
+    def remove_expired(self):
+        '''Removes expired entries. Returns number of entries removed.'''
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, (_, expires, _) in self._entries.items()
+                if expires is not None and expires < now]
+            for key in expired:
+                self._pop(key)
+        return len(expired)
+
+    def clear(self):
+        '''Removes every entry (counters are kept).'''
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        '''Returns dict of hits, misses, hit ratio, size and max size
+            (and bytes and max bytes for memory-bounded caches).
+        '''
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+            }
+            if self.max_bytes:
+                stats.update({'bytes': self.bytes, 'max_bytes': self.max_bytes})
+            return stats
@@ -0,0 +1,102 @@
+'''Unit tests for the in-process LRU cache and the cached utility lookups'''
+import time
+from cache import LRUCache
+from init_sql import migrate
+from utils import (
+        add_user,
+        get_table_columns,
+        get_user_by_username,
+        invalidate_user,
+        table_columns_cache,
+        user_cache,
+        )
+# pylint: disable=line-too-long
+
+
+class TestLRUCache:
+    '''Tests eviction, expiry and hit ratio of LRUCache'''
+
+    def test_evicts_least_recently_used(self):
+        '''Once full, the entry used longest ago is dropped first'''
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        assert cache.get('a') == 1
+        cache.set('c', 3)
+        assert cache.get('b') is None
+        assert cache.get('a') == 1 and cache.get('c') == 3
+
+    def test_entries_expire(self):
+        '''Entries older than the ttl are treated as misses'''
+        cache = LRUCache(max_size=2, ttl=0.01)
+        cache.set('a', 1)
+        time.sleep(0.02)
+        assert cache.get('a') is None
+        assert cache.stats()['size'] == 0
+
+    def test_entry_ttl_and_remove_expired(self):
+        '''A ttl given to set overrides the cache's, and expired entries can be removed in bulk'''
+        cache = LRUCache(max_size=3, ttl=60)
+        cache.set('a', 1, ttl=0.01)
+        cache.set('b', 2)
+        time.sleep(0.02)
+        assert cache.remove_expired() == 1
+        assert cache.stats()['size'] == 1 and cache.get('b') == 2
+
+    def test_evicts_over_max_bytes(self):
+        '''A memory-bounded cache drops least recently used entries once over max_bytes'''
+        cache = LRUCache(max_size=10, max_bytes=10, weigh=len)
+        cache.set('a', 'xxxx')
+        cache.set('b', 'xxxx')
+        cache.set('a', 'xxxxx')
+        assert cache.stats()['bytes'] == 9
+        cache.set('c', 'xxxx')
+        assert cache.get('b') is None and cache.get('a') == 'xxxxx'
+        cache.set('d', 'x' * 11)
+        assert cache.get('d') is None
+        cache.invalidate('c')
+        assert cache.stats()['size'] == 0 and cache.stats()['bytes'] == 0
+
+    def test_stats(self):
+        '''Hits, misses and hit ratio are counted per lookup'''
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.get('a')
+        cache.get('b')
+        cache.invalidate('a')
+        cache.get('a')
+        assert cache.stats() == {'hits': 1, 'misses': 2, 'hit_ratio': 1 / 3, 'size': 0, 'max_size': 2}
+
+
+class TestCachedLookups:
+    '''Tests the cached user and table column lookups in utils'''
+
+    def test_user_lookup_is_cached_and_copied(self, tmp_path):
+        '''Repeat lookups hit the cache and callers can't modify the cached record'''
+        db = str(tmp_path / 'users.db')
+        migrate(db)
+        add_user(db, 'Suze', 'abcdefghijklmnopqrstuvwxyz123456')
+        first = get_user_by_username(db, 'Suze')
+        hits = user_cache.stats()['hits']
+        first['username'] = 'Changed'
+        assert get_user_by_username(db, 'Suze')['username'] == 'Suze'
+        assert user_cache.stats()['hits'] == hits + 1
+        invalidate_user(db, 'Suze')
+        assert get_user_by_username(db, 'Suze')['id'] == first['id']
+
+    def test_missing_user_is_not_cached(self, tmp_path):
+        '''A user added after a failed lookup is found right away'''
+        db = str(tmp_path / 'users.db')
+        migrate(db)
+        assert not get_user_by_username(db, 'Frank')
+        add_user(db, 'Frank', '654321zyxwvutsrqponmlkjihgfedcba')
+        assert get_user_by_username(db, 'Frank')['username'] == 'Frank'
+
+    def test_migrate_clears_table_columns(self, tmp_path):
+        '''Cached column lists are dropped when migrations run'''
+        db = str(tmp_path / 'columns.db')
+        migrate(db)
+        columns = get_table_columns(db, 'users')
+        assert table_columns_cache.get((db, 'users')) == columns
+        migrate(db)
+        assert table_columns_cache.get((db, 'users')) is None
@@ -0,0 +1,34 @@
+'''Shared pytest fixtures for the unit tests'''
+import pytest
+import metrics
+from constants import SLOW_QUERY_MS, SLOW_QUERY_SAMPLE_RATE
+from slow_query_log import SlowQueryLog
+from testing import load_app, make_db
+
+
+@pytest.fixture(autouse=True, scope='session')
+def slow_query_log(tmp_path_factory):
+    '''Logs slow statements to a temporary directory, not the repo's logs/ directory.
+        Session scoped, so module scoped fixtures (ie. generated datasets) are covered too.
+    '''
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(metrics, 'slow_log', SlowQueryLog(
+            str(tmp_path_factory.mktemp('logs') / 'slow_queries.jsonl'), SLOW_QUERY_MS,
+            SLOW_QUERY_SAMPLE_RATE))
+        yield
+
+
+@pytest.fixture(name='db')
+def fixture_db(tmp_path):
+    '''Returns migrated db file with users suze (1) and frank (2).
+        A test module can override it, taking this one as its db argument to add more rows.
+    '''
+    return make_db(str(tmp_path / 'test.db'))
+
+
+@pytest.fixture(name='app_module')
+def fixture_app_module(tmp_path, db, monkeypatch):
+    '''Returns app module using the db fixture.'''
+    app_module = load_app(str(tmp_path))
+    monkeypatch.setattr(app_module, 'DB', db)
+    return app_module
@@ -0,0 +1,120 @@
+'''This module manages sqlite connections shared by the utility functions.
+    Inside a Flask app context each database file gets one connection per context,
+    which is returned to a bounded pool on teardown. Outside an app context (ie. scripts
+    and unit tests) a fresh connection is opened and closed for every use.
+'''
+from contextlib import contextmanager
+import sqlite3
+import threading
+from flask import g, has_app_context
+from constants import DB_POOL_SIZE, DB_PRAGMAS
+from metrics import InstrumentedConnection, record
+
+
+def open_connection(db, check_same_thread=True, pragmas=None):
+    '''Takes sqlite3 db file, optional thread check flag and pragmas (DB_PRAGMAS by default).
+        Returns new (instrumented) connection with the pragmas applied.
+    '''
+    record('connections_opened')
+    connection = sqlite3.connect(
+        db, check_same_thread=check_same_thread, factory=InstrumentedConnection)
+    for pragma, value in (DB_PRAGMAS if pragmas is None else pragmas).items():
+        connection.execute(f'PRAGMA {pragma} = {value}')
+    return connection
+
+
+class ConnectionPool:
+    '''Bounded pool of idle sqlite connections, keyed by database file.'''
+
+    def __init__(self, max_size=DB_POOL_SIZE, pragmas=None):
+        self.max_size = max_size
+        self.pragmas = pragmas
+        self.hits = 0
+        self.misses = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, db):
+        '''Takes db file. Returns an idle connection if one exists, otherwise a new one.'''
+        with self._lock:
+            idle = self._idle.get(db)
+            if idle:
+                self.hits += 1
+                return idle.pop()
+            self.misses += 1
+        # Pooled connections may be handed to a different request thread later on
+        return open_connection(db, check_same_thread=False, pragmas=self.pragmas)
+
+    def release(self, db, connection):
+        '''Takes db file and connection. Returns connection to the pool, or closes it if full.'''
+        # Never hand out a connection with a half-finished transaction
+        if connection.in_transaction:
+            connection.rollback()
+        with self._lock:
+            idle = self._idle.setdefault(db, [])
+            if len(idle) < self.max_size:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def clear(self):
+        '''Closes every idle connection and resets the counters.'''
+        with self._lock:
+            idle_lists = list(self._idle.values())
+            self._idle = {}
+            self.hits = 0
+            self.misses = 0
+        for idle in idle_lists:
+            for connection in idle:
+                connection.close()
+
+    def stats(self):
+        '''Returns dict of pool hits, misses and idle connection count.'''
+        with self._lock:
+            idle = sum(len(connections) for connections in self._idle.values())
+            return {
+                'hits': self.hits, 'misses': self.misses, 'idle': idle, 'max_size': self.max_size}
+
+
+pool = ConnectionPool()
+
+
+@contextmanager
+def scoped_connection(db):
+    '''Takes sqlite3 db file.
+        Yields library containing connection and cursor objects (same shape as create_connection).
+        Uncommitted changes are rolled back when the outermost scope for a connection exits.
+    '''
+    if not has_app_context():
+        connection = open_connection(db)
+        try:
+            yield {'connection': connection, 'cursor': connection.cursor()}
+        finally:
+            connection.close()
+        return
+    if 'db_connections' not in g:
+        g.db_connections = {}
+    scope = g.db_connections.get(db)
+    if scope is None:
+        scope = {'connection': pool.acquire(db), 'depth': 0}
+        g.db_connections[db] = scope
+        record('connections')
+    scope['depth'] += 1
+    try:
+        yield {'connection': scope['connection'], 'cursor': scope['connection'].cursor()}
+    finally:
+        scope['depth'] -= 1
+        if scope['depth'] == 0 and scope['connection'].in_transaction:
+            scope['connection'].rollback()
+
+
+def release_connections(_exception=None):
+    '''Returns the app context's connections to the pool. Registered as a teardown handler.'''
+    connections = g.pop('db_connections', {})
+    for db, scope in connections.items():
+        pool.release(db, scope['connection'])
+
+
+def init_app(app):
+    '''Takes Flask app. Registers teardown handler that releases pooled connections.'''
+    app.teardown_appcontext(release_connections)
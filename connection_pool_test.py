@@ -0,0 +1,84 @@
+'''Unit tests for the pooled, app-context scoped sqlite connections'''
+from flask import Flask
+from connection_pool import ConnectionPool, init_app, open_connection, pool, scoped_connection
+from constants import DB_PRAGMAS
+# pylint: disable=line-too-long
+
+
+class TestConnectionPool:
+    '''Tests acquiring and releasing connections from a bounded pool'''
+
+    def test_hits_and_misses(self, tmp_path):
+        '''Released connections are reused and counted as hits'''
+        db = str(tmp_path / 'pool.db')
+        test_pool = ConnectionPool(max_size=1)
+        connection = test_pool.acquire(db)
+        test_pool.release(db, connection)
+        assert test_pool.acquire(db) is connection
+        assert test_pool.stats()['hits'] == 1
+        assert test_pool.stats()['misses'] == 1
+        test_pool.clear()
+
+    def test_pragmas(self, tmp_path):
+        '''New connections wait on a locked database, sync less often and memory-map reads'''
+        connection = open_connection(str(tmp_path / 'pool.db'))
+        assert connection.execute('PRAGMA busy_timeout').fetchone()[0] == DB_PRAGMAS['busy_timeout']
+        # 1 is NORMAL
+        assert connection.execute('PRAGMA synchronous').fetchone()[0] == 1
+        assert connection.execute('PRAGMA mmap_size').fetchone()[0] == DB_PRAGMAS['mmap_size']
+        connection.close()
+
+    def test_pool_is_bounded(self, tmp_path):
+        '''Connections released beyond max_size are closed instead of kept'''
+        db = str(tmp_path / 'pool.db')
+        test_pool = ConnectionPool(max_size=1)
+        first, second = test_pool.acquire(db), test_pool.acquire(db)
+        test_pool.release(db, first)
+        test_pool.release(db, second)
+        assert test_pool.stats()['idle'] == 1
+        test_pool.clear()
+
+    def test_release_rolls_back(self, tmp_path):
+        '''Uncommitted changes are discarded before a connection goes back to the pool'''
+        db = str(tmp_path / 'pool.db')
+        test_pool = ConnectionPool()
+        connection = test_pool.acquire(db)
+        connection.execute('CREATE TABLE things (name TEXT)')
+        connection.execute("INSERT INTO things VALUES ('tent')")
+        test_pool.release(db, connection)
+        assert not connection.in_transaction
+        assert connection.execute('SELECT COUNT(*) FROM things').fetchone()[0] == 0
+        test_pool.clear()
+
+
+class TestScopedConnection:
+    '''Tests that an app context shares a single connection per database'''
+
+    def test_one_connection_per_app_context(self, tmp_path):
+        '''Nested and sequential scopes in one app context use the same connection'''
+        db = str(tmp_path / 'scoped.db')
+        app = Flask(__name__)
+        init_app(app)
+        pool.clear()
+        with app.app_context():
+            with scoped_connection(db) as outer:
+                with scoped_connection(db) as inner:
+                    assert inner['connection'] is outer['connection']
+            with scoped_connection(db) as later:
+                assert later['connection'] is outer['connection']
+        assert pool.stats() == {'hits': 0, 'misses': 1, 'idle': 1, 'max_size': pool.max_size}
+        # The next app context is served from the pool
+        with app.app_context():
+            with scoped_connection(db) as reused:
+                assert reused['connection'] is outer['connection']
+        assert pool.stats()['hits'] == 1
+        pool.clear()
+
+    def test_no_app_context_closes_connection(self, tmp_path):
+        '''Outside an app context every scope gets its own short-lived connection'''
+        db = str(tmp_path / 'scoped.db')
+        with scoped_connection(db) as first:
+            pass
+        with scoped_connection(db) as second:
+            assert second['connection'] is not first['connection']
+        assert pool.stats()['idle'] == 0
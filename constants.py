@@ -1,8 +1,102 @@
 '''Constants for python functions'''
+import os
+from dotenv import load_dotenv
 # pylint: disable=line-too-long
 
-# Database file string
-DB = 'hikes.db'
+# Load environment variables so settings below can be overridden in the .env file
+load_dotenv()
+
+# Database file string (DATABASE overrides it, ie. to point the app at a benchmark database)
+DB = os.environ.get('DATABASE', 'hikes.db')
 # Cloudinary urls for limit fill specified width, and quality
 CLOUDINARY_URL_900 = 'https://res.cloudinary.com/take-a-hike/image/upload/c_lfill,w_900/q_auto:best/'
 CLOUDINARY_URL_100 = 'https://res.cloudinary.com/take-a-hike/image/upload/c_lfill,w_100/q_auto:good/'
+# Maximum number of idle sqlite connections kept per database file
+DB_POOL_SIZE = 8
+# Pragmas applied once to every new sqlite connection. The app database is in WAL mode (see
+# init_sql.migrate), where synchronous=NORMAL can't corrupt it (a power cut may lose the last
+# commits) and saves an fsync per commit. Reads are memory-mapped up to mmap_size bytes. A write
+# waits up to busy_timeout ms for another process's write, well under gunicorn's 30 s timeout
+DB_PRAGMAS = {
+    'busy_timeout': int(os.environ.get('DB_BUSY_TIMEOUT_MS', 10_000)),
+    'synchronous': 'NORMAL',
+    'mmap_size': int(os.environ.get('DB_MMAP_SIZE', 256 * 1024 * 1024)),
+    'temp_store': 'MEMORY',
+    'cache_size': -8000,
+}
+# Writer thread (see writer.py): whether writes go through it ('off' commits on the request
+# thread), max writes committed together, and seconds idle before it closes its connection
+DB_WRITE_QUEUE = os.environ.get('DB_WRITE_QUEUE', 'on') == 'on'
+DB_WRITE_BATCH_SIZE = int(os.environ.get('DB_WRITE_BATCH_SIZE', 64))
+DB_WRITER_IDLE_SECONDS = 5
+# Default and maximum number of hikes per page for paginated lists
+FEED_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# Maximum number of user cards shown for a user search
+SEARCH_RESULTS_LIMIT = 50
+# Hike search: max length of the search text, terms matched, results paged through, and newest
+# matches ranked
+SEARCH_MAX_LENGTH = 100
+SEARCH_MAX_TERMS = 8
+SEARCH_MAX_OFFSET = 1000
+SEARCH_MAX_MATCHES = 10_000
+# Months of km per month shown in a user's profile stats
+PROFILE_STATS_MONTHS = 12
+# Hikers on each leaderboard, and how often the leaderboard snapshots are rebuilt (seconds)
+LEADERBOARD_SIZE = 10
+LEADERBOARD_REFRESH_SECONDS = int(os.environ.get('LEADERBOARD_REFRESH_SECONDS', 300))
+# Feed strategy: 'read' joins follows and hikes per request (fan-out-on-read),
+# 'write' keeps a feed_items timeline per follower current on every write (fan-out-on-write)
+FEED_MODE = os.environ.get('FEED_MODE', 'read')
+# In-process cache of user records: max entries and seconds before an entry expires
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1024))
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 300))
+# Password hashing: werkzeug method string (ie. 'pbkdf2:sha256:600000' sets the iteration count),
+# number of hashing worker processes (0 hashes on the request thread) and how many more
+# hashing jobs may wait for a worker before requests are turned away with a 503
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2')
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS', 2))
+HASH_QUEUE_LIMIT = int(os.environ.get('HASH_QUEUE_LIMIT', 8))
+# Image uploads: local spool directory for files waiting to upload, uploader ('cloudinary', or
+# 'local' to copy files into the spool directory instead, ie. offline), number of worker threads,
+# attempts before an upload is marked failed, first retry delay (doubles per attempt), seconds a
+# claimed upload is leased to a worker, and how often idle workers check for due uploads
+UPLOAD_SPOOL_DIR = os.environ.get(
+    'UPLOAD_SPOOL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'upload_spool'))
+UPLOADER = os.environ.get('UPLOADER', 'cloudinary')
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 2))
+UPLOAD_MAX_ATTEMPTS = int(os.environ.get('UPLOAD_MAX_ATTEMPTS', 5))
+UPLOAD_RETRY_SECONDS = float(os.environ.get('UPLOAD_RETRY_SECONDS', 2))
+UPLOAD_LEASE_SECONDS = 300
+UPLOAD_POLL_SECONDS = 5
+# Slow-query log: statements slower than SLOW_QUERY_MS (0 turns the log off) are written, for the
+# given fraction of them, to a JSON-lines file rotated at max bytes with this many backups
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+SLOW_QUERY_SAMPLE_RATE = float(os.environ.get('SLOW_QUERY_SAMPLE_RATE', 1.0))
+SLOW_QUERY_LOG = os.environ.get(
+    'SLOW_QUERY_LOG', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs', 'slow_queries.jsonl'))
+SLOW_QUERY_LOG_MAX_BYTES = 5_000_000
+SLOW_QUERY_LOG_BACKUPS = 3
+# Sessions: backend ('sqlite', 'memory' (per process, lost on restart) or 'filesystem' (flask_session)),
+# sqlite session database file, max sessions kept by the memory backend, per-process cache of
+# decoded sqlite sessions (entries and seconds a cached session is trusted, 0 turns it off)
+# and how often expired sessions are swept
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'sqlite')
+SESSION_DB = os.environ.get('SESSION_DB', 'sessions.db')
+SESSION_MEMORY_SIZE = int(os.environ.get('SESSION_MEMORY_SIZE', 10_000))
+SESSION_CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', 1024))
+SESSION_CACHE_TTL = float(os.environ.get('SESSION_CACHE_TTL', 5))
+SESSION_SWEEP_SECONDS = 300
+# Pragmas of session database connections. Not DB_PRAGMAS: a session read or write is a single
+# small row, so there's nothing to memory-map, and it shouldn't hold a request for the app
+# database's longer busy timeout. The session database is in WAL mode, so synchronous=NORMAL
+# can only lose the last few session writes to a power cut
+SESSION_DB_PRAGMAS = {
+    'busy_timeout': 5000,
+    'synchronous': 'NORMAL',
+    'temp_store': 'MEMORY',
+    'cache_size': -8000,
+}
+# Rendered hike blocks: max cached fragments and max total size of their HTML in bytes
+FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE', 50_000))
+FRAGMENT_CACHE_BYTES = int(os.environ.get('FRAGMENT_CACHE_BYTES', 8_000_000))
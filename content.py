@@ -61,6 +61,7 @@ hike_form_content = {
 
 
 error_messages = {
+    'hike_query_invalid': 'Searches are up to one hundred characters long.',
     'incorrect_pw': 'Incorrect password. Please try again.',
     'invalid_number': 'Distance field must contain only numbers or decimal characters.',
     'invalid_url': 'Map URL must be valid web address.',
@@ -68,10 +69,15 @@ error_messages = {
     'no_username_or_pw': 'Username and password are required.',
     'password_invalid': 'Password with four to sixty-four characters is required.',
     'pw_confirm_match': 'Passwords must match.',
+    'server_busy': 'The server is busy right now. Please try again in a moment.',
+    'save_failed': 'Your hike could not be saved. Please try again in a moment.',
+    'signup_failed': 'Your account could not be created. Please try again in a moment.',
     'out_of_range': 'Distance must be between 0 and 100km.',
     'user_query_invalid': 'Usernames are between four and sixteen characters.',
     'unaccepted_url': 'URLs are not allowed in this field.',
     'unauthorized': 'You are not authorized to view this page.',
+    'trail_not_found': 'Trail not found. Please check the link and try again.',
+    'area_not_found': 'Area not found. Please check the link and try again.',
     'user_not_found': 'Username not found. Please check the username provided and try again.',
     'username_invalid': 'A username between four and sixteen characters containing only letters and/or numbers is required.',
     'username_taken': 'Username is already taken. Please select a different username.',
@@ -0,0 +1,71 @@
+'''This module houses the fragment cache for rendered hike blocks.
+    A hike is rendered the same way on its owner's page, in every follower's feed and on later
+    pages, so feed.html renders each block with render_hike, which reuses the HTML cached for
+    the hike until its version changes. Versions come from a counter in the settings table that
+    add_hike, update_hike and completed uploads bump in the same transaction as the write.
+    The cache is bounded by entries and bytes of HTML, and evicts least recently used blocks.
+'''
+import os
+import sys
+from flask import current_app, g
+from markupsafe import Markup
+from cache import LRUCache
+from constants import CLOUDINARY_URL_900, FRAGMENT_CACHE_BYTES, FRAGMENT_CACHE_SIZE
+from http_cache import TEMPLATES_DIR, get_file_hash
+
+HIKE_TEMPLATE = 'hike-block.html'
+# Templates a hike block is rendered from, a change to any of them renders every block again
+HIKE_TEMPLATES = [HIKE_TEMPLATE, 'hike-context-menu.html']
+
+# (hike id, viewer may edit, with username heading): ((version, templates hash), html)
+fragment_cache = LRUCache(FRAGMENT_CACHE_SIZE, max_bytes=FRAGMENT_CACHE_BYTES,
+    weigh=lambda entry: sys.getsizeof(entry[1]))
+
+
+def next_hike_version(cursor):
+    '''Takes cursor of the transaction writing a hike.
+        Bumps the hike version counter. Returns the new version for the hike.
+    '''
+    cursor.execute(
+        "INSERT INTO settings (key, value) VALUES ('hike_version', 1) "
+        'ON CONFLICT (key) DO UPDATE SET value = value + 1 RETURNING value')
+    return int(cursor.fetchone()[0])
+
+
+def get_templates_hash():
+    '''Returns hash of the hike block templates, computed once per request.'''
+    if 'hike_templates_hash' not in g:
+        g.hike_templates_hash = ''.join(
+            get_file_hash(os.path.join(TEMPLATES_DIR, filename)) for filename in HIKE_TEMPLATES)
+    return g.hike_templates_hash
+
+
+def render_hike(hike, auth=False):
+    '''Takes hike dict and whether the viewer may edit it. Returns rendered hike block,
+        from the cache if this version of the hike was rendered before.
+        Available in templates as render_hike.
+    '''
+    auth = bool(auth)
+    key = (hike.get('id'), auth, bool(hike.get('username')))
+    stamp = (hike.get('version'), get_templates_hash())
+    cached = fragment_cache.get(key) if stamp[0] else None
+    if cached and cached[0] == stamp:
+        return Markup(cached[1])
+    html = current_app.jinja_env.get_template(HIKE_TEMPLATE).render(
+        hike=hike, auth=auth, cloudinary_url=CLOUDINARY_URL_900)
+    # Hikes written before versions existed (version 0) are rendered every time
+    if stamp[0]:
+        fragment_cache.set(key, (stamp, html))
+    return Markup(html)
+
+
+def invalidate_hike(hike_id):
+    '''Takes hike id. Drops every cached rendering of the hike (ie. once it is deleted).'''
+    for auth in (False, True):
+        for with_username in (False, True):
+            fragment_cache.invalidate((hike_id, auth, with_username))
+
+
+def init_app(app):
+    '''Takes Flask app. Registers the render_hike template function.'''
+    app.jinja_env.globals['render_hike'] = render_hike
@@ -0,0 +1,60 @@
+'''Unit tests for the hike block fragment cache'''
+import pytest
+from fragments import fragment_cache
+from testing import HIKE
+from uploads import complete_upload
+from utils import add_hike, delete_hike, follow, get_hikes, update_hike
+# pylint: disable=line-too-long
+
+
+@pytest.fixture(name='db')
+def fixture_db(db):
+    '''Returns db file where frank follows suze, who has one hike.'''
+    follow(db, 'frank', 'suze', 'follow')
+    add_hike(db, 1, 1, dict(HIKE))
+    return db
+
+
+def log_in(client, username, user_id):
+    '''Takes test client, username and user id. Logs client in as that user.'''
+    with client.session_transaction() as session:
+        session['username'], session['user_id'] = username, user_id
+
+
+class TestFragmentCache:
+    '''Tests rendering hike blocks from cache until the hike changes'''
+
+    def test_blocks_are_reused(self, app_module):
+        '''A hike block rendered once is served from the cache on later pages'''
+        client = app_module.app.test_client()
+        first = client.get('/users/suze').text
+        hits = fragment_cache.stats()['hits']
+        assert client.get('/users/suze').text == first
+        assert fragment_cache.stats()['hits'] == hits + 1
+        assert 'Rad Trail' in first
+
+    def test_variants(self, app_module):
+        '''The owner's block has the edit menu, and feed blocks have the owner's name'''
+        client = app_module.app.test_client()
+        assert 'del_1' not in client.get('/users/suze').text
+        log_in(client, 'frank', 2)
+        assert 'href="/users/suze"' in client.get('/users/frank/feed').text
+        log_in(client, 'suze', 1)
+        assert 'del_1' in client.get('/users/suze').text
+
+    def test_writes_change_version(self, app_module):
+        '''Updating a hike or completing its upload renders it again, deleting drops it'''
+        client = app_module.app.test_client()
+        db = app_module.DB
+        client.get('/users/suze')
+        version = get_hikes(db, 1)[0]['version']
+        update_hike(db, {'id': 1}, {'trailhead': 'Tubular Trail'})
+        assert 'Tubular Trail' in client.get('/users/suze').text
+        complete_upload(db, {'id': 1, 'hike_id': 1, 'public_id': 'suzepic', 'spool_path': ''})
+        assert get_hikes(db, 1)[0]['version'] > version + 1
+        assert 'suzepic' in client.get('/users/suze').text
+        delete_hike(db, 1, 1)
+        assert fragment_cache.get((1, False, False)) is None
+        # A new hike reusing the deleted hike's id gets a newer version, not its cached block
+        add_hike(db, 1, 1, dict(HIKE, trailhead='Kewl Trailhead'))
+        assert 'Kewl Trailhead' in client.get('/users/suze').text
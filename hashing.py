@@ -0,0 +1,80 @@
+'''This module runs password hashing and verification off the request thread, in a bounded
+    pool of worker processes. Each pbkdf2 call is deliberately slow (CPU bound), so running
+    it inline lets one burst of logins hold every request thread. An admission limit rejects
+    work beyond the pool's queue straight away, so callers can answer with a fast 503.
+'''
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import threading
+from werkzeug.security import check_password_hash, generate_password_hash
+from constants import HASH_QUEUE_LIMIT, HASH_WORKERS, PASSWORD_HASH_METHOD
+
+
+class HashingBusy(Exception):
+    '''Raised when every worker is busy and the queue is full.'''
+
+
+class HashingPool:
+    '''Process pool with at most workers + queue_limit jobs admitted at once.
+        With zero workers jobs run inline on the calling thread (still admission limited).
+    '''
+    # The executor lives as long as the process and slots are released in run's finally block
+    # pylint: disable=consider-using-with
+
+    def __init__(self, workers, queue_limit):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + queue_limit)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        '''Returns process pool executor, started on first use.'''
+        with self._lock:
+            if self._executor is None:
+                # Kept for the life of the process, see shutdown. Workers are spawned, not
+                #   forked: a fork copies locks held by the app's other threads (ie. the writer)
+                #   into the child, where nothing would ever release them
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def run(self, function, *args):
+        '''Takes picklable function and its args.
+            Returns function result. Raises HashingBusy if no slot is free.
+        '''
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HashingBusy()
+        try:
+            if not self.workers:
+                return function(*args)
+            return self._get_executor().submit(function, *args).result()
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        '''Stops the worker processes (a new pool starts on the next job).'''
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+hashing_pool = HashingPool(HASH_WORKERS, HASH_QUEUE_LIMIT)
+
+
+def hash_password(password, method=PASSWORD_HASH_METHOD):
+    '''Takes password string and optional werkzeug hash method (ie. 'pbkdf2:sha256:600000').
+        Returns password hash. Raises HashingBusy if the pool is full.
+    '''
+    return hashing_pool.run(generate_password_hash, password, method)
+
+
+def verify_password(password_hash, password):
+    '''Takes stored password hash and submitted password string.
+        Returns True if they match. Raises HashingBusy if the pool is full.
+    '''
+    return hashing_pool.run(check_password_hash, password_hash, password)
@@ -0,0 +1,55 @@
+'''Unit tests for the bounded password hashing pool'''
+from concurrent.futures import ProcessPoolExecutor
+import threading
+import pytest
+import hashing
+from hashing import HashingBusy, HashingPool, hash_password, verify_password
+
+
+class TestHashingPool:
+    '''Tests running and rejecting jobs in a HashingPool'''
+
+    def test_hash_and_verify_in_worker_process(self):
+        '''Hashes made in the worker processes verify, wrong passwords don't'''
+        password_hash = hash_password('hunter22', 'pbkdf2:sha256:1000')
+        assert password_hash.startswith('pbkdf2:sha256:1000$')
+        assert verify_password(password_hash, 'hunter22') is True
+        assert verify_password(password_hash, 'hunter23') is False
+
+    def test_workers_are_spawned(self, monkeypatch):
+        '''Worker processes start from a fresh interpreter, not a fork of this multi-threaded one'''
+        contexts = []
+
+        def executor(**kwargs):
+            contexts.append(kwargs['mp_context'].get_start_method())
+            return ProcessPoolExecutor(**kwargs)
+        monkeypatch.setattr(hashing, 'ProcessPoolExecutor', executor)
+        pool = HashingPool(workers=1, queue_limit=0)
+        try:
+            assert pool.run(abs, -1) == 1
+        finally:
+            pool.shutdown()
+        assert contexts == ['spawn']
+
+    def test_full_pool_rejects_jobs(self):
+        '''Jobs beyond workers + queue_limit raise HashingBusy instead of waiting'''
+        pool = HashingPool(workers=0, queue_limit=0)
+        started, release = threading.Event(), threading.Event()
+
+        def slow_job():
+            started.set()
+            release.wait(5)
+            return 'done'
+
+        results = []
+        worker = threading.Thread(target=lambda: results.append(pool.run(slow_job)))
+        worker.start()
+        started.wait(5)
+        with pytest.raises(HashingBusy):
+            pool.run(slow_job)
+        release.set()
+        worker.join()
+        assert results == ['done']
+        assert pool.rejected == 1
+        # A freed slot admits jobs again
+        assert pool.run(lambda: 'again') == 'again'
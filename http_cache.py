@@ -0,0 +1,111 @@
+'''This module houses the HTTP caching policies, replacing the blanket no-store header.
+    Static assets are linked with a content hash (/static/styles.css?v=<hash>), so they can be
+    cached as immutable for a year, and a changed file gets a new URL. User pages and feeds are
+    private and revalidated on every request: routes pass an ETag (and Last-Modified) derived
+    from the user_activity change counters to check_not_modified, which answers 304 before
+    any hikes are fetched or templates rendered. Only the ETag is compared, Last-Modified is
+    informational. Every other route is never stored.
+'''
+import hashlib
+import os
+from flask import current_app, g, request
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+PRIVATE_REVALIDATE = 'private, no-cache'
+NO_STORE = 'no-cache, no-store, must-revalidate'
+# Cache-Control by endpoint, routes not listed here (forms, log in, redirects) aren't stored
+CACHE_POLICIES = {
+    'user_route': PRIVATE_REVALIDATE,
+    'feed': PRIVATE_REVALIDATE,
+    'api_user_hikes': PRIVATE_REVALIDATE,
+    'api_feed': PRIVATE_REVALIDATE,
+}
+
+# File path: (modification time, content hash), rehashed when a file changes (ie. in development)
+file_hashes = {}
+
+
+def get_file_hash(path):
+    '''Takes file path. Returns short hash of its content, or '' if it doesn't exist.'''
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return ''
+    cached = file_hashes.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, 'rb') as file:
+        digest = hashlib.sha256(file.read()).hexdigest()[:12]
+    file_hashes[path] = (mtime, digest)
+    return digest
+
+
+def static_url(filename):
+    '''Takes filename under static/. Returns its URL, versioned by content hash.
+        Available in templates as static_url.
+    '''
+    return f'/static/{filename}?v={get_file_hash(os.path.join(STATIC_DIR, filename))}'
+
+
+def get_templates_version():
+    '''Returns hash of every template's content hash, so ETags change when a template does.'''
+    digest = hashlib.sha256()
+    for filename in sorted(os.listdir(TEMPLATES_DIR)):
+        digest.update(get_file_hash(os.path.join(TEMPLATES_DIR, filename)).encode())
+    return digest.hexdigest()[:12]
+
+
+def make_etag(*parts):
+    '''Takes everything a response depends on (ie. change counters and viewer).
+        Returns ETag value for it.
+    '''
+    digest = hashlib.sha256(get_templates_version().encode())
+    for part in parts:
+        digest.update(b'\x1f' + str(part).encode())
+    return digest.hexdigest()[:32]
+
+
+def check_not_modified(etag, last_modified=None):
+    '''Takes ETag and optional last modified unix time, which are added to the response.
+        Returns empty 304 response if the request's If-None-Match matches, otherwise None.
+    '''
+    g.validators = (etag, last_modified)
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    # If-Modified-Since is ignored: it has whole second resolution, so a change made in the same
+    #   second as the cached response would be served stale (and it doesn't cover the viewer)
+    matched = bool(request.if_none_match) and request.if_none_match.contains_weak(etag)
+    return current_app.response_class(status=304) if matched else None
+
+
+def apply_cache_policy(response):
+    '''Takes response. Sets Cache-Control for the endpoint, and ETag/Last-Modified if the route
+        checked them. Registered as an after_request handler.
+    '''
+    validators = g.pop('validators', None)
+    if request.endpoint == 'static':
+        version = request.args.get('v')
+        current = get_file_hash(os.path.join(STATIC_DIR, request.view_args.get('filename', '')))
+        # An outdated ?v= (ie. a page rendered before a deploy) gets the current file, uncached
+        immutable = version and version == current
+        response.headers['Cache-Control'] = IMMUTABLE if immutable else REVALIDATE
+        return response
+    policy = CACHE_POLICIES.get(request.endpoint, NO_STORE)
+    response.headers['Cache-Control'] = policy
+    if policy == NO_STORE:
+        response.headers['Expires'] = 0
+        response.headers['Pragma'] = 'no-cache'
+    elif validators and response.status_code in (200, 304):
+        response.set_etag(validators[0])
+        if validators[1]:
+            response.last_modified = validators[1]
+    return response
+
+
+def init_app(app):
+    '''Takes Flask app. Registers cache policy handler and static_url template function.'''
+    app.after_request(apply_cache_policy)
+    app.jinja_env.globals['static_url'] = static_url
@@ -0,0 +1,102 @@
+'''Unit tests for per-route cache policies, versioned static assets and conditional GETs'''
+import pytest
+from http_cache import IMMUTABLE, NO_STORE, PRIVATE_REVALIDATE, REVALIDATE, static_url
+from testing import HIKE
+from utils import add_hike, follow, get_feed_activity, get_user_activity, get_user_by_username
+# pylint: disable=line-too-long
+
+
+def log_in(client, db, username):
+    '''Takes test client, db file and username. Logs client in as that user.'''
+    with client.session_transaction() as session:
+        session['username'] = username
+        session['user_id'] = get_user_by_username(db, username)['id']
+
+
+class TestCachePolicies:
+    '''Tests Cache-Control per route and for static assets'''
+
+    def test_static_assets(self, app_module):
+        '''Static files linked with their content hash are immutable, others are revalidated'''
+        client = app_module.app.test_client()
+        page = client.get('/signup').text
+        assert static_url('styles.css') in page
+        assert client.get(static_url('styles.css')).headers['Cache-Control'] == IMMUTABLE
+        assert client.get('/static/styles.css').headers['Cache-Control'] == REVALIDATE
+        assert client.get('/static/styles.css?v=outdated').headers['Cache-Control'] == REVALIDATE
+
+    def test_forms_are_not_stored(self, app_module):
+        '''Routes without a policy keep the no-store headers'''
+        response = app_module.app.test_client().get('/login')
+        assert response.headers['Cache-Control'] == NO_STORE
+        assert 'ETag' not in response.headers
+
+
+class TestConditionalGet:
+    '''Tests ETags and 304 responses for user pages and feeds'''
+
+    def test_user_page_not_modified(self, app_module, monkeypatch):
+        '''A matching If-None-Match gets a 304 without fetching hikes, until a hike is added'''
+        client = app_module.app.test_client()
+        log_in(client, app_module.DB, 'frank')
+        response = client.get('/users/suze')
+        etag = response.headers['ETag']
+        assert response.headers['Cache-Control'] == PRIVATE_REVALIDATE
+        with monkeypatch.context() as patch:
+            patch.setattr(app_module, 'get_hikes', lambda *args: pytest.fail('hikes fetched'))
+            cached = client.get('/users/suze', headers={'If-None-Match': etag})
+        assert cached.status_code == 304 and cached.data == b''
+        assert cached.headers['ETag'] == etag
+        add_hike(app_module.DB, 1, 1, dict(HIKE))
+        changed = client.get('/users/suze', headers={'If-None-Match': etag})
+        assert changed.status_code == 200 and changed.headers['ETag'] != etag
+        assert changed.headers['Last-Modified']
+
+    def test_etag_depends_on_viewer(self, app_module):
+        '''Another viewer (or a change in follow status) gets a different ETag'''
+        client = app_module.app.test_client()
+        anonymous = client.get('/users/suze').headers['ETag']
+        log_in(client, app_module.DB, 'frank')
+        viewer = client.get('/users/suze').headers['ETag']
+        follow(app_module.DB, 'frank', 'suze', 'follow')
+        following = client.get('/users/suze', headers={'If-None-Match': viewer})
+        assert len({anonymous, viewer, following.headers['ETag']}) == 3
+        assert following.status_code == 200
+
+    def test_if_modified_since_ignored(self, app_module):
+        '''A change in the same second as the cached page isn't missed: If-Modified-Since alone is never a 304'''
+        client = app_module.app.test_client()
+        add_hike(app_module.DB, 1, 1, dict(HIKE))
+        response = client.get('/users/suze')
+        last_modified = response.headers['Last-Modified']
+        add_hike(app_module.DB, 1, 1, dict(HIKE))
+        for headers in [{'If-Modified-Since': last_modified}, {'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'}]:
+            changed = client.get('/users/suze', headers=headers)
+            assert changed.status_code == 200 and changed.headers['ETag'] != response.headers['ETag']
+        assert client.get('/users/suze', headers={'If-None-Match': changed.headers['ETag']}).status_code == 304
+
+    def test_feed_not_modified(self, app_module):
+        '''The feed is 304 until a followee's hikes or the user's follows change'''
+        client = app_module.app.test_client()
+        log_in(client, app_module.DB, 'frank')
+        follow(app_module.DB, 'frank', 'suze', 'follow')
+        etag = client.get('/users/frank/feed').headers['ETag']
+        assert client.get('/users/frank/feed', headers={'If-None-Match': etag}).status_code == 304
+        add_hike(app_module.DB, 1, 1, dict(HIKE))
+        assert client.get('/users/frank/feed', headers={'If-None-Match': etag}).status_code == 200
+
+
+class TestUserActivity:  # pylint: disable=too-few-public-methods
+    '''Tests the user_activity counters kept by triggers'''
+
+    def test_counters(self, db):
+        '''Hike changes bump the owner's counter, follows the follower's, and feeds see both'''
+        assert get_user_activity(db, 1) == {'hikes_version': 0, 'follows_version': 0, 'updated_at': None}
+        add_hike(db, 1, 1, dict(HIKE))
+        assert get_user_activity(db, 1)['hikes_version'] == 1
+        follow(db, 'frank', 'suze', 'follow')
+        feed = get_feed_activity(db, 'frank')
+        assert (feed['follows_version'], feed['hikes_version']) == (1, 1)
+        assert feed['updated_at'] >= get_user_activity(db, 1)['updated_at']
+        add_hike(db, 1, 1, dict(HIKE))
+        assert get_feed_activity(db, 'frank')['hikes_version'] == 2
@@ -1,9 +1,14 @@
 '''Uses Error for error reporting'''
-from sqlite3 import Error
-from utils import create_connection, commit_close_conn
+import os
+from sqlite3 import Error, complete_statement
+from utils import create_connection, commit_close_conn, invalidate_caches
 from constants import DB
 
 SEPARATOR = '=' * 24
+# Resolve schema files relative to this module so the app can start from any working directory
+TABLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tables')
+TABLES_FILE = os.path.join(TABLES_DIR, 'tables.sql')
+MIGRATIONS_DIR = os.path.join(TABLES_DIR, 'migrations')
 
 def runner(environment='development'):
     '''Takes optional environment arg to run init fn with'''
@@ -19,21 +24,127 @@ def init_sql(db):
     '''Takes database file. Prints table schema.'''
     print('Hold onto your butts...\n' + SEPARATOR)
     try:
-        with open('./tables/tables.sql', 'r', encoding='utf-8') as tables:
-            tables_commands = tables.read()
         db_connection = create_connection(db)
         print('Connection established...\n' + SEPARATOR)
-        db_connection['cursor'].executescript(tables_commands)
-        db_connection['connection'].commit()
+        create_tables(db_connection)
+        applied = apply_migrations(db_connection)
         db_connection['cursor'].execute("SELECT name FROM sqlite_master WHERE type = 'table';")
         schema = db_connection['cursor'].fetchall()
         print('Tables created: ')
         for table in schema:
             print(f'   * {table[0]}')
+        print('Migrations applied: ')
+        for migration in applied:
+            print(f'   * {migration}')
         print(SEPARATOR)
         commit_close_conn(db_connection['connection'])
         print('Connection closed...\n')
     except Error as error:
         print(error)
 
-runner()
+
+def migrate(db):
+    '''Takes database file. Creates any missing tables and applies pending migrations
+        without recreating the database. Run on app startup.
+    '''
+    db_connection = create_connection(db)
+    try:
+        create_tables(db_connection)
+        apply_migrations(db_connection)
+    finally:
+        db_connection['connection'].close()
+
+
+def create_tables(db_connection):
+    '''Takes connection library. Switches the database to WAL mode and runs base table schema
+        (no-op for existing tables).
+    '''
+    # Readers and the writer don't block each other in WAL mode. It's kept in the database
+    # file, so it only needs setting once
+    db_connection['cursor'].execute('PRAGMA journal_mode = WAL')
+    with open(TABLES_FILE, 'r', encoding='utf-8') as tables:
+        tables_commands = tables.read()
+    db_connection['cursor'].executescript(tables_commands)
+    db_connection['connection'].commit()
+
+
+def get_migrations(directory=MIGRATIONS_DIR):
+    '''Takes migrations directory.
+        Returns list of (version, name, path) tuples sorted by version.
+        Migration files are named <version>_<name>.sql, ie. 001_hikes_user_id_integer.sql
+    '''
+    migrations = []
+    for filename in os.listdir(directory):
+        version, _, name = filename.partition('_')
+        if not filename.endswith('.sql') or not version.isdigit():
+            continue
+        migrations.append((int(version), name[:-len('.sql')], os.path.join(directory, filename)))
+    return sorted(migrations)
+
+
+def get_schema_version(db_connection):
+    '''Takes connection library. Returns version of the last applied migration (0 if none).'''
+    db_connection['cursor'].execute(
+        'CREATE TABLE IF NOT EXISTS schema_version ('
+        'version INTEGER PRIMARY KEY, name TEXT NOT NULL, '
+        'applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP)')
+    db_connection['connection'].commit()
+    db_connection['cursor'].execute('SELECT MAX(version) FROM schema_version')
+    version = db_connection['cursor'].fetchone()[0]
+    return version or 0
+
+
+def split_statements(script):
+    '''Takes SQL script. Returns list of its statements (a trigger with its body is one).'''
+    *parts, rest = script.split(';')
+    statements = []
+    statement = ''
+    for part in parts:
+        # A ; in a string, comment or trigger body doesn't end the statement
+        statement += part + ';'
+        if complete_statement(statement):
+            statements.append(statement)
+            statement = ''
+    return statements + [statement + rest] if (statement + rest).strip() else statements
+
+
+def apply_migrations(db_connection, directory=MIGRATIONS_DIR):
+    '''Takes connection library and optional migrations directory.
+        Applies each pending migration in version order, in its own transaction.
+        Returns list of applied migration names.
+    '''
+    current_version = get_schema_version(db_connection)
+    applied = []
+    for version, name, path in get_migrations(directory):
+        if version <= current_version:
+            continue
+        with open(path, 'r', encoding='utf-8') as migration:
+            script = migration.read()
+        try:
+            # Every app process migrates on startup, so take the write lock and read the version
+            # again under it: a process that lost the race skips what the winner applied.
+            # (executescript would commit the transaction first, so statements run one by one)
+            db_connection['cursor'].execute('BEGIN IMMEDIATE')
+            db_connection['cursor'].execute('SELECT MAX(version) FROM schema_version')
+            if (db_connection['cursor'].fetchone()[0] or 0) >= version:
+                db_connection['connection'].rollback()
+                continue
+            for statement in split_statements(script):
+                db_connection['cursor'].execute(statement)
+            db_connection['cursor'].execute(
+                'INSERT INTO schema_version (version, name) VALUES (?, ?)', (version, name))
+            db_connection['connection'].commit()
+        except Error:
+            # Leave the database at the last good version
+            if db_connection['connection'].in_transaction:
+                db_connection['connection'].rollback()
+            print(f'Migration {version} ({name}) failed')
+            raise
+        applied.append(f'{version:03d} {name}')
+    # Cached users and table columns may not match the new schema
+    invalidate_caches()
+    return applied
+
+
+if __name__ == '__main__':
+    runner()
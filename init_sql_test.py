@@ -0,0 +1,144 @@
+'''Unit tests for database initialization and schema migrations'''
+from concurrent.futures import ThreadPoolExecutor
+import sqlite3
+import init_sql
+from init_sql import TABLES_FILE, apply_migrations, get_migrations, migrate, split_statements
+from utils import create_connection, commit_close_conn
+# pylint: disable=line-too-long
+
+
+def get_latest_version():
+    '''Returns the version number of the newest migration file'''
+    return get_migrations()[-1][0]
+
+
+class TestMigrations:
+    '''Tests applying versioned migrations to new and existing databases'''
+
+    def test_migrations_are_numbered_in_order(self):
+        '''Migration versions are unique and start at 1'''
+        versions = [version for version, _, _ in get_migrations()]
+        assert versions == list(range(1, len(versions) + 1))
+
+    def test_migrate_new_database(self, tmp_path):
+        '''A new database ends up at the latest schema version with the hot query indexes'''
+        db = str(tmp_path / 'new.db')
+        migrate(db)
+        connection = sqlite3.connect(db)
+        assert connection.execute('SELECT MAX(version) FROM schema_version').fetchone()[0] == get_latest_version()
+        indexes = [row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+        assert 'hikes_user_date_idx' in indexes
+        assert 'follows_followee_idx' in indexes
+        user_id_type = [row[2] for row in connection.execute('PRAGMA table_info(hikes)') if row[1] == 'user_id']
+        assert user_id_type == ['INTEGER']
+        # WAL mode is kept in the database file, so every later connection uses it
+        assert connection.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        connection.close()
+
+    def test_migrate_existing_database(self, tmp_path):
+        '''Existing rows survive the migrations and user ids are converted to integers'''
+        db = str(tmp_path / 'existing.db')
+        # Create a database with only the original (version 0) schema and a hike with a TEXT user id
+        db_connection = create_connection(db)
+        with open(TABLES_FILE, 'r', encoding='utf-8') as tables:
+            db_connection['cursor'].executescript(tables.read())
+        db_connection['cursor'].execute("INSERT INTO hikes (hike_date, user_id, area_name, trails_cs) VALUES ('2025-01-01', '7', 'Neat Place', 'Rad Trail')")
+        commit_close_conn(db_connection['connection'])
+        migrate(db)
+        connection = sqlite3.connect(db)
+        assert connection.execute('SELECT user_id, typeof(user_id), area_name FROM hikes').fetchall() == [(7, 'integer', 'Neat Place')]
+        connection.close()
+
+    def test_hike_trails_backfill(self, tmp_path):
+        '''Trail names are unique per area, and existing hikes are linked to their trails'''
+        db = str(tmp_path / 'trails.db')
+        db_connection = create_connection(db)
+        with open(TABLES_FILE, 'r', encoding='utf-8') as tables:
+            db_connection['cursor'].executescript(tables.read())
+        # 'Rad Trail' was only ever stored for area 1, names were unique across areas
+        db_connection['cursor'].executescript("""
+            INSERT INTO areas (area_name) VALUES ('Neat Place'), ('Other Place');
+            INSERT INTO trails (area_id, trail_name) VALUES (1, 'Rad Trail');
+            INSERT INTO hikes (hike_date, user_id, area_id, area_name, trails_cs) VALUES
+                ('2025-01-01', 1, 1, 'Neat Place', 'Rad Trail, Tubular Trail'),
+                ('2025-01-02', 1, 2, 'Other Place', 'Rad Trail'),
+                ('2025-01-03', 1, 2, 'Other Place', '');""")
+        commit_close_conn(db_connection['connection'])
+        migrate(db)
+        connection = sqlite3.connect(db)
+        assert connection.execute('SELECT id, area_id, trail_name FROM trails ORDER BY id').fetchall() == [
+            (1, 1, 'Rad Trail'), (2, 1, 'Tubular Trail'), (3, 2, 'Rad Trail')]
+        assert connection.execute('SELECT trail_id, hike_date, hike_id FROM hike_trails ORDER BY hike_id, trail_id').fetchall() == [
+            (1, '2025-01-01', 1), (2, '2025-01-01', 1), (3, '2025-01-02', 2)]
+        connection.close()
+
+    def test_user_stats_backfill(self, tmp_path):
+        '''Existing hikes are rolled up into the profile stats tables'''
+        db = str(tmp_path / 'stats.db')
+        db_connection = create_connection(db)
+        with open(TABLES_FILE, 'r', encoding='utf-8') as tables:
+            db_connection['cursor'].executescript(tables.read())
+        db_connection['cursor'].executescript("""
+            INSERT INTO hikes (hike_date, user_id, area_name, distance_km) VALUES
+                ('2025-01-01', 1, 'Neat Place', 4.5),
+                ('2025-01-20', 1, 'Neat Place', 10),
+                ('2025-02-02', 1, 'Other Place', NULL),
+                ('2025-02-03', 2, 'Neat Place', 3);""")
+        commit_close_conn(db_connection['connection'])
+        migrate(db)
+        connection = sqlite3.connect(db)
+        assert connection.execute('SELECT * FROM user_stats ORDER BY user_id').fetchall() == [(1, 3, 14.5, 2, 10.0), (2, 1, 3.0, 1, 3.0)]
+        assert connection.execute('SELECT * FROM user_monthly_stats WHERE user_id = 1').fetchall() == [(1, '2025-01', 2, 14.5), (1, '2025-02', 1, 0.0)]
+        connection.close()
+
+    def test_migrate_is_idempotent(self, tmp_path):
+        '''Running migrations again doesn't reapply anything'''
+        db = str(tmp_path / 'twice.db')
+        migrate(db)
+        db_connection = create_connection(db)
+        # pylint: disable=use-implicit-booleaness-not-comparison
+        assert apply_migrations(db_connection) == []
+        db_connection['connection'].close()
+
+    def test_version_read_again_under_lock(self, tmp_path, monkeypatch):
+        '''A process that read the version before another one migrated skips the applied migrations'''
+        db = str(tmp_path / 'raced.db')
+        migrate(db)
+        # As read by a worker that started at the same time as the one that migrated
+        monkeypatch.setattr(init_sql, 'get_schema_version', lambda db_connection: 0)
+        db_connection = create_connection(db)
+        # pylint: disable=use-implicit-booleaness-not-comparison
+        assert apply_migrations(db_connection) == []
+        db_connection['connection'].close()
+
+    def test_concurrent_migrate(self, tmp_path):
+        '''Workers starting together on a new database all start, and each migration is applied once'''
+        db = str(tmp_path / 'workers.db')
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(migrate, [db] * 4))
+        connection = sqlite3.connect(db)
+        assert [row[0] for row in connection.execute('SELECT version FROM schema_version ORDER BY version')] == list(range(1, get_latest_version() + 1))
+        connection.close()
+
+    def test_split_statements(self):
+        '''Scripts split at each statement's ;, but not at one in a string, comment or trigger body'''
+        script = "CREATE TABLE a (x TEXT); INSERT INTO a VALUES ('1;2');\n-- a; comment\nCREATE TRIGGER t AFTER INSERT ON a BEGIN DELETE FROM a; END;\n"
+        assert [statement.strip() for statement in split_statements(script)] == [
+            'CREATE TABLE a (x TEXT);', "INSERT INTO a VALUES ('1;2');", '-- a; comment\nCREATE TRIGGER t AFTER INSERT ON a BEGIN DELETE FROM a; END;']
+
+    def test_failed_migration_rolls_back(self, tmp_path):
+        '''A failing migration leaves the schema at the last good version'''
+        db = str(tmp_path / 'broken.db')
+        migrations_dir = tmp_path / 'migrations'
+        migrations_dir.mkdir()
+        (migrations_dir / '001_good.sql').write_text('CREATE TABLE good (id INTEGER);', encoding='utf-8')
+        (migrations_dir / '002_bad.sql').write_text('CREATE TABLE bad (id INTEGER); INSERT INTO missing VALUES (1);', encoding='utf-8')
+        db_connection = create_connection(db)
+        try:
+            apply_migrations(db_connection, str(migrations_dir))
+        except sqlite3.Error:
+            pass
+        tables = [row[0] for row in db_connection['cursor'].execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        assert 'good' in tables and 'bad' not in tables
+        assert db_connection['cursor'].execute('SELECT MAX(version) FROM schema_version').fetchone()[0] == 1
+        db_connection['connection'].close()
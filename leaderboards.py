@@ -0,0 +1,280 @@
+'''This module houses the "top hikers this month" leaderboards (/leaderboards for the hikers a
+    user follows, /leaderboards/areas/<area_id> for an area). Ranking by summed km on every view
+    would aggregate a month of hikes per request, so boards are read from ranked snapshot tables
+    (tables/migrations/010_leaderboards.sql) that a background refresher rebuilds every
+    LEADERBOARD_REFRESH_SECONDS. A board is read from its snapshot once, then kept in memory as a
+    TopK, which add_hike / save_new_hike update with the hiker's new monthly total right away.
+    A read is the board's K entries, plus a check that the snapshot hasn't been rebuilt since
+    (ie. by another process). Edits and deletes show up with the next snapshot.
+    Run as a script to rebuild the snapshots once: python leaderboards.py [db file]
+'''
+import bisect
+from datetime import date
+import sqlite3
+import sys
+import threading
+import time
+from connection_pool import scoped_connection
+from constants import DB, LEADERBOARD_REFRESH_SECONDS, LEADERBOARD_SIZE
+from writer import try_write
+
+# Snapshot table and its board column, by kind of board
+BOARD_TABLES = {'following': ('followee_leaderboards', 'follower_id'),
+    'area': ('area_leaderboards', 'area_id')}
+# Boards in memory looked up per query when a hike is added (stays under SQLite's bound
+# parameter limit)
+FOLLOWERS_BATCH_SIZE = 500
+
+
+class TopK:
+    '''The k hikers with the most km on one board, most first (ties go to the lower user id).'''
+
+    def __init__(self, k, month, built_at):
+        self.k = k
+        self.month = month
+        self.built_at = built_at
+        self.updated_at = built_at
+        # (-total_km, user_id, username, hike_count), kept sorted
+        self.entries = []
+
+    def update(self, user_id, username, total_km, hike_count):
+        '''Takes hiker's user id, username, and their new total km and hike count this month.
+            Moves the hiker to their new place, or drops whoever falls below the top k.
+        '''
+        self.entries = [entry for entry in self.entries if entry[1] != user_id]
+        bisect.insort(self.entries, (-total_km, user_id, username, hike_count))
+        del self.entries[self.k:]
+        self.updated_at = int(time.time())
+
+    def hikers(self):
+        '''Returns list of dicts of rank, user id, username, total km and hike count.'''
+        return [{'rank': rank, 'user_id': user_id, 'username': username, 'total_km': -total_km,
+            'hike_count': hike_count} for rank, (total_km, user_id, username, hike_count)
+            in enumerate(self.entries, start=1)]
+
+
+# db file: {(kind, board id): TopK}
+boards = {}
+boards_lock = threading.Lock()
+
+
+def get_month_range(month):
+    '''Takes month string (YYYY-MM). Returns (first day, first day of the next month) strings.'''
+    year, month_number = (int(part) for part in month.split('-'))
+    next_month = f'{year + month_number // 12:04d}-{month_number % 12 + 1:02d}'
+    return f'{month}-01', f'{next_month}-01'
+
+
+def get_snapshot_info(cursor):
+    '''Takes cursor. Returns (month, built_at) of the current snapshot, (None, None) if none.'''
+    cursor.execute("SELECT key, value FROM settings WHERE key IN "
+        "('leaderboards_month', 'leaderboards_built_at')")
+    info = dict(cursor.fetchall())
+    built_at = info.get('leaderboards_built_at')
+    return info.get('leaderboards_month'), int(built_at) if built_at else None
+
+
+def load_board(cursor, kind, board_id, month, built_at):
+    '''Takes cursor, kind of board, board id (follower or area id), snapshot month and build
+        time. Returns TopK holding the board's snapshot.
+    '''
+    table, column = BOARD_TABLES[kind]
+    board = TopK(LEADERBOARD_SIZE, month, built_at)
+    cursor.execute(
+        f'SELECT {table}.user_id, users.username, {table}.total_km, {table}.hike_count '
+        f'FROM {table} JOIN users ON users.id = {table}.user_id WHERE {table}.{column} = ? '
+        f'ORDER BY {table}.rank', (board_id,))
+    board.entries = [(-total_km, user_id, username, hike_count)
+        for user_id, username, total_km, hike_count in cursor.fetchall()]
+    return board
+
+
+def get_leaderboard(db, kind, board_id):
+    '''Takes db file, kind of board ('following' or 'area') and board id (follower or area id).
+        Returns dict of the board's month, snapshot build time, last update (unix times, None if
+        never built) and list of top hikers (see TopK.hikers).
+    '''
+    with scoped_connection(db) as db_connection:
+        try:
+            month, built_at = get_snapshot_info(db_connection['cursor'])
+            with boards_lock:
+                board = boards.get(db, {}).get((kind, board_id))
+            if board is None or board.built_at != built_at:
+                board = load_board(db_connection['cursor'], kind, board_id, month, built_at)
+                with boards_lock:
+                    boards.setdefault(db, {})[(kind, board_id)] = board
+        except sqlite3.Error as error:
+            print(error)
+            return {'month': None, 'built_at': None, 'updated_at': None, 'hikers': []}
+        with boards_lock:
+            return {'month': board.month, 'built_at': board.built_at,
+                'updated_at': board.updated_at, 'hikers': board.hikers()}
+
+
+def get_follower_boards(cursor, user_id, loaded):
+    '''Takes cursor, user id and dict of boards in memory ({(kind, board id): TopK}).
+        Returns list of the boards in memory of users following the user.
+    '''
+    # Only the followers with boards in memory, a popular hiker may have thousands
+    follower_ids = [board_id for kind, board_id in loaded if kind == 'following']
+    follower_boards = []
+    for index in range(0, len(follower_ids), FOLLOWERS_BATCH_SIZE):
+        batch = follower_ids[index:index + FOLLOWERS_BATCH_SIZE]
+        cursor.execute(
+            'SELECT follower_id FROM follows WHERE followee_id = ? AND follower_id IN '
+            f'({", ".join("?" * len(batch))})', [user_id] + batch)
+        follower_boards += [loaded[('following', follower_id)]
+            for follower_id, in cursor.fetchall()]
+    return follower_boards
+
+
+def record_hike(db, user_id, area_id, hike_date):
+    '''Takes db file, and user id, area id and date of a newly added hike.
+        Updates the hiker's place on the boards held in memory that the hike counts towards:
+        their area's, and those of the users following them. Boards not in memory are read
+        from the next snapshot.
+    '''
+    month = str(hike_date)[:7]
+    with boards_lock:
+        loaded = {key: board for key, board in boards.get(db, {}).items() if board.month == month}
+    if not loaded:
+        return
+    with scoped_connection(db) as db_connection:
+        try:
+            db_connection['cursor'].execute('SELECT username FROM users WHERE id = ?', (user_id,))
+            username = db_connection['cursor'].fetchone()[0]
+            updates = []
+            if ('area', area_id) in loaded:
+                db_connection['cursor'].execute(
+                    'SELECT total(distance_km), count(*) FROM hikes WHERE user_id = ? AND '
+                    'hike_date >= ? AND hike_date < ? AND area_id = ?',
+                    (user_id, *get_month_range(month), area_id))
+                updates.append((loaded[('area', area_id)], db_connection['cursor'].fetchone()))
+            follower_boards = get_follower_boards(db_connection['cursor'], user_id, loaded)
+            if follower_boards:
+                db_connection['cursor'].execute(
+                    'SELECT total_km, hike_count FROM user_monthly_stats '
+                    'WHERE user_id = ? AND month = ?', (user_id, month))
+                month_totals = db_connection['cursor'].fetchone()
+                updates += [(board, month_totals) for board in follower_boards if month_totals]
+        except sqlite3.Error as error:
+            print(error)
+            return
+    with boards_lock:
+        for board, (total_km, hike_count) in updates:
+            board.update(user_id, username, total_km, hike_count)
+
+
+def rebuild_leaderboards(db, month=None):
+    '''Takes db file and optional month (YYYY-MM, defaults to this month).
+        Replaces every board's snapshot with the month's top LEADERBOARD_SIZE hikers, in one
+        transaction. Returns 0 on success, or the error.
+    '''
+    month = month or date.today().strftime('%Y-%m')
+    start, end = get_month_range(month)
+
+    def write(cursor):
+        cursor.execute('DELETE FROM followee_leaderboards')
+        # Followees' totals come from the user_monthly_stats rollup (see user_stats.py)
+        cursor.execute(
+            'INSERT INTO followee_leaderboards '
+            '(follower_id, rank, user_id, total_km, hike_count) '
+            'SELECT follower_id, rank, user_id, total_km, hike_count FROM ('
+            'SELECT follows.follower_id, user_monthly_stats.user_id, '
+            'user_monthly_stats.total_km, user_monthly_stats.hike_count, row_number() OVER ('
+            'PARTITION BY follows.follower_id '
+            'ORDER BY user_monthly_stats.total_km DESC, user_monthly_stats.user_id) AS rank '
+            'FROM user_monthly_stats '
+            'JOIN follows ON follows.followee_id = user_monthly_stats.user_id '
+            'WHERE user_monthly_stats.month = ?) WHERE rank <= ?', (month, LEADERBOARD_SIZE))
+        cursor.execute('DELETE FROM area_leaderboards')
+        cursor.execute(
+            'INSERT INTO area_leaderboards (area_id, rank, user_id, total_km, hike_count) '
+            'SELECT area_id, rank, user_id, total_km, hike_count FROM ('
+            'SELECT area_id, user_id, total(distance_km) AS total_km, count(*) AS hike_count, '
+            'row_number() OVER (PARTITION BY area_id '
+            'ORDER BY total(distance_km) DESC, user_id) AS rank '
+            'FROM hikes WHERE hike_date >= ? AND hike_date < ? AND area_id IS NOT NULL '
+            'GROUP BY area_id, user_id) WHERE rank <= ?', (start, end, LEADERBOARD_SIZE))
+        cursor.executemany(
+            'INSERT INTO settings (key, value) VALUES (?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET value = excluded.value',
+            [('leaderboards_month', month), ('leaderboards_built_at', int(time.time()))])
+
+    error = try_write(db, write)
+    if error:
+        return error
+    # Boards in memory are from the old snapshot
+    with boards_lock:
+        boards.pop(db, None)
+    return 0
+
+
+def refresh_leaderboards(db, interval=LEADERBOARD_REFRESH_SECONDS):
+    '''Takes db file and refresh interval (seconds).
+        Rebuilds the snapshots if they're older than the interval or from another month (so
+        several processes sharing the database don't all rebuild them). Returns True if rebuilt.
+    '''
+    with scoped_connection(db) as db_connection:
+        month, built_at = get_snapshot_info(db_connection['cursor'])
+    if month == date.today().strftime('%Y-%m') and built_at and time.time() - built_at < interval:
+        return False
+    return rebuild_leaderboards(db) == 0
+
+
+class LeaderboardRefresher:
+    '''Background thread rebuilding stale leaderboard snapshots every interval (seconds).'''
+
+    def __init__(self, db, interval=LEADERBOARD_REFRESH_SECONDS):
+        self.db = db
+        self.interval = interval
+        self._thread = None
+        self._stop = threading.Event()
+
+    def run(self):
+        '''Refresher loop: refreshes now, then once every interval until it is stopped.'''
+        while True:
+            try:
+                refresh_leaderboards(self.db, self.interval)
+            except sqlite3.Error as error:
+                # ie. database locked, the next refresh catches up
+                print(error)
+            if self._stop.wait(self.interval):
+                return
+
+    def start(self):
+        '''Starts the refresher (a daemon thread, so it doesn't block interpreter exit).'''
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self.run, name='leaderboard-refresher', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        '''Stops and joins the refresher thread.'''
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+
+def format_age(timestamp):
+    '''Takes unix time. Returns how long ago it was (ie. '5 minutes ago').
+        Available in templates as the age filter.
+    '''
+    seconds = max(0, int(time.time() - timestamp))
+    for unit, unit_seconds in [('day', 86400), ('hour', 3600), ('minute', 60)]:
+        if seconds >= unit_seconds:
+            count = seconds // unit_seconds
+            return f'{count} {unit}{"s" if count > 1 else ""} ago'
+    return 'just now'
+
+
+def init_app(app):
+    '''Takes Flask app. Registers the age template filter.'''
+    app.jinja_env.filters['age'] = format_age
+
+
+if __name__ == '__main__':
+    sys.exit(1 if rebuild_leaderboards(sys.argv[1] if len(sys.argv) > 1 else DB) else 0)
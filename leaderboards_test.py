@@ -0,0 +1,131 @@
+'''Unit tests for the top hikers leaderboards'''
+from datetime import date
+import time
+import pytest
+import leaderboards
+from leaderboards import (LeaderboardRefresher, TopK, format_age, get_leaderboard, get_month_range,
+    rebuild_leaderboards, refresh_leaderboards)
+from testing import HIKE
+from utils import add_user, follow, get_area_id, save_new_hike
+# pylint: disable=line-too-long
+
+MONTH = date.today().strftime('%Y-%m')
+# Counted towards this month's boards
+MONTH_HIKE = dict(HIKE, hike_date=f'{MONTH}-01', distance_km='4')
+
+
+@pytest.fixture(name='db')
+def fixture_db(db):
+    '''Returns db file where suze (1) follows frank (2) and bo (3), who hike this month (and frank last year too).'''
+    add_user(db, 'bo', 'x')
+    follow(db, 'suze', 'frank', 'follow')
+    follow(db, 'suze', 'bo', 'follow')
+    save_new_hike(db, 2, MONTH_HIKE)
+    save_new_hike(db, 2, dict(MONTH_HIKE, distance_km='3'))
+    save_new_hike(db, 2, dict(MONTH_HIKE, hike_date='2020-01-01', distance_km='50'))
+    save_new_hike(db, 3, dict(MONTH_HIKE, area_name='Other Place', distance_km='5'))
+    yield db
+    leaderboards.boards.pop(db, None)
+
+
+def get_ranking(board):
+    '''Takes leaderboard dict. Returns list of (username, total km, hike count) in rank order.'''
+    return [(hiker['username'], hiker['total_km'], hiker['hike_count']) for hiker in board['hikers']]
+
+
+class TestTopK:
+    '''Tests the in-memory top k'''
+
+    def test_update(self):
+        '''Hikers are ranked by km (ties to the lower id), move when their total changes and drop out below k'''
+        board = TopK(2, MONTH, 1)
+        board.update(3, 'bo', 5.0, 1)
+        board.update(2, 'frank', 5.0, 1)
+        assert [hiker['user_id'] for hiker in board.hikers()] == [2, 3]
+        board.update(1, 'suze', 6.0, 2)
+        assert [(hiker['rank'], hiker['username']) for hiker in board.hikers()] == [(1, 'suze'), (2, 'frank')]
+        board.update(3, 'bo', 9.0, 2)
+        assert [hiker['username'] for hiker in board.hikers()] == ['bo', 'suze']
+        assert board.updated_at > board.built_at
+
+    def test_month_range(self):
+        '''A month runs to the first of the next, December to the next year'''
+        assert get_month_range('2025-03') == ('2025-03-01', '2025-04-01')
+        assert get_month_range('2025-12') == ('2025-12-01', '2026-01-01')
+
+    def test_format_age(self):
+        '''Ages are given in the largest whole unit'''
+        now = time.time()
+        assert format_age(now) == 'just now'
+        assert format_age(now - 60) == '1 minute ago'
+        assert format_age(now - 7300) == '2 hours ago'
+        assert format_age(now - 3 * 86400) == '3 days ago'
+
+
+class TestLeaderboards:
+    '''Tests the snapshots and their incremental updates'''
+
+    def test_not_built(self, db):
+        '''Boards are empty until the snapshots are first built'''
+        assert get_leaderboard(db, 'following', 1) == {'month': None, 'built_at': None, 'updated_at': None, 'hikers': []}
+
+    def test_rebuild(self, db):
+        '''Snapshots rank this month's km among a user's followees and in each area'''
+        assert rebuild_leaderboards(db) == 0
+        board = get_leaderboard(db, 'following', 1)
+        assert board['month'] == MONTH and board['built_at'] == board['updated_at']
+        assert get_ranking(board) == [('frank', 7.0, 2), ('bo', 5.0, 1)]
+        assert not get_leaderboard(db, 'following', 2)['hikers']
+        assert get_ranking(get_leaderboard(db, 'area', get_area_id('Neat Place', db))) == [('frank', 7.0, 2)]
+        assert get_ranking(get_leaderboard(db, 'area', get_area_id('Other Place', db))) == [('bo', 5.0, 1)]
+
+    def test_new_hike(self, db):
+        '''A new hike moves the hiker up the boards in memory it counts towards'''
+        rebuild_leaderboards(db)
+        neat_place = get_area_id('Neat Place', db)
+        get_leaderboard(db, 'following', 1)
+        get_leaderboard(db, 'area', neat_place)
+        save_new_hike(db, 3, dict(MONTH_HIKE, distance_km='2.5'))
+        save_new_hike(db, 1, dict(MONTH_HIKE, hike_date='2020-01-02', distance_km='90'))
+        board = get_leaderboard(db, 'following', 1)
+        assert get_ranking(board) == [('bo', 7.5, 2), ('frank', 7.0, 2)]
+        assert board['updated_at'] >= board['built_at']
+        assert get_ranking(get_leaderboard(db, 'area', neat_place)) == [('frank', 7.0, 2), ('bo', 2.5, 1)]
+
+    def test_refresh(self, db):
+        '''Snapshots are only rebuilt once they're older than the interval, and a rebuild replaces boards in memory'''
+        assert refresh_leaderboards(db, 60)
+        assert not refresh_leaderboards(db, 60)
+        get_leaderboard(db, 'following', 1)
+        save_new_hike(db, 3, dict(MONTH_HIKE, distance_km='10'))
+        assert refresh_leaderboards(db, 0)
+        assert get_ranking(get_leaderboard(db, 'following', 1))[0] == ('bo', 15.0, 2)
+
+    def test_refresher(self, db):
+        '''The refresher builds the snapshots when started'''
+        LeaderboardRefresher(db, 60).start().stop()
+        assert get_leaderboard(db, 'following', 1)['built_at']
+
+
+class TestLeaderboardRoutes:
+    '''Tests the leaderboard pages'''
+
+    def test_followee_leaderboard(self, db, app_module):
+        '''The page ranks followees and shows how old the ranking is, and needs a login'''
+        client = app_module.app.test_client()
+        assert client.get('/leaderboards').status_code == 302
+        with client.session_transaction() as session:
+            session['username'], session['user_id'] = 'suze', 1
+        assert 'Not ranked yet' in client.get('/leaderboards').data.decode()
+        rebuild_leaderboards(db)
+        page = client.get('/leaderboards').data.decode()
+        assert 'Ranked just now' in page
+        assert page.index('>frank</a>: 7.0 km (2 hikes)') < page.index('>bo</a>: 5.0 km (1 hike)')
+
+    def test_area_leaderboard(self, db, app_module):
+        '''The page ranks the area's hikers, and unknown areas are not found'''
+        client = app_module.app.test_client()
+        rebuild_leaderboards(db)
+        page = client.get(f'/leaderboards/areas/{get_area_id("Other Place", db)}').data.decode()
+        assert 'OTHER PLACE' in page and '>bo</a>: 5.0 km (1 hike)' in page
+        assert b'Area not found' in client.get('/leaderboards/areas/999').data
@@ -0,0 +1,237 @@
+'''This module houses per-request SQL instrumentation and the /metrics exposition.
+    Connections are opened with InstrumentedConnection, whose cursors time every statement
+    and count the rows fetched. While a request is handled the totals are kept in flask.g,
+    and once it finishes they are observed into histograms labelled by Flask endpoint,
+    and added to the response as a Server-Timing header. Slow statements also go to the
+    slow-query log (see slow_query_log.py).
+    Metrics are kept per process (each worker process reports its own).
+'''
+import sqlite3
+import threading
+import time
+from flask import g, has_app_context, request
+from slow_query_log import slow_log
+
+PREFIX = 'hikes_'
+REQUEST_TOTALS = ['queries', 'sql_seconds', 'rows', 'connections', 'connections_opened', 'commits']
+DURATION_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5]
+COUNT_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100, 250]
+ROW_BUCKETS = [0, 1, 10, 50, 100, 500, 1000, 5000, 10000]
+
+
+# ==== SQL INSTRUMENTATION ====
+
+def record(total, value=1):
+    '''Takes name of a per-request total and value. Adds value to the current request's
+        totals, does nothing outside of a request (ie. scripts and background workers).
+    '''
+    if has_app_context():
+        totals = g.get('sql_metrics')
+        if totals is not None:
+            totals[total] += value
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    '''sqlite3 cursor that records statement count, time and fetched rows.'''
+
+    def _timed(self, method, *args):
+        '''Takes sqlite3.Cursor method and its args. Returns method result, timed.
+            Slow statements are passed on to the slow-query log.
+        '''
+        start = time.perf_counter()
+        try:
+            return method(self, *args)
+        finally:
+            seconds = time.perf_counter() - start
+            record('queries')
+            record('sql_seconds', seconds)
+            if seconds >= slow_log.threshold_seconds:
+                slow_log.observe(self.connection, method.__name__, args, seconds)
+
+    def execute(self, *args):
+        '''Same as sqlite3.Cursor.execute, timed.'''
+        return self._timed(sqlite3.Cursor.execute, *args)
+
+    def executemany(self, *args):
+        '''Same as sqlite3.Cursor.executemany, timed.'''
+        return self._timed(sqlite3.Cursor.executemany, *args)
+
+    def executescript(self, *args):
+        '''Same as sqlite3.Cursor.executescript, timed.'''
+        return self._timed(sqlite3.Cursor.executescript, *args)
+
+    def fetchone(self):
+        '''Same as sqlite3.Cursor.fetchone, counting the row.'''
+        row = super().fetchone()
+        if row is not None:
+            record('rows')
+        return row
+
+    def fetchmany(self, *args):
+        '''Same as sqlite3.Cursor.fetchmany, counting the rows.'''
+        rows = super().fetchmany(*args)
+        record('rows', len(rows))
+        return rows
+
+    def fetchall(self):
+        '''Same as sqlite3.Cursor.fetchall, counting the rows.'''
+        rows = super().fetchall()
+        record('rows', len(rows))
+        return rows
+
+    def __next__(self):
+        row = super().__next__()
+        record('rows')
+        return row
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    '''sqlite3 connection whose cursors are instrumented, and which counts commits.'''
+
+    def cursor(self, factory=None):
+        '''Returns new cursor, instrumented unless another factory is given.'''
+        return super().cursor(factory or InstrumentedCursor)
+
+    def execute(self, *args):
+        '''Same as sqlite3.Connection.execute, with an instrumented cursor.'''
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        '''Same as sqlite3.Connection.executemany, with an instrumented cursor.'''
+        return self.cursor().executemany(*args)
+
+    def executescript(self, *args):
+        '''Same as sqlite3.Connection.executescript, with an instrumented cursor.'''
+        return self.cursor().executescript(*args)
+
+    def commit(self):
+        '''Same as sqlite3.Connection.commit, counted.'''
+        record('commits')
+        super().commit()
+
+
+# ==== HISTOGRAMS ====
+
+class Histogram:
+    '''Cumulative histogram (prometheus style), one series per label value.'''
+
+    def __init__(self, name, description, buckets, label='endpoint'):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.label = label
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        '''Takes label value (ie. endpoint name) and observed value.'''
+        with self._lock:
+            series = self.series.setdefault(
+                label_value, {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def clear(self):
+        '''Removes every series.'''
+        with self._lock:
+            self.series = {}
+
+    def render(self):
+        '''Returns list of lines in text exposition format.'''
+        name = PREFIX + self.name
+        lines = [f'# HELP {name} {self.description}', f'# TYPE {name} histogram']
+        with self._lock:
+            for label_value, series in sorted(self.series.items()):
+                label = f'{self.label}="{escape_label(label_value)}"'
+                for bound, count in zip(self.buckets, series['buckets']):
+                    lines.append(f'{name}_bucket{{{label},le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{{label},le="+Inf"}} {series["count"]}')
+                lines.append(f'{name}_sum{{{label}}} {series["sum"]}')
+                lines.append(f'{name}_count{{{label}}} {series["count"]}')
+        return lines
+
+
+def escape_label(value):
+    '''Takes label value. Returns value escaped for text exposition format.'''
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_gauges(name, description, values, label):
+    '''Takes metric name, description, dict of label value: number and label name.
+        Returns list of lines for a gauge in text exposition format.
+    '''
+    name = PREFIX + name
+    lines = [f'# HELP {name} {description}', f'# TYPE {name} gauge']
+    for label_value, value in sorted(values.items()):
+        lines.append(f'{name}{{{label}="{escape_label(label_value)}"}} {value}')
+    return lines
+
+
+histograms = {
+    'request_seconds': Histogram(
+        'request_duration_seconds', 'Time to handle a request.', DURATION_BUCKETS),
+    'sql_seconds': Histogram(
+        'sql_duration_seconds', 'Time spent executing SQL per request.', DURATION_BUCKETS),
+    'queries': Histogram('sql_queries', 'SQL statements executed per request.', COUNT_BUCKETS),
+    'rows': Histogram('sql_rows_fetched', 'Rows fetched per request.', ROW_BUCKETS),
+    'connections': Histogram(
+        'sql_connections', 'Database connections used per request.', COUNT_BUCKETS),
+    'connections_opened': Histogram(
+        'sql_connections_opened', 'New database connections opened per request.', COUNT_BUCKETS),
+    'commits': Histogram('sql_commits', 'Transactions committed per request.', COUNT_BUCKETS),
+}
+
+
+def render(extra_lines=()):
+    '''Takes optional list of extra exposition lines (ie. gauges).
+        Returns every histogram in text exposition format.
+    '''
+    lines = []
+    for histogram in histograms.values():
+        lines.extend(histogram.render())
+    lines.extend(extra_lines)
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    '''Clears every histogram (ie. between tests).'''
+    for histogram in histograms.values():
+        histogram.clear()
+
+
+# ==== REQUEST HOOKS ====
+
+def start_request():
+    '''Starts per-request totals. Registered as a before_request handler.'''
+    g.request_start = time.perf_counter()
+    g.sql_metrics = dict.fromkeys(REQUEST_TOTALS, 0)
+
+
+def finish_request(response):
+    '''Takes response. Observes the request's totals and adds a Server-Timing header.
+        Registered as an after_request handler.
+    '''
+    totals = g.pop('sql_metrics', None)
+    if totals is None:
+        return response
+    duration = time.perf_counter() - g.pop('request_start')
+    endpoint = request.endpoint or 'not_found'
+    histograms['request_seconds'].observe(endpoint, duration)
+    for total in REQUEST_TOTALS:
+        histograms[total].observe(endpoint, totals[total])
+    response.headers.add(
+        'Server-Timing',
+        f'sql;dur={totals["sql_seconds"] * 1000:.2f};desc="{totals["queries"]} queries", '
+        f'rows;desc="{totals["rows"]} rows", '
+        f'db;desc="{totals["connections"]} connections, {totals["connections_opened"]} opened", '
+        f'app;dur={duration * 1000:.2f}')
+    return response
+
+
+def init_app(app):
+    '''Takes Flask app. Registers handlers that record per-request SQL totals.'''
+    app.before_request(start_request)
+    app.after_request(finish_request)
@@ -0,0 +1,75 @@
+'''Unit tests for per-request SQL instrumentation and the metrics exposition'''
+from flask import Flask
+import connection_pool
+import metrics
+from init_sql import migrate
+from utils import add_user, get_all_usernames, get_user_by_username
+# pylint: disable=line-too-long
+
+
+def create_test_app(db):
+    '''Takes db file. Returns Flask app with instrumentation and routes that run utils queries.'''
+    app = Flask(__name__)
+    connection_pool.init_app(app)
+    metrics.init_app(app)
+
+    @app.route('/usernames')
+    def usernames():
+        return {'usernames': [row[0] for row in get_all_usernames(db)]}
+
+    @app.route('/add/<username>')
+    def add(username):
+        return {'result': add_user(db, username, 'hash')}
+
+    return app
+
+
+class TestMetrics:
+    '''Tests per-request totals, Server-Timing headers and histogram rendering'''
+
+    def setup_method(self):
+        '''Starts every test with empty histograms'''
+        metrics.reset()
+        connection_pool.pool.clear()
+
+    def test_request_totals(self, tmp_path):
+        '''Queries, rows, connections and commits are counted per request and endpoint'''
+        db = str(tmp_path / 'metrics.db')
+        migrate(db)
+        client = create_test_app(db).test_client()
+        assert client.get('/usernames').json == {'usernames': []}
+        assert client.get('/add/suze').status_code == 200
+        response = client.get('/usernames')
+        assert response.json == {'usernames': ['suze']}
+        server_timing = response.headers['Server-Timing']
+        assert 'sql;dur=' in server_timing and 'desc="1 queries"' in server_timing
+        assert 'desc="1 rows"' in server_timing
+        # The first request opened the connection, the last reused it from the pool (the write
+        # went through the writer's connection)
+        assert 'desc="1 connections, 0 opened"' in server_timing
+        assert metrics.histograms['commits'].series['add']['sum'] == 1
+        assert metrics.histograms['queries'].series['usernames']['count'] == 2
+
+    def test_queries_outside_requests_are_not_recorded(self, tmp_path):
+        '''Scripts and tests (no request) run queries without recording anything'''
+        db = str(tmp_path / 'metrics.db')
+        migrate(db)
+        add_user(db, 'frank', 'hash')
+        assert get_user_by_username(db, 'frank')['username'] == 'frank'
+        assert not metrics.histograms['queries'].series
+
+    def test_render(self):
+        '''Histograms render cumulative buckets, sum and count in text exposition format'''
+        histogram = metrics.Histogram('test_rows', 'Rows per request.', [1, 10])
+        histogram.observe('feed', 5)
+        histogram.observe('feed', 50)
+        assert histogram.render() == [
+            '# HELP hikes_test_rows Rows per request.',
+            '# TYPE hikes_test_rows histogram',
+            'hikes_test_rows_bucket{endpoint="feed",le="1"} 0',
+            'hikes_test_rows_bucket{endpoint="feed",le="10"} 1',
+            'hikes_test_rows_bucket{endpoint="feed",le="+Inf"} 2',
+            'hikes_test_rows_sum{endpoint="feed"} 55.0',
+            'hikes_test_rows_count{endpoint="feed"} 2',
+        ]
+        assert metrics.render_gauges('pool', 'Pool stats.', {'idle': 2}, 'stat')[-1] == 'hikes_pool{stat="idle"} 2'
@@ -0,0 +1,437 @@
+'''Query plan regression tests.
+    Runs every function that issues SQL (utils.py, writer, uploads, username index, leaderboards
+    and session store) against a seeded database, records each distinct statement they issue
+    with its EXPLAIN QUERY PLAN, and compares it with the plan registered in PLANS below.
+    A new or changed statement fails test_every_statement_is_registered until its expected
+    plan is added to PLANS.
+'''
+import re
+import sqlite3
+import pytest
+import api
+import leaderboards
+import metrics
+import search
+import user_stats
+from benchmarks.datagen import generate
+from sessions import SqliteSessionStore
+from slow_query_log import explain, get_caller
+from uploads import claim_upload, complete_upload, retry_upload
+from utils import (add_area, add_hike, add_trail, add_user, delete_hike, encode_cursor, follow,
+    get_all_usernames, get_area_id, get_area_name, get_feed_activity, get_feed_page, get_followees,
+    get_hike_img_src, get_hikes, get_hikes_page, get_similar_usernames, get_trail,
+    get_trail_hikes_page, get_trail_id, get_user_activity,
+    get_user_by_username, get_user_cards, get_username_from_user_id, invalidate_caches,
+    save_hike_changes, save_new_hike, sync_feed_mode, update_hike)
+# pylint: disable=line-too-long
+
+HIKE = {'hike_date': '2025-01-01', 'area_name': 'Plan Area', 'trailhead': 'Start', 'trails_cs': 'Plan Loop', 'distance_km': 3.3, 'image_url': ''}
+
+# Expected EXPLAIN QUERY PLAN steps (nested steps indented) for every statement the app issues.
+# Bound parameter lists are written '?, ...' since their length varies (ie. IN lists).
+PLANS = {
+    # ==== USERS ====
+    'INSERT INTO users (username, password_hash) VALUES (?, ...)': [],
+    'SELECT * FROM users WHERE username = ?': [
+        'SEARCH users USING INDEX sqlite_autoindex_users_1 (username=?)'],
+    'SELECT id, username from users WHERE id = (?)': [
+        'SEARCH users USING INTEGER PRIMARY KEY (rowid=?)'],
+    'SELECT username FROM users': [
+        'SCAN users USING COVERING INDEX sqlite_autoindex_users_1'],
+    'SELECT id, username FROM users WHERE id IN (?, ...) ORDER BY id': [
+        'SEARCH users USING INTEGER PRIMARY KEY (rowid=?)'],
+    'SELECT id, username FROM users WHERE id > ? ORDER BY id': [
+        'SEARCH users USING INTEGER PRIMARY KEY (rowid>?)'],
+    'SELECT users.id, users.username, (SELECT image_url FROM hikes WHERE hikes.user_id = users.id ORDER BY hike_date DESC, id DESC LIMIT 1) FROM users WHERE users.username IN (?, ...)': [
+        'SEARCH users USING COVERING INDEX sqlite_autoindex_users_1 (username=?)',
+        'CORRELATED SCALAR SUBQUERY 1',
+        '  SEARCH hikes USING INDEX hikes_user_date_idx (user_id=?)'],
+    # ==== AREAS AND TRAILS ====
+    'INSERT OR IGNORE INTO areas (area_name) VALUES (?)': [],
+    'SELECT id FROM areas WHERE area_name = (?)': [
+        'SEARCH areas USING COVERING INDEX sqlite_autoindex_areas_1 (area_name=?)'],
+    'SELECT area_name FROM areas WHERE id = ?': [
+        'SEARCH areas USING INTEGER PRIMARY KEY (rowid=?)'],
+    'INSERT INTO areas (area_name) VALUES (?) ON CONFLICT (area_name) DO UPDATE SET area_name = excluded.area_name RETURNING id': [],
+    'INSERT OR IGNORE INTO trails (area_id, trail_name) VALUES (?, ...)': [],
+    'SELECT id FROM trails WHERE area_id = ? AND trail_name = ?': [
+        'SEARCH trails USING COVERING INDEX sqlite_autoindex_trails_1 (area_id=? AND trail_name=?)'],
+    'SELECT trails.id, trails.trail_name, trails.area_id, areas.area_name FROM trails LEFT JOIN areas ON areas.id = trails.area_id WHERE trails.id = ?': [
+        'SEARCH trails USING INTEGER PRIMARY KEY (rowid=?)',
+        'SEARCH areas USING INTEGER PRIMARY KEY (rowid=?) LEFT-JOIN'],
+    # ==== HIKE TRAILS ====
+    'INSERT OR IGNORE INTO hike_trails (trail_id, hike_date, hike_id) SELECT id, ?, ... FROM trails WHERE area_id = ? AND trail_name = ?': [
+        'SEARCH trails USING COVERING INDEX sqlite_autoindex_trails_1 (area_id=? AND trail_name=?)'],
+    'DELETE FROM hike_trails WHERE hike_id = ?': [
+        'SEARCH hike_trails USING COVERING INDEX hike_trails_hike_idx (hike_id=?)'],
+    'DELETE FROM hike_trails WHERE hike_id = (?)': [
+        'SEARCH hike_trails USING COVERING INDEX hike_trails_hike_idx (hike_id=?)'],
+    'SELECT hikes.*, users.username FROM hike_trails JOIN hikes ON hikes.id = hike_trails.hike_id JOIN users ON users.id = hikes.user_id WHERE hike_trails.trail_id = ? ORDER BY hike_trails.hike_date DESC, hike_trails.hike_id DESC LIMIT ?': [
+        'SEARCH hike_trails USING PRIMARY KEY (trail_id=?)',
+        'SEARCH hikes USING INTEGER PRIMARY KEY (rowid=?)',
+        'SEARCH users USING INTEGER PRIMARY KEY (rowid=?)'],
+    'SELECT hikes.*, users.username FROM hike_trails JOIN hikes ON hikes.id = hike_trails.hike_id JOIN users ON users.id = hikes.user_id WHERE hike_trails.trail_id = ? AND (hike_trails.hike_date, hike_trails.hike_id) < (?, ...) ORDER BY hike_trails.hike_date DESC, hike_trails.hike_id DESC LIMIT ?': [
+        'SEARCH hike_trails USING PRIMARY KEY (trail_id=? AND (hike_date,hike_id)<(?,?))',
+        'SEARCH hikes USING INTEGER PRIMARY KEY (rowid=?)',
+        'SEARCH users USING INTEGER PRIMARY KEY (rowid=?)'],
+    # ==== HIKES ====
+    'INSERT INTO hikes (hike_date, area_name, trailhead, trails_cs, distance_km, image_url, user_id, area_id, version) VALUES (?, ...)': [],
+    'SELECT * FROM hikes WHERE user_id = ? ORDER BY hike_date DESC, id DESC LIMIT ?': [
+        'SEARCH hikes USING INDEX hikes_user_date_idx (user_id=?)'],
+    'SELECT * FROM hikes WHERE user_id = ? AND (hike_date, id) < (?, ...) ORDER BY hike_date DESC, id DESC LIMIT ?': [
+        'SEARCH hikes USING INDEX hikes_user_date_idx (user_id=? AND hike_date<?)'],
+    'SELECT * FROM hikes WHERE user_id = ? ORDER BY hike_date DESC, id DESC LIMIT 1': [
+        'SEARCH hikes USING INDEX hikes_user_date_idx (user_id=?)'],
+    'SELECT * FROM hikes WHERE id = ? AND user_id = ?': [
+        'SEARCH hikes USING INTEGER PRIMARY KEY (rowid=?)'],
+    'UPDATE hikes SET hike_date = (?), area_name = (?), trailhead = (?), trails_cs = (?), distance_km = (?), image_url = (?), other_info = (?), area_id = (?), version = (?) WHERE id = (?) RETURNING hike_date, area_id, trails_cs': [
+        'SEARCH hikes USING INTEGER PRIMARY KEY (rowid=?)'],
+    'UPDATE hikes SET hike_date = (?), other_info = (?), version = (?) WHERE id = (?) RETURNING hike_date, area_id, trails_cs': [
+        'SEARCH hikes USING INTEGER PRIMARY KEY (rowid=?)'],
+    'DELETE FROM hikes WHERE id = (?) AND user_id = (?)': [
+        'SEARCH hikes USING INTEGER PRIMARY KEY (rowid=?)'],
+    # ==== FOLLOWS ====
+    'INSERT OR IGNORE INTO follows (follower_id, followee_id) VALUES (?, ...)': [],
+    'DELETE FROM follows WHERE follower_id = (?) AND followee_id = (?)': [
+        'SEARCH follows USING INDEX sqlite_autoindex_follows_1 (follower_id=? AND followee_id=?)'],
+    'SELECT followee_id FROM follows WHERE follower_id = (?)': [
+        'SEARCH follows USING COVERING INDEX sqlite_autoindex_follows_1 (follower_id=?)'],
+    # ==== FEED ====
+    # Read mode merges every followee's hikes, so it sorts them (the write mode timeline doesn't)
+    'SELECT hikes.*, users.username FROM users AS followers JOIN follows ON follows.follower_id = followers.id JOIN hikes ON hikes.user_id = follows.followee_id JOIN users ON users.id = hikes.user_id WHERE followers.username = ? ORDER BY hikes.hike_date DESC, hikes.id DESC LIMIT ?': [
+        'SEARCH followers USING COVERING INDEX sqlite_autoindex_users_1 (username=?)',
+        'SEARCH follows USING COVERING INDEX sqlite_autoindex_follows_1 (follower_id=?)',
+        'SEARCH users USING INTEGER PRIMARY KEY (rowid=?)',
+        'SEARCH hikes USING INDEX hikes_user_date_idx (user_id=?)',
+        'USE TEMP B-TREE FOR ORDER BY'],
+    'SELECT hikes.*, users.username FROM users AS followers JOIN follows ON follows.follower_id = followers.id JOIN hikes ON hikes.user_id = follows.followee_id JOIN users ON users.id = hikes.user_id WHERE followers.username = ? AND (hikes.hike_date, hikes.id) < (?, ...) ORDER BY hikes.hike_date DESC, hikes.id DESC LIMIT ?': [
+        'SEARCH followers USING COVERING INDEX sqlite_autoindex_users_1 (username=?)',
+        'SEARCH follows USING COVERING INDEX sqlite_autoindex_follows_1 (follower_id=?)',
+        'SEARCH users USING INTEGER PRIMARY KEY (rowid=?)',
+        'SEARCH hikes USING INDEX hikes_user_date_idx (user_id=? AND hike_date<?)',
+        'USE TEMP B-TREE FOR ORDER BY'],
+    'SELECT hikes.*, users.username FROM users AS followers JOIN feed_items ON feed_items.owner_id = followers.id JOIN hikes ON hikes.id = feed_items.hike_id JOIN users ON users.id = hikes.user_id WHERE followers.username = ? ORDER BY feed_items.hike_date DESC, feed_items.hike_id DESC LIMIT ?': [
+        'SEARCH followers USING COVERING INDEX sqlite_autoindex_users_1 (username=?)',
+        'SEARCH feed_items USING PRIMARY KEY (owner_id=?)',
+        'SEARCH hikes USING INTEGER PRIMARY KEY (rowid=?)',
+        'SEARCH users USING INTEGER PRIMARY KEY (rowid=?)'],
+    'SELECT hikes.*, users.username FROM users AS followers JOIN feed_items ON feed_items.owner_id = followers.id JOIN hikes ON hikes.id = feed_items.hike_id JOIN users ON users.id = hikes.user_id WHERE followers.username = ? AND (feed_items.hike_date, feed_items.hike_id) < (?, ...) ORDER BY feed_items.hike_date DESC, feed_items.hike_id DESC LIMIT ?': [
+        'SEARCH followers USING COVERING INDEX sqlite_autoindex_users_1 (username=?)',
+        'SEARCH feed_items USING PRIMARY KEY (owner_id=? AND (hike_date,hike_id)<(?,?))',
+        'SEARCH hikes USING INTEGER PRIMARY KEY (rowid=?)',
+        'SEARCH users USING INTEGER PRIMARY KEY (rowid=?)'],
+    'INSERT OR IGNORE INTO feed_items (owner_id, hike_date, hike_id) SELECT follower_id, ?, ... FROM follows WHERE followee_id = ?': [
+        'SEARCH follows USING INDEX follows_followee_idx (followee_id=?)'],
+    'INSERT OR IGNORE INTO feed_items (owner_id, hike_date, hike_id) SELECT ?, hike_date, id FROM hikes WHERE user_id = ?': [
+        'SEARCH hikes USING COVERING INDEX hikes_user_date_idx (user_id=?)'],
+    'UPDATE feed_items SET hike_date = ? WHERE hike_id = ?': [
+        'SEARCH feed_items USING COVERING INDEX feed_items_hike_idx (hike_id=?)'],
+    'DELETE FROM feed_items WHERE hike_id = (?)': [
+        'SEARCH feed_items USING COVERING INDEX feed_items_hike_idx (hike_id=?)'],
+    'DELETE FROM feed_items WHERE owner_id = ? AND hike_id IN (SELECT id FROM hikes WHERE user_id = ?)': [
+        'SEARCH feed_items USING COVERING INDEX feed_items_hike_idx (hike_id=? AND owner_id=?)',
+        'LIST SUBQUERY 1',
+        '  SEARCH hikes USING COVERING INDEX hikes_user_date_idx (user_id=?)'],
+    'DELETE FROM feed_items': [],
+    'INSERT INTO feed_items (owner_id, hike_date, hike_id) SELECT follows.follower_id, hikes.hike_date, hikes.id FROM follows JOIN hikes ON hikes.user_id = follows.followee_id': [
+        'SCAN follows',
+        'SEARCH hikes USING COVERING INDEX hikes_user_date_idx (user_id=?)'],
+    # ==== HIKE SEARCH ====
+    "SELECT hikes.*, users.username, snippet(hikes_fts, -1, char(2), char(3), '…', 16) AS snippet FROM hikes_fts JOIN hikes ON hikes.id = hikes_fts.rowid JOIN users ON users.id = hikes.user_id WHERE hikes_fts MATCH ? AND hikes_fts.rowid >= coalesce((SELECT hikes_fts.rowid FROM hikes_fts WHERE hikes_fts MATCH ? ORDER BY hikes_fts.rowid DESC LIMIT 1 OFFSET ?), 0) ORDER BY rank LIMIT ? OFFSET ?": [
+        'SCAN hikes_fts VIRTUAL TABLE INDEX 32:M4>',
+        'SCALAR SUBQUERY 1',
+        '  SCAN hikes_fts VIRTUAL TABLE INDEX 192:M4',
+        'REUSE SUBQUERY 1',
+        'SEARCH hikes USING INTEGER PRIMARY KEY (rowid=?)',
+        'SEARCH users USING INTEGER PRIMARY KEY (rowid=?)'],
+    "SELECT hikes.*, users.username, snippet(hikes_fts, -1, char(2), char(3), '…', 16) AS snippet FROM hikes_fts JOIN hikes ON hikes.id = hikes_fts.rowid JOIN users ON users.id = hikes.user_id JOIN follows ON follows.followee_id = hikes.user_id AND follows.follower_id = ? WHERE hikes_fts MATCH ? AND hikes_fts.rowid >= coalesce((SELECT hikes_fts.rowid FROM hikes_fts JOIN hikes ON hikes.id = hikes_fts.rowid JOIN follows ON follows.followee_id = hikes.user_id AND follows.follower_id = ? WHERE hikes_fts MATCH ? ORDER BY hikes_fts.rowid DESC LIMIT 1 OFFSET ?), 0) ORDER BY rank LIMIT ? OFFSET ?": [
+        'SCAN hikes_fts VIRTUAL TABLE INDEX 32:M4>',
+        'SCALAR SUBQUERY 1',
+        '  SCAN hikes_fts VIRTUAL TABLE INDEX 192:M4',
+        '  SEARCH hikes USING INTEGER PRIMARY KEY (rowid=?)',
+        '  SEARCH follows USING COVERING INDEX sqlite_autoindex_follows_1 (follower_id=? AND followee_id=?)',
+        'REUSE SUBQUERY 1',
+        'SEARCH hikes USING INTEGER PRIMARY KEY (rowid=?)',
+        'SEARCH users USING INTEGER PRIMARY KEY (rowid=?)',
+        'SEARCH follows USING COVERING INDEX sqlite_autoindex_follows_1 (follower_id=? AND followee_id=?)'],
+    # ==== PROFILE STATS (check and rebuild recompute every rollup from hikes) ====
+    'SELECT hike_count, total_km, area_count, longest_km FROM user_stats WHERE user_id = ?': [
+        'SEARCH user_stats USING INTEGER PRIMARY KEY (rowid=?)'],
+    'SELECT month, hike_count, total_km FROM user_monthly_stats WHERE user_id = ? ORDER BY month DESC LIMIT ?': [
+        'SEARCH user_monthly_stats USING PRIMARY KEY (user_id=?)'],
+    'SELECT user_id, count(*), total(distance_km), count(DISTINCT area_name), coalesce(max(distance_km), 0) FROM hikes GROUP BY user_id': [
+        'SCAN hikes USING INDEX hikes_user_date_idx',
+        'USE TEMP B-TREE FOR count(DISTINCT)'],
+    'SELECT user_id, hike_count, total_km, area_count, longest_km FROM user_stats': [
+        'SCAN user_stats'],
+    'SELECT user_id, substr(hike_date, 1, 7), count(*), total(distance_km) FROM hikes GROUP BY user_id, substr(hike_date, 1, 7)': [
+        'SCAN hikes USING INDEX hikes_user_date_idx',
+        'USE TEMP B-TREE FOR GROUP BY'],
+    'SELECT user_id, month, hike_count, total_km FROM user_monthly_stats': [
+        'SCAN user_monthly_stats'],
+    'SELECT user_id, area_name, count(*) FROM hikes GROUP BY user_id, area_name': [
+        'SCAN hikes USING INDEX hikes_user_date_idx',
+        'USE TEMP B-TREE FOR GROUP BY'],
+    'SELECT user_id, area_name, hike_count FROM user_area_stats': [
+        'SCAN user_area_stats'],
+    'DELETE FROM user_stats': [],
+    'INSERT INTO user_stats (user_id, hike_count, total_km, area_count, longest_km) SELECT user_id, count(*), total(distance_km), count(DISTINCT area_name), coalesce(max(distance_km), 0) FROM hikes GROUP BY user_id': [
+        'SCAN hikes USING INDEX hikes_user_date_idx',
+        'USE TEMP B-TREE FOR count(DISTINCT)'],
+    'DELETE FROM user_monthly_stats': [],
+    'INSERT INTO user_monthly_stats (user_id, month, hike_count, total_km) SELECT user_id, substr(hike_date, 1, 7), count(*), total(distance_km) FROM hikes GROUP BY user_id, substr(hike_date, 1, 7)': [
+        'SCAN hikes USING INDEX hikes_user_date_idx',
+        'USE TEMP B-TREE FOR GROUP BY'],
+    'DELETE FROM user_area_stats': [],
+    'INSERT INTO user_area_stats (user_id, area_name, hike_count) SELECT user_id, area_name, count(*) FROM hikes GROUP BY user_id, area_name': [
+        'SCAN hikes USING INDEX hikes_user_date_idx',
+        'USE TEMP B-TREE FOR GROUP BY'],
+    # ==== JSON API (every field selected) ====
+    'SELECT hikes.id, hikes.hike_date, hikes.user_id, hikes.area_id, hikes.area_name, hikes.trailhead, hikes.trails_cs, hikes.distance_km, hikes.image_url, hikes.image_alt, hikes.map_link, hikes.other_info, hikes.hike_date, hikes.id FROM hikes WHERE user_id = ? AND (hike_date, id) < (?, ...) ORDER BY hike_date DESC, id DESC LIMIT ?': [
+        'SEARCH hikes USING INDEX hikes_user_date_idx (user_id=? AND hike_date<?)'],
+    'SELECT hikes.id, hikes.hike_date, hikes.user_id, hikes.area_id, hikes.area_name, hikes.trailhead, hikes.trails_cs, hikes.distance_km, hikes.image_url, hikes.image_alt, hikes.map_link, hikes.other_info, users.username, hikes.hike_date, hikes.id FROM users AS followers JOIN follows ON follows.follower_id = followers.id JOIN hikes ON hikes.user_id = follows.followee_id JOIN users ON users.id = hikes.user_id WHERE followers.username = ? ORDER BY hikes.hike_date DESC, hikes.id DESC LIMIT ?': [
+        'SEARCH followers USING COVERING INDEX sqlite_autoindex_users_1 (username=?)',
+        'SEARCH follows USING COVERING INDEX sqlite_autoindex_follows_1 (follower_id=?)',
+        'SEARCH users USING INTEGER PRIMARY KEY (rowid=?)',
+        'SEARCH hikes USING INDEX hikes_user_date_idx (user_id=?)',
+        'USE TEMP B-TREE FOR ORDER BY'],
+    'SELECT hikes.id, hikes.hike_date, hikes.user_id, hikes.area_id, hikes.area_name, hikes.trailhead, hikes.trails_cs, hikes.distance_km, hikes.image_url, hikes.image_alt, hikes.map_link, hikes.other_info, users.username, hikes.hike_date, hikes.id FROM users AS followers JOIN feed_items ON feed_items.owner_id = followers.id JOIN hikes ON hikes.id = feed_items.hike_id JOIN users ON users.id = hikes.user_id WHERE followers.username = ? ORDER BY feed_items.hike_date DESC, feed_items.hike_id DESC LIMIT ?': [
+        'SEARCH followers USING COVERING INDEX sqlite_autoindex_users_1 (username=?)',
+        'SEARCH feed_items USING PRIMARY KEY (owner_id=?)',
+        'SEARCH hikes USING INTEGER PRIMARY KEY (rowid=?)',
+        'SEARCH users USING INTEGER PRIMARY KEY (rowid=?)'],
+    # ==== ACTIVITY (HTTP validators) ====
+    'SELECT hikes_version, follows_version, updated_at FROM user_activity WHERE user_id = ?': [
+        'SEARCH user_activity USING INTEGER PRIMARY KEY (rowid=?)'],
+    'SELECT COALESCE(follower.follows_version, 0), COALESCE(SUM(followees.hikes_version), 0), MAX(COALESCE(follower.updated_at, 0), COALESCE(MAX(followees.updated_at), 0)) FROM users LEFT JOIN user_activity AS follower ON follower.user_id = users.id LEFT JOIN follows ON follows.follower_id = users.id LEFT JOIN user_activity AS followees ON followees.user_id = follows.followee_id WHERE users.username = ?': [
+        'SEARCH users USING COVERING INDEX sqlite_autoindex_users_1 (username=?)',
+        'SEARCH follower USING INTEGER PRIMARY KEY (rowid=?) LEFT-JOIN',
+        'SEARCH follows USING COVERING INDEX sqlite_autoindex_follows_1 (follower_id=?) LEFT-JOIN',
+        'SEARCH followees USING INTEGER PRIMARY KEY (rowid=?) LEFT-JOIN'],
+    # ==== SETTINGS ====
+    "SELECT value FROM settings WHERE key = 'feed_mode'": [
+        'SEARCH settings USING INDEX sqlite_autoindex_settings_1 (key=?)'],
+    "INSERT INTO settings (key, value) VALUES ('feed_mode', ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value": [],
+    "INSERT INTO settings (key, value) VALUES ('hike_version', 1) ON CONFLICT (key) DO UPDATE SET value = value + 1 RETURNING value": [],
+    # ==== UPLOAD OUTBOX ====
+    'INSERT INTO upload_outbox (hike_id, spool_path, public_id) VALUES (?, ...)': [],
+    "UPDATE upload_outbox SET attempts = attempts + 1, next_attempt_at = ? WHERE id = (SELECT id FROM upload_outbox WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT 1) RETURNING id, hike_id, spool_path, public_id, attempts": [
+        'SEARCH upload_outbox USING INTEGER PRIMARY KEY (rowid=?)',
+        'SCALAR SUBQUERY 1',
+        '  SEARCH upload_outbox USING COVERING INDEX upload_outbox_due_idx (status=? AND next_attempt_at<?)'],
+    'UPDATE upload_outbox SET status = ?, next_attempt_at = ?, last_error = ? WHERE id = ?': [
+        'SEARCH upload_outbox USING INTEGER PRIMARY KEY (rowid=?)'],
+    'UPDATE hikes SET image_url = ?, version = ? WHERE id = ? AND NOT EXISTS (SELECT 1 FROM upload_outbox WHERE hike_id = ? AND id > ?)': [
+        'SEARCH hikes USING INTEGER PRIMARY KEY (rowid=?)',
+        'SCALAR SUBQUERY 1',
+        '  SEARCH upload_outbox USING COVERING INDEX upload_outbox_hike_idx (hike_id=? AND rowid>?)'],
+    "UPDATE upload_outbox SET status = 'done', last_error = NULL WHERE id = ?": [
+        'SEARCH upload_outbox USING INTEGER PRIMARY KEY (rowid=?)'],
+    # ==== SESSIONS (session database) ====
+    'SELECT data, expires_at, version FROM sessions WHERE id = ? AND expires_at > ?': [
+        'SEARCH sessions USING PRIMARY KEY (id=?)'],
+    'SELECT version FROM sessions WHERE id = ? AND expires_at > ?': [
+        'SEARCH sessions USING PRIMARY KEY (id=?)'],
+    'INSERT INTO sessions (id, data, expires_at) VALUES (?, ...) ON CONFLICT (id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at, version = sessions.version + 1 RETURNING version': [],
+    'DELETE FROM sessions WHERE id = ?': [
+        'SEARCH sessions USING PRIMARY KEY (id=?)'],
+    'DELETE FROM sessions WHERE expires_at <= ?': [
+        'SEARCH sessions USING COVERING INDEX sessions_expires_idx (expires_at<?)'],
+    # ==== WRITER (group commit, each queued write in a savepoint) ====
+    'BEGIN IMMEDIATE': [],
+    'SAVEPOINT queued_write': [],
+    'RELEASE queued_write': [],
+    # ==== LEADERBOARDS (rebuild ranks every board from the month's hikes) ====
+    "SELECT key, value FROM settings WHERE key IN ('leaderboards_month', 'leaderboards_built_at')": [
+        'SEARCH settings USING INDEX sqlite_autoindex_settings_1 (key=?)'],
+    'SELECT followee_leaderboards.user_id, users.username, followee_leaderboards.total_km, followee_leaderboards.hike_count FROM followee_leaderboards JOIN users ON users.id = followee_leaderboards.user_id WHERE followee_leaderboards.follower_id = ? ORDER BY followee_leaderboards.rank': [
+        'SEARCH followee_leaderboards USING PRIMARY KEY (follower_id=?)',
+        'SEARCH users USING INTEGER PRIMARY KEY (rowid=?)'],
+    'SELECT area_leaderboards.user_id, users.username, area_leaderboards.total_km, area_leaderboards.hike_count FROM area_leaderboards JOIN users ON users.id = area_leaderboards.user_id WHERE area_leaderboards.area_id = ? ORDER BY area_leaderboards.rank': [
+        'SEARCH area_leaderboards USING PRIMARY KEY (area_id=?)',
+        'SEARCH users USING INTEGER PRIMARY KEY (rowid=?)'],
+    'SELECT username FROM users WHERE id = ?': [
+        'SEARCH users USING INTEGER PRIMARY KEY (rowid=?)'],
+    'SELECT total(distance_km), count(*) FROM hikes WHERE user_id = ? AND hike_date >= ? AND hike_date < ? AND area_id = ?': [
+        'SEARCH hikes USING INDEX hikes_area_date_idx (area_id=? AND hike_date>? AND hike_date<?)'],
+    'SELECT follower_id FROM follows WHERE followee_id = ? AND follower_id IN (?, ...)': [
+        'SEARCH follows USING COVERING INDEX sqlite_autoindex_follows_1 (follower_id=? AND followee_id=?)'],
+    'SELECT total_km, hike_count FROM user_monthly_stats WHERE user_id = ? AND month = ?': [
+        'SEARCH user_monthly_stats USING PRIMARY KEY (user_id=? AND month=?)'],
+    'DELETE FROM followee_leaderboards': [],
+    'INSERT INTO followee_leaderboards (follower_id, rank, user_id, total_km, hike_count) SELECT follower_id, rank, user_id, total_km, hike_count FROM (SELECT follows.follower_id, user_monthly_stats.user_id, user_monthly_stats.total_km, user_monthly_stats.hike_count, row_number() OVER (PARTITION BY follows.follower_id ORDER BY user_monthly_stats.total_km DESC, user_monthly_stats.user_id) AS rank FROM user_monthly_stats JOIN follows ON follows.followee_id = user_monthly_stats.user_id WHERE user_monthly_stats.month = ?) WHERE rank <= ?': [
+        'CO-ROUTINE (subquery-1)',
+        '  CO-ROUTINE (subquery-3)',
+        '    SCAN follows USING COVERING INDEX sqlite_autoindex_follows_1',
+        '    SEARCH user_monthly_stats USING PRIMARY KEY (user_id=? AND month=?)',
+        '    USE TEMP B-TREE FOR RIGHT PART OF ORDER BY',
+        '  SCAN (subquery-3)',
+        'SCAN (subquery-1)'],
+    'DELETE FROM area_leaderboards': [],
+    'INSERT INTO area_leaderboards (area_id, rank, user_id, total_km, hike_count) SELECT area_id, rank, user_id, total_km, hike_count FROM (SELECT area_id, user_id, total(distance_km) AS total_km, count(*) AS hike_count, row_number() OVER (PARTITION BY area_id ORDER BY total(distance_km) DESC, user_id) AS rank FROM hikes WHERE hike_date >= ? AND hike_date < ? AND area_id IS NOT NULL GROUP BY area_id, user_id) WHERE rank <= ?': [
+        'CO-ROUTINE (subquery-1)',
+        '  CO-ROUTINE (subquery-3)',
+        '    SEARCH hikes USING INDEX hikes_date_idx (hike_date>? AND hike_date<?)',
+        '    USE TEMP B-TREE FOR GROUP BY',
+        '    USE TEMP B-TREE FOR ORDER BY',
+        '  SCAN (subquery-3)',
+        'SCAN (subquery-1)'],
+    'INSERT INTO settings (key, value) VALUES (?, ...) ON CONFLICT (key) DO UPDATE SET value = excluded.value': [],
+}
+
+# Statements off the request hot path (ie. the all-usernames list and rebuilding
+# timelines on startup), which may read a whole table or index
+COLD = {
+    'SELECT username FROM users',
+    'DELETE FROM feed_items',
+    'INSERT INTO feed_items (owner_id, hike_date, hike_id) SELECT follows.follower_id, hikes.hike_date, hikes.id FROM follows JOIN hikes ON hikes.user_id = follows.followee_id',
+    'SELECT user_id, count(*), total(distance_km), count(DISTINCT area_name), coalesce(max(distance_km), 0) FROM hikes GROUP BY user_id',
+    'SELECT user_id, hike_count, total_km, area_count, longest_km FROM user_stats',
+    'SELECT user_id, substr(hike_date, 1, 7), count(*), total(distance_km) FROM hikes GROUP BY user_id, substr(hike_date, 1, 7)',
+    'SELECT user_id, month, hike_count, total_km FROM user_monthly_stats',
+    'SELECT user_id, area_name, count(*) FROM hikes GROUP BY user_id, area_name',
+    'SELECT user_id, area_name, hike_count FROM user_area_stats',
+    'DELETE FROM user_stats',
+    'INSERT INTO user_stats (user_id, hike_count, total_km, area_count, longest_km) SELECT user_id, count(*), total(distance_km), count(DISTINCT area_name), coalesce(max(distance_km), 0) FROM hikes GROUP BY user_id',
+    'DELETE FROM user_monthly_stats',
+    'INSERT INTO user_monthly_stats (user_id, month, hike_count, total_km) SELECT user_id, substr(hike_date, 1, 7), count(*), total(distance_km) FROM hikes GROUP BY user_id, substr(hike_date, 1, 7)',
+    'DELETE FROM user_area_stats',
+    'INSERT INTO user_area_stats (user_id, area_name, hike_count) SELECT user_id, area_name, count(*) FROM hikes GROUP BY user_id, area_name',
+    'INSERT INTO followee_leaderboards (follower_id, rank, user_id, total_km, hike_count) SELECT follower_id, rank, user_id, total_km, hike_count FROM (SELECT follows.follower_id, user_monthly_stats.user_id, user_monthly_stats.total_km, user_monthly_stats.hike_count, row_number() OVER (PARTITION BY follows.follower_id ORDER BY user_monthly_stats.total_km DESC, user_monthly_stats.user_id) AS rank FROM user_monthly_stats JOIN follows ON follows.followee_id = user_monthly_stats.user_id WHERE user_monthly_stats.month = ?) WHERE rank <= ?',
+    'INSERT INTO area_leaderboards (area_id, rank, user_id, total_km, hike_count) SELECT area_id, rank, user_id, total_km, hike_count FROM (SELECT area_id, user_id, total(distance_km) AS total_km, count(*) AS hike_count, row_number() OVER (PARTITION BY area_id ORDER BY total(distance_km) DESC, user_id) AS rank FROM hikes WHERE hike_date >= ? AND hike_date < ? AND area_id IS NOT NULL GROUP BY area_id, user_id) WHERE rank <= ?',
+}
+
+
+def normalize(sql):
+    '''Takes sql string. Returns it on one line, with runs of bound parameters as '?, ...'.'''
+    return re.sub(r'\?(?:, \?)+', '?, ...', ' '.join(sql.split()))
+
+
+class PlanRecorder:  # pylint: disable=too-few-public-methods
+    '''Stands in for the slow-query log, recording the plan of every statement instead.'''
+    threshold_seconds = 0
+
+    def __init__(self):
+        self.statements = {}
+
+    def observe(self, connection, method, args, _seconds):
+        '''Takes connection, cursor method name, its args and seconds taken.
+            Records plan and caller the first time a statement is seen.
+        '''
+        sql = normalize(args[0])
+        if method == 'executescript' or sql.upper().startswith('PRAGMA') or sql in self.statements:
+            return
+        params = args[1] if len(args) > 1 else ()
+        if method == 'executemany':
+            params = params[0] if params else ()
+        # The connection may be closed once the calling function returns, so explain now
+        self.statements[sql] = {'plan': explain(connection, args[0], params), 'caller': get_caller()}
+
+
+def run_workload(db, mode, username, followee):
+    '''Takes db file, feed mode, username to add and username to follow.
+        Calls every function that issues SQL.
+    '''
+    add_user(db, username, 'x')
+    get_username_from_user_id(db, get_user_by_username(db, username)['id'])
+    add_area(db, HIKE['area_name'])
+    area_id = get_area_id(HIKE['area_name'], db)
+    add_trail(db, area_id, HIKE['trails_cs'])
+    follow(db, username, followee['username'], 'follow', mode)
+    add_hike(db, followee['id'], area_id, dict(HIKE), mode,
+        pending_upload={'spool_path': '', 'public_id': 'plan'})
+    hike = get_hikes(db, followee['id'])[0]
+    get_hikes(db, followee['id'], hike_id=hike['id'])
+    get_hikes_page(db, followee['id'], after=encode_cursor(hike))
+    get_hike_img_src(db, followee['id'])
+    update_hike(db, hike, {'hike_date': '2025-02-02', 'other_info': 'Updated'}, mode)
+    saved_hike_id = save_new_hike(db, followee['id'], dict(HIKE, area_name='Saved Area'), mode)
+    save_hike_changes(db, saved_hike_id, dict(HIKE, other_info='Saved'), mode)
+    get_followees(db, username)
+    get_feed_page(db, username, after=encode_cursor(hike), feed_mode=mode)
+    get_feed_page(db, username, feed_mode=mode)
+    get_area_name(db, area_id)
+    trail_id = get_trail_id(db, area_id, HIKE['trails_cs'])
+    get_trail(db, trail_id)
+    get_trail_hikes_page(db, trail_id)
+    get_trail_hikes_page(db, trail_id, after=encode_cursor(hike))
+    search.search_hikes(db, 'plan loo', after='20')
+    search.search_hikes(db, 'plan', follower_id=get_user_by_username(db, username)['id'])
+    user_stats.get_user_stats(db, followee['id'])
+    api.get_hikes_page(db, followee['id'], after=encode_cursor(hike))
+    api.get_feed_page(db, username, feed_mode=mode)
+    upload = claim_upload(db)
+    retry_upload(db, upload, 'Offline')
+    complete_upload(db, upload)
+    delete_hike(db, hike['id'], followee['id'], mode)
+    follow(db, username, followee['username'], 'unfollow', mode)
+
+
+@pytest.fixture(scope='module', name='statements')
+def fixture_statements(tmp_path_factory):
+    '''Returns dict of normalized sql: plan and caller, for every statement the workload issues.'''
+    db = str(tmp_path_factory.mktemp('plans') / 'plans.db')
+    generate(db, 300, seed=7)
+    invalidate_caches()
+    connection = sqlite3.connect(db)
+    followee = dict(zip(('id', 'username'),
+        connection.execute('SELECT id, username FROM users WHERE id = 1').fetchone()))
+    follower_ids = [row[0] for row in connection.execute('SELECT follower_id FROM follows WHERE followee_id = 1 LIMIT 2')]
+    connection.close()
+    recorder = PlanRecorder()
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(metrics, 'slow_log', recorder)
+        for mode in ['read', 'write']:
+            run_workload(db, mode, f'planner{mode}', followee)
+        get_user_cards(db, [followee['username'], 'plannerread'])
+        get_user_activity(db, followee['id'])
+        get_feed_activity(db, 'plannerread')
+        get_all_usernames(db)
+        # The second search checks the cached username index is current
+        get_similar_usernames(db, 'plan', 5)
+        get_similar_usernames(db, 'plan', 5)
+        sync_feed_mode(db, 'read')
+        sync_feed_mode(db, 'write')
+        user_stats.check_user_stats(db)
+        user_stats.rebuild_user_stats(db)
+        # Boards are updated by new hikes once loaded, so load them before adding one
+        leaderboards.rebuild_leaderboards(db, HIKE['hike_date'][:7])
+        for follower_id in follower_ids:
+            leaderboards.get_leaderboard(db, 'following', follower_id)
+        leaderboards.get_leaderboard(db, 'area', get_area_id(HIKE['area_name'], db))
+        save_new_hike(db, followee['id'], dict(HIKE), 'write')
+        session_store = SqliteSessionStore(str(tmp_path_factory.mktemp('plans') / 'sessions.db'))
+        session_store.set('plan', '{}', 1e12)
+        session_store.get('plan')
+        session_store.get_version('plan')
+        session_store.delete('plan')
+        session_store.sweep()
+    invalidate_caches()
+    return recorder.statements
+
+
+class TestQueryPlans:
+    '''Tests every SQL statement is registered with its plan, and hot paths use indexes'''
+
+    def test_every_statement_is_registered(self, statements):
+        '''Each statement issued has an expected plan in PLANS'''
+        unregistered = [f'{details["caller"]}: {sql}\n    plan: {details["plan"]}'
+            for sql, details in statements.items() if sql not in PLANS]
+        assert not unregistered, 'Register the expected plan in PLANS for:\n' + '\n'.join(unregistered)
+
+    def test_every_registered_statement_is_issued(self, statements):
+        '''PLANS has no entries for statements the app no longer issues'''
+        assert not set(PLANS) - set(statements)
+
+    @pytest.mark.parametrize('sql', PLANS, ids=lambda sql: sql[:60])
+    def test_plan_matches(self, statements, sql):
+        '''The statement's plan is the registered one'''
+        assert sql in statements
+        assert statements[sql]['plan'] == PLANS[sql], statements[sql]['caller']
+
+    @pytest.mark.parametrize('sql', sorted(set(PLANS) - COLD), ids=lambda sql: sql[:60])
+    def test_hot_path_searches_index(self, sql):
+        '''Statements on the hot path search an index or primary key, never scan a table'''
+        # Full-text matches show up as a SCAN of the FTS5 table using its index
+        scans = [step for step in PLANS[sql] if step.strip().startswith('SCAN ') and 'VIRTUAL TABLE INDEX' not in step]
+        assert not scans
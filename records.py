@@ -0,0 +1,83 @@
+'''This module houses the compact record type hike rows are decoded into (in place of a dict
+    per row). A HikeRecord keeps the fetched row tuple as is, and shares one column layout
+    (column name: position) with every row of the same statement, so decoding a row is a single
+    object allocation. distance_km is rounded, and trails_cs split into trails_list, only when
+    read. Records are read-only mappings: hike.get('area_name'), hike['id'], dict(hike) and
+    comparisons with dicts work as they did with format_hikes' dicts.
+'''
+from collections.abc import Mapping
+from functools import lru_cache
+
+# Keys computed from the row rather than read from a column
+TRAILS_KEY = 'trails_list'
+
+
+@lru_cache(maxsize=64)
+def get_layout(columns):
+    '''Takes tuple of column names. Returns dict of column name: position in the row
+        (one dict per distinct statement, shared by its records).
+    '''
+    return {column: position for position, column in enumerate(columns)}
+
+
+class HikeRecord(Mapping):
+    '''Read-only mapping over one hike row, with the derived trails_list key.'''
+    __slots__ = ('_layout', '_row', '_trails')
+
+    def __init__(self, layout, row):
+        self._layout = layout
+        self._row = row
+        self._trails = None
+
+    def __getitem__(self, key):
+        position = self._layout.get(key)
+        if position is None:
+            if key == TRAILS_KEY and 'trails_cs' in self._layout:
+                return self.trails_list
+            raise KeyError(key)
+        value = self._row[position]
+        # Ensure max of 1 decimal place for distance (UI spacing only supports 1 dp)
+        if key == 'distance_km' and value is not None:
+            return round(value, 1)
+        return value
+
+    def get(self, key, default=None):
+        '''Takes key and optional default. Returns value of key, or default if missing.'''
+        position = self._layout.get(key)
+        # Plain columns (most reads from templates) skip __getitem__
+        if position is not None and key != 'distance_km':
+            return self._row[position]
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in self._layout or (key == TRAILS_KEY and 'trails_cs' in self._layout)
+
+    def __iter__(self):
+        yield from self._layout
+        if 'trails_cs' in self._layout:
+            yield TRAILS_KEY
+
+    def __len__(self):
+        return len(self._layout) + ('trails_cs' in self._layout)
+
+    def __repr__(self):
+        return f'HikeRecord({dict(self)!r})'
+
+    @property
+    def trails_list(self):
+        '''Returns list of trail names, split from trails_cs on first use.'''
+        if self._trails is None:
+            trails_cs = self._row[self._layout['trails_cs']]
+            self._trails = trails_cs.split(', ') if trails_cs is not None else []
+        return self._trails
+
+
+def decode_hikes(description, rows):
+    '''Takes cursor description and fetched hike rows.
+        Returns list of HikeRecords, sharing one column layout.
+    '''
+    layout = get_layout(tuple(column[0] for column in description))
+    return [HikeRecord(layout, row) for row in rows]
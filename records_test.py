@@ -0,0 +1,33 @@
+'''Unit tests for hike records'''
+import pytest
+from records import HikeRecord, decode_hikes
+# pylint: disable=line-too-long
+
+DESCRIPTION = [('id',), ('distance_km',), ('trails_cs',), ('username',)]
+
+
+class TestHikeRecord:
+    '''Tests mapping access, derived keys and shared layouts of hike records'''
+
+    def test_mapping_access(self):
+        '''Records read like the dicts format_hikes built, and compare equal to them'''
+        hike = decode_hikes(DESCRIPTION, [(1, 4.94, 'Rad Trail, Tubular Trail', 'suze')])[0]
+        assert hike.get('distance_km') == hike['distance_km'] == 4.9
+        assert hike.get('trails_list') == ['Rad Trail', 'Tubular Trail']
+        assert hike.get('image_url') is None and hike.get('image_url', '') == ''
+        with pytest.raises(KeyError):
+            hike['image_url']  # pylint: disable=pointless-statement
+        assert 'trails_list' in hike and 'image_url' not in hike
+        assert hike == {'id': 1, 'distance_km': 4.9, 'trails_cs': 'Rad Trail, Tubular Trail', 'username': 'suze', 'trails_list': ['Rad Trail', 'Tubular Trail']}
+        assert len(hike) == 5
+
+    def test_shared_layout_and_lazy_trails(self):
+        '''Rows of a statement share one layout, and trails are split once, when first read'''
+        first, second = decode_hikes(DESCRIPTION, [(1, None, 'A', 'suze'), (2, 1.0, None, 'suze')])
+        # pylint: disable=protected-access
+        assert first._layout is second._layout
+        assert first._trails is None
+        assert first['trails_list'] == ['A']
+        assert first['trails_list'] is first['trails_list']
+        assert first['distance_km'] is None and second['trails_list'] == []
+        assert 'trails_list' not in HikeRecord({'id': 0}, (1,))
@@ -0,0 +1,104 @@
+'''This module houses full-text search over hikes (/search), backed by the hikes_fts FTS5 index
+    (tables/migrations/008_hikes_fts.sql) on area_name, trailhead, trails_cs and other_info.
+    The search text is reduced to plain terms (FTS5 query syntax from users is never passed on),
+    every term has to match and the last one may be a prefix. Results are ranked with BM25,
+    paged with an offset cursor (?after=N), since a rank isn't a stable position to seek past,
+    and come with a snippet of the best matching field. BM25 scores every match before the best
+    are known, so only the newest SEARCH_MAX_MATCHES matches are ranked: a common word costs
+    about the same as a rare one. Snippets are HTML-escaped before the
+    matched terms are wrapped in <mark>.
+    Search can be limited to the hikes of the users someone follows.
+'''
+import re
+from markupsafe import Markup, escape
+from constants import FEED_PAGE_SIZE, SEARCH_MAX_MATCHES, SEARCH_MAX_OFFSET, SEARCH_MAX_TERMS
+from utils import clamp_page_size, fetch_hikes_page
+
+# FTS5 marks matches in snippets with these (control characters never appear in form text)
+MATCH_START, MATCH_END = '\x02', '\x03'
+TERM = re.compile(r'\w+')
+
+
+def build_match_query(text):
+    '''Takes search text. Returns FTS5 MATCH query of its terms (each quoted, the last one also
+        matching as a prefix), or None if the text has no terms.
+    '''
+    terms = TERM.findall(text or '')[:SEARCH_MAX_TERMS]
+    if not terms:
+        return None
+    query = ' '.join(f'"{term}"' for term in terms)
+    # Match words being typed (ie. 'tubul' finds 'tubular'). The index keeps 3 character prefixes,
+    # shorter ones would have to merge the rows of most words
+    if len(terms[-1]) >= 3:
+        query += '*'
+    return query
+
+
+def decode_offset(after):
+    '''Takes ?after= cursor. Returns offset of the page, 0 if missing or malformed.'''
+    if not after or not str(after).isdigit():
+        return 0
+    return min(int(after), SEARCH_MAX_OFFSET)
+
+
+def build_search_query(match_query, offset, limit, follower_id=None):
+    '''Takes FTS5 MATCH query, offset, page size and optional id of the user whose followees'
+        hikes to search. Returns (query, params) for one page of results, plus one extra row.
+        Only matches from the newest SEARCH_MAX_MATCHES on (by hike id) are ranked, the subquery
+        finds the oldest of them by walking the index in id order, which needs no scoring.
+        In followees mode the subquery counts only followees' matches, so older followee hikes
+        aren't cut off by newer matches from everyone else.
+    '''
+    follows_join = ''
+    if follower_id is not None:
+        follows_join = ('JOIN follows ON follows.followee_id = hikes.user_id '
+            'AND follows.follower_id = ? ')
+    query = (
+        'SELECT hikes.*, users.username, '
+        "snippet(hikes_fts, -1, char(2), char(3), '…', 16) AS snippet FROM hikes_fts "
+        'JOIN hikes ON hikes.id = hikes_fts.rowid '
+        f'JOIN users ON users.id = hikes.user_id {follows_join}'
+        'WHERE hikes_fts MATCH ? AND hikes_fts.rowid >= coalesce(('
+        'SELECT hikes_fts.rowid FROM hikes_fts ')
+    if follower_id is not None:
+        query += f'JOIN hikes ON hikes.id = hikes_fts.rowid {follows_join}'
+    query += (
+        'WHERE hikes_fts MATCH ? '
+        'ORDER BY hikes_fts.rowid DESC LIMIT 1 OFFSET ?), 0) ORDER BY rank LIMIT ? OFFSET ?')
+    follower_params = [] if follower_id is None else [follower_id]
+    params = (follower_params + [match_query] + follower_params
+        + [match_query, SEARCH_MAX_MATCHES - 1, limit + 1, offset])
+    return query, params
+
+
+def search_hikes(db, text, after=None, limit=FEED_PAGE_SIZE, follower_id=None):
+    '''Takes db file, search text, optional page cursor, page size and id of the user whose
+        followees' hikes to search (None searches every hike).
+        Returns dict with list of matching hikes (best match first, each with its snippet)
+        and cursor for the next page (None once it would be past SEARCH_MAX_OFFSET).
+    '''
+    match_query = build_match_query(text)
+    if not match_query:
+        return {'hikes': [], 'next_cursor': None}
+    limit = clamp_page_size(limit)
+    offset = decode_offset(after)
+    query, params = build_search_query(match_query, offset, limit, follower_id)
+    hikes_list, has_more = fetch_hikes_page(db, query, params, limit)
+    # Past SEARCH_MAX_OFFSET the cursor would decode to the same capped offset again
+    next_cursor = None
+    if has_more and offset + limit <= SEARCH_MAX_OFFSET:
+        next_cursor = str(offset + limit)
+    return {'hikes': hikes_list, 'next_cursor': next_cursor}
+
+
+def highlight(snippet):
+    '''Takes snippet from search_hikes. Returns it HTML-escaped, with matches in <mark> tags.
+        Available in templates as highlight.
+    '''
+    escaped = str(escape(snippet or ''))
+    return Markup(escaped.replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>'))
+
+
+def init_app(app):
+    '''Takes Flask app. Registers the highlight template function.'''
+    app.jinja_env.globals['highlight'] = highlight
@@ -0,0 +1,103 @@
+'''Unit tests for full-text hike search'''
+import pytest
+from search import build_match_query, highlight, search_hikes
+from testing import HIKE
+from utils import delete_hike, follow, save_hike_changes, save_new_hike
+# pylint: disable=line-too-long
+
+
+@pytest.fixture(name='db')
+def fixture_db(db):
+    '''Returns db file where frank follows suze. suze hiked in Glacier Basin (1) and noted a
+        glacier on another hike (2), frank hiked in Glacier Basin too (3).
+    '''
+    follow(db, 'frank', 'suze', 'follow')
+    save_new_hike(db, 1, dict(HIKE, area_name='Glacier Basin'))
+    save_new_hike(db, 1, dict(HIKE, other_info='Saw the <glacier> from the ridge & lunch spot, a long and beautiful day out'))
+    save_new_hike(db, 2, dict(HIKE, area_name='Glacier Basin', hike_date='2025-01-02'))
+    return db
+
+
+class TestSearch:
+    '''Tests matching, ranking and paging hikes'''
+
+    def test_build_match_query(self):
+        '''Search text becomes quoted terms, FTS5 syntax is dropped'''
+        assert build_match_query('Rad "trail" NOT') == '"Rad" "trail" "NOT"*'
+        assert build_match_query('tubul') == '"tubul"*'
+        assert build_match_query('rad tr OR') == '"rad" "tr" "OR"'
+        assert build_match_query('*:(") -') is None
+
+    def test_highlight(self):
+        '''Snippet text is escaped, only the match markers become tags'''
+        assert highlight('<b>\x02Rad\x03</b> & co') == '&lt;b&gt;<mark>Rad</mark>&lt;/b&gt; &amp; co'
+
+    def test_ranking_and_pages(self, db):
+        '''Area name matches rank above notes, pages continue with an offset cursor'''
+        results = search_hikes(db, 'glacier')
+        assert [hike['id'] for hike in results['hikes']][-1] == 2
+        assert results['hikes'][-1]['snippet'].startswith('Saw the <\x02glacier\x03>')
+        first_page = search_hikes(db, 'GLAC', limit=2)
+        assert first_page['next_cursor'] == '2'
+        assert len(search_hikes(db, 'glac', after=first_page['next_cursor'], limit=2)['hikes']) == 1
+        assert not search_hikes(db, 'nowhere')['hikes']
+
+    def test_pages_end_at_max_offset(self, db, monkeypatch):
+        '''Paging stops at SEARCH_MAX_OFFSET, a cursor past it isn't handed out again'''
+        monkeypatch.setattr('search.SEARCH_MAX_OFFSET', 4)
+        for _ in range(5):
+            save_new_hike(db, 2, dict(HIKE, area_name='Glacier Basin'))
+        cursors, page = [], search_hikes(db, 'basin', limit=2)
+        while page['next_cursor']:
+            cursors.append(page['next_cursor'])
+            page = search_hikes(db, 'basin', after=page['next_cursor'], limit=2)
+        assert cursors == ['2', '4']
+        assert len(page['hikes']) == 2
+        assert search_hikes(db, 'basin', after='6', limit=2)['next_cursor'] is None
+
+    def test_newest_matches_ranked(self, db, monkeypatch):
+        '''Only the newest SEARCH_MAX_MATCHES matches are ranked'''
+        monkeypatch.setattr('search.SEARCH_MAX_MATCHES', 2)
+        assert sorted(hike['id'] for hike in search_hikes(db, 'glacier')['hikes']) == [2, 3]
+
+    def test_index_follows_writes(self, db):
+        '''Edited and deleted hikes are found by their new text only'''
+        save_hike_changes(db, 1, dict(HIKE, area_name='Moraine Lake'))
+        delete_hike(db, 3, 2)
+        assert [hike['id'] for hike in search_hikes(db, 'glacier')['hikes']] == [2]
+        assert [hike['id'] for hike in search_hikes(db, 'moraine lake')['hikes']] == [1]
+
+    def test_followees_mode(self, db):
+        '''Followees mode only searches hikes of followed users'''
+        assert sorted(hike['id'] for hike in search_hikes(db, 'glacier', follower_id=2)['hikes']) == [1, 2]
+        assert not search_hikes(db, 'glacier', follower_id=1)['hikes']
+
+    def test_followees_mode_older_matches(self, db, monkeypatch):
+        '''Followees' matches older than the newest SEARCH_MAX_MATCHES of all hikes are still found'''
+        monkeypatch.setattr('search.SEARCH_MAX_MATCHES', 3)
+        for _ in range(5):
+            save_new_hike(db, 2, dict(HIKE, area_name='Glacier Basin'))
+        assert [hike['id'] for hike in search_hikes(db, 'basin', follower_id=2)['hikes']] == [1]
+
+
+class TestSearchRoute:
+    '''Tests the /search route'''
+
+    def test_search_route(self, app_module):
+        '''Results are rendered with highlighted, escaped snippets'''
+        client = app_module.app.test_client()
+        page = client.get('/search?q=glacier&limit=1').data
+        assert b'<mark>Glacier</mark>' in page
+        assert b'/search?after=1&amp;q=glacier&amp;limit=1' in page
+        notes = client.get('/search?q=ridge').data
+        assert b'&lt;glacier&gt; from the <mark>ridge</mark>' in notes
+        assert client.get('/search?q=glacier&mode=following').status_code == 302
+        with client.session_transaction() as session:
+            session['username'], session['user_id'] = 'suze', 1
+        assert b'No hikes found' in client.get('/search?q=glacier&mode=following').data
+
+    def test_search_too_long(self, app_module):
+        '''Searches over the length limit show an error instead of results'''
+        page = app_module.app.test_client().get('/search?q=' + 'glacier ' * 20).data
+        assert b'Searches are up to one hundred characters long.' in page
+        assert b'<mark>' not in page
@@ -0,0 +1,308 @@
+'''This module houses the server-side session backends, replacing flask_session's
+    filesystem sessions. The session cookie only holds a random session id, the session data
+    is kept in a sqlite table (WAL mode, so session writes don't block readers) or, for a
+    single process, in a bounded in-memory LRU. Decoded sqlite sessions are cached in-process
+    for a few seconds, so most requests only read the session's version (which every write
+    bumps) instead of reading and decoding its data, and unchanged sessions are only written
+    back once half their lifetime has passed.
+    Logging in gets a new session id (see save_session), against session fixation.
+    A background thread sweeps expired sessions.
+'''
+from contextlib import contextmanager
+import copy
+import secrets
+import sqlite3
+import threading
+import time
+from flask.sessions import SecureCookieSession, SessionInterface, session_json_serializer
+from cache import LRUCache
+from connection_pool import ConnectionPool
+from constants import (SESSION_BACKEND, SESSION_CACHE_SIZE, SESSION_CACHE_TTL, SESSION_DB,
+    SESSION_DB_PRAGMAS, SESSION_MEMORY_SIZE, SESSION_SWEEP_SECONDS)
+
+SESSION_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS sessions_expires_idx ON sessions (expires_at);
+'''
+
+
+# ==== STORES ====
+# Each store keeps serialized session data by session id, with its expiry (unix time) and a
+# version, bumped by every write, so other processes can tell their cached copy is outdated.
+
+class SqliteSessionStore:
+    '''Sessions in a sqlite table, shared by every process (on one host) using the file.'''
+
+    def __init__(self, path=SESSION_DB):
+        self.path = path
+        # Its own pool, so session connections don't count against the app database's
+        self.pool = ConnectionPool(pragmas=SESSION_DB_PRAGMAS)
+        with self.connection() as connection:
+            # WAL is kept in the database file, so it only needs setting once
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.executescript(SESSION_SCHEMA)
+            columns = [row[1] for row in connection.execute('PRAGMA table_info(sessions)')]
+            if 'version' not in columns:
+                # Session files created before sessions had versions
+                connection.execute(
+                    'ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+                connection.commit()
+
+    @contextmanager
+    def connection(self):
+        '''Yields a pooled connection to the session database.'''
+        connection = self.pool.acquire(self.path)
+        try:
+            yield connection
+        finally:
+            self.pool.release(self.path, connection)
+
+    def get(self, sid, now=None):
+        '''Takes session id and optional current unix time.
+            Returns (data, expires_at, version) tuple, or None if missing or expired.
+        '''
+        now = time.time() if now is None else now
+        with self.connection() as connection:
+            return connection.execute(
+                'SELECT data, expires_at, version FROM sessions WHERE id = ? AND expires_at > ?',
+                (sid, now)).fetchone()
+
+    def get_version(self, sid, now=None):
+        '''Takes session id and optional current unix time.
+            Returns session version, or None if missing or expired.
+        '''
+        now = time.time() if now is None else now
+        with self.connection() as connection:
+            row = connection.execute(
+                'SELECT version FROM sessions WHERE id = ? AND expires_at > ?',
+                (sid, now)).fetchone()
+        return row[0] if row else None
+
+    def set(self, sid, data, expires_at):
+        '''Takes session id, serialized data and expiry. Stores session.
+            Returns its new version.
+        '''
+        with self.connection() as connection:
+            version = connection.execute(
+                'INSERT INTO sessions (id, data, expires_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (id) DO UPDATE SET data = excluded.data, '
+                'expires_at = excluded.expires_at, version = sessions.version + 1 '
+                'RETURNING version', (sid, data, expires_at)).fetchone()[0]
+            connection.commit()
+        return version
+
+    def delete(self, sid):
+        '''Takes session id. Removes session.'''
+        with self.connection() as connection:
+            connection.execute('DELETE FROM sessions WHERE id = ?', (sid,))
+            connection.commit()
+
+    def sweep(self, now=None):
+        '''Takes optional current unix time. Removes expired sessions. Returns number removed.'''
+        now = time.time() if now is None else now
+        with self.connection() as connection:
+            removed = connection.execute(
+                'DELETE FROM sessions WHERE expires_at <= ?', (now,)).rowcount
+            connection.commit()
+        return removed
+
+
+class MemorySessionStore:
+    '''Sessions in a bounded in-process LRU (least recently used sessions are dropped when full).
+        Sessions aren't shared between processes and are lost on restart.
+    '''
+
+    def __init__(self, max_size=SESSION_MEMORY_SIZE):
+        self.sessions = LRUCache(max_size)
+
+    def get(self, sid, now=None):
+        '''Takes session id and optional current unix time.
+            Returns (data, expires_at, version) tuple, or None if missing or expired.
+        '''
+        now = time.time() if now is None else now
+        record = self.sessions.get(sid)
+        return record if record and record[1] > now else None
+
+    def get_version(self, sid, now=None):
+        '''Takes session id and optional current unix time.
+            Returns session version, or None if missing or expired.
+        '''
+        now = time.time() if now is None else now
+        record = self.sessions.get(sid)
+        return record[2] if record and record[1] > now else None
+
+    def set(self, sid, data, expires_at):
+        '''Takes session id, serialized data and expiry. Stores session.
+            Returns its new version.
+        '''
+        record = self.sessions.get(sid)
+        version = record[2] + 1 if record else 1
+        self.sessions.set(
+            sid, (data, expires_at, version), ttl=max(expires_at - time.time(), 0.001))
+        return version
+
+    def delete(self, sid):
+        '''Takes session id. Removes session.'''
+        self.sessions.invalidate(sid)
+
+    def sweep(self, _now=None):
+        '''Removes expired sessions. Returns number removed.'''
+        return self.sessions.remove_expired()
+
+
+# ==== SESSION INTERFACE ====
+
+class ServerSession(SecureCookieSession):
+    '''Session dict (tracking access and changes like flask's cookie session) with its id.'''
+
+    def __init__(self, initial=None, sid=None, new=False, expires_at=0.0):
+        super().__init__(initial)
+        self.sid = sid or secrets.token_urlsafe(32)
+        self.new = new
+        self.expires_at = expires_at
+        # Who the session belonged to when loaded, to tell when someone logs in
+        self.loaded_user = (initial or {}).get('username')
+
+
+class StoreSessionInterface(SessionInterface):
+    '''Flask session interface keeping session data in a store, and the session id in the cookie.'''
+    serializer = session_json_serializer
+
+    def __init__(self, store, cache=None):
+        self.store = store
+        self.cache = cache
+
+    def load(self, sid):
+        '''Takes session id. Returns (data dict, expires_at) tuple, or None if there's no
+            current session. Decoded sessions come from the cache while their version is current.
+        '''
+        now = time.time()
+        cached = self.cache.get(sid) if self.cache else None
+        try:
+            # The cached copy is only used while it's the stored version, so a session deleted
+            #   or changed by another process (ie. logged out) isn't trusted until the TTL is up
+            if cached and cached[1] > now and self.store.get_version(sid, now) == cached[2]:
+                # A copy, so changes made during the request (ie. list appends) stay out of cache
+                return copy.deepcopy(cached[0]), cached[1]
+            record = self.store.get(sid, now)
+        except sqlite3.Error as error:
+            print(error)
+            return None
+        if record is None:
+            if cached:
+                self.cache.invalidate(sid)
+            return None
+        data = self.serializer.loads(record[0])
+        if self.cache:
+            self.cache.set(sid, (copy.deepcopy(data), record[1], record[2]))
+        return data, record[1]
+
+    def open_session(self, app, request):
+        '''Takes app and request. Returns the request's session, or a new empty one.'''
+        sid = request.cookies.get(self.get_cookie_name(app))
+        loaded = self.load(sid) if sid else None
+        if loaded is None:
+            return ServerSession(new=True)
+        return ServerSession(loaded[0], sid, expires_at=loaded[1])
+
+    def save_session(self, app, session, response):
+        '''Takes app, session and response. Stores session if it changed (or is due a refresh),
+            and sets or deletes the session cookie.
+        '''
+        name, domain, path = (self.get_cookie_name(app), self.get_cookie_domain(app),
+            self.get_cookie_path(app))
+        if session.accessed:
+            response.vary.add('Cookie')
+        if not session:
+            # Emptied (ie. logged out): forget the session and its cookie
+            if session.modified:
+                if not session.new:
+                    self.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path,
+                    secure=self.get_cookie_secure(app), httponly=self.get_cookie_httponly(app),
+                    samesite=self.get_cookie_samesite(app))
+            return
+        if not session.new and session.get('username') not in (None, session.loaded_user):
+            # Logged in: a new id, so an id planted before log in (session fixation) is useless
+            self.delete(session.sid)
+            session.sid = secrets.token_urlsafe(32)
+        now = time.time()
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        if session.modified or session.expires_at - now < lifetime / 2:
+            session.expires_at = now + lifetime
+            try:
+                version = self.store.set(
+                    session.sid, self.serializer.dumps(dict(session)), session.expires_at)
+            except sqlite3.Error as error:
+                print(error)
+                return
+            if self.cache:
+                self.cache.set(
+                    session.sid, (copy.deepcopy(dict(session)), session.expires_at, version))
+        if self.should_set_cookie(app, session):
+            response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+
+    def delete(self, sid):
+        '''Takes session id. Removes session from the store and cache.'''
+        if self.cache:
+            self.cache.invalidate(sid)
+        try:
+            self.store.delete(sid)
+        except sqlite3.Error as error:
+            print(error)
+
+
+# ==== SWEEPER ====
+
+class SessionSweeper:
+    '''Background thread removing expired sessions from a store every interval (seconds).'''
+
+    def __init__(self, store, interval=SESSION_SWEEP_SECONDS):
+        self.store = store
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run(self):
+        '''Sweeper loop: sweeps, then sleeps until the interval passes or it is stopped.'''
+        while not self._stop.is_set():
+            try:
+                self.store.sweep()
+            except sqlite3.Error as error:
+                # ie. database locked, the next sweep catches up
+                print(error)
+            self._stop.wait(self.interval)
+
+    def start(self):
+        '''Starts the sweeper (a daemon thread, so it doesn't block interpreter exit).'''
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name='session-sweeper', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        '''Stops and joins the sweeper thread.'''
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def get_session_interface(backend=SESSION_BACKEND, path=SESSION_DB):
+    '''Takes backend name ('sqlite' or 'memory') and sqlite session db file.
+        Returns session interface using that backend.
+    '''
+    if backend == 'memory':
+        return StoreSessionInterface(MemorySessionStore())
+    if backend == 'sqlite':
+        cache = LRUCache(SESSION_CACHE_SIZE, SESSION_CACHE_TTL) if SESSION_CACHE_TTL > 0 else None
+        return StoreSessionInterface(SqliteSessionStore(path), cache)
+    raise ValueError(f'Unknown session backend: {backend}')
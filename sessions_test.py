@@ -0,0 +1,188 @@
+'''Unit tests for the server-side session stores and session interface'''
+import sqlite3
+import time
+from flask import Flask, session
+from cache import LRUCache
+from constants import SESSION_DB_PRAGMAS
+from sessions import (MemorySessionStore, SessionSweeper, SqliteSessionStore,
+    StoreSessionInterface)
+# pylint: disable=line-too-long
+
+
+class CountingStore(MemorySessionStore):
+    '''Memory store counting reads and writes'''
+
+    def __init__(self):
+        super().__init__()
+        self.gets = 0
+        self.sets = 0
+
+    def get(self, sid, now=None):
+        '''Same as MemorySessionStore.get, counted'''
+        self.gets += 1
+        return super().get(sid, now)
+
+    def set(self, sid, data, expires_at):
+        '''Same as MemorySessionStore.set, counted'''
+        self.sets += 1
+        return super().set(sid, data, expires_at)
+
+
+def make_app(store, cache=None):
+    '''Takes session store and optional decoded session cache.
+        Returns Flask app using them, with log in, view and log out routes.
+    '''
+    app = Flask(__name__)
+    app.session_interface = StoreSessionInterface(store, cache)
+
+    @app.route('/login/<username>')
+    def login(username):
+        session.clear()
+        session['username'] = username
+        return 'ok'
+
+    @app.route('/whoami')
+    def whoami():
+        return session.get('username', 'nobody')
+
+    @app.route('/logout')
+    def logout():
+        session.clear()
+        return 'ok'
+
+    return app
+
+
+class TestSessionStores:
+    '''Tests storing, expiring and sweeping sessions'''
+
+    def test_sqlite_store(self, tmp_path):
+        '''Sessions are stored in a WAL mode table until they expire, then swept'''
+        store = SqliteSessionStore(str(tmp_path / 'sessions.db'))
+        with store.connection() as connection:
+            assert connection.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+            # Session pragmas, not the app database's (no memory map, shorter busy timeout)
+            assert connection.execute('PRAGMA busy_timeout').fetchone()[0] == SESSION_DB_PRAGMAS['busy_timeout']
+            assert connection.execute('PRAGMA mmap_size').fetchone()[0] == 0
+        store.set('a', '{"username": "suze"}', expires_at=2000)
+        store.set('b', '{}', expires_at=1000)
+        assert store.get('a', now=1500) == ('{"username": "suze"}', 2000, 1)
+        assert store.set('a', '{"username": "frank"}', expires_at=2000) == 2
+        assert store.get_version('a', now=1500) == 2
+        assert store.get('b', now=1500) is None
+        assert store.get_version('b', now=1500) is None
+        assert store.sweep(now=1500) == 1
+        store.delete('a')
+        assert store.get('a', now=1500) is None
+
+    def test_sqlite_store_adds_version(self, tmp_path):
+        '''A session file from before session versions gets the column, and its sessions are kept'''
+        path = str(tmp_path / 'sessions.db')
+        connection = sqlite3.connect(path)
+        connection.execute('CREATE TABLE sessions (id TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL) WITHOUT ROWID')
+        connection.execute("INSERT INTO sessions VALUES ('a', '{}', 2000)")
+        connection.commit()
+        connection.close()
+        store = SqliteSessionStore(path)
+        assert store.get('a', now=1500) == ('{}', 2000, 1)
+        assert store.set('a', '{}', expires_at=2000) == 2
+
+    def test_memory_store_is_bounded(self):
+        '''The least recently used sessions are dropped once the store is full'''
+        store = MemorySessionStore(max_size=2)
+        expires_at = time.time() + 60
+        for sid in ['a', 'b', 'c']:
+            store.set(sid, '{}', expires_at)
+        assert store.get('a') is None
+        assert store.get('c') == ('{}', expires_at, 1)
+        assert store.set('c', '{}', expires_at) == 2
+        store.set('d', '{}', time.time() + 0.01)
+        time.sleep(0.02)
+        assert store.sweep() == 1
+
+    def test_sweeper_thread(self, tmp_path):
+        '''The sweeper removes expired sessions in the background'''
+        store = SqliteSessionStore(str(tmp_path / 'sessions.db'))
+        store.set('old', '{}', expires_at=1)
+        sweeper = SessionSweeper(store, interval=60).start()
+        sweeper.stop()
+        with store.connection() as connection:
+            assert connection.execute('SELECT COUNT(*) FROM sessions').fetchone()[0] == 0
+
+
+class TestSessionInterface:
+    '''Tests sessions through a Flask app'''
+
+    def test_login_and_logout(self, tmp_path):
+        '''The cookie holds only the session id, and logging out deletes the session'''
+        store = SqliteSessionStore(str(tmp_path / 'sessions.db'))
+        client = make_app(store).test_client()
+        assert client.get('/whoami').text == 'nobody'
+        response = client.get('/login/suze')
+        sid = client.get_cookie('session').value
+        assert 'suze' not in response.headers['Set-Cookie']
+        assert store.get(sid)[0] == '{"username":"suze"}'
+        assert client.get('/whoami').text == 'suze'
+        client.get('/logout')
+        assert client.get_cookie('session') is None
+        assert store.get(sid) is None
+        assert client.get('/whoami').text == 'nobody'
+
+    def test_session_id_rotated_on_login(self, tmp_path):
+        '''Logging in issues a new session id and deletes the one used before (ie. planted by someone else)'''
+        store = SqliteSessionStore(str(tmp_path / 'sessions.db'))
+        store.set('planted', '{"visits": 1}', time.time() + 60)
+        client = make_app(store, LRUCache(8, ttl=60)).test_client()
+        client.set_cookie('session', 'planted')
+        client.get('/login/suze')
+        sid = client.get_cookie('session').value
+        assert sid != 'planted'
+        assert store.get('planted') is None
+        assert client.get('/whoami').text == 'suze'
+        # Logging in as someone else rotates it again, reading the session doesn't
+        client.get('/login/frank')
+        assert client.get_cookie('session').value not in ('planted', sid)
+        rotated = client.get_cookie('session').value
+        client.get('/whoami')
+        assert client.get_cookie('session').value == rotated
+
+    def test_unchanged_session_is_not_rewritten(self):
+        '''Requests that only read the session don't write it back or set the cookie'''
+        store = CountingStore()
+        client = make_app(store).test_client()
+        client.get('/login/suze')
+        response = client.get('/whoami')
+        assert store.sets == 1
+        assert 'Set-Cookie' not in response.headers
+        assert response.headers['Vary'] == 'Cookie'
+
+    def test_decoded_session_is_cached(self):
+        '''Cached sessions skip reading and decoding the stored data, and logging out removes them from the cache'''
+        store = CountingStore()
+        cache = LRUCache(8, ttl=60)
+        client = make_app(store, cache).test_client()
+        client.get('/login/suze')
+        for _ in range(3):
+            assert client.get('/whoami').text == 'suze'
+        assert store.gets == 0
+        client.get('/logout')
+        assert cache.stats()['size'] == 0
+        assert client.get('/whoami').text == 'nobody'
+
+    def test_cache_follows_other_processes(self, tmp_path):
+        '''A session changed or deleted by another process isn't served from this process's cache'''
+        path = str(tmp_path / 'sessions.db')
+        first = make_app(SqliteSessionStore(path), LRUCache(8, ttl=60)).test_client()
+        second_cache = LRUCache(8, ttl=60)
+        second = make_app(SqliteSessionStore(path), second_cache).test_client()
+        first.get('/login/suze')
+        sid = first.get_cookie('session').value
+        second.set_cookie('session', sid)
+        assert second.get('/whoami').text == 'suze'
+        assert second_cache.stats()['size'] == 1
+        # Changed, then logged out, by the first process only
+        SqliteSessionStore(path).set(sid, '{"username": "frank"}', time.time() + 60)
+        assert second.get('/whoami').text == 'frank'
+        first.get('/logout')
+        assert second.get('/whoami').text == 'nobody'
+        assert second_cache.stats()['size'] == 0
@@ -0,0 +1,183 @@
+'''This module houses the slow-query log. Statements run through instrumented cursors
+    (see metrics.py) that take longer than SLOW_QUERY_MS are written, at SLOW_QUERY_SAMPLE_RATE,
+    as JSON lines to a rotating log file, with their bound-parameter shapes (not values),
+    the calling function, the Flask endpoint and the EXPLAIN QUERY PLAN output.
+    Run as a script to list the top offenders:
+    python slow_query_log.py [log file] [--top N] [--sort total|max|count]
+'''
+import argparse
+from datetime import datetime, timezone
+import glob
+import json
+import logging
+from logging.handlers import RotatingFileHandler
+import os
+import random
+import re
+import sqlite3
+import sys
+import threading
+from flask import has_request_context, request
+from constants import (SLOW_QUERY_LOG, SLOW_QUERY_LOG_BACKUPS, SLOW_QUERY_LOG_MAX_BYTES,
+    SLOW_QUERY_MS, SLOW_QUERY_SAMPLE_RATE)
+
+# A plan step that reads a whole table (ie. 'SCAN hikes'), rather than searching an index
+FULL_SCAN = re.compile(r'^SCAN (\w+)(?: AS \w+)?$')
+# Frames from these files are skipped when looking for the calling function
+INSTRUMENTATION_FILES = ('metrics.py', 'slow_query_log.py')
+
+
+def param_shapes(params):
+    '''Takes bound parameters (sequence or mapping). Returns their type names, not values.'''
+    if isinstance(params, dict):
+        return {key: type(value).__name__ for key, value in params.items()}
+    return [type(value).__name__ for value in params]
+
+
+def explain(connection, sql, params):
+    '''Takes connection, sql string and bound parameters.
+        Returns list of EXPLAIN QUERY PLAN steps, indented by depth.
+    '''
+    # A plain cursor, so the EXPLAIN isn't itself instrumented (or logged)
+    rows = sqlite3.Cursor(connection).execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+    depths = {0: -1}
+    plan = []
+    for step_id, parent_id, _, detail in rows:
+        depths[step_id] = depths.get(parent_id, -1) + 1
+        plan.append('  ' * depths[step_id] + detail)
+    return plan
+
+
+def get_caller():
+    '''Returns 'module.function' of the nearest caller outside the instrumentation,
+        preferring a utils.py function.
+    '''
+    frame = sys._getframe(1)  # pylint: disable=protected-access
+    caller = None
+    while frame is not None:
+        filename = os.path.basename(frame.f_code.co_filename)
+        if filename not in INSTRUMENTATION_FILES:
+            name = f'{filename[:-len(".py")]}.{frame.f_code.co_name}'
+            if filename == 'utils.py':
+                return name
+            caller = caller or name
+        frame = frame.f_back
+    return caller
+
+
+class SlowQueryLog:
+    '''Writes sampled slow statements to a rotating JSON-lines file.'''
+
+    def __init__(self, path, threshold_ms, sample_rate=1.0, max_bytes=5_000_000, backups=3):
+        self.path = path
+        self.threshold_seconds = threshold_ms / 1000 if threshold_ms > 0 else float('inf')
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._logger = None
+        self._lock = threading.Lock()
+
+    def get_logger(self):
+        '''Returns logger writing to the rotating file, created on first use.'''
+        with self._lock:
+            if self._logger is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                handler = RotatingFileHandler(
+                    self.path, maxBytes=self.max_bytes, backupCount=self.backups,
+                    encoding='utf-8')
+                handler.setFormatter(logging.Formatter('%(message)s'))
+                # Not registered with logging.getLogger, so app log config doesn't touch it
+                self._logger = logging.Logger('slow_queries')
+                self._logger.addHandler(handler)
+            return self._logger
+
+    def observe(self, connection, method, args, seconds):
+        '''Takes connection, cursor method name, its args and seconds taken.
+            Logs the statement if it is slower than the threshold and is sampled.
+        '''
+        if seconds < self.threshold_seconds or random.random() >= self.sample_rate:
+            return
+        sql = args[0]
+        params = args[1] if len(args) > 1 else ()
+        if method == 'executemany':
+            # Log the shape of the first parameter set (an iterator may already be used up)
+            params = params[0] if isinstance(params, (list, tuple)) and params else ()
+        entry = {
+            'time': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+            'ms': round(seconds * 1000, 3),
+            'sql': ' '.join(sql.split()),
+            'method': method,
+            'params': param_shapes(params),
+            'caller': get_caller(),
+            'endpoint': request.endpoint if has_request_context() else None,
+        }
+        if method != 'executescript':
+            try:
+                entry['plan'] = explain(connection, sql, params)
+            except sqlite3.Error as error:
+                entry['plan_error'] = str(error)
+            entry['full_scans'] = sorted({match.group(1) for match
+                in map(FULL_SCAN.match, (step.strip() for step in entry.get('plan', [])))
+                if match})
+        self.get_logger().warning(json.dumps(entry))
+
+
+slow_log = SlowQueryLog(SLOW_QUERY_LOG, SLOW_QUERY_MS, SLOW_QUERY_SAMPLE_RATE,
+    SLOW_QUERY_LOG_MAX_BYTES, SLOW_QUERY_LOG_BACKUPS)
+
+
+# ==== REPORT ====
+
+def read_entries(path):
+    '''Takes log file path. Yields entries from it and its rotated backups (oldest first).'''
+    backups = sorted(glob.glob(f'{glob.escape(path)}.*'),
+        key=lambda name: int(name.rsplit('.', 1)[1]) if name.rsplit('.', 1)[1].isdigit() else 0,
+        reverse=True)
+    for filename in backups + [path]:
+        if not os.path.exists(filename):
+            continue
+        with open(filename, 'r', encoding='utf-8') as log_file:
+            for line in log_file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def aggregate(entries):
+    '''Takes iterable of log entries.
+        Returns list of per-statement dicts (count, total/max ms, callers, full scans, plan).
+    '''
+    statements = {}
+    for entry in entries:
+        statement = statements.setdefault(entry['sql'], {
+            'sql': entry['sql'], 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+            'callers': set(), 'full_scans': set(), 'plan': entry.get('plan', [])})
+        statement['count'] += 1
+        statement['total_ms'] += entry['ms']
+        statement['max_ms'] = max(statement['max_ms'], entry['ms'])
+        statement['callers'].add(entry.get('caller') or '?')
+        statement['full_scans'].update(entry.get('full_scans', []))
+    return list(statements.values())
+
+
+def main():
+    '''Parses command line args. Prints the top N statements from the slow-query log.'''
+    parser = argparse.ArgumentParser(description='Top offenders in the slow-query log.')
+    parser.add_argument('path', nargs='?', default=SLOW_QUERY_LOG)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--sort', choices=['total', 'max', 'count'], default='total')
+    args = parser.parse_args()
+    sort_key = {'total': 'total_ms', 'max': 'max_ms', 'count': 'count'}[args.sort]
+    statements = sorted(aggregate(read_entries(args.path)), key=lambda statement:
+        statement[sort_key], reverse=True)
+    for rank, statement in enumerate(statements[:args.top], start=1):
+        print(f'{rank}. {statement["count"]}x  total {statement["total_ms"]:.1f} ms  '
+            f'max {statement["max_ms"]:.1f} ms  from {", ".join(sorted(statement["callers"]))}')
+        if statement['full_scans']:
+            print(f'   FULL SCAN of {", ".join(sorted(statement["full_scans"]))}')
+        print(f'   {statement["sql"]}')
+        for step in statement['plan']:
+            print(f'     {step}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+'''Unit tests for the slow-query log and its top offenders report'''
+import json
+import metrics
+from connection_pool import open_connection
+from init_sql import migrate
+from slow_query_log import SlowQueryLog, aggregate, read_entries
+from utils import get_user_by_username
+# pylint: disable=line-too-long
+
+
+def read_log(path):
+    '''Takes log file path. Returns list of logged entries.'''
+    return list(read_entries(str(path)))
+
+
+class TestSlowQueryLog:
+    '''Tests logging slow statements with their plan, and aggregating the log'''
+
+    def test_logs_statement_with_plan(self, tmp_path, monkeypatch):
+        '''Statements over the threshold are logged with parameter shapes, caller and query plan'''
+        log_path = tmp_path / 'slow.jsonl'
+        # A tiny threshold logs every statement
+        monkeypatch.setattr(metrics, 'slow_log', SlowQueryLog(str(log_path), threshold_ms=1e-9))
+        db = str(tmp_path / 'slow.db')
+        migrate(db)
+        get_user_by_username(db, 'suze')
+        connection = open_connection(db)
+        connection.execute('SELECT * FROM hikes WHERE trailhead = ?', ('Rad Trail',)).fetchall()
+        connection.close()
+        entries = read_log(log_path)
+        lookup = [entry for entry in entries if entry['caller'] == 'utils.get_user_by_username'][-1]
+        assert lookup['sql'] == 'SELECT * FROM users WHERE username = ?'
+        assert lookup['params'] == ['str']
+        assert lookup['plan'] == ['SEARCH users USING INDEX sqlite_autoindex_users_1 (username=?)']
+        assert lookup['full_scans'] == []
+        assert entries[-1]['full_scans'] == ['hikes']
+        assert entries[-1]['caller'] == 'slow_query_log_test.test_logs_statement_with_plan'
+
+    def test_fast_and_unsampled_statements_are_skipped(self, tmp_path):
+        '''Nothing is logged under the threshold, or when the sample rate is zero'''
+        connection = open_connection(':memory:')
+        for slow_log in [SlowQueryLog(str(tmp_path / 'slow.jsonl'), threshold_ms=0),
+                SlowQueryLog(str(tmp_path / 'slow.jsonl'), threshold_ms=1e-9, sample_rate=0)]:
+            slow_log.observe(connection, 'execute', ('SELECT 1',), 10.0)
+        connection.close()
+        assert not (tmp_path / 'slow.jsonl').exists()
+
+    def test_aggregate_rotated_logs(self, tmp_path):
+        '''The report reads rotated backups too, and totals each statement'''
+        entry = {'sql': 'SELECT * FROM hikes', 'ms': 10.0, 'caller': 'utils.get_hikes', 'full_scans': ['hikes'], 'plan': ['SCAN hikes']}
+        (tmp_path / 'slow.jsonl.1').write_text(json.dumps(entry) + '\n', encoding='utf-8')
+        (tmp_path / 'slow.jsonl').write_text(json.dumps(dict(entry, ms=30.0)) + '\n', encoding='utf-8')
+        statements = aggregate(read_log(tmp_path / 'slow.jsonl'))
+        assert len(statements) == 1
+        statement = statements[0]
+        assert (statement['count'], statement['total_ms'], statement['max_ms']) == (2, 40.0, 30.0)
+        assert statement['full_scans'] == {'hikes'}
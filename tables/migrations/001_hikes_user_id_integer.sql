@@ -0,0 +1,32 @@
+-- hikes.user_id was declared TEXT, so ids were stored and returned as strings.
+-- SQLite can't change a column type in place, so rebuild the table with an INTEGER column.
+CREATE TABLE hikes_rebuild (
+  id INTEGER,
+  hike_date DATE NOT NULL,
+  user_id INTEGER,
+  area_id INTEGER,
+  area_name TEXT NOT NULL,
+  trailhead TEXT,
+  trails_cs TEXT,
+  distance_km FLOAT,
+  image_url TEXT,
+  image_alt TEXT,
+  map_link TEXT,
+  other_info TEXT,
+  PRIMARY KEY (id)
+  FOREIGN KEY (area_id) REFERENCES areas(id)
+  FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
+INSERT INTO hikes_rebuild (
+  id, hike_date, user_id, area_id, area_name, trailhead, trails_cs,
+  distance_km, image_url, image_alt, map_link, other_info
+)
+SELECT
+  id, hike_date, CAST(user_id AS INTEGER), area_id, area_name, trailhead, trails_cs,
+  distance_km, image_url, image_alt, map_link, other_info
+FROM hikes;
+
+DROP TABLE hikes;
+
+ALTER TABLE hikes_rebuild RENAME TO hikes;
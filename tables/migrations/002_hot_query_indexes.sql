@@ -0,0 +1,8 @@
+-- A user's hikes newest first (user page, most recent hike image, feed per followee).
+CREATE INDEX IF NOT EXISTS hikes_user_date_idx ON hikes (user_id, hike_date DESC, id DESC);
+
+-- Hikes in an area by date.
+CREATE INDEX IF NOT EXISTS hikes_area_date_idx ON hikes (area_id, hike_date);
+
+-- Followers of a user (the primary key only covers lookups by follower_id).
+CREATE INDEX IF NOT EXISTS follows_followee_idx ON follows (followee_id);
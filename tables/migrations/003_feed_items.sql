@@ -0,0 +1,19 @@
+-- Materialized timelines for FEED_MODE = 'write' (fan-out-on-write): one row per hike in each
+-- follower's feed, kept current by add_hike, update_hike, delete_hike and follow.
+CREATE TABLE IF NOT EXISTS feed_items (
+  owner_id INTEGER NOT NULL,
+  hike_date DATE NOT NULL,
+  hike_id INTEGER NOT NULL,
+  PRIMARY KEY (owner_id, hike_date, hike_id)
+  FOREIGN KEY (owner_id) REFERENCES users(id)
+  FOREIGN KEY (hike_id) REFERENCES hikes(id)
+) WITHOUT ROWID;
+
+-- Updating or deleting a hike touches every feed it was fanned out to
+CREATE INDEX IF NOT EXISTS feed_items_hike_idx ON feed_items (hike_id);
+
+-- Key/value app state that has to survive restarts (ie. the feed mode feed_items was built for)
+CREATE TABLE IF NOT EXISTS settings (
+  key TEXT PRIMARY KEY,
+  value TEXT
+);
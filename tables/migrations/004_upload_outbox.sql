@@ -0,0 +1,22 @@
+-- Outbox of image uploads waiting for the background workers in uploads.py. Rows are written
+-- in the same transaction as their hike, so a hike never loses its upload (or vice versa).
+-- next_attempt_at (unix time) schedules retries and leases claimed rows to one worker.
+CREATE TABLE IF NOT EXISTS upload_outbox (
+  id INTEGER,
+  hike_id INTEGER NOT NULL,
+  spool_path TEXT NOT NULL,
+  public_id TEXT NOT NULL,
+  status TEXT NOT NULL DEFAULT 'pending',
+  attempts INTEGER NOT NULL DEFAULT 0,
+  next_attempt_at REAL NOT NULL DEFAULT 0,
+  last_error TEXT,
+  created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (id)
+  FOREIGN KEY (hike_id) REFERENCES hikes(id)
+);
+
+-- Workers look for the oldest due pending row
+CREATE INDEX IF NOT EXISTS upload_outbox_due_idx ON upload_outbox (status, next_attempt_at);
+
+-- Completing an upload checks for a newer upload of the same hike
+CREATE INDEX IF NOT EXISTS upload_outbox_hike_idx ON upload_outbox (hike_id);
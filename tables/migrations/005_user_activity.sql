@@ -0,0 +1,54 @@
+-- Per-user change counters for HTTP validators (ETag / Last-Modified) on user pages and feeds.
+-- hikes_version goes up whenever one of the user's hikes is added, changed or deleted,
+-- follows_version whenever the user follows or unfollows someone. updated_at is unix time.
+-- Kept current by triggers, so every write path (including upload workers) is covered.
+CREATE TABLE IF NOT EXISTS user_activity (
+  user_id INTEGER PRIMARY KEY,
+  hikes_version INTEGER NOT NULL DEFAULT 0,
+  follows_version INTEGER NOT NULL DEFAULT 0,
+  updated_at INTEGER NOT NULL,
+  FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
+INSERT OR IGNORE INTO user_activity (user_id, hikes_version, updated_at)
+SELECT id, 1, CAST(strftime('%s', 'now') AS INTEGER) FROM users;
+
+CREATE TRIGGER IF NOT EXISTS hikes_activity_insert AFTER INSERT ON hikes
+BEGIN
+  INSERT INTO user_activity (user_id, hikes_version, updated_at)
+  VALUES (NEW.user_id, 1, CAST(strftime('%s', 'now') AS INTEGER))
+  ON CONFLICT (user_id) DO UPDATE
+  SET hikes_version = hikes_version + 1, updated_at = excluded.updated_at;
+END;
+
+CREATE TRIGGER IF NOT EXISTS hikes_activity_update AFTER UPDATE ON hikes
+BEGIN
+  INSERT INTO user_activity (user_id, hikes_version, updated_at)
+  VALUES (NEW.user_id, 1, CAST(strftime('%s', 'now') AS INTEGER))
+  ON CONFLICT (user_id) DO UPDATE
+  SET hikes_version = hikes_version + 1, updated_at = excluded.updated_at;
+END;
+
+CREATE TRIGGER IF NOT EXISTS hikes_activity_delete AFTER DELETE ON hikes
+BEGIN
+  INSERT INTO user_activity (user_id, hikes_version, updated_at)
+  VALUES (OLD.user_id, 1, CAST(strftime('%s', 'now') AS INTEGER))
+  ON CONFLICT (user_id) DO UPDATE
+  SET hikes_version = hikes_version + 1, updated_at = excluded.updated_at;
+END;
+
+CREATE TRIGGER IF NOT EXISTS follows_activity_insert AFTER INSERT ON follows
+BEGIN
+  INSERT INTO user_activity (user_id, follows_version, updated_at)
+  VALUES (NEW.follower_id, 1, CAST(strftime('%s', 'now') AS INTEGER))
+  ON CONFLICT (user_id) DO UPDATE
+  SET follows_version = follows_version + 1, updated_at = excluded.updated_at;
+END;
+
+CREATE TRIGGER IF NOT EXISTS follows_activity_delete AFTER DELETE ON follows
+BEGIN
+  INSERT INTO user_activity (user_id, follows_version, updated_at)
+  VALUES (OLD.follower_id, 1, CAST(strftime('%s', 'now') AS INTEGER))
+  ON CONFLICT (user_id) DO UPDATE
+  SET follows_version = follows_version + 1, updated_at = excluded.updated_at;
+END;
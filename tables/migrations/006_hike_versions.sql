@@ -0,0 +1,6 @@
+-- Render version of each hike, the key of its cached HTML fragment (see fragments.py).
+-- add_hike, update_hike and completed uploads set it from the 'hike_version' counter in settings,
+-- which only goes up, so a deleted hike's reused id never matches a fragment cached for it.
+ALTER TABLE hikes ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
+
+INSERT OR IGNORE INTO settings (key, value) VALUES ('hike_version', 0);
@@ -0,0 +1,54 @@
+-- trails.trail_name was UNIQUE across all areas, so a trail name already used in one area was
+-- silently dropped when added to another. Rebuild the table with names unique per area.
+CREATE TABLE trails_rebuild (
+  id INTEGER,
+  area_id INTEGER,
+  trail_name TEXT NOT NULL,
+  PRIMARY KEY (id),
+  UNIQUE (area_id, trail_name),
+  FOREIGN KEY (area_id) REFERENCES areas(id)
+);
+
+INSERT INTO trails_rebuild (id, area_id, trail_name)
+SELECT id, area_id, trail_name FROM trails;
+
+DROP TABLE trails;
+
+ALTER TABLE trails_rebuild RENAME TO trails;
+
+-- Trails of each hike (one row per trail in hikes.trails_cs), kept current by add_hike,
+-- update_hike and delete_hike. hike_date is copied from the hike so a trail's hikes are read
+-- newest first, and paginated with (hike_date, hike_id) cursors, straight from the primary key.
+CREATE TABLE IF NOT EXISTS hike_trails (
+  trail_id INTEGER NOT NULL,
+  hike_date DATE NOT NULL,
+  hike_id INTEGER NOT NULL,
+  PRIMARY KEY (trail_id, hike_date, hike_id)
+  FOREIGN KEY (trail_id) REFERENCES trails(id)
+  FOREIGN KEY (hike_id) REFERENCES hikes(id)
+) WITHOUT ROWID;
+
+-- Updating or deleting a hike replaces its rows
+CREATE INDEX IF NOT EXISTS hike_trails_hike_idx ON hike_trails (hike_id);
+
+-- Backfill: split each hike's trails_cs on ', ' (as the app does), add the trails missing from
+-- the hike's area, then link every hike to its trails.
+CREATE TEMP TABLE split_trails AS
+WITH RECURSIVE split (hike_id, hike_date, area_id, trail_name, rest) AS (
+  SELECT id, hike_date, area_id, NULL, trails_cs || ', ' FROM hikes
+  WHERE area_id IS NOT NULL AND trails_cs IS NOT NULL AND trails_cs != ''
+  UNION ALL
+  SELECT hike_id, hike_date, area_id, substr(rest, 1, instr(rest, ', ') - 1),
+    substr(rest, instr(rest, ', ') + 2)
+  FROM split WHERE rest != ''
+)
+SELECT hike_id, hike_date, area_id, trail_name FROM split WHERE trail_name != '';
+
+INSERT OR IGNORE INTO trails (area_id, trail_name)
+SELECT area_id, trail_name FROM split_trails ORDER BY hike_id;
+
+INSERT OR IGNORE INTO hike_trails (trail_id, hike_date, hike_id)
+SELECT trails.id, split_trails.hike_date, split_trails.hike_id FROM split_trails
+JOIN trails ON trails.area_id = split_trails.area_id AND trails.trail_name = split_trails.trail_name;
+
+DROP TABLE split_trails;
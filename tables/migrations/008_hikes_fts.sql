@@ -0,0 +1,37 @@
+-- Full-text index over the searchable hike fields, for /search (see search.py). It's an
+-- external content table: the text stays in hikes, the index is kept current by the triggers
+-- below, so every write path (including upload workers) is covered. 3 character prefixes are
+-- indexed as well, so a word being typed doesn't merge the rows of every word it starts.
+CREATE VIRTUAL TABLE IF NOT EXISTS hikes_fts USING fts5 (
+  area_name, trailhead, trails_cs, other_info,
+  content = 'hikes', content_rowid = 'id', tokenize = 'unicode61 remove_diacritics 2',
+  prefix = '3'
+);
+
+-- Rank with BM25, a match in the area or trail names counts for more than one in the notes
+INSERT INTO hikes_fts (hikes_fts, rank) VALUES ('rank', 'bm25(4.0, 2.0, 3.0, 1.0)');
+
+CREATE TRIGGER IF NOT EXISTS hikes_fts_insert AFTER INSERT ON hikes
+BEGIN
+  INSERT INTO hikes_fts (rowid, area_name, trailhead, trails_cs, other_info)
+  VALUES (NEW.id, NEW.area_name, NEW.trailhead, NEW.trails_cs, NEW.other_info);
+END;
+
+CREATE TRIGGER IF NOT EXISTS hikes_fts_delete AFTER DELETE ON hikes
+BEGIN
+  INSERT INTO hikes_fts (hikes_fts, rowid, area_name, trailhead, trails_cs, other_info)
+  VALUES ('delete', OLD.id, OLD.area_name, OLD.trailhead, OLD.trails_cs, OLD.other_info);
+END;
+
+-- Only changes to indexed fields touch the index (ie. not a finished image upload)
+CREATE TRIGGER IF NOT EXISTS hikes_fts_update
+AFTER UPDATE OF area_name, trailhead, trails_cs, other_info ON hikes
+BEGIN
+  INSERT INTO hikes_fts (hikes_fts, rowid, area_name, trailhead, trails_cs, other_info)
+  VALUES ('delete', OLD.id, OLD.area_name, OLD.trailhead, OLD.trails_cs, OLD.other_info);
+  INSERT INTO hikes_fts (rowid, area_name, trailhead, trails_cs, other_info)
+  VALUES (NEW.id, NEW.area_name, NEW.trailhead, NEW.trails_cs, NEW.other_info);
+END;
+
+-- Index the existing hikes
+INSERT INTO hikes_fts (hikes_fts) VALUES ('rebuild');
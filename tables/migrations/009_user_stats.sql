@@ -0,0 +1,123 @@
+-- Profile stats rollups (see user_stats.py): totals per user, per user and month (YYYY-MM of
+-- hike_date) and hikes per user and area, which counts the user's distinct areas.
+-- Kept current by triggers, so every write path (including upload workers) is covered.
+-- Users without hikes have no rows. `python user_stats.py` checks them against a full recompute.
+CREATE TABLE IF NOT EXISTS user_stats (
+  user_id INTEGER PRIMARY KEY,
+  hike_count INTEGER NOT NULL,
+  total_km FLOAT NOT NULL,
+  area_count INTEGER NOT NULL,
+  longest_km FLOAT NOT NULL,
+  FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
+CREATE TABLE IF NOT EXISTS user_monthly_stats (
+  user_id INTEGER NOT NULL,
+  month TEXT NOT NULL,
+  hike_count INTEGER NOT NULL,
+  total_km FLOAT NOT NULL,
+  PRIMARY KEY (user_id, month)
+  FOREIGN KEY (user_id) REFERENCES users(id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS user_area_stats (
+  user_id INTEGER NOT NULL,
+  area_name TEXT NOT NULL,
+  hike_count INTEGER NOT NULL,
+  PRIMARY KEY (user_id, area_name)
+  FOREIGN KEY (user_id) REFERENCES users(id)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS user_stats_insert AFTER INSERT ON hikes
+BEGIN
+  INSERT INTO user_area_stats (user_id, area_name, hike_count)
+  VALUES (NEW.user_id, NEW.area_name, 1)
+  ON CONFLICT (user_id, area_name) DO UPDATE SET hike_count = hike_count + 1;
+  INSERT INTO user_stats (user_id, hike_count, total_km, area_count, longest_km)
+  VALUES (NEW.user_id, 1, coalesce(NEW.distance_km, 0), 1, coalesce(NEW.distance_km, 0))
+  ON CONFLICT (user_id) DO UPDATE
+  SET hike_count = hike_count + 1, total_km = total_km + excluded.total_km,
+    longest_km = max(longest_km, excluded.longest_km),
+    -- A new area for the user if this is its first hike there
+    area_count = area_count + (SELECT hike_count = 1 FROM user_area_stats
+      WHERE user_id = NEW.user_id AND area_name = NEW.area_name);
+  INSERT INTO user_monthly_stats (user_id, month, hike_count, total_km)
+  VALUES (NEW.user_id, substr(NEW.hike_date, 1, 7), 1, coalesce(NEW.distance_km, 0))
+  ON CONFLICT (user_id, month) DO UPDATE
+  SET hike_count = hike_count + 1, total_km = total_km + excluded.total_km;
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_stats_delete AFTER DELETE ON hikes
+BEGIN
+  UPDATE user_area_stats SET hike_count = hike_count - 1
+  WHERE user_id = OLD.user_id AND area_name = OLD.area_name;
+  UPDATE user_stats
+  SET hike_count = hike_count - 1, total_km = total_km - coalesce(OLD.distance_km, 0),
+    area_count = area_count - (SELECT hike_count = 0 FROM user_area_stats
+      WHERE user_id = OLD.user_id AND area_name = OLD.area_name),
+    -- Only deleting the longest hike needs the next longest, from the user's remaining hikes
+    longest_km = CASE WHEN coalesce(OLD.distance_km, 0) < longest_km THEN longest_km
+      ELSE (SELECT coalesce(max(distance_km), 0) FROM hikes WHERE user_id = OLD.user_id) END
+  WHERE user_id = OLD.user_id;
+  UPDATE user_monthly_stats
+  SET hike_count = hike_count - 1, total_km = total_km - coalesce(OLD.distance_km, 0)
+  WHERE user_id = OLD.user_id AND month = substr(OLD.hike_date, 1, 7);
+  DELETE FROM user_area_stats
+  WHERE user_id = OLD.user_id AND area_name = OLD.area_name AND hike_count = 0;
+  DELETE FROM user_monthly_stats
+  WHERE user_id = OLD.user_id AND month = substr(OLD.hike_date, 1, 7) AND hike_count = 0;
+  DELETE FROM user_stats WHERE user_id = OLD.user_id AND hike_count = 0;
+END;
+
+-- An edit moves the hike out of its old user, month and area and into its new ones. Only
+-- changes to the summed fields touch the rollups (ie. not a finished image upload).
+CREATE TRIGGER IF NOT EXISTS user_stats_update
+AFTER UPDATE OF hike_date, user_id, area_name, distance_km ON hikes
+BEGIN
+  UPDATE user_area_stats SET hike_count = hike_count - 1
+  WHERE user_id = OLD.user_id AND area_name = OLD.area_name;
+  UPDATE user_stats
+  SET hike_count = hike_count - 1, total_km = total_km - coalesce(OLD.distance_km, 0),
+    area_count = area_count - (SELECT hike_count = 0 FROM user_area_stats
+      WHERE user_id = OLD.user_id AND area_name = OLD.area_name),
+    -- hikes already holds the new values, so this is the longest after the edit
+    longest_km = CASE WHEN coalesce(OLD.distance_km, 0) < longest_km THEN longest_km
+      ELSE (SELECT coalesce(max(distance_km), 0) FROM hikes WHERE user_id = OLD.user_id) END
+  WHERE user_id = OLD.user_id;
+  UPDATE user_monthly_stats
+  SET hike_count = hike_count - 1, total_km = total_km - coalesce(OLD.distance_km, 0)
+  WHERE user_id = OLD.user_id AND month = substr(OLD.hike_date, 1, 7);
+  DELETE FROM user_area_stats
+  WHERE user_id = OLD.user_id AND area_name = OLD.area_name AND hike_count = 0;
+  DELETE FROM user_monthly_stats
+  WHERE user_id = OLD.user_id AND month = substr(OLD.hike_date, 1, 7) AND hike_count = 0;
+  DELETE FROM user_stats WHERE user_id = OLD.user_id AND hike_count = 0;
+
+  INSERT INTO user_area_stats (user_id, area_name, hike_count)
+  VALUES (NEW.user_id, NEW.area_name, 1)
+  ON CONFLICT (user_id, area_name) DO UPDATE SET hike_count = hike_count + 1;
+  INSERT INTO user_stats (user_id, hike_count, total_km, area_count, longest_km)
+  VALUES (NEW.user_id, 1, coalesce(NEW.distance_km, 0), 1, coalesce(NEW.distance_km, 0))
+  ON CONFLICT (user_id) DO UPDATE
+  SET hike_count = hike_count + 1, total_km = total_km + excluded.total_km,
+    longest_km = max(longest_km, excluded.longest_km),
+    area_count = area_count + (SELECT hike_count = 1 FROM user_area_stats
+      WHERE user_id = NEW.user_id AND area_name = NEW.area_name);
+  INSERT INTO user_monthly_stats (user_id, month, hike_count, total_km)
+  VALUES (NEW.user_id, substr(NEW.hike_date, 1, 7), 1, coalesce(NEW.distance_km, 0))
+  ON CONFLICT (user_id, month) DO UPDATE
+  SET hike_count = hike_count + 1, total_km = total_km + excluded.total_km;
+END;
+
+-- Fill the rollups from the existing hikes (same queries as user_stats.rebuild_user_stats)
+INSERT INTO user_stats (user_id, hike_count, total_km, area_count, longest_km)
+SELECT user_id, count(*), total(distance_km), count(DISTINCT area_name),
+  coalesce(max(distance_km), 0)
+FROM hikes GROUP BY user_id;
+
+INSERT INTO user_monthly_stats (user_id, month, hike_count, total_km)
+SELECT user_id, substr(hike_date, 1, 7), count(*), total(distance_km)
+FROM hikes GROUP BY user_id, substr(hike_date, 1, 7);
+
+INSERT INTO user_area_stats (user_id, area_name, hike_count)
+SELECT user_id, area_name, count(*) FROM hikes GROUP BY user_id, area_name;
@@ -0,0 +1,27 @@
+-- Ranked snapshots of this month's top hikers by km (see leaderboards.py), rebuilt every
+-- LEADERBOARD_REFRESH_SECONDS by the refresher: one board per follower (among their followees)
+-- and one per area. The month and build time (unix) of the snapshot are kept in settings.
+CREATE TABLE IF NOT EXISTS followee_leaderboards (
+  follower_id INTEGER NOT NULL,
+  rank INTEGER NOT NULL,
+  user_id INTEGER NOT NULL,
+  total_km FLOAT NOT NULL,
+  hike_count INTEGER NOT NULL,
+  PRIMARY KEY (follower_id, rank)
+  FOREIGN KEY (follower_id) REFERENCES users(id)
+  FOREIGN KEY (user_id) REFERENCES users(id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS area_leaderboards (
+  area_id INTEGER NOT NULL,
+  rank INTEGER NOT NULL,
+  user_id INTEGER NOT NULL,
+  total_km FLOAT NOT NULL,
+  hike_count INTEGER NOT NULL,
+  PRIMARY KEY (area_id, rank)
+  FOREIGN KEY (area_id) REFERENCES areas(id)
+  FOREIGN KEY (user_id) REFERENCES users(id)
+) WITHOUT ROWID;
+
+-- The area boards are built from the month's hikes only
+CREATE INDEX IF NOT EXISTS hikes_date_idx ON hikes (hike_date);
@@ -1,3 +1,5 @@
+-- Base schema (version 0). Changes to existing tables go in ./migrations as numbered scripts.
+
 CREATE TABLE IF NOT EXISTS users (
   id INTEGER,
   username TEXT NOT NULL UNIQUE,
@@ -0,0 +1,34 @@
+'''This module houses test support shared by the unit tests (as fixtures in conftest.py) and the
+    route benchmarks: a hike form, a database with two users, and loading the Flask app.
+'''
+import importlib
+import os
+from init_sql import migrate
+from utils import add_user
+
+HIKE = {'hike_date': '2025-01-01', 'area_name': 'Neat Place', 'trailhead': 'Start',
+    'trails_cs': 'Rad Trail', 'distance_km': '3.3', 'image_url': '', 'other_info': ''}
+
+
+def make_db(db):
+    '''Takes db file. Migrates it and adds users suze (1) and frank (2). Returns db file.'''
+    migrate(db)
+    add_user(db, 'suze', 'x')
+    add_user(db, 'frank', 'x')
+    return db
+
+
+def load_app(directory):
+    '''Takes temporary directory. Imports the Flask app with its session files and startup
+        database in that directory, and upload workers and the leaderboard refresher stopped.
+        Returns app module.
+    '''
+    working_directory = os.getcwd()
+    os.chdir(directory)
+    try:
+        app_module = importlib.import_module('app')
+    finally:
+        os.chdir(working_directory)
+    app_module.upload_workers.stop()
+    app_module.leaderboard_refresher.stop()
+    return app_module
@@ -0,0 +1,207 @@
+'''This module houses the background image upload pipeline.
+    A request only writes the uploaded image to local spool storage and records an
+    upload_outbox row in the same transaction as the hike, then returns. Worker threads
+    claim due outbox rows, upload the spooled file, and set the hike's image_url when done.
+    Failed uploads are retried with exponential backoff, and a claim is only a lease
+    (next_attempt_at is pushed forward), so rows claimed by a crashed process are retried too.
+'''
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+import cloudinary
+import cloudinary.uploader
+from constants import (UPLOADER, UPLOAD_LEASE_SECONDS, UPLOAD_MAX_ATTEMPTS, UPLOAD_POLL_SECONDS,
+    UPLOAD_RETRY_SECONDS, UPLOAD_SPOOL_DIR, UPLOAD_WORKERS)
+from fragments import next_hike_version
+from writer import run_write
+
+
+# ==== UPLOADERS ====
+# Uploaders only need an upload(path, public_id) method
+# pylint: disable=too-few-public-methods
+
+class CloudinaryUploader:
+    '''Uploads images to cloudinary.'''
+
+    def upload(self, path, public_id):
+        '''Takes spooled file path and public id. Uploads file, raises on failure.'''
+        cloudinary.uploader.upload(
+            path,
+            public_id=public_id,
+            unique_filename=False,
+            overwrite=True,
+            eager='c_lfill,w_900|q_auto:best')
+
+
+class LocalUploader:
+    '''Stand-in uploader that copies images to a local directory, for tests and offline use.'''
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def upload(self, path, public_id):
+        '''Takes spooled file path and public id. Copies file to <directory>/<public_id>.'''
+        os.makedirs(self.directory, exist_ok=True)
+        shutil.copyfile(path, os.path.join(self.directory, public_id))
+
+
+def get_uploader(name=UPLOADER):
+    '''Takes uploader name ('cloudinary' or 'local'). Returns uploader instance.'''
+    if name == 'local':
+        return LocalUploader(os.path.join(UPLOAD_SPOOL_DIR, 'uploaded'))
+    return CloudinaryUploader()
+
+
+# ==== SPOOL & OUTBOX ====
+
+def spool_upload(file, username, spool_dir=UPLOAD_SPOOL_DIR):
+    '''Takes file from file input, username, and optional spool directory.
+        Saves file to spool storage.
+        Returns pending upload dict (spool path and cloudinary public_id), or None if no file.
+    '''
+    if not file:
+        return None
+    os.makedirs(spool_dir, exist_ok=True)
+    # Spooled files get unique names, public_id is username + filename without the extension
+    spool_path = os.path.join(spool_dir, uuid.uuid4().hex)
+    file.save(spool_path)
+    return {'spool_path': spool_path, 'public_id': username + file.filename.split('.')[0]}
+
+
+def discard_upload(pending_upload):
+    '''Takes pending upload dict from spool_upload (or None).
+        Removes its spooled file, ie. when the hike it was for couldn't be saved.
+    '''
+    if pending_upload and os.path.exists(pending_upload['spool_path']):
+        os.remove(pending_upload['spool_path'])
+
+
+def queue_upload(cursor, hike_id, pending_upload):
+    '''Takes cursor of an open transaction, hike id and pending upload dict.
+        Records outbox row, committed (or rolled back) together with the hike.
+    '''
+    cursor.execute(
+        'INSERT INTO upload_outbox (hike_id, spool_path, public_id) VALUES (?, ?, ?)',
+        (hike_id, pending_upload['spool_path'], pending_upload['public_id']))
+
+
+def claim_upload(db, now=None):
+    '''Takes db file and optional current unix time.
+        Leases the oldest due outbox row.
+        Returns dict of upload data (including attempts so far), or None if nothing is due.
+    '''
+    now = time.time() if now is None else now
+
+    def write(cursor):
+        cursor.execute(
+            'UPDATE upload_outbox SET attempts = attempts + 1, next_attempt_at = ? '
+            'WHERE id = (SELECT id FROM upload_outbox WHERE status = \'pending\' '
+            'AND next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT 1) '
+            'RETURNING id, hike_id, spool_path, public_id, attempts',
+            (now + UPLOAD_LEASE_SECONDS, now))
+        return cursor.fetchone()
+
+    row = run_write(db, write)
+    if row is None:
+        return None
+    return dict(zip(('id', 'hike_id', 'spool_path', 'public_id', 'attempts'), row))
+
+
+def complete_upload(db, upload):
+    '''Takes db file and claimed upload dict.
+        Marks upload done and sets hike image_url, unless a newer upload for the hike is queued.
+    '''
+    def write(cursor):
+        # A new version, so the hike's cached HTML (still showing the old image) isn't reused
+        version = next_hike_version(cursor)
+        cursor.execute(
+            'UPDATE hikes SET image_url = ?, version = ? WHERE id = ? AND NOT EXISTS '
+            '(SELECT 1 FROM upload_outbox WHERE hike_id = ? AND id > ?)',
+            (upload['public_id'], version, upload['hike_id'], upload['hike_id'], upload['id']))
+        cursor.execute(
+            'UPDATE upload_outbox SET status = \'done\', last_error = NULL WHERE id = ?',
+            (upload['id'],))
+
+    run_write(db, write)
+    if os.path.exists(upload['spool_path']):
+        os.remove(upload['spool_path'])
+
+
+def retry_upload(db, upload, error, now=None):
+    '''Takes db file, claimed upload dict, error and optional current unix time.
+        Schedules next attempt with exponential backoff, or marks upload failed
+        once UPLOAD_MAX_ATTEMPTS is reached (the spooled file is kept for inspection).
+    '''
+    now = time.time() if now is None else now
+    status = 'failed' if upload['attempts'] >= UPLOAD_MAX_ATTEMPTS else 'pending'
+    delay = UPLOAD_RETRY_SECONDS * 2 ** (upload['attempts'] - 1)
+    run_write(db, lambda cursor: cursor.execute(
+        'UPDATE upload_outbox SET status = ?, next_attempt_at = ?, last_error = ? WHERE id = ?',
+        (status, now + delay, str(error), upload['id'])))
+
+
+# ==== WORKERS ====
+
+class UploadWorkers:
+    '''Background threads that drain the upload outbox of a database.'''
+
+    def __init__(self, db, uploader, threads=UPLOAD_WORKERS):
+        self.db = db
+        self.uploader = uploader
+        self.threads = threads
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._workers = []
+
+    def run_once(self, now=None):
+        '''Takes optional current unix time. Claims and uploads one due outbox row.
+            Returns True if a row was processed, False if nothing was due.
+        '''
+        try:
+            upload = claim_upload(self.db, now)
+            if upload is None:
+                return False
+            try:
+                self.uploader.upload(upload['spool_path'], upload['public_id'])
+            except Exception as error:  # pylint: disable=broad-exception-caught
+                # Any uploader error (network, file, api) is retried, a bad file can't stop a worker
+                print(error)
+                retry_upload(self.db, upload, error, now)
+                return True
+            complete_upload(self.db, upload)
+        except sqlite3.Error as error:
+            # ie. database locked, the row's lease runs out and it is claimed again later
+            print(error)
+            return False
+        return True
+
+    def run(self):
+        '''Worker loop: processes due rows, sleeps until notified or the poll interval passes.'''
+        while not self._stop.is_set():
+            if not self.run_once():
+                self._wake.wait(UPLOAD_POLL_SECONDS)
+                self._wake.clear()
+
+    def notify(self):
+        '''Wakes sleeping workers (ie. right after a request queued an upload).'''
+        self._wake.set()
+
+    def start(self):
+        '''Starts worker threads (daemon threads, so they don't block interpreter exit).'''
+        self._stop.clear()
+        for _ in range(self.threads - len(self._workers)):
+            worker = threading.Thread(target=self.run, name='upload-worker', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        return self
+
+    def stop(self):
+        '''Stops and joins worker threads.'''
+        self._stop.set()
+        self._wake.set()
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
@@ -0,0 +1,141 @@
+'''Unit tests for the background image upload pipeline'''
+import io
+import os
+import sqlite3
+import pytest
+from werkzeug.datastructures import FileStorage
+from init_sql import migrate
+from testing import HIKE
+import uploads
+from uploads import LocalUploader, UploadWorkers, claim_upload, complete_upload, spool_upload
+from utils import add_hike, get_hikes, save_new_hike, update_hike
+# pylint: disable=line-too-long
+
+
+class FailingUploader:  # pylint: disable=too-few-public-methods
+    '''Uploader that always fails, like an unreachable upload service'''
+
+    def upload(self, path, public_id):
+        '''Raises for every upload'''
+        raise ConnectionError(f'Upload of {public_id} from {path} failed')
+
+
+def add_hike_with_image(tmp_path, filename='pic.jpg'):
+    '''Takes pytest tmp_path. Creates db with a hike whose image is spooled.
+        Returns db file and pending upload dict.
+    '''
+    db = str(tmp_path / 'uploads.db')
+    migrate(db)
+    file = FileStorage(stream=open(__file__, 'rb'), filename=filename)  # pylint: disable=consider-using-with
+    pending_upload = spool_upload(file, 'suze', str(tmp_path / 'spool'))
+    file.close()
+    assert add_hike(db, 1, 1, dict(HIKE), pending_upload=pending_upload) == 0
+    return db, pending_upload
+
+
+def get_outbox(db):
+    '''Takes db file. Returns list of (status, attempts) for every outbox row'''
+    connection = sqlite3.connect(db)
+    rows = connection.execute('SELECT status, attempts FROM upload_outbox ORDER BY id').fetchall()
+    connection.close()
+    return rows
+
+
+class TestUploadPipeline:
+    '''Tests spooling, uploading and retrying hike images'''
+
+    def test_no_file_is_not_spooled(self, tmp_path):
+        '''Submitting a hike without an image queues nothing'''
+        assert spool_upload(None, 'suze', str(tmp_path)) is None
+
+    def test_upload_sets_image_url(self, tmp_path):
+        '''The hike is saved straight away and gets its image_url once a worker uploads it'''
+        db, pending_upload = add_hike_with_image(tmp_path)
+        assert pending_upload['public_id'] == 'suzepic'
+        assert get_hikes(db, 1)[0]['image_url'] == ''
+        assert get_outbox(db) == [('pending', 0)]
+        workers = UploadWorkers(db, LocalUploader(str(tmp_path / 'uploaded')))
+        assert workers.run_once() is True
+        assert workers.run_once() is False
+        assert get_hikes(db, 1)[0]['image_url'] == 'suzepic'
+        assert get_outbox(db) == [('done', 1)]
+        assert os.path.exists(tmp_path / 'uploaded' / 'suzepic')
+        assert not os.path.exists(pending_upload['spool_path'])
+
+    def test_failed_upload_is_retried_then_failed(self, tmp_path):
+        '''Failed uploads back off exponentially and are marked failed after the last attempt'''
+        db, pending_upload = add_hike_with_image(tmp_path)
+        workers = UploadWorkers(db, FailingUploader())
+        assert workers.run_once(now=1000) is True
+        # Not due again until the backoff delay (UPLOAD_RETRY_SECONDS) has passed
+        assert workers.run_once(now=1001) is False
+        assert get_outbox(db) == [('pending', 1)]
+        for now in (1002, 1006, 1014, 1030):
+            assert workers.run_once(now=now) is True
+        assert get_outbox(db) == [('failed', 5)]
+        assert workers.run_once(now=10 ** 9) is False
+        # The hike keeps no image and the spooled file is kept for inspection
+        assert get_hikes(db, 1)[0]['image_url'] == ''
+        assert os.path.exists(pending_upload['spool_path'])
+
+    def test_older_upload_does_not_replace_newer(self, tmp_path):
+        '''When a hike's image is replaced before the first upload finishes, the newest image wins'''
+        db, _ = add_hike_with_image(tmp_path, 'first.jpg')
+        file = FileStorage(stream=open(__file__, 'rb'), filename='second.jpg')  # pylint: disable=consider-using-with
+        second_upload = spool_upload(file, 'suze', str(tmp_path / 'spool'))
+        file.close()
+        assert update_hike(db, get_hikes(db, 1)[0], {'image_url': ''}, pending_upload=second_upload) == 0
+        first, second = claim_upload(db), claim_upload(db)
+        assert (first['public_id'], second['public_id']) == ('suzefirst', 'suzesecond')
+        # The newer upload finishes first
+        complete_upload(db, second)
+        complete_upload(db, first)
+        assert get_hikes(db, 1)[0]['image_url'] == 'suzesecond'
+        assert get_outbox(db) == [('done', 1), ('done', 1)]
+
+
+@pytest.fixture(name='spool_dir')
+def fixture_spool_dir(tmp_path, monkeypatch):
+    '''Returns directory the app's uploads are spooled to in this test.'''
+    spool_dir = str(tmp_path / 'spool')
+    spool = uploads.spool_upload
+    monkeypatch.setattr(uploads, 'spool_upload', lambda file, username: spool(file, username, spool_dir))
+    return spool_dir
+
+
+@pytest.fixture(name='client')
+def fixture_client(app_module, monkeypatch):
+    '''Returns test client logged in as suze, where every hike write fails.'''
+    locked = sqlite3.OperationalError('database is locked')
+    monkeypatch.setattr(app_module, 'save_new_hike', lambda *args, **kwargs: locked)
+    monkeypatch.setattr(app_module, 'save_hike_changes', lambda *args, **kwargs: locked)
+    client = app_module.app.test_client()
+    with client.session_transaction() as session:
+        session['username'], session['user_id'] = 'suze', 1
+    return client
+
+
+def post_form(client, path, form):
+    '''Takes test client, form path and extra form data. Posts the hike form with an image.'''
+    form = dict(HIKE, image_alt='', map_link='', **form)
+    form['image_url'] = (io.BytesIO(b'image'), 'pic.jpg')
+    return client.post(path, data=form, content_type='multipart/form-data')
+
+
+class TestFailedSave:
+    '''Tests a hike form whose write fails shows an error and drops its spooled image'''
+
+    def test_new_hike(self, client, spool_dir):
+        '''A new hike that can't be saved is a server error, not a redirect'''
+        response = post_form(client, '/new-hike', {})
+        assert response.status_code == 500
+        assert b'Your hike could not be saved' in response.data
+        assert not os.listdir(spool_dir)
+
+    def test_edit_hike(self, db, client, spool_dir):
+        '''An edit that can't be saved is a server error, not a redirect'''
+        save_new_hike(db, 1, HIKE)
+        response = post_form(client, '/edit-hike/1', {'action': 'save'})
+        assert response.status_code == 500
+        assert b'Your hike could not be saved' in response.data
+        assert not os.listdir(spool_dir)
@@ -0,0 +1,127 @@
+'''This module houses the profile stats shown on /users/<username>: hike count, total km,
+    distinct areas, longest hike and km per month. They are read from rollup tables
+    (tables/migrations/009_user_stats.sql) that triggers keep current as hikes are added, edited
+    and deleted, so a profile view reads a few rows instead of aggregating all of the user's hikes.
+    Run as a script to check the rollups against a full recompute, or to rebuild them from hikes:
+    python user_stats.py [db file] [--rebuild]
+'''
+import argparse
+import math
+import sqlite3
+import sys
+from connection_pool import scoped_connection
+from constants import DB, PROFILE_STATS_MONTHS
+from writer import try_write
+
+# Full recompute of each rollup from hikes, keyed the way the rollup tables are
+RECOMPUTE_QUERIES = {
+    'user_stats': (
+        ('user_id',), ('hike_count', 'total_km', 'area_count', 'longest_km'),
+        'SELECT user_id, count(*), total(distance_km), count(DISTINCT area_name), '
+        'coalesce(max(distance_km), 0) FROM hikes GROUP BY user_id'),
+    'user_monthly_stats': (
+        ('user_id', 'month'), ('hike_count', 'total_km'),
+        'SELECT user_id, substr(hike_date, 1, 7), count(*), total(distance_km) FROM hikes '
+        'GROUP BY user_id, substr(hike_date, 1, 7)'),
+    'user_area_stats': (
+        ('user_id', 'area_name'), ('hike_count',),
+        'SELECT user_id, area_name, count(*) FROM hikes GROUP BY user_id, area_name'),
+}
+# km are summed one hike at a time by the triggers, so allow for float rounding
+KM_TOLERANCE = 1e-6
+
+
+def get_user_stats(db, user_id, months=PROFILE_STATS_MONTHS):
+    '''Takes db file, user id and number of months.
+        Returns dict of the user's hike count, total km, distinct areas and longest hike (km),
+        and list of dicts of hikes and km for each of their latest months hiked, newest first.
+    '''
+    stats = {'hike_count': 0, 'total_km': 0.0, 'area_count': 0, 'longest_km': 0.0, 'months': []}
+    with scoped_connection(db) as db_connection:
+        try:
+            db_connection['cursor'].execute(
+                'SELECT hike_count, total_km, area_count, longest_km FROM user_stats '
+                'WHERE user_id = ?', (user_id,))
+            row = db_connection['cursor'].fetchone()
+            db_connection['cursor'].execute(
+                'SELECT month, hike_count, total_km FROM user_monthly_stats WHERE user_id = ? '
+                'ORDER BY month DESC LIMIT ?', (user_id, months))
+            months_data = db_connection['cursor'].fetchall()
+        except sqlite3.Error as error:
+            print(error)
+            return stats
+    if row:
+        stats.update(zip(('hike_count', 'total_km', 'area_count', 'longest_km'), row))
+    stats['months'] = [{'month': month, 'hike_count': hike_count, 'total_km': total_km}
+        for month, hike_count, total_km in months_data]
+    return stats
+
+
+def matches(stored, expected):
+    '''Takes stored and recomputed values of a rollup row. Returns True if they agree.'''
+    return all(math.isclose(stored_value, expected_value, abs_tol=KM_TOLERANCE)
+        if isinstance(expected_value, float) else stored_value == expected_value
+        for stored_value, expected_value in zip(stored, expected))
+
+
+def check_user_stats(db):
+    '''Takes db file. Recomputes every rollup from hikes and compares it with the stored one.
+        Returns list of dicts describing each mismatched row (table, key, stored and expected
+        values, None for a missing row), empty if the rollups are current, or the error.
+    '''
+    mismatches = []
+    with scoped_connection(db) as db_connection:
+        try:
+            for table, (key_columns, value_columns, query) in RECOMPUTE_QUERIES.items():
+                expected = {row[:len(key_columns)]: row[len(key_columns):]
+                    for row in db_connection['cursor'].execute(query)}
+                stored = {row[:len(key_columns)]: row[len(key_columns):]
+                    for row in db_connection['cursor'].execute(
+                        f'SELECT {", ".join(key_columns + value_columns)} FROM {table}')}
+                for key in sorted(expected.keys() | stored.keys(), key=str):
+                    if key in stored and key in expected and matches(stored[key], expected[key]):
+                        continue
+                    mismatches.append({'table': table, 'key': dict(zip(key_columns, key)),
+                        'stored': stored.get(key), 'expected': expected.get(key)})
+        except sqlite3.Error as error:
+            print(error)
+            return error
+    return mismatches
+
+
+def rebuild_user_stats(db):
+    '''Takes db file. Replaces every rollup with a full recompute from hikes, in one transaction.
+        Returns 0 on success, or the error.
+    '''
+    def write(cursor):
+        for table, (key_columns, value_columns, query) in RECOMPUTE_QUERIES.items():
+            cursor.execute(f'DELETE FROM {table}')
+            cursor.execute(
+                f'INSERT INTO {table} ({", ".join(key_columns + value_columns)}) {query}')
+
+    return try_write(db, write)
+
+
+def main():
+    '''Parses command line args. Prints rollup rows that don't match a full recompute and exits
+        with status 1 if there are any, or rebuilds the rollups with --rebuild.
+    '''
+    parser = argparse.ArgumentParser(description='Check or rebuild the profile stats rollups.')
+    parser.add_argument('db', nargs='?', default=DB)
+    parser.add_argument('--rebuild', action='store_true',
+        help='replace the rollups with a full recompute from hikes')
+    args = parser.parse_args()
+    if args.rebuild:
+        sys.exit(1 if rebuild_user_stats(args.db) else 0)
+    mismatches = check_user_stats(args.db)
+    if isinstance(mismatches, sqlite3.Error):
+        sys.exit(1)
+    for mismatch in mismatches:
+        print(f'{mismatch["table"]} {mismatch["key"]}: stored {mismatch["stored"]}, '
+            f'expected {mismatch["expected"]}')
+    print(f'{len(mismatches)} mismatched rows')
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+'''Unit tests for the profile stats rollups'''
+import sqlite3
+import pytest
+from testing import HIKE
+from user_stats import check_user_stats, get_user_stats, main, rebuild_user_stats
+from utils import delete_hike, save_hike_changes, save_new_hike
+# pylint: disable=line-too-long
+
+
+@pytest.fixture(name='db')
+def fixture_db(db):
+    '''Returns db file where suze (1) has 3 hikes in 2 areas over 2 months, frank (2) has none.'''
+    save_new_hike(db, 1, dict(HIKE, distance_km='4.5'))
+    save_new_hike(db, 1, dict(HIKE, hike_date='2025-01-20', distance_km='12.25'))
+    save_new_hike(db, 1, dict(HIKE, hike_date='2025-02-02', area_name='Other Place', distance_km='3'))
+    return db
+
+
+def get_totals(db, user_id):
+    '''Takes db file and user id. Returns tuple of the user's hike count, total km, areas and longest km.'''
+    stats = get_user_stats(db, user_id)
+    return stats['hike_count'], stats['total_km'], stats['area_count'], stats['longest_km']
+
+
+class TestUserStats:
+    '''Tests the rollups follow hikes as they're added, edited and deleted'''
+
+    def test_new_hikes(self, db):
+        '''Totals and months are summed as hikes are added'''
+        assert get_totals(db, 1) == (3, 19.75, 2, 12.25)
+        assert get_user_stats(db, 1)['months'] == [
+            {'month': '2025-02', 'hike_count': 1, 'total_km': 3.0},
+            {'month': '2025-01', 'hike_count': 2, 'total_km': 16.75}]
+        assert get_user_stats(db, 2) == {'hike_count': 0, 'total_km': 0.0, 'area_count': 0, 'longest_km': 0.0, 'months': []}
+        assert not check_user_stats(db)
+
+    def test_edited_hikes(self, db):
+        '''An edit moves the hike to its new month and area, and shortening the longest hike finds the next longest'''
+        save_hike_changes(db, 2, dict(HIKE, hike_date='2025-03-01', area_name='Other Place', distance_km='2'))
+        assert get_totals(db, 1) == (3, 9.5, 2, 4.5)
+        assert [month['month'] for month in get_user_stats(db, 1)['months']] == ['2025-03', '2025-02', '2025-01']
+        save_hike_changes(db, 1, dict(HIKE, area_name='Other Place', distance_km='4.5'))
+        assert get_totals(db, 1)[2] == 1
+        assert not check_user_stats(db)
+
+    def test_deleted_hikes(self, db):
+        '''Deleting the longest hike finds the next longest, deleting every hike removes the rollups'''
+        delete_hike(db, 2, 1)
+        assert get_totals(db, 1) == (2, 7.5, 2, 4.5)
+        delete_hike(db, 3, 1)
+        assert get_totals(db, 1) == (1, 4.5, 1, 4.5)
+        assert [month['month'] for month in get_user_stats(db, 1)['months']] == ['2025-01']
+        delete_hike(db, 1, 1)
+        assert get_user_stats(db, 1)['hike_count'] == 0
+        connection = sqlite3.connect(db)
+        assert connection.execute('SELECT (SELECT count(*) FROM user_stats) + (SELECT count(*) FROM user_monthly_stats) + (SELECT count(*) FROM user_area_stats)').fetchone() == (0,)
+        connection.close()
+
+    def test_check_and_rebuild(self, db):
+        '''check_user_stats finds rows that don't match a full recompute, rebuild_user_stats fixes them'''
+        connection = sqlite3.connect(db)
+        connection.executescript("""
+            UPDATE user_stats SET total_km = 1 WHERE user_id = 1;
+            DELETE FROM user_monthly_stats WHERE month = '2025-02';
+            INSERT INTO user_area_stats (user_id, area_name, hike_count) VALUES (2, 'Neat Place', 1);""")
+        connection.close()
+        mismatches = check_user_stats(db)
+        assert [(mismatch['table'], mismatch['key']) for mismatch in mismatches] == [
+            ('user_stats', {'user_id': 1}),
+            ('user_monthly_stats', {'user_id': 1, 'month': '2025-02'}),
+            ('user_area_stats', {'user_id': 2, 'area_name': 'Neat Place'})]
+        assert mismatches[1]['stored'] is None and mismatches[1]['expected'] == (1, 3.0)
+        assert rebuild_user_stats(db) == 0
+        assert not check_user_stats(db)
+        assert get_totals(db, 1) == (3, 19.75, 2, 12.25)
+
+    def test_command(self, db, monkeypatch, capsys):
+        '''The command exits with status 1 while rollups are stale, --rebuild fixes them'''
+        sqlite3.connect(db).executescript('UPDATE user_stats SET hike_count = 9;')
+        for args, status in [([db], 1), ([db, '--rebuild'], 0), ([db], 0)]:
+            monkeypatch.setattr('sys.argv', ['user_stats.py'] + args)
+            with pytest.raises(SystemExit) as exit_info:
+                main()
+            assert exit_info.value.code == status
+        assert "user_stats {'user_id': 1}: stored (9, 19.75, 2, 12.25), expected (3, 19.75, 2, 12.25)" in capsys.readouterr().out
+
+
+class TestProfileStats:
+    '''Tests the stats on user pages'''
+
+    def test_user_page_stats(self, app_module):
+        '''A user's page shows their totals and km per month'''
+        page = app_module.app.test_client().get('/users/suze').data.decode()
+        assert '<p class="stat">19.8</p><p>km total</p>' in page
+        assert '<p class="stat">12.2</p><p>km longest hike</p>' in page
+        assert '2025-01: 16.8 km (2 hikes)' in page
+        assert '2025-02: 3.0 km (1 hike)' in page
+
+    def test_stats_update_etag(self, db, app_module):
+        '''A new hike changes the page's ETag, so cached stats aren't reused'''
+        client = app_module.app.test_client()
+        etag = client.get('/users/suze').headers['ETag']
+        save_new_hike(db, 1, dict(HIKE, distance_km='1'))
+        page = client.get('/users/suze', headers={'If-None-Match': etag})
+        assert page.status_code == 200
+        assert '<p class="stat">20.8</p>' in page.data.decode()
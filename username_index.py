@@ -0,0 +1,174 @@
+'''This module houses the in-process character index used by the user search.
+    Every username gets a position, and each character maps to a bitmask of the positions
+    whose username contains that character. Counting how many query characters each username
+    contains is then a handful of bitwise operations over whole bitmasks (bit-sliced counters),
+    instead of a python loop over every username.
+    The users table stays the source of truth: an index catches up on new rows (by id) before
+    each search, so users added by other processes are picked up too.
+'''
+import re
+import threading
+
+NONZERO_BYTE = re.compile(rb'[^\x00]')
+
+
+def iter_positions(mask):
+    '''Takes bitmask (int). Yields positions of the set bits in ascending order.'''
+    data = mask.to_bytes((mask.bit_length() + 7) // 8, 'little')
+    # Let the regex engine skip the empty bytes, only decode the ones with bits set
+    for match in NONZERO_BYTE.finditer(data):
+        byte = data[match.start()]
+        base = match.start() * 8
+        while byte:
+            lowest = byte & -byte
+            yield base + lowest.bit_length() - 1
+            byte ^= lowest
+
+
+class UsernameIndex:
+    '''Character bitmask index over usernames ordered by user id.'''
+
+    def __init__(self):
+        self.usernames = []
+        self.first_id = 0
+        self.last_id = 0
+        self.char_masks = {}
+        self.length_masks = {}
+
+    def add(self, user_id, username):
+        '''Takes user id and username. Appends username at the next position.'''
+        bit = 1 << len(self.usernames)
+        self.usernames.append(username)
+        self.first_id = self.first_id or user_id
+        self.last_id = user_id
+        for char in set(username):
+            self.char_masks[char] = self.char_masks.get(char, 0) | bit
+        self.length_masks[len(username)] = self.length_masks.get(len(username), 0) | bit
+
+    def load(self, rows):
+        '''Takes iterable of (id, username) rows ordered by id. Appends them in bulk.'''
+        start = len(self.usernames)
+        char_bits = {}
+        length_bits = {}
+        for user_id, username in rows:
+            position = len(self.usernames) - start
+            self.usernames.append(username)
+            self.first_id = self.first_id or user_id
+            self.last_id = user_id
+            for char in set(username):
+                char_bits.setdefault(char, []).append(position)
+            length_bits.setdefault(len(username), []).append(position)
+        # Build each new bitmask from a bytearray once, rather than growing a big int per user
+        for masks, bits in ((self.char_masks, char_bits), (self.length_masks, length_bits)):
+            for key, positions in bits.items():
+                buffer = bytearray((len(self.usernames) - start + 7) // 8)
+                for position in positions:
+                    buffer[position >> 3] |= 1 << (position & 7)
+                masks[key] = masks.get(key, 0) | (int.from_bytes(buffer, 'little') << start)
+
+    def snapshot(self):
+        '''Returns a copy of the index to search outside indexes_lock, unchanged by later adds.
+            The mask dicts are copied (their int bitmasks are never changed in place), the
+            usernames list is shared, since it is only appended to and a search only reads the
+            positions in its masks.
+        '''
+        copy = UsernameIndex()
+        copy.usernames = self.usernames
+        copy.first_id, copy.last_id = self.first_id, self.last_id
+        copy.char_masks = dict(self.char_masks)
+        copy.length_masks = dict(self.length_masks)
+        return copy
+
+    def count_matches(self, query):
+        '''Takes query string.
+            Returns dict of {frequency: bitmask of usernames where frequency query chars match}.
+        '''
+        # Bit-sliced counters: planes[i] holds bit i of every username's frequency
+        planes = []
+        for char in query:
+            carry = self.char_masks.get(char, 0)
+            for index, plane in enumerate(planes):
+                if not carry:
+                    break
+                planes[index], carry = plane ^ carry, plane & carry
+            if carry:
+                planes.append(carry)
+        all_positions = (1 << len(self.usernames)) - 1
+        frequencies = {}
+        for frequency in range(1, len(query) + 1):
+            if frequency >> len(planes):
+                break
+            mask = all_positions
+            for index, plane in enumerate(planes):
+                mask &= plane if frequency >> index & 1 else ~plane
+            if mask:
+                frequencies[frequency] = mask
+        return frequencies
+
+    def search(self, query, limit=None):
+        '''Takes query string and optional max number of results.
+            Returns list of (username, match_factor) tuples, highest match factor first.
+        '''
+        # Group (frequency, username length) buckets by match factor (frequency * accuracy)
+        buckets = {}
+        for frequency, frequency_mask in self.count_matches(query).items():
+            for length, length_mask in self.length_masks.items():
+                accuracy = frequency / length
+                if not (frequency > 2 or accuracy >= 0.5):
+                    continue
+                mask = frequency_mask & length_mask
+                if mask:
+                    match_factor = frequency * accuracy
+                    buckets[match_factor] = buckets.get(match_factor, 0) | mask
+        results = []
+        # Equal match factors keep user id order, like a stable sort over the users table
+        for match_factor in sorted(buckets, reverse=True):
+            for position in iter_positions(buckets[match_factor]):
+                results.append((self.usernames[position], match_factor))
+                if limit and len(results) >= limit:
+                    return results
+        return results
+
+
+indexes = {}
+indexes_lock = threading.Lock()
+
+
+def is_current(index, cursor):
+    '''Takes index and cursor.
+        Returns False if the first or last indexed user no longer matches the users table
+        (ie. the database file was recreated), True otherwise.
+    '''
+    if not index.usernames:
+        return True
+    cursor.execute(
+        'SELECT id, username FROM users WHERE id IN (?, ?) ORDER BY id',
+        (index.first_id, index.last_id))
+    expected = [(index.first_id, index.usernames[0]), (index.last_id, index.usernames[-1])]
+    return cursor.fetchall() == sorted(set(expected))
+
+
+def get_index(db, cursor):
+    '''Takes db file and cursor. Returns a snapshot of that database's index, caught up with the
+        users table, which is safe to search while other threads add users.
+    '''
+    with indexes_lock:
+        index = indexes.get(db)
+        if index is None or not is_current(index, cursor):
+            index = UsernameIndex()
+            indexes[db] = index
+        cursor.execute(
+            'SELECT id, username FROM users WHERE id > ? ORDER BY id', (index.last_id,))
+        index.load(cursor)
+        return index.snapshot()
+
+
+def record_user(db, user_id, username):
+    '''Takes db file, id and username of a newly added user.
+        Adds the user to an already built index. Gaps (ie. users added by another
+        process in between) are left for the catch-up in get_index.
+    '''
+    with indexes_lock:
+        index = indexes.get(db)
+        if index is not None and user_id == index.last_id + 1:
+            index.add(user_id, username)
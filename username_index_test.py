@@ -0,0 +1,79 @@
+'''Unit tests for the username character index'''
+import random
+import sqlite3
+import string
+from username_index import UsernameIndex, get_index, iter_positions, record_user
+# pylint: disable=line-too-long
+
+
+def score_all(usernames, query):
+    '''Reference implementation: scores every username (the original user search loop)'''
+    similar_users = {}
+    for username in usernames:
+        frequency = sum(1 for char in query if char in username)
+        accuracy = frequency / len(username)
+        if frequency > 2 or accuracy >= 0.5:
+            similar_users[username] = frequency * accuracy
+    return list(sorted(similar_users.items(), key=lambda item: item[1], reverse=True))
+
+
+def test_iter_positions():
+    '''Set bits are yielded in ascending order'''
+    assert not list(iter_positions(0))
+    assert list(iter_positions(0b1011 | 1 << 70)) == [0, 1, 3, 70]
+
+
+class TestUsernameIndex:
+    '''Tests that index search results match scoring every username'''
+
+    def make_usernames(self, count, seed=7):
+        '''Returns list of unique random usernames'''
+        generator = random.Random(seed)
+        usernames = []
+        while len(usernames) < count:
+            username = ''.join(generator.choices(string.ascii_lowercase[:8] + '12', k=generator.randint(1, 14)))
+            if username not in usernames:
+                usernames.append(username)
+        return usernames
+
+    def test_search_matches_full_scan(self):
+        '''Bulk loaded and individually added usernames rank exactly like the full scan'''
+        usernames = self.make_usernames(500)
+        index = UsernameIndex()
+        index.load(enumerate(usernames[:300], start=1))
+        for user_id, username in enumerate(usernames[300:], start=301):
+            index.add(user_id, username)
+        for query in ['abc', 'aaaa', 'h1', 'zzz', 'abcdefgh12', 'g', 'ddcc2ba']:
+            assert index.search(query) == score_all(usernames, query)
+            assert index.search(query, limit=5) == score_all(usernames, query)[:5]
+
+    def test_catches_up_with_users_table(self, tmp_path):
+        '''Users inserted elsewhere are picked up, and a recreated table resets the index'''
+        db = str(tmp_path / 'index.db')
+        connection = sqlite3.connect(db)
+        connection.execute('CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT)')
+        connection.execute("INSERT INTO users (username) VALUES ('suze'), ('frank')")
+        assert [name for name, _ in get_index(db, connection.cursor()).search('frank')] == ['frank']
+        # A user added by this process, then one added by another process
+        connection.execute("INSERT INTO users (username) VALUES ('frannie')")
+        record_user(db, 3, 'frannie')
+        connection.execute("INSERT INTO users (username) VALUES ('franky')")
+        assert [name for name, _ in get_index(db, connection.cursor()).search('frank')] == ['frank', 'franky', 'frannie']
+        # Recreate the table with different users
+        connection.execute('DELETE FROM users')
+        connection.execute("INSERT INTO users (id, username) VALUES (1, 'zed')")
+        assert get_index(db, connection.cursor()).usernames == ['zed']
+        connection.close()
+
+    def test_snapshot(self, tmp_path):
+        '''A search works from a snapshot, which users added after it don't change'''
+        db = str(tmp_path / 'index.db')
+        connection = sqlite3.connect(db)
+        connection.execute('CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT)')
+        connection.execute("INSERT INTO users (username) VALUES ('frank')")
+        snapshot = get_index(db, connection.cursor())
+        connection.execute("INSERT INTO users (username) VALUES ('franky')")
+        record_user(db, 2, 'franky')
+        assert [name for name, _ in snapshot.search('frank')] == ['frank']
+        assert [name for name, _ in get_index(db, connection.cursor()).search('frank')] == ['frank', 'franky']
+        connection.close()
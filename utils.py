@@ -2,11 +2,24 @@
 from functools import wraps
 import re
 import sqlite3
-import cloudinary
-from flask import render_template, session, redirect
+from urllib.parse import urlencode
+from flask import render_template, request, session, redirect
+from cache import LRUCache
+from connection_pool import open_connection, scoped_connection
+from constants import FEED_MODE, FEED_PAGE_SIZE, MAX_PAGE_SIZE, USER_CACHE_SIZE, USER_CACHE_TTL
 from content import hike_form_content
+from fragments import fragment_cache, invalidate_hike, next_hike_version
+from leaderboards import record_hike
+from records import decode_hikes
+from uploads import queue_upload
+from username_index import get_index, record_user
+from writer import run_write, try_write
 # pylint: disable=line-too-long
 
+# In-process caches. Users are keyed by (db, username), table columns by (db, table).
+user_cache = LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+table_columns_cache = LRUCache(64)
+
 # ===================
 # DATABASE CONNECTION
 
@@ -14,7 +27,7 @@ def create_connection(db):
     '''Takes sqlite3 db file as parameter.
         Returns library containing connection and cursor objects
     '''
-    connection = sqlite3.connect(db)
+    connection = open_connection(db)
     cursor = connection.cursor()
     return {'connection': connection, 'cursor': cursor}
 
@@ -43,13 +56,15 @@ def add_user(db, username, password_hash):
     # Break out for nonexistent string arg
     if not username or not password_hash:
         return 'Error: Required value not provided'
-    db_connection = create_connection(db)
     try:
-        db_connection['cursor'].execute('INSERT INTO users (username, password_hash) VALUES (?, ?)', (username, password_hash))
+        user_id = run_write(db, lambda cursor: cursor.execute(
+            'INSERT INTO users (username, password_hash) VALUES (?, ?)', (username, password_hash)).lastrowid)
     except sqlite3.Error as error:
         print(error)
         return error
-    commit_close_conn(db_connection['connection'])
+    # Keep this process's username search index current
+    record_user(db, user_id, username)
+    invalidate_user(db, username)
     return 0
 
 
@@ -60,14 +75,12 @@ def add_area(db, area_name):
     # Break out for nonexistent area name string
     if not area_name:
         return 'Error: Required value not provided'
-    db_connection = create_connection(db)
     try:
-        db_connection['cursor'].execute(
-            'INSERT OR IGNORE INTO areas (area_name) VALUES (?)', (area_name, ))
+        run_write(db, lambda cursor: cursor.execute(
+            'INSERT OR IGNORE INTO areas (area_name) VALUES (?)', (area_name, )))
     except sqlite3.Error as error:
         print(error)
         return 1
-    commit_close_conn(db_connection['connection'])
     return 0
 
 
@@ -76,73 +89,181 @@ def add_trail(db, area_id, trail_names):
         Retrieves area ID from db, and inserts trail data into db.
     '''
     trail_list = trail_names.split(', ')
-    db_connection = create_connection(db)
-    for trail_name in trail_list:
-        try:
-            db_connection['cursor'].execute(
+    def write(cursor):
+        for trail_name in trail_list:
+            cursor.execute(
                 'INSERT OR IGNORE INTO trails (area_id, trail_name) VALUES (?, ?)',
                 [area_id, trail_name])
-        except sqlite3.Error as error:
-            print(error)
-            return 1
-    commit_close_conn(db_connection['connection'])
+    try:
+        run_write(db, write)
+    except sqlite3.Error as error:
+        print(error)
+        return 1
     return 0
 
 
-def add_hike(db, user_id, area_id, form_data):
-    '''Takes hike data from form and area id from database.
-        Creates new hike in hikes table and inserts data.
+# pylint: disable-next=too-many-arguments
+def add_hike(db, user_id, area_id, form_data, feed_mode=FEED_MODE, *, pending_upload=None):
+    '''Takes hike data from form and area id from database, optional feed mode, and optional
+        pending upload dict (from uploads.spool_upload).
+        Creates new hike in hikes table and inserts data, and queues its image upload.
     '''
-    # Get list of keys from form data and append additional keys for user id and area id args
-    keys_list = list(form_data.keys()) + ['user_id', 'area_id']
-    # Convert list to comma-separated string
-    keys_string = ", ".join(keys_list)
-    # Get list of values from form data and append user_id and area_id
-    values_list = list(form_data.values()) + [user_id, area_id]
-    placeholders_string = '?, ' * (len(values_list))
-    # Create command string with list of keys and corresponding number of placeholder values
-    insert_cmd_string = f'INSERT INTO hikes ({keys_string}) VALUES ({placeholders_string.strip(" ,")})'
-
-    db_connection = create_connection(db)
     try:
-        db_connection['cursor'].execute(insert_cmd_string, values_list)
+        run_write(db, lambda cursor: insert_hike(cursor, user_id, area_id, form_data, feed_mode, pending_upload=pending_upload))
     except sqlite3.Error as error:
         print(error)
         return error
-    commit_close_conn(db_connection['connection'])
+    # Move the hiker up this process's leaderboards
+    record_hike(db, user_id, area_id, form_data.get('hike_date'))
     return 0
 
 
-def update_hike(db, existing_hike_data, updated_hike_data):
-    '''Takes preexisting hike data, and data from updade hike form'''
-    hike_id = existing_hike_data.get('id')
-    # Get keys from hike form data and create string of keys & placeholders for SET command
-    keys_string = ' = (?), '.join(updated_hike_data.keys()) + ' = (?)'
-    # Construct tuple of updated values plus the hike id to pass as second arg.
-    values_tuple = tuple(updated_hike_data.values()) + (hike_id,)
-    db_connection = create_connection(db)
+def update_hike(db, existing_hike_data, updated_hike_data, feed_mode=FEED_MODE, *, pending_upload=None):
+    '''Takes preexisting hike data, data from updade hike form, optional feed mode, and
+        optional pending upload dict (from uploads.spool_upload)
+    '''
     try:
-        db_connection['cursor'].execute(f'UPDATE hikes SET {keys_string} WHERE id = (?)', values_tuple)
+        run_write(db, lambda cursor: write_hike_update(cursor, existing_hike_data.get('id'), updated_hike_data, feed_mode, pending_upload=pending_upload))
     except sqlite3.Error as error:
         print(error)
         return error
-    commit_close_conn(db_connection['connection'])
     return 0
 
 
-def delete_hike(db, hike_id, user_id):
-    '''Takes the id of selected hike and id of logged in user'''
-    db_connection = create_connection(db)
-    try:
-        db_connection['cursor'].execute(
+def delete_hike(db, hike_id, user_id, feed_mode=FEED_MODE):
+    '''Takes the id of selected hike, id of logged in user, and optional feed mode'''
+    def write(cursor):
+        cursor.execute(
             'DELETE FROM hikes WHERE id = (?) AND user_id = (?)',
             (hike_id, user_id,)
         )
-        commit_close_conn(db_connection['connection'])
+        # Only purge trail links and timelines if the hike existed and belonged to this user
+        if cursor.rowcount:
+            cursor.execute('DELETE FROM hike_trails WHERE hike_id = (?)', (hike_id,))
+            if feed_mode == 'write':
+                cursor.execute('DELETE FROM feed_items WHERE hike_id = (?)', (hike_id,))
+
+    error = try_write(db, write)
+    if error:
+        return error
+    # Free the deleted hike's cached HTML (a reused id gets a newer version anyway)
+    invalidate_hike(hike_id)
+    return 0
+
+
+# ==== WRITE SERVICE ====
+# A hike form post touches areas, trails, hikes and hike_trails (plus feed_items and upload_outbox). Each
+# post is written by one of these as a single write (see writer.py): committed at once, and
+# nothing is left behind (ie. an area without its hike) if any statement fails.
+
+def upsert_area(cursor, area_name):
+    '''Takes cursor of an open transaction and area name.
+        Inserts the area if it's new. Returns area id.
+    '''
+    # The no-op update makes RETURNING give the id of an existing area too
+    cursor.execute(
+        'INSERT INTO areas (area_name) VALUES (?) '
+        'ON CONFLICT (area_name) DO UPDATE SET area_name = excluded.area_name RETURNING id',
+        (area_name, ))
+    return cursor.fetchone()[0]
+
+
+def link_trails(cursor, hike_id, hike_date, area_id, trail_names):
+    '''Takes cursor of an open transaction, hike id, hike date, area id and comma-separated
+        trail names. Inserts the trails that are new to the area, and links them to the hike.
+    '''
+    trail_list = [trail_name for trail_name in (trail_names or '').split(', ') if trail_name]
+    # Trails without an area can't be told apart, so they aren't linked
+    if area_id is None or not trail_list:
+        return
+    cursor.executemany(
+        'INSERT OR IGNORE INTO trails (area_id, trail_name) VALUES (?, ?)',
+        [(area_id, trail_name) for trail_name in trail_list])
+    cursor.executemany(
+        'INSERT OR IGNORE INTO hike_trails (trail_id, hike_date, hike_id) '
+        'SELECT id, ?, ? FROM trails WHERE area_id = ? AND trail_name = ?',
+        [(hike_date, hike_id, area_id, trail_name) for trail_name in trail_list])
+
+
+# pylint: disable-next=too-many-arguments
+def insert_hike(cursor, user_id, area_id, form_data, feed_mode, *, pending_upload):
+    '''Takes cursor of an open transaction, user id, area id, hike data from form, feed mode
+        and pending upload dict (or None).
+        Inserts hike, links it to its trails, fans it out to followers' timelines (write feed
+        mode) and queues its image upload. Returns hike id.
+    '''
+    # Get list of keys from form data and append additional keys for user id, area id and version
+    keys_list = list(form_data.keys()) + ['user_id', 'area_id', 'version']
+    # Convert list to comma-separated string
+    keys_string = ", ".join(keys_list)
+    # Get list of values from form data and append user_id, area_id and the new version
+    values_list = list(form_data.values()) + [user_id, area_id, next_hike_version(cursor)]
+    placeholders_string = '?, ' * (len(keys_list))
+    # Create command string with list of keys and corresponding number of placeholder values
+    cursor.execute(f'INSERT INTO hikes ({keys_string}) VALUES ({placeholders_string.strip(" ,")})', values_list)
+    hike_id = cursor.lastrowid
+    link_trails(cursor, hike_id, form_data.get('hike_date'), area_id, form_data.get('trails_cs'))
+    if feed_mode == 'write':
+        # Fan out the new hike to every follower's timeline
+        cursor.execute(
+            'INSERT OR IGNORE INTO feed_items (owner_id, hike_date, hike_id) '
+            'SELECT follower_id, ?, ? FROM follows WHERE followee_id = ?',
+            (form_data.get('hike_date'), hike_id, user_id))
+    if pending_upload:
+        queue_upload(cursor, hike_id, pending_upload)
+    return hike_id
+
+
+def write_hike_update(cursor, hike_id, updated_hike_data, feed_mode, *, pending_upload):
+    '''Takes cursor of an open transaction, hike id, updated hike data, feed mode and
+        pending upload dict (or None).
+        Updates hike, its trail links and timeline entries, and queues its upload.
+    '''
+    # Get keys from hike form data (plus the new version) and create string of keys & placeholders for SET command
+    keys_string = ' = (?), '.join(list(updated_hike_data.keys()) + ['version']) + ' = (?)'
+    # Construct tuple of updated values plus the new version and the hike id
+    values_tuple = tuple(updated_hike_data.values()) + (next_hike_version(cursor), hike_id)
+    cursor.execute(f'UPDATE hikes SET {keys_string} WHERE id = (?) RETURNING hike_date, area_id, trails_cs', values_tuple)
+    updated_row = cursor.fetchone()
+    if updated_row and {'hike_date', 'area_id', 'trails_cs'} & set(updated_hike_data):
+        # Replace the hike's trail links with the ones from its updated row
+        cursor.execute('DELETE FROM hike_trails WHERE hike_id = ?', (hike_id,))
+        link_trails(cursor, hike_id, *updated_row)
+    if feed_mode == 'write' and updated_hike_data.get('hike_date'):
+        # Timelines are ordered by hike date, so move the hike in every feed it was fanned out to
+        cursor.execute(
+            'UPDATE feed_items SET hike_date = ? WHERE hike_id = ?',
+            (updated_hike_data.get('hike_date'), hike_id))
+    if pending_upload:
+        queue_upload(cursor, hike_id, pending_upload)
+
+
+def save_new_hike(db, user_id, hike_data, feed_mode=FEED_MODE, *, pending_upload=None):
+    '''Takes db file, user id, hike data from form, optional feed mode and pending upload dict.
+        Adds the hike's area and trails (if new), the hike and its trail links in one transaction.
+        Returns new hike id, or the error if nothing was written.
+    '''
+    def write(cursor):
+        area_id = upsert_area(cursor, hike_data.get('area_name'))
+        return area_id, insert_hike(cursor, user_id, area_id, hike_data, feed_mode, pending_upload=pending_upload)
+    try:
+        area_id, hike_id = run_write(db, write)
     except sqlite3.Error as error:
         print(error)
         return error
-    return 0
+    record_hike(db, user_id, area_id, hike_data.get('hike_date'))
+    return hike_id
+
+
+def save_hike_changes(db, hike_id, updated_hike_data, feed_mode=FEED_MODE, *, pending_upload=None):
+    '''Takes db file, hike id, updated hike data from form, optional feed mode and pending
+        upload dict. Adds the hike's area and trails (if new) and updates the hike, pointing it
+        at its (possibly new) area, in one transaction. Returns 0, or the error if nothing was written.
+    '''
+    def write(cursor):
+        area_id = upsert_area(cursor, updated_hike_data.get('area_name'))
+        write_hike_update(cursor, hike_id, dict(updated_hike_data, area_id=area_id), feed_mode, pending_upload=pending_upload)
+    return try_write(db, write)
 
 
 # ==== RETRIEVE DATA FROM DATABASE ====
@@ -151,19 +272,18 @@ def get_area_id(area_name, db):
     '''Takes area name string and db file
         Returns area id.
     '''
-    db_connection = create_connection(db)
-    try:
-        area_id_data = db_connection['cursor'].execute(
-            'SELECT id FROM areas WHERE area_name = (?)', (area_name, ))
-    except sqlite3.Error as error:
-        print(error)
-        return ''
-    arr = []
-    for row in area_id_data:
-        arr.append(row)
+    with scoped_connection(db) as db_connection:
+        try:
+            area_id_data = db_connection['cursor'].execute(
+                'SELECT id FROM areas WHERE area_name = (?)', (area_name, ))
+        except sqlite3.Error as error:
+            print(error)
+            return ''
+        arr = []
+        for row in area_id_data:
+            arr.append(row)
     area_id = arr[0][0] if arr and arr[0] else None
     area_id = int(area_id) if area_id else None
-    db_connection['connection'].close()
     return area_id
 
 
@@ -178,87 +298,106 @@ def get_hike_img_src(db, user_id):
     return img_src
 
 
+def get_user_cards(db, usernames):
+    '''Takes database file and list of usernames.
+        Returns dict of {username: {id, username, img_src}} for the users that exist,
+        where img_src is the image of that user's most recent hike (or empty string).
+    '''
+    if not usernames:
+        return {}
+    placeholders = ', '.join(['?'] * len(usernames))
+    # One query for the whole list: the correlated subquery is a single lookup on hikes_user_date_idx
+    query = (
+        'SELECT users.id, users.username, ('
+        'SELECT image_url FROM hikes WHERE hikes.user_id = users.id '
+        'ORDER BY hike_date DESC, id DESC LIMIT 1) '
+        f'FROM users WHERE users.username IN ({placeholders})')
+    with scoped_connection(db) as db_connection:
+        try:
+            cards_data = db_connection['cursor'].execute(query, list(usernames))
+        except sqlite3.Error as error:
+            print(error)
+            return {}
+        user_cards = {}
+        for user_id, username, img_src in cards_data:
+            user_cards[username] = {'id': user_id, 'username': username, 'img_src': img_src or ''}
+    return user_cards
+
+
 def get_hikes(db, user_id, hike_id=None, most_recent=False):
     ''' Takes database file and user id
         Optionally a hike id, and boolean
         Returns formatted list of hike dictionaries to serve to UI.
         Returns empty list if no table is found.
     '''
-    db_connection = create_connection(db)
-    # If most_recent is passed, we wish to fetch the single most recent hike
-    if most_recent:
-        try:
-            data = db_connection['cursor'].execute(
-                'SELECT * FROM hikes WHERE user_id = ? ORDER BY hike_date DESC LIMIT 1', (user_id,))
-            hikes_data = db_connection['cursor'].fetchall()
-        except sqlite3.Error as error:
-            print(error)
-            return []
-    # If hike_id is passed, we wish to fetch a single hike
-    elif hike_id:
-        try:
-            data = db_connection['cursor'].execute(
-                'SELECT * FROM hikes WHERE id = ? AND user_id = ?', (hike_id, user_id,))
-            hikes_data = db_connection['cursor'].fetchall()
-        except sqlite3.Error as error:
-            print(error)
-            return []
-    # Otherwise get all records for specified user
-    else:
-        try:
-            data = db_connection['cursor'].execute(
-                'SELECT * FROM hikes WHERE user_id = ? ORDER BY hike_date DESC LIMIT 10', (user_id,))
-            hikes_data = db_connection['cursor'].fetchall()
-        except sqlite3.Error as error:
-            print(error)
-            return []
-    hikes_list = format_hikes(data, hikes_data)
-    commit_close_conn(db_connection['connection'])
+    with scoped_connection(db) as db_connection:
+        # If most_recent is passed, we wish to fetch the single most recent hike
+        if most_recent:
+            try:
+                data = db_connection['cursor'].execute(
+                    'SELECT * FROM hikes WHERE user_id = ? ORDER BY hike_date DESC, id DESC LIMIT 1',
+                    (user_id,))
+                hikes_data = db_connection['cursor'].fetchall()
+            except sqlite3.Error as error:
+                print(error)
+                return []
+        # If hike_id is passed, we wish to fetch a single hike
+        elif hike_id:
+            try:
+                data = db_connection['cursor'].execute(
+                    'SELECT * FROM hikes WHERE id = ? AND user_id = ?', (hike_id, user_id,))
+                hikes_data = db_connection['cursor'].fetchall()
+            except sqlite3.Error as error:
+                print(error)
+                return []
+        # Otherwise get the first page of records for specified user
+        else:
+            return get_hikes_page(db, user_id)['hikes']
+        hikes_list = decode_hikes(data.description, hikes_data)
     return hikes_list
 
 
-def format_hikes(sql_data_object, fetched_hikes_values):
-    '''Takes sql response object (to get keys) and fetched hike data (values).
-        Returns list of hikes as dictionaries.
-    '''
-    # Create list of keys from data object
-    keys = []
-    for column in sql_data_object.description:
-        keys.append(column[0])
-    hikes_list = []
-    for entry in fetched_hikes_values:
-        # Convert each tuple in list to a dictionary by adding keys
-        this_entry = {}
-        for index, key in enumerate(keys):
-            # Ensure max of 1 decimal place for distance (UI spacing only supports 1 dp)
-            if key == 'distance_km':
-                this_entry[key] = round(entry[index], 1)
-            # For some reason, user_id is being returned from db as string, even though
-            # It is stored there as an int 🤔 Convert back to int.
-            if key == 'user_id':
-                this_entry[key] = int(entry[index])
-            else:
-                this_entry[key] = entry[index]
-        # Add key/value pair containing list of trail strings
-        trails_list = this_entry.get('trails_cs').split(', ')
-        this_entry['trails_list'] = trails_list
-        hikes_list.append(this_entry)
-    return hikes_list
+def build_hikes_page_query(user_id, after, limit, columns='*'):
+    '''Takes user id, page cursor (or None), page size and optional column list.
+        Returns (query, params) for one page of the user's hikes, plus one extra row.
+    '''
+    query = f'SELECT {columns} FROM hikes WHERE user_id = ? '
+    params = [user_id]
+    # Keyset pagination: seek past the last (hike_date, id) of the previous page in
+    # hikes_user_date_idx, so a deep page costs the same as the first one
+    position = decode_cursor(after)
+    if position:
+        query += 'AND (hike_date, id) < (?, ?) '
+        params += position
+    # Fetch one extra row to find out whether there is a next page
+    query += 'ORDER BY hike_date DESC, id DESC LIMIT ?'
+    params.append(limit + 1)
+    return query, params
+
+
+def get_hikes_page(db, user_id, after=None, limit=FEED_PAGE_SIZE):
+    '''Takes db file, user id, optional page cursor and page size.
+        Returns dict with list of the user's hikes (newest first) and cursor for the next page.
+    '''
+    limit = clamp_page_size(limit)
+    query, params = build_hikes_page_query(user_id, after, limit)
+    hikes_list, has_more = fetch_hikes_page(db, query, params, limit)
+    return {'hikes': hikes_list, 'next_cursor': next_page_cursor(hikes_list, has_more)}
 
 
 def get_all_usernames(db):
     '''Takes database file
         Returns list of all names in database
     '''
-    db_connection = create_connection(db)
-    try:
-        usernames_query = db_connection['cursor'].execute('SELECT username FROM users')
-    except sqlite3.Error as error:
-        print(error)
-        return []
-    usernames = []
-    for row in usernames_query:
-        usernames.append(row)
+    with scoped_connection(db) as db_connection:
+        try:
+            usernames_query = db_connection['cursor'].execute('SELECT username FROM users')
+        except sqlite3.Error as error:
+            print(error)
+            return []
+        usernames = []
+        for row in usernames_query:
+            usernames.append(row)
     return usernames
 
 
@@ -266,21 +405,25 @@ def get_user_by_username(db, username):
     '''Takes database file and username string
         Returns dict of user data from users table, or empty dictionary if no user found.
     '''
+    # Found users are cached (missing ones aren't, so a new user is visible right away)
+    cached_user = user_cache.get((db, username))
+    if cached_user is not None:
+        return dict(cached_user)
     keys = get_table_columns(db, 'users')
-    db_connection = create_connection(db)
-    try:
-        user_data = db_connection['cursor'].execute('SELECT * FROM users WHERE username = ?', (username,))
-    except sqlite3.Error as error:
-        print(error)
-        return {}
-    values = []
-    for row in user_data:
-        for position in row:
-            values.append(position)
-    db_connection['connection'].close()
+    with scoped_connection(db) as db_connection:
+        try:
+            user_data = db_connection['cursor'].execute('SELECT * FROM users WHERE username = ?', (username,))
+        except sqlite3.Error as error:
+            print(error)
+            return {}
+        values = []
+        for row in user_data:
+            for position in row:
+                values.append(position)
     if len(values) == 0:
         return {}
     user = generate_user_data_dict(keys, values)
+    user_cache.set((db, username), dict(user))
     return user
 
 
@@ -288,73 +431,59 @@ def get_username_from_user_id(db, user_id):
     '''Takes db file and user_id
         Returns dict with user name related to id.
     '''
-    db_connection = create_connection(db)
-    try:
-        data = db_connection['cursor'].execute('SELECT id, username from users WHERE id = (?)', (user_id,))
-    except sqlite3.Error as error:
-        print(error)
-        return []
-    user = {}
-    for row in data:
-        user['id'] = row[0]
-        user['username'] = row[1]
-    db_connection['connection'].close()
+    with scoped_connection(db) as db_connection:
+        try:
+            data = db_connection['cursor'].execute('SELECT id, username from users WHERE id = (?)', (user_id,))
+        except sqlite3.Error as error:
+            print(error)
+            return []
+        user = {}
+        for row in data:
+            user['id'] = row[0]
+            user['username'] = row[1]
     return user
 
 
-def get_similar_usernames(db, query):
-    '''Takes database file and query string.
+def get_similar_usernames(db, query, limit=None):
+    '''Takes database file, query string and optional max number of results.
         Returns dict of usernames
         or empty dict.
     '''
-    db_connection = create_connection(db)
-    try:
-        username_data = db_connection['cursor'].execute('SELECT username FROM users')
-    except sqlite3.Error as error:
-        print(error)
-        return {}
-
-    users_list = []
-    for row in username_data:
-        users_list.append(row[0])
-
-    similar_users = {}
-    for username in users_list:
-        # Frequency is the number of occurrences where a char in the query matched a char in the username
-        frequency = 0
-        for char in query:
-            if char in username:
-                frequency +=1
-        # Accuracy is the proportion of matching chars relative to the length of the username
-        accuracy = frequency / len(username)
-        match_factor = frequency * accuracy
-        if frequency > 2 or accuracy >= 0.5:
-            similar_users.update({username: match_factor})
-
-    # Source: https://www.datacamp.com/tutorial/sort-a-dictionary-by-value-python
-    sorted_similar_users = dict(sorted(similar_users.items(), key=lambda item: item[1], reverse=True))
-    return sorted_similar_users
-
-
-def follow(db, username, followee, action):
-    '''Takes db file, username of auth user, username of user to follow and action (follow/unfollow)'''
-    db_connection = create_connection(db)
-    follower_id = get_user_by_username(db, username)['id']
-    followee_id = get_user_by_username(db, followee)['id']
-    if action == 'follow':
+    # Frequency is the number of occurrences where a char in the query matched a char in the username.
+    # Accuracy is the proportion of matching chars relative to the length of the username.
+    # A username matches if frequency > 2 or accuracy >= 0.5, and is ranked by frequency * accuracy.
+    # Scoring is done by the character index in username_index.py rather than a loop over every user.
+    with scoped_connection(db) as db_connection:
         try:
-            db_connection['cursor'].execute('INSERT OR IGNORE INTO follows (follower_id, followee_id) VALUES (?, ?)', (follower_id, followee_id,))
+            index = get_index(db, db_connection['cursor'])
         except sqlite3.Error as error:
             print(error)
-            return error
-    else:
-        try:
-            db_connection['cursor'].execute('DELETE FROM follows WHERE follower_id = (?) AND followee_id = (?)', (follower_id, followee_id,))
-        except sqlite3.Error as error:
-            print(error)
-            return error
-    commit_close_conn(db_connection['connection'])
-    return 0
+            return {}
+    return dict(index.search(query, limit))
+
+
+def follow(db, username, followee, action, feed_mode=FEED_MODE):
+    '''Takes db file, username of auth user, username of user to follow, action (follow/unfollow)
+        and optional feed mode
+    '''
+    follower_id = get_user_by_username(db, username)['id']
+    followee_id = get_user_by_username(db, followee)['id']
+    def write(cursor):
+        if action == 'follow':
+            cursor.execute('INSERT OR IGNORE INTO follows (follower_id, followee_id) VALUES (?, ?)', (follower_id, followee_id,))
+            # Backfill the followee's existing hikes into the follower's timeline
+            if feed_mode == 'write' and cursor.rowcount:
+                cursor.execute(
+                    'INSERT OR IGNORE INTO feed_items (owner_id, hike_date, hike_id) '
+                    'SELECT ?, hike_date, id FROM hikes WHERE user_id = ?', (follower_id, followee_id,))
+        else:
+            cursor.execute('DELETE FROM follows WHERE follower_id = (?) AND followee_id = (?)', (follower_id, followee_id,))
+            # Purge the followee's hikes from the follower's timeline
+            if feed_mode == 'write' and cursor.rowcount:
+                cursor.execute(
+                    'DELETE FROM feed_items WHERE owner_id = ? AND hike_id IN (SELECT id FROM hikes WHERE user_id = ?)',
+                    (follower_id, followee_id,))
+    return try_write(db, write)
 
 
 def get_followees(db, username):
@@ -362,15 +491,15 @@ def get_followees(db, username):
         Returns list of user ids.
     '''
     followees_list = []
-    db_connection = create_connection(db)
     follower_id = get_user_by_username(db, username).get('id')
-    try:
-        data = db_connection['cursor'].execute('SELECT followee_id FROM follows WHERE follower_id = (?)', (follower_id,))
-    except sqlite3.Error as error:
-        print(error)
-        return []
-    for row in data:
-        followees_list.append(row[0])
+    with scoped_connection(db) as db_connection:
+        try:
+            data = db_connection['cursor'].execute('SELECT followee_id FROM follows WHERE follower_id = (?)', (follower_id,))
+        except sqlite3.Error as error:
+            print(error)
+            return []
+        for row in data:
+            followees_list.append(row[0])
     return followees_list
 
 
@@ -378,47 +507,255 @@ def get_feed(db, username):
     '''Takes db file and username.
         Returns list of hikes.
     '''
-    db_connection = create_connection(db)
-    followees_list = get_followees(db, username)
-    try:
-        data = db_connection['cursor'].execute('SELECT * FROM hikes ORDER BY hike_date DESC LIMIT 1000')
-        hikes_data = db_connection['cursor'].fetchall()
-    except sqlite3.Error as error:
-        print(error)
-        return []
-    hikes_list = format_hikes(data, hikes_data)
-    feed_list = []
-    for hike in hikes_list:
-        if int(hike['user_id']) in followees_list:
-            username = get_username_from_user_id(db, hike.get('user_id')).get('username')
-            hike['username'] = username
-            feed_list.append(hike)
-    return feed_list
+    return get_feed_page(db, username)['hikes']
+
+
+def build_feed_page_query(username, after, limit, feed_mode, columns='hikes.*, users.username'):
+    '''Takes username, page cursor (or None), page size, feed mode and optional column list.
+        Returns (query, params) for one page of the user's feed, plus one extra row.
+    '''
+    if feed_mode == 'write':
+        # Read the follower's materialized timeline
+        query = (
+            f'SELECT {columns} FROM users AS followers '
+            'JOIN feed_items ON feed_items.owner_id = followers.id '
+            'JOIN hikes ON hikes.id = feed_items.hike_id '
+            'JOIN users ON users.id = hikes.user_id '
+            'WHERE followers.username = ? ')
+        date_column, id_column = 'feed_items.hike_date', 'feed_items.hike_id'
+    else:
+        # Join follows -> hikes -> users in a single query (no per-hike username lookups)
+        query = (
+            f'SELECT {columns} FROM users AS followers '
+            'JOIN follows ON follows.follower_id = followers.id '
+            'JOIN hikes ON hikes.user_id = follows.followee_id '
+            'JOIN users ON users.id = hikes.user_id '
+            'WHERE followers.username = ? ')
+        date_column, id_column = 'hikes.hike_date', 'hikes.id'
+    params = [username]
+    # Keyset pagination: continue strictly after the last (hike_date, id) of the previous page
+    position = decode_cursor(after)
+    if position:
+        query += f'AND ({date_column}, {id_column}) < (?, ?) '
+        params += position
+    # Fetch one extra row to find out whether there is a next page
+    query += f'ORDER BY {date_column} DESC, {id_column} DESC LIMIT ?'
+    params.append(limit + 1)
+    return query, params
+
+
+def get_feed_page(db, username, after=None, limit=FEED_PAGE_SIZE, feed_mode=FEED_MODE):
+    '''Takes db file, username, optional page cursor, page size and feed mode.
+        Returns dict with list of followees' hikes (newest first) and cursor for the next page.
+    '''
+    limit = clamp_page_size(limit)
+    query, params = build_feed_page_query(username, after, limit, feed_mode)
+    hikes_list, has_more = fetch_hikes_page(db, query, params, limit)
+    return {'hikes': hikes_list, 'next_cursor': next_page_cursor(hikes_list, has_more)}
+
+
+def get_area_name(db, area_id):
+    '''Takes db file and area id. Returns the area's name, or None if not found.'''
+    with scoped_connection(db) as db_connection:
+        try:
+            db_connection['cursor'].execute('SELECT area_name FROM areas WHERE id = ?', (area_id,))
+            row = db_connection['cursor'].fetchone()
+        except sqlite3.Error as error:
+            print(error)
+            return None
+    return row[0] if row else None
+
+
+def get_trail(db, trail_id):
+    '''Takes db file and trail id.
+        Returns dict of the trail's id, name, area id and area name, or empty dict if not found.
+    '''
+    with scoped_connection(db) as db_connection:
+        try:
+            db_connection['cursor'].execute(
+                'SELECT trails.id, trails.trail_name, trails.area_id, areas.area_name FROM trails '
+                'LEFT JOIN areas ON areas.id = trails.area_id WHERE trails.id = ?', (trail_id,))
+            row = db_connection['cursor'].fetchone()
+        except sqlite3.Error as error:
+            print(error)
+            return {}
+    if not row:
+        return {}
+    return dict(zip(('id', 'trail_name', 'area_id', 'area_name'), row))
+
+
+def get_trail_id(db, area_id, trail_name):
+    '''Takes db file, area id and trail name.
+        Returns id of the area's trail with that name, or None if not found.
+    '''
+    with scoped_connection(db) as db_connection:
+        try:
+            db_connection['cursor'].execute(
+                'SELECT id FROM trails WHERE area_id = ? AND trail_name = ?', (area_id, trail_name))
+            row = db_connection['cursor'].fetchone()
+        except sqlite3.Error as error:
+            print(error)
+            return None
+    return row[0] if row else None
+
+
+def build_trail_page_query(trail_id, after, limit, columns='hikes.*, users.username'):
+    '''Takes trail id, page cursor (or None), page size and optional column list.
+        Returns (query, params) for one page of the trail's hikes, plus one extra row.
+    '''
+    # hike_trails' primary key is ordered by (trail_id, hike_date, hike_id), so a page is one seek
+    query = (
+        f'SELECT {columns} FROM hike_trails '
+        'JOIN hikes ON hikes.id = hike_trails.hike_id '
+        'JOIN users ON users.id = hikes.user_id '
+        'WHERE hike_trails.trail_id = ? ')
+    params = [trail_id]
+    position = decode_cursor(after)
+    if position:
+        query += 'AND (hike_trails.hike_date, hike_trails.hike_id) < (?, ?) '
+        params += position
+    # Fetch one extra row to find out whether there is a next page
+    query += 'ORDER BY hike_trails.hike_date DESC, hike_trails.hike_id DESC LIMIT ?'
+    params.append(limit + 1)
+    return query, params
+
+
+def get_trail_hikes_page(db, trail_id, after=None, limit=FEED_PAGE_SIZE):
+    '''Takes db file, trail id, optional page cursor and page size.
+        Returns dict with list of every user's hikes on the trail (newest first) and cursor for the next page.
+    '''
+    limit = clamp_page_size(limit)
+    query, params = build_trail_page_query(trail_id, after, limit)
+    hikes_list, has_more = fetch_hikes_page(db, query, params, limit)
+    return {'hikes': hikes_list, 'next_cursor': next_page_cursor(hikes_list, has_more)}
+
+
+def get_user_activity(db, user_id):
+    '''Takes db file and user id.
+        Returns dict of the user's hikes and follows change counters and last change (unix time).
+    '''
+    activity = {'hikes_version': 0, 'follows_version': 0, 'updated_at': None}
+    with scoped_connection(db) as db_connection:
+        try:
+            db_connection['cursor'].execute(
+                'SELECT hikes_version, follows_version, updated_at FROM user_activity '
+                'WHERE user_id = ?', (user_id,))
+            row = db_connection['cursor'].fetchone()
+        except sqlite3.Error as error:
+            print(error)
+            return activity
+    if row:
+        activity.update(zip(('hikes_version', 'follows_version', 'updated_at'), row))
+    return activity
+
+
+def get_feed_activity(db, username):
+    '''Takes db file and username.
+        Returns dict of the user's follows counter, the sum of their followees' hikes counters
+        and the last change (unix time) to either. Any change to the feed changes one of them.
+    '''
+    activity = {'hikes_version': 0, 'follows_version': 0, 'updated_at': None}
+    with scoped_connection(db) as db_connection:
+        try:
+            db_connection['cursor'].execute(
+                'SELECT COALESCE(follower.follows_version, 0), '
+                'COALESCE(SUM(followees.hikes_version), 0), '
+                'MAX(COALESCE(follower.updated_at, 0), COALESCE(MAX(followees.updated_at), 0)) '
+                'FROM users '
+                'LEFT JOIN user_activity AS follower ON follower.user_id = users.id '
+                'LEFT JOIN follows ON follows.follower_id = users.id '
+                'LEFT JOIN user_activity AS followees ON followees.user_id = follows.followee_id '
+                'WHERE users.username = ?', (username,))
+            row = db_connection['cursor'].fetchone()
+        except sqlite3.Error as error:
+            print(error)
+            return activity
+    activity.update(zip(('follows_version', 'hikes_version', 'updated_at'), row))
+    activity['updated_at'] = activity['updated_at'] or None
+    return activity
+
+
+def write_feed_items(cursor):
+    '''Takes db cursor. Replaces every follower's timeline with one built from the follows and
+        hikes tables.
+    '''
+    cursor.execute('DELETE FROM feed_items')
+    cursor.execute(
+        'INSERT INTO feed_items (owner_id, hike_date, hike_id) '
+        'SELECT follows.follower_id, hikes.hike_date, hikes.id FROM follows '
+        'JOIN hikes ON hikes.user_id = follows.followee_id')
+
+
+def rebuild_feed_items(db):
+    '''Takes db file. Rebuilds every follower's timeline from the follows and hikes tables.'''
+    return try_write(db, write_feed_items)
+
+
+def sync_feed_mode(db, feed_mode=FEED_MODE):
+    '''Takes db file and feed mode. Run on app startup.
+        Timelines aren't maintained in 'read' mode, so rebuild them when switching to 'write'.
+    '''
+    def write(cursor):
+        # Read under the writer's lock, so two processes starting at once rebuild only once
+        cursor.execute("SELECT value FROM settings WHERE key = 'feed_mode'")
+        row = cursor.fetchone()
+        if feed_mode == 'write' and (not row or row[0] != 'write'):
+            write_feed_items(cursor)
+        cursor.execute(
+            "INSERT INTO settings (key, value) VALUES ('feed_mode', ?) "
+            'ON CONFLICT (key) DO UPDATE SET value = excluded.value', (feed_mode,))
+
+    return try_write(db, write)
 
 
 def get_table_columns(db, table):
     '''Takes db file and table name as string
         Returns a list of provided table's column names
     '''
-    db_connection = create_connection(db)
+    # Columns only change with a migration, which clears this cache
+    cached_keys = table_columns_cache.get((db, table))
+    if cached_keys is not None:
+        return list(cached_keys)
     query = f'PRAGMA table_info({table})'
     # This query returns a sqlite object containing rows of tuples, each representing a column in the table
         # The column heading is at the [1]th index of each tuple
 
-    try:
+    with scoped_connection(db) as db_connection:
+        try:
+            table_info = db_connection['cursor'].execute(query)
+        except sqlite3.Error as error:
+            print(error)
+            return []
 
-        table_info = db_connection['cursor'].execute(query)
-    except sqlite3.Error as error:
-        print(error)
-        return []
+        keys = []
+        for column in table_info:
+            keys.append(column[1])
+
+    table_columns_cache.set((db, table), list(keys))
+    return keys
 
-    keys = []
-    for column in table_info:
-        keys.append(column[1])
 
-    commit_close_conn(db_connection['connection'])
+# ==== CACHE INVALIDATION ====
 
-    return keys
+def invalidate_user(db, username):
+    '''Takes db file and username. Drops cached user record. Call after any change to a user.'''
+    user_cache.invalidate((db, username))
+
+
+def invalidate_caches():
+    '''Drops every cached user record and table column list (ie. after a schema change).'''
+    user_cache.clear()
+    table_columns_cache.clear()
+    fragment_cache.clear()
+
+
+def cache_stats():
+    '''Returns dict of hit/miss stats for each in-process cache.'''
+    return {
+        'users': user_cache.stats(),
+        'table_columns': table_columns_cache.stats(),
+        'hike_fragments': fragment_cache.stats(),
+    }
 
 
 def generate_user_data_dict(keys, values):
@@ -439,29 +776,6 @@ def format_hike_form_data(data):
     return formatted_data
 
 
-# ==== CLOUDINARY FILE HANDLING ====
-
-def process_img_upload(file, existing_file=''):
-    '''Takes file location from file input, and optional existing file from prev import
-        Returns cloudinary public_id string
-    '''
-    # Use existing file (or default value of '' if no file is uploaded)
-    # Editing an existing hike will keep previous image, new hike will submit with no image.
-    if not file:
-        return existing_file
-    # Create public_id from username image filename without file type extension
-    filename = file.filename.split('.')[0]
-    public_id = session.get('username') + filename
-    # Call cloudinary store function (passing file location and public id)
-    cloudinary.uploader.upload(
-        file,
-        public_id=public_id,
-        unique_filename=False,
-        overwrite=True,
-        eager='c_lfill,w_900|q_auto:best')
-    return public_id
-
-
 #  ==== FORM VALIDATION ====
 
 # pylint: disable=too-many-return-statements
@@ -524,8 +838,73 @@ def login_required(function):
     return decorated_function
 
 
+#  ==== PAGINATION ====
+
+def clamp_page_size(limit):
+    '''Takes requested page size (int or None).
+        Returns page size between 1 and the max page size.
+    '''
+    if not limit:
+        return FEED_PAGE_SIZE
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
+
+
+def encode_cursor(hike):
+    '''Takes hike dictionary.
+        Returns url-safe cursor string for the (hike_date, id) position of that hike.
+    '''
+    return f'{hike.get("hike_date")}_{hike.get("id")}'
+
+
+def decode_cursor(cursor):
+    '''Takes cursor string from query string.
+        Returns [hike_date, hike_id] list, or None if cursor is missing or malformed.
+    '''
+    if not cursor:
+        return None
+    hike_date, _, hike_id = str(cursor).rpartition('_')
+    if not hike_date or not hike_id.isdigit():
+        return None
+    return [hike_date, int(hike_id)]
+
+
+def fetch_hikes_page(db, query, params, limit):
+    '''Takes db file, page query (fetching one row more than the page size), its params and
+        page size. Returns (list of the page's hikes, True if more rows follow).
+        A database error is an empty last page.
+    '''
+    with scoped_connection(db) as db_connection:
+        try:
+            data = db_connection['cursor'].execute(query, params)
+            hikes_data = db_connection['cursor'].fetchall()
+        except sqlite3.Error as error:
+            print(error)
+            return [], False
+        return decode_hikes(data.description, hikes_data[:limit]), len(hikes_data) > limit
+
+
+def next_page_cursor(hikes_list, has_more):
+    '''Takes page of hikes and whether more rows follow (see fetch_hikes_page).
+        Returns cursor for the following page, or None on the last page.
+    '''
+    if not has_more or not hikes_list:
+        return None
+    return encode_cursor(hikes_list[-1])
+
+
 #  UI HELPERS
 
+def get_next_page_path(next_cursor, keep=('limit',)):
+    '''Takes cursor for the next page of the requested list (or None), and optional names of
+        query args to keep (ie. the search text).
+        Returns path of the next page, keeping the requested page size, or None on the last page.
+    '''
+    if not next_cursor:
+        return None
+    args = [('after', next_cursor)] + [(name, request.args.get(name)) for name in keep if request.args.get(name)]
+    return f'{request.path}?{urlencode(args)}'
+
+
 def get_context_string_from_referrer(referrer, current_path, username):
     '''Takes http request referrer & path, and username from session.
         Returns string or None.
@@ -537,7 +916,8 @@ def get_context_string_from_referrer(referrer, current_path, username):
         return 'Hike deleted.'
     if 'cancel' in str(current_path):
         return 'Edits discarded.'
-    tmp_list = referrer.split('/')
+    # Referrer is None when the page was opened directly (ie. a bookmark)
+    tmp_list = str(referrer).split('/')
     routes_dict = {
         'login': f'Logged in as {username.upper()}.',
         'new-hike': 'New hike added.',
@@ -1,6 +1,9 @@
 '''Unit tests for all python utility functions'''
 import os
+from flask import Flask, g
 from init_sql import runner
+from metrics import REQUEST_TOTALS
+from testing import HIKE
 from utils import  (
         add_area,
         add_hike,
@@ -14,14 +17,24 @@ from utils import  (
         get_area_id,
         get_context_string_from_referrer,
         get_feed,
+        get_feed_page,
         get_followees,
         get_hikes,
+        get_hikes_page,
         get_similar_usernames,
+        get_trail,
+        get_trail_hikes_page,
+        get_trail_id,
         get_user_by_username,
+        get_user_cards,
         get_username_from_user_id,
+        rebuild_feed_items,
+        save_hike_changes,
+        save_new_hike,
         update_hike,
         validate_hike_form,
         )
+from writer import stop_writers
 # pylint: disable=line-too-long
 
 
@@ -49,12 +62,15 @@ def test_get_context_string_from_referrer():
     mock_null_referrer = 'https://takeahike.com/cool/stuff/wow/users/more-users/even-more-users/coolstuffwow'
     mock_null_current_path = 'https://takeahike.com/reasons-why-this-is-the-best-app-ever/even-more-reasons-why'
     assert get_context_string_from_referrer(mock_null_referrer ,mock_null_current_path, mock_username) is None
+    # Check for no context string if there is no referrer (ie. page opened from a bookmark)
+    assert get_context_string_from_referrer(None, mock_current_path, mock_username) is None
 
 
 # Cleanup
 def cleanup(self):
     '''Runs cleanup operations for tests that use the sqlite database'''
-    # Rm temporary db file if it exists
+    # Close the writer's connection to the db file, then rm the file if it exists
+    stop_writers()
     db_path = f'./{self.DB}'
     if os.path.exists(db_path):
         os.remove(db_path)
@@ -193,6 +209,26 @@ class TestAddAndRetrieveUser:
         cleanup(self)
 
 
+    def test_similar_usernames_index_matches_full_scan(self, db=DB):
+        '''Test that the character index returns the same ranked matches as scoring every username'''
+        self.setup()
+        usernames = ['suze', 'frank', 'frannie', 'zed', 'hikerdude', 'trailmix', 'suzanne', 'abc', 'aabbcc', 'kewlhiker']
+        for username in usernames:
+            add_user(db, username, 'abcdefghijklmnopqrstuvwxyz123456')
+        for query in ['suz', 'frankie', 'hiker', 'aaa', 'zzz', 'mix', 'a']:
+            expected = {}
+            for username in usernames:
+                frequency = sum(1 for char in query if char in username)
+                if frequency > 2 or frequency / len(username) >= 0.5:
+                    expected[username] = frequency * (frequency / len(username))
+            expected = dict(sorted(expected.items(), key=lambda item: item[1], reverse=True))
+            assert list(get_similar_usernames(db, query).items()) == list(expected.items())
+        # Limit returns only the best matches
+        assert list(get_similar_usernames(db, 'hiker', limit=1)) == ['hikerdude']
+        # Cleanup
+        cleanup(self)
+
+
 class TestFollowUnfollowFeedFlows:
     '''Test flow where user follows another user, '''
 
@@ -296,6 +332,64 @@ class TestFollowUnfollowFeedFlows:
         cleanup(self)
 
 
+    def test_get_feed_page(self, user_1=mock_users[0]['username'], user_2=mock_users[1]['username']):
+        '''Test paging through a feed with keyset cursors'''
+        # Set up by running the follow flow so user_1 follows user_2
+        self.test_follow(run_cleanup=False)
+        user_2_id = get_user_by_username(self.DB, user_2)['id']
+        user_1_id = get_user_by_username(self.DB, user_1)['id']
+        # Two hikes share a date so the hike id has to break the tie
+        for hike_date in ['2025-01-01', '2025-01-02', '2025-01-02']:
+            add_hike(self.DB, user_2_id, 1, {'hike_date': hike_date, 'area_name': 'Kewl Place', 'trails_cs': 'Rad Trail', 'distance_km': '4.9'})
+        # Hikes from users who aren't followed never show up in the feed
+        add_hike(self.DB, user_1_id, 1, {'hike_date': '2025-01-03', 'area_name': 'Kewl Place', 'trails_cs': 'Rad Trail', 'distance_km': '1.0'})
+        first_page = get_feed_page(self.DB, user_1, limit=2)
+        assert [hike['id'] for hike in first_page['hikes']] == [3, 2]
+        assert first_page['hikes'][0]['username'] == user_2
+        assert first_page['next_cursor'] == '2025-01-02_2'
+        second_page = get_feed_page(self.DB, user_1, after=first_page['next_cursor'], limit=2)
+        assert [hike['id'] for hike in second_page['hikes']] == [1]
+        assert second_page['next_cursor'] is None
+        # A malformed cursor falls back to the first page
+        assert len(get_feed_page(self.DB, user_1, after='not-a-cursor')['hikes']) == 3
+        # Run cleanup
+        cleanup(self)
+
+
+    def test_fan_out_on_write_feed(self, user_1=mock_users[0]['username'], user_2=mock_users[1]['username']):
+        '''Test that the materialized timeline (feed_mode='write') serves the same feed as the join'''
+        self.setup()
+        user_2_id = get_user_by_username(self.DB, user_2)['id']
+        mock_hike = {'hike_date': '2025-01-01', 'area_name': 'Kewl Place', 'trails_cs': 'Rad Trail', 'distance_km': '4.9'}
+
+        def assert_same_feeds(expected_ids):
+            '''Check both feed modes return the expected hikes in the same order'''
+            for feed_mode in ['read', 'write']:
+                assert [hike['id'] for hike in get_feed_page(self.DB, user_1, feed_mode=feed_mode)['hikes']] == expected_ids
+
+        # Existing hikes are backfilled into the timeline on follow
+        add_hike(self.DB, user_2_id, 1, mock_hike, feed_mode='write')
+        assert follow(self.DB, user_1, user_2, 'follow', feed_mode='write') == 0
+        assert_same_feeds([1])
+        # New hikes are fanned out to followers
+        add_hike(self.DB, user_2_id, 1, dict(mock_hike, hike_date='2025-01-02'), feed_mode='write')
+        assert_same_feeds([2, 1])
+        # Changing a hike date moves it in the timeline
+        update_hike(self.DB, {'id': 1}, dict(mock_hike, hike_date='2025-01-03'), feed_mode='write')
+        assert_same_feeds([1, 2])
+        # Deleted hikes are purged from the timeline
+        assert delete_hike(self.DB, 1, user_2_id, feed_mode='write') == 0
+        assert_same_feeds([2])
+        # A rebuild produces the same timeline
+        assert rebuild_feed_items(self.DB) == 0
+        assert_same_feeds([2])
+        # Unfollowing purges the followee's hikes from the timeline
+        assert follow(self.DB, user_1, user_2, 'unfollow', feed_mode='write') == 0
+        assert_same_feeds([])
+        # Run cleanup
+        cleanup(self)
+
+
 class TestAddUpdateDeleteRetreiveHike:
     '''Tests user adding, updating, deleting hikes and accessing their hikes list.'''
     DB = 'test.db'
@@ -382,6 +476,47 @@ class TestAddUpdateDeleteRetreiveHike:
             cleanup(self)
 
 
+    def test_save_new_hike(self, db=DB):
+        '''Test `save_new_hike` fn -- adding area, trails and hike with a single commit'''
+        self.setup()
+        with Flask(__name__).app_context():
+            g.sql_metrics = dict.fromkeys(REQUEST_TOTALS, 0)
+            assert save_new_hike(db, 1, self.mock_hikes[0]) == 1
+            # A second hike in the same area reuses the area's id
+            assert save_new_hike(db, 1, self.mock_hikes[1]) == 2
+            assert g.sql_metrics['commits'] == 2
+        assert [hike['area_id'] for hike in get_hikes(db, 1)] == [1, 1]
+        db_connection = create_connection(db)
+        trail_names = db_connection['cursor'].execute('SELECT trail_name FROM trails WHERE area_id = 1 ORDER BY id').fetchall()
+        commit_close_conn(db_connection['connection'])
+        assert [row[0] for row in trail_names] == ['Rad Trail', 'Tubular Trail', 'Incredible Trail', 'Wowzers Trail']
+        # Run cleanup
+        cleanup(self)
+
+
+    def test_save_new_hike_rolls_back(self, db=DB):
+        '''Test `save_new_hike` fn -- a failed hike insert leaves no area or trails behind'''
+        self.setup()
+        assert save_new_hike(db, 1, dict(self.mock_hikes[0], not_a_column='x')) != 0
+        db_connection = create_connection(db)
+        counts = [db_connection['cursor'].execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in ['areas', 'trails', 'hikes']]
+        commit_close_conn(db_connection['connection'])
+        assert counts == [0, 0, 0]
+        # Run cleanup
+        cleanup(self)
+
+
+    def test_save_hike_changes(self, db=DB):
+        '''Test `save_hike_changes` fn -- a hike moved to a new area points at the new area'''
+        self.setup()
+        save_new_hike(db, 1, self.mock_hikes[0])
+        assert save_hike_changes(db, 1, dict(self.mock_hikes[0], area_name='Another Neat Place')) == 0
+        hike = get_hikes(db, 1, 1)[0]
+        assert (hike['area_id'], hike['area_name']) == (2, 'Another Neat Place')
+        # Run cleanup
+        cleanup(self)
+
+
     def test_get_all_hikes(self, db=DB):
         '''Test `get_hikes` fn -- retreiving list of all hikes with correct values and structure'''
         expected_hike_structure = {
@@ -397,6 +532,7 @@ class TestAddUpdateDeleteRetreiveHike:
             'image_alt': 'This is a very kewl image',
             'map_link': 'https://maps.google.com/map1',
             'other_info': 'Woah this trail is kewl!',
+            'version': 1,
             'trails_list': ['Rad Trail', 'Tubular Trail']
             }
         # Run test_add_hike to setup and add two hikes to user's list
@@ -429,6 +565,8 @@ class TestAddUpdateDeleteRetreiveHike:
             'other_info': 'What a stupendous trail!',
             'map_link': 'https://maps.google.com/map123',
             'image_url': 'image-that-is-also-quite-kewl',
+            # Added as version 1, updated after the second hike (version 2)
+            'version': 3,
             'trails_list': ['Awesome Trail', 'Really Neat Trail']
         }
         updated_hikes_list = get_hikes(db, expected_updated_structure['user_id'])
@@ -450,6 +588,7 @@ class TestAddUpdateDeleteRetreiveHike:
             'image_alt': 'This is a great image!',
             'map_link': 'https://maps.google.com/map2',
             'other_info': 'Woah this trail is very nice!',
+            'version': 2,
             'trails_list': ['Incredible Trail', 'Wowzers Trail']
             }
         # Run test_add_hike to setup and add a hike to user's list
@@ -459,6 +598,24 @@ class TestAddUpdateDeleteRetreiveHike:
         assert hikes_list[0] == expected_hike_structure
 
 
+    def test_get_hikes_page(self, db=DB):
+        '''Test `get_hikes_page` fn -- paging through a user's hikes with keyset cursors'''
+        # Run test_add_hike to setup and add hikes dated 2025-01-01 (id 1) and 2025-01-02 (id 2)
+        self.test_add_hike(run_cleanup=False)
+        # A hike sharing a date with hike 2 has to be ordered by its id
+        add_hike(db, 1, 1, dict(self.mock_hikes[0], hike_date='2025-01-02'))
+        first_page = get_hikes_page(db, 1, limit=2)
+        assert [hike['id'] for hike in first_page['hikes']] == [3, 2]
+        assert first_page['next_cursor'] == '2025-01-02_2'
+        second_page = get_hikes_page(db, 1, after=first_page['next_cursor'], limit=2)
+        assert [hike['id'] for hike in second_page['hikes']] == [1]
+        assert second_page['next_cursor'] is None
+        # get_hikes returns the first page
+        assert [hike['id'] for hike in get_hikes(db, 1)] == [3, 2, 1]
+        # Run cleanup
+        cleanup(self)
+
+
     def test_get_most_recent_hike(self, db=DB):
         '''Test `get_hikes` fn -- retrieving single most recent hike by user id'''
         # Run test_add_hike to setup db and add hikes to user's list
@@ -468,6 +625,26 @@ class TestAddUpdateDeleteRetreiveHike:
         hikes_list = get_hikes(db, 1, hike_id=None, most_recent=True)
         assert len(hikes_list) == 1
         assert hikes_list[0]['hike_date'] == expected_date
+        # A hike sharing the latest date is more recent by id, like the pages and user cards
+        add_hike(db, 1, 1, dict(self.mock_hikes[0], hike_date=expected_date))
+        assert get_hikes(db, 1, most_recent=True)[0]['id'] == 3
+        # Run cleanup
+        cleanup(self)
+
+
+    def test_get_user_cards(self, db=DB):
+        '''Test `get_user_cards` fn -- batch loading ids and most recent hike images for usernames'''
+        # Run test_add_hike to setup db and add two hikes to the user's list
+        self.test_add_hike(run_cleanup=False)
+        add_user(db, 'nohikes', self.user['password_hash'])
+        user_cards = get_user_cards(db, [self.user['username'], 'nohikes', 'notauser'])
+        # Unknown usernames are left out, users without hikes get an empty image source
+        assert user_cards == {
+            self.user['username']: {'id': 1, 'username': self.user['username'], 'img_src': self.mock_hikes[1]['image_url']},
+            'nohikes': {'id': 2, 'username': 'nohikes', 'img_src': ''},
+        }
+        # pylint: disable=use-implicit-booleaness-not-comparison
+        assert get_user_cards(db, []) == {}
         # Run cleanup
         cleanup(self)
 
@@ -586,3 +763,38 @@ class TestAddRetrieveArea:
         assert not get_area_id('fake area name', db)
         # Run cleanup
         cleanup(self)
+
+
+class TestTrails:
+    '''Tests linking hikes to their trails and paging through a trail's hikes'''
+    hike = dict(HIKE, trails_cs='Rad Trail, Tubular Trail')
+
+    def test_trail_pages(self, db):
+        '''A trail's hikes are paged newest first, and follow edits and deletes'''
+        for user_id, hike_date in [(1, '2025-01-01'), (2, '2025-01-02'), (1, '2025-01-03')]:
+            save_new_hike(db, user_id, dict(self.hike, hike_date=hike_date))
+        # The same trail name in another area is another trail
+        save_new_hike(db, 1, dict(self.hike, area_name='Other Place', trails_cs='Rad Trail'))
+        rad_trail = get_trail_id(db, 1, 'Rad Trail')
+        assert get_trail_id(db, 2, 'Rad Trail') not in (None, rad_trail)
+        assert get_trail(db, rad_trail) == {'id': rad_trail, 'trail_name': 'Rad Trail', 'area_id': 1, 'area_name': 'Neat Place'}
+        first_page = get_trail_hikes_page(db, rad_trail, limit=2)
+        assert [(hike['id'], hike['username']) for hike in first_page['hikes']] == [(3, 'suze'), (2, 'frank')]
+        assert [hike['id'] for hike in get_trail_hikes_page(db, rad_trail, after=first_page['next_cursor'])['hikes']] == [1]
+        # Dropping the trail from a hike unlinks it, deleting a hike unlinks all its trails
+        save_hike_changes(db, 3, dict(self.hike, trails_cs='Tubular Trail'))
+        delete_hike(db, 2, 2)
+        assert [hike['id'] for hike in get_trail_hikes_page(db, rad_trail)['hikes']] == [1]
+        assert [hike['id'] for hike in get_trail_hikes_page(db, get_trail_id(db, 1, 'Tubular Trail'))['hikes']] == [3, 1]
+
+    def test_trail_routes(self, db, app_module):
+        '''Trail links from hike blocks lead to the trail page'''
+        save_new_hike(db, 2, self.hike)
+        client = app_module.app.test_client()
+        assert b'/trails?area_id=1&name=Rad%20Trail' in client.get('/users/frank').data
+        response = client.get('/trails?area_id=1&name=Rad%20Trail')
+        assert response.status_code == 302 and response.location == '/trails/1'
+        page = client.get('/trails/1').data
+        assert b'RAD TRAIL' in page and b'/users/frank' in page
+        assert b'Trail not found' in client.get('/trails/99').data
+        assert b'Trail not found' in client.get('/trails?area_id=2&name=Rad%20Trail').data
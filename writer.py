@@ -0,0 +1,202 @@
+'''This module houses the database writer: one thread per database file, which makes every
+    write of this process on its own connection. Request threads hand it a write (a function
+    taking a cursor) with run_write and wait for the result. The writer takes every write waiting
+    in its queue (up to DB_WRITE_BATCH_SIZE) and runs them in one transaction, each in a
+    savepoint so a failed write is rolled back on its own, then commits them together (group
+    commit). This process's threads never race each other for sqlite's write lock, so only
+    other processes can make a write wait (up to busy_timeout, see DB_PRAGMAS). The writer
+    closes its connection after DB_WRITER_IDLE_SECONDS without writes, and restarts on the next.
+    Set DB_WRITE_QUEUE=off to commit writes on the request thread instead. Rebuilds (feed items,
+    leaderboards, user stats) and the upload outbox go through the writer too; only migrations
+    (see init_sql.py) and the sessions database (see sessions.py) use their own connections.
+'''
+from concurrent.futures import Future
+import queue
+import sqlite3
+import threading
+from connection_pool import open_connection, scoped_connection
+from constants import DB_WRITE_BATCH_SIZE, DB_WRITE_QUEUE, DB_WRITER_IDLE_SECONDS
+from metrics import record
+
+
+class Writer:
+    '''Thread committing the writes queued for a database file, in batches.'''
+
+    def __init__(self, db, batch_size=DB_WRITE_BATCH_SIZE, idle_seconds=DB_WRITER_IDLE_SECONDS):
+        self.db = db
+        self.batch_size = batch_size
+        self.idle_seconds = idle_seconds
+        self.committed = {'batches': 0, 'writes': 0}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, write):
+        '''Takes write fn (takes a cursor). Queues it, starting the writer thread if it isn't
+            running, and waits for it to be committed.
+            Returns the write's result, or raises its error (sqlite3.Error if not committed).
+        '''
+        future = Future()
+        with self._lock:
+            self._queue.put((write, future))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run, name='db-writer', daemon=True)
+                self._thread.start()
+        return future.result()
+
+    def next_write(self):
+        '''Waits for a queued write. Returns (write, future), or None once idle or stopped with
+            nothing queued (the thread is then marked stopped).
+        '''
+        while True:
+            try:
+                item = self._queue.get(timeout=self.idle_seconds)
+            except queue.Empty:
+                item = None
+            if item is not None:
+                return item
+            # Checked under the lock, so a write queued meanwhile starts a new thread
+            with self._lock:
+                if self._queue.empty():
+                    self._thread = None
+                    return None
+
+    def drain(self, batch):
+        '''Takes list of (write, future). Adds the writes waiting in the queue to it, up to the
+            batch size.
+        '''
+        while len(batch) < self.batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is None:
+                # A stop, seen after this batch
+                self._queue.put(None)
+                return
+            batch.append(item)
+
+    def commit_batch(self, connection, batch):
+        '''Takes the writer's connection and list of (write, future).
+            Runs each write in its own savepoint and commits them in one transaction, then
+            resolves each future with the write's result or error.
+        '''
+        results = []
+        try:
+            # Take the write lock up front, so waiting on another process is covered by
+            # busy_timeout (a read transaction can't wait to upgrade to a write in WAL mode)
+            connection.execute('BEGIN IMMEDIATE')
+            # Writes queued while waiting for the lock are committed with the batch too
+            self.drain(batch)
+            for write, future in batch:
+                connection.execute('SAVEPOINT queued_write')
+                try:
+                    results.append((future, write(connection.cursor()), None))
+                except Exception as error:  # pylint: disable=broad-exception-caught
+                    # Raised again on the submitting thread
+                    connection.execute('ROLLBACK TO queued_write')
+                    results.append((future, None, error))
+                connection.execute('RELEASE queued_write')
+            connection.commit()
+        except sqlite3.Error as error:
+            # ie. database locked by another process, nothing in the batch was written
+            if connection.in_transaction:
+                connection.rollback()
+            results = [(future, None, error) for _, future in batch]
+        self.committed['batches'] += 1
+        self.committed['writes'] += len(batch)
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def run(self):
+        '''Writer loop: commits batches of queued writes until idle or stopped.'''
+        connection = None
+        try:
+            while True:
+                item = self.next_write()
+                if item is None:
+                    return
+                try:
+                    connection = connection or open_connection(self.db)
+                except sqlite3.Error as error:
+                    # ie. the database file can't be opened, fail the write rather than hang it
+                    item[1].set_exception(error)
+                    continue
+                self.commit_batch(connection, [item])
+        finally:
+            if connection is not None:
+                connection.close()
+
+    def stop(self):
+        '''Stops and joins the writer thread once the writes queued before are committed.'''
+        with self._lock:
+            thread = self._thread
+            if thread is not None:
+                self._queue.put(None)
+        if thread is not None:
+            thread.join()
+
+    def running(self):
+        '''Returns True if the writer thread is running (ie. not idled out or stopped).'''
+        with self._lock:
+            return self._thread is not None
+
+    def stats(self):
+        '''Returns dict of batches committed, writes committed, writes per batch and writes
+            waiting in the queue.
+        '''
+        batches, writes = self.committed['batches'], self.committed['writes']
+        return {'batches': batches, 'writes': writes,
+            'writes_per_batch': writes / batches if batches else 0, 'queued': self._queue.qsize()}
+
+
+# db file: Writer
+writers = {}
+writers_lock = threading.Lock()
+
+
+def get_writer(db):
+    '''Takes db file. Returns the database's writer, created on first use.'''
+    with writers_lock:
+        if db not in writers:
+            writers[db] = Writer(db)
+        return writers[db]
+
+
+def stop_writers():
+    '''Stops every writer (ie. before a database file is deleted), closing their connections.'''
+    with writers_lock:
+        stopping = list(writers.values())
+    for database_writer in stopping:
+        database_writer.stop()
+
+
+def run_write(db, write):
+    '''Takes db file and write fn (takes a cursor, ie. runs INSERT / UPDATE / DELETE statements).
+        Commits the write, through the database's writer unless DB_WRITE_QUEUE is off.
+        Returns the write's result, or raises its error (sqlite3.Error if nothing was written).
+    '''
+    if not DB_WRITE_QUEUE:
+        with scoped_connection(db) as db_connection:
+            result = write(db_connection['cursor'])
+            db_connection['connection'].commit()
+        return result
+    result = get_writer(db).submit(write)
+    # Committed by the writer, counted against the request waiting on it
+    record('commits')
+    return result
+
+
+def try_write(db, write):
+    '''Takes db file and write fn (takes a cursor). Commits the write with run_write.
+        Returns 0 on success, or the error.
+    '''
+    try:
+        run_write(db, write)
+    except sqlite3.Error as error:
+        print(error)
+        return error
+    return 0
@@ -0,0 +1,168 @@
+'''Unit tests for the database writer thread'''
+from concurrent.futures import ThreadPoolExecutor
+import sqlite3
+import threading
+import time
+from flask import Flask, g
+import pytest
+from init_sql import migrate
+from metrics import REQUEST_TOTALS
+from utils import add_user, follow, get_followees
+import writer
+from writer import Writer, run_write, try_write
+# pylint: disable=line-too-long
+
+
+@pytest.fixture(name='db')
+def fixture_db(tmp_path):
+    '''Returns migrated db file.'''
+    db = str(tmp_path / 'writer.db')
+    migrate(db)
+    return db
+
+
+def add_user_write(username):
+    '''Takes username. Returns write fn inserting the user, which returns their id.'''
+    return lambda cursor: cursor.execute('INSERT INTO users (username, password_hash) VALUES (?, ?)', (username, 'x')).lastrowid
+
+
+def get_usernames(db):
+    '''Takes db file. Returns list of committed usernames.'''
+    connection = sqlite3.connect(db)
+    usernames = [row[0] for row in connection.execute('SELECT username FROM users ORDER BY id')]
+    connection.close()
+    return usernames
+
+
+def wait_for(condition):
+    '''Takes condition fn. Waits up to 5 seconds for it to return True.'''
+    deadline = time.time() + 5
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+class TestWriter:
+    '''Tests queued writes are committed in batches, and fail on their own'''
+
+    def test_group_commit(self, db):
+        '''Writes queued while a batch is committing are committed together in the next one'''
+        database_writer = Writer(db)
+        started, release = threading.Event(), threading.Event()
+
+        def blocked_write(cursor):
+            started.set()
+            release.wait()
+            return add_user_write('first')(cursor)
+        with ThreadPoolExecutor(max_workers=9) as executor:
+            first = executor.submit(database_writer.submit, blocked_write)
+            try:
+                assert started.wait(5)
+                queued = [executor.submit(database_writer.submit, add_user_write(f'user{index}')) for index in range(8)]
+                wait_for(lambda: database_writer.stats()['queued'] == 8)
+            finally:
+                # Never leaves the writer blocked, so a failed wait doesn't hang the executor
+                release.set()
+            assert first.result() == 1
+            assert sorted(future.result() for future in queued) == list(range(2, 10))
+        database_writer.stop()
+        assert database_writer.stats() == {'batches': 2, 'writes': 9, 'writes_per_batch': 4.5, 'queued': 0}
+        assert len(get_usernames(db)) == 9
+
+    def test_failed_write_rolls_back_alone(self, db):
+        '''A failed write raises on its own thread, and the rest of its batch is committed'''
+        database_writer = Writer(db)
+        started, release = threading.Event(), threading.Event()
+
+        def blocked_write(cursor):
+            started.set()
+            release.wait()
+            return add_user_write('suze')(cursor)
+
+        def failing_write(cursor):
+            add_user_write('half')(cursor)
+            add_user_write('suze')(cursor)
+
+        def not_sql_write(_cursor):
+            raise ValueError('Not a write')
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            executor.submit(database_writer.submit, blocked_write)
+            try:
+                assert started.wait(5)
+                failed = executor.submit(database_writer.submit, failing_write)
+                not_sql = executor.submit(database_writer.submit, not_sql_write)
+                wait_for(lambda: database_writer.stats()['queued'] == 2)
+                frank = executor.submit(database_writer.submit, add_user_write('frank'))
+                wait_for(lambda: database_writer.stats()['queued'] == 3)
+            finally:
+                release.set()
+            with pytest.raises(sqlite3.IntegrityError):
+                failed.result()
+            with pytest.raises(ValueError):
+                not_sql.result()
+            assert frank.result() == 2
+        database_writer.stop()
+        assert database_writer.stats()['batches'] == 2
+        assert get_usernames(db) == ['suze', 'frank']
+
+    def test_idle_writer_stops(self, db):
+        '''The writer closes its connection once idle, and starts again for the next write'''
+        database_writer = Writer(db, idle_seconds=0.01)
+        database_writer.submit(add_user_write('suze'))
+        wait_for(lambda: not database_writer.running())
+        database_writer.submit(add_user_write('frank'))
+        database_writer.stop()
+        assert not database_writer.running()
+        assert get_usernames(db) == ['suze', 'frank']
+
+    def test_locked_database(self, db, monkeypatch):
+        '''A batch that can't get the write lock in time fails every write in it'''
+        monkeypatch.setattr('connection_pool.DB_PRAGMAS', {'busy_timeout': 0})
+        database_writer = Writer(db)
+        connection = sqlite3.connect(db)
+        connection.execute('BEGIN IMMEDIATE')
+        with pytest.raises(sqlite3.OperationalError):
+            database_writer.submit(add_user_write('suze'))
+        connection.rollback()
+        connection.close()
+        assert database_writer.submit(add_user_write('suze')) == 1
+        database_writer.stop()
+
+
+class TestRunWrite:
+    '''Tests writes go through the writer unless the write queue is off'''
+
+    def test_write_queue(self, db, monkeypatch):
+        '''Writes are committed by the database's writer thread, or on the calling thread when off'''
+        threads = []
+
+        def write(cursor):
+            threads.append(threading.current_thread().name)
+            return add_user_write(f'user{len(threads)}')(cursor)
+        assert run_write(db, write) == 1
+        monkeypatch.setattr(writer, 'DB_WRITE_QUEUE', False)
+        assert run_write(db, write) == 2
+        with pytest.raises(sqlite3.IntegrityError):
+            run_write(db, add_user_write('user1'))
+        writer.stop_writers()
+        assert threads == ['db-writer', threading.current_thread().name]
+        assert get_usernames(db) == ['user1', 'user2']
+
+    def test_request_writes(self, db):
+        '''Writes made by a request are committed by the writer, and counted as the request's commits'''
+        with Flask(__name__).app_context():
+            g.sql_metrics = dict.fromkeys(REQUEST_TOTALS, 0)
+            assert add_user(db, 'suze', 'x') == 0
+            assert add_user(db, 'frank', 'x') == 0
+            assert follow(db, 'suze', 'frank', 'follow') == 0
+            assert g.sql_metrics['commits'] == 3
+        assert writer.get_writer(db).stats()['writes'] == 3
+        assert get_followees(db, 'suze') == [2]
+        writer.stop_writers()
+
+    def test_try_write(self, db):
+        '''try_write returns 0 once the write is committed, or the error instead of raising it'''
+        assert try_write(db, add_user_write('user1')) == 0
+        assert isinstance(try_write(db, add_user_write('user1')), sqlite3.IntegrityError)
+        writer.stop_writers()
+        assert get_usernames(db) == ['user1']